@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+Cache for parsed API schema files.
+
+Parsing the schema YAML files takes seconds, so the parsed schema is kept
+in a pickle file next to the YAML file, keyed by the digest of the YAML
+file. Each python version uses its own cache file, e.g. vdsm-api.py2.pickle.
+The cache files are created at build time, and are created on first use
+when running from the source tree. A missing, stale or unreadable cache
+file is ignored, and the YAML file is parsed.
+
+This module is run during the build, so it must not depend on vdsm.
+
+Usage: schemacache.py SCHEMA.yml CACHE.pyN.pickle
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+import yaml
+
+try:
+    import cPickle as pickle
+except ImportError:  # py3
+    import pickle
+
+# Readable by both python 2 and python 3
+_PROTOCOL = 2
+
+log = logging.getLogger("SchemaCache")
+
+
+def cache_path(path):
+    """
+    Returns the path of the cache file of the YAML file at path, for the
+    running python version.
+
+    Objects pickled by python 3 are not the same as objects pickled by
+    python 2, so each version uses its own cache file, and running vdsm with
+    both versions does not rewrite the cache on every load.
+    """
+    return "%s.py%d.pickle" % (os.path.splitext(path)[0],
+                               sys.version_info[0])
+
+
+def load(path):
+    """
+    Returns the schema parsed from the YAML file at path, using the cache
+    file if it matches the YAML file.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    key = _key(data)
+    cache = cache_path(path)
+    schema = _read(cache, key)
+    if schema is None:
+        schema = yaml.load(data)
+        _write(cache, key, schema)
+    return schema
+
+
+def compile(path, cache):
+    """
+    Parses the YAML file at path and writes the cache file.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    _dump(cache, _key(data), yaml.load(data))
+
+
+def _key(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _read(cache, key):
+    try:
+        with open(cache, 'rb') as f:
+            cached_key, schema = pickle.load(f)
+    except EnvironmentError:
+        return None
+    except Exception:
+        log.warning("Ignoring invalid schema cache %s", cache, exc_info=True)
+        return None
+    if cached_key != key:
+        log.debug("Ignoring stale schema cache %s", cache)
+        return None
+    return schema
+
+
+def _write(cache, key, schema):
+    try:
+        _dump(cache, key, schema)
+    except EnvironmentError as e:
+        # Expected when the schema is installed in a read only location
+        # without a cache.
+        log.debug("Cannot write schema cache %s: %s", cache, e)
+
+
+def _dump(cache, key, schema):
+    # Write to a temporary file and rename, so concurrent readers never see
+    # a partial cache.
+    dirname, basename = os.path.split(cache)
+    fd, tmp = tempfile.mkstemp(dir=dirname or '.', prefix=basename + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((key, schema), f, _PROTOCOL)
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, cache)
+    except:
+        os.unlink(tmp)
+        raise
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    compile(sys.argv[1], sys.argv[2])
@@ -24,8 +24,8 @@ import logging
 import os
 import six
 import warnings
-import yaml
 
+from api import schemacache
 from vdsm.logUtils import Suppressed
 from yajsonrpc import JsonRpcInvalidParamsError
 
@@ -124,10 +124,14 @@ class Schema(object):
         self._strict_mode = strict_mode
         self._methods = {}
         self._types = {}
+        # Verification functions compiled on first use, keyed by method or
+        # event id.
+        self._args_validators = {}
+        self._retval_validators = {}
+        self._event_validators = {}
         try:
             for path in paths:
-                with open(path) as f:
-                    loaded_schema = yaml.load(f)
+                loaded_schema = schemacache.load(path)
 
                 types = loaded_schema.pop('types')
                 self._types.update(types)
@@ -168,12 +172,6 @@ class Schema(object):
         except KeyError:
             raise TypeNotFound(type_name)
 
-    def _check_primitive_type(self, t, value, name):
-        condition = PRIMITIVE_TYPES.get(t)
-        if not condition(value):
-            self._report_inconsistency('Parameter %s is not %s type'
-                                       % (name, t))
-
     def _report_inconsistency(self, message):
         if self._strict_mode:
             raise JsonRpcInvalidParamsError(message)
@@ -182,157 +180,275 @@ class Schema(object):
 
     def verify_args(self, rep, args):
         try:
+            verify = self._args_validators.get(rep.id)
+            if verify is None:
+                verify = self._compile_args(rep)
+                self._args_validators[rep.id] = verify
+            verify(args)
+        except JsonRpcInvalidParamsError:
+            raise
+        except Exception:
+            self._report_inconsistency('Unexpected issue with request type'
+                                       ' verification for %s' % rep.id)
+
+    def _compile_args(self, rep):
+        arg_names = _Names(self.get_arg_names(rep))
+        memo = {}
+        params = [(param.get('name'), 'defaultvalue' in param,
+                   self._compile_type(param, rep.id, memo))
+                  for param in self.get_args(rep)]
+
+        def verify(args):
             # check whether there are extra parameters
-            unknown_args = [key for key in args if key not in
-                            self.get_arg_names(rep)]
+            unknown_args = arg_names.unknown(args)
             if unknown_args:
                 self._report_inconsistency('Following parameters %s were not'
                                            ' recognized' % (unknown_args))
 
             # verify types of provided parameters
-            for param in self.get_args(rep):
-                name = param.get('name')
+            for name, optional, verify_type in params:
                 arg = args.get(name)
                 if arg is None:
                     # check if missing paramter was defined as optional
-                    if 'defaultvalue' not in param:
+                    if not optional:
                         self._report_inconsistency(
                             'Required parameter %s is not '
                             'provided when calling %s' % (name, rep.id))
                     continue
-                self._verify_type(param, arg, rep.id)
-        except JsonRpcInvalidParamsError:
-            raise
-        except Exception:
-            self._report_inconsistency('Unexpected issue with request type'
-                                       ' verification for %s' % rep.id)
+                verify_type(arg)
+
+        return verify
+
+    def _compile_type(self, param, identifier, memo):
+        """
+        Returns a function verifying that a value matches param.
+
+        Types may contain themselves, so the functions compiled for a method
+        are kept in memo. Errors in the schema are raised when verifying a
+        value, as if the schema was walked for every value.
+        """
+        key = id(param)
+        try:
+            return memo[key]
+        except KeyError:
+            pass
 
-    def _verify_type(self, param, value, identifier):
+        # Used by types containing themselves until param is compiled.
+        compiled = []
+        memo[key] = lambda value: compiled[0](value)
+        try:
+            verify = self._compile_param(param, identifier, memo)
+        except Exception as e:
+            verify = _raise(e)
+        compiled.append(verify)
+        memo[key] = verify
+        return verify
+
+    def _compile_param(self, param, identifier, memo):
         # check whether a parameter is in a list
         if isinstance(param, list):
-            if not isinstance(value, list):
-                self._report_inconsistency('Parameter %s is not a list'
-                                           % (value))
-            for a in value:
-                self._verify_type(param[0], a, identifier)
-            return
+            verify_item = self._compile_type(param[0] if param else None,
+                                             identifier, memo)
+
+            def verify(value):
+                if not isinstance(value, list):
+                    self._report_inconsistency('Parameter %s is not a list'
+                                               % (value))
+                for a in value:
+                    verify_item(a)
+
+            return verify
+
         # check whether a parameter is defined as primitive type
         elif param in TYPE_KEYS:
-            self._check_primitive_type(param, value, param)
-            return
+            return self._compile_primitive_type(param, param)
 
         # get type and name
         name = param.get('name')
         t = param.get('type')
         if t == 'dict':
             # it seems that there is no other way to have it fixed
-            self._report_inconsistency(
-                'Unsupported type %s in %s please fix' % (t, identifier))
+            message = 'Unsupported type %s in %s please fix' % (t, identifier)
+
+            def verify(value):
+                self._report_inconsistency(message)
+
+            return verify
 
         # check whether it is a primitive type
         elif t in TYPE_KEYS:
-            self._check_primitive_type(t, value, name)
+            return self._compile_primitive_type(t, name)
 
-        else:
-            # if type is a string call type verification method
-            if isinstance(t, six.string_types):
-                self._verify_complex_type(t, param, value, name, identifier)
+        # if type is a string compile type verification
+        elif isinstance(t, six.string_types):
+            return self._compile_complex_type(t, param, name, identifier,
+                                              memo)
+
+        # if type is in a list we need to get the type and compile
+        # type verification
+        elif isinstance(t, list):
+            verify_item = self._compile_type(t[0] if t else None,
+                                             identifier, memo)
 
-            # if type is in a list we need to get the type and call
-            # type verification method
-            elif isinstance(t, list):
+            def verify(value):
                 if not isinstance(value, (list, tuple)):
                     self._report_inconsistency('Parameter %s is not a sequence'
                                                % (value))
                 for a in value:
-                    self._verify_type(t[0], a, identifier)
-            else:
-                # call complex type verification
-                self._verify_complex_type(t.get('type'), t, value, name,
-                                          identifier)
+                    verify_item(a)
 
-    def _verify_complex_type(self, t_type, t, arg, name, identifier):
+            return verify
+
+        else:
+            # compile complex type verification
+            return self._compile_complex_type(t.get('type'), t, name,
+                                              identifier, memo)
+
+    def _compile_primitive_type(self, t, name):
+        condition = PRIMITIVE_TYPES.get(t)
+        message = 'Parameter %s is not %s type' % (name, t)
+
+        def verify(value):
+            if not condition(value):
+                self._report_inconsistency(message)
+
+        return verify
+
+    def _compile_complex_type(self, t_type, t, name, identifier, memo):
         """
-        This method verify whether argument value align with different
-        types we support such as: alias, map, union, enum and object.
+        This method compiles verification whether argument value align with
+        different types we support such as: alias, map, union, enum and
+        object.
         """
         if t_type == 'alias':
             # if alias we need to check sourcetype
-            self._check_primitive_type(t.get('sourcetype'), arg, name)
+            return self._compile_primitive_type(t.get('sourcetype'), name)
+
         elif t_type == 'map':
             # if map we need to check key and value types
-            for key, value in six.iteritems(arg):
-                self._verify_type(t.get('key-type'), key, identifier)
-                self._verify_type(t.get('value-type'), value, identifier)
+            verify_key = self._compile_type(t.get('key-type'), identifier,
+                                            memo)
+            verify_value = self._compile_type(t.get('value-type'), identifier,
+                                              memo)
+
+            def verify(arg):
+                for key, value in six.iteritems(arg):
+                    verify_key(key)
+                    verify_value(value)
+
+            return verify
+
         elif t_type == 'union':
             # if union we need to check whether parameter matches on of the
             # values defined
+            values = []
             for value in t.get('values'):
-                props = value.get('properties')
-                prop_names = [prop.get('name') for prop in props]
-                if not [key for key in arg if key not in prop_names]:
-                    self._verify_complex_type(value.get('type'), value, arg,
-                                              name, identifier)
-                    return
-            self._report_inconsistency('Provided parameters %s do not match'
-                                       ' any of union %s values'
-                                       % (arg, t.get('name')))
+                try:
+                    prop_names = _Names(prop.get('name')
+                                        for prop in value.get('properties'))
+                except Exception as e:
+                    values.append((None, _raise(e)))
+                    continue
+                try:
+                    verify_value = self._compile_complex_type(
+                        value.get('type'), value, name, identifier, memo)
+                except Exception as e:
+                    verify_value = _raise(e)
+                values.append((prop_names, verify_value))
+            union_name = t.get('name')
+
+            def verify(arg):
+                for prop_names, verify_value in values:
+                    if prop_names is None:
+                        # invalid value in the schema
+                        verify_value(arg)
+                    if not prop_names.unknown(arg):
+                        verify_value(arg)
+                        return
+                self._report_inconsistency('Provided parameters %s do not'
+                                           ' match any of union %s values'
+                                           % (arg, union_name))
+
+            return verify
+
         elif t_type == 'enum':
             # if enum we need to check whether provided parameter is in values
-            if arg not in t.get('values'):
-                self._report_inconsistency('Provided value "%s" not'
-                                           ' defined in %s enum for'
-                                           ' %s' % (arg,
-                                                    t.get('name'),
-                                                    identifier))
+            enum_values = t.get('values')
+            enum_name = t.get('name')
+
+            def verify(arg):
+                if arg not in enum_values:
+                    self._report_inconsistency('Provided value "%s" not'
+                                               ' defined in %s enum for'
+                                               ' %s' % (arg,
+                                                        enum_name,
+                                                        identifier))
+
+            return verify
+
         else:
             # if custom time (object) we need to check whether all the
             # properties match values provided
-            self._verify_object_type(t, arg, identifier)
+            return self._compile_object_type(t, identifier, memo)
 
-    def _verify_object_type(self, t, arg, identifier):
+    def _compile_object_type(self, t, identifier, memo):
         props = t.get('properties')
-        prop_names = [prop.get('name') for prop in props]
-        # check if there are any extra prarameters
-        unknown_props = [key for key in arg
-                         if key not in prop_names]
-        if unknown_props:
-            self._report_inconsistency('Following parameters %s were not'
-                                       ' recognized' % (unknown_props))
-        # iterate over properties
+        prop_names = _Names(prop.get('name') for prop in props)
+        checks = []
         for prop in props:
-            p_name = prop.get('name')
-            a = arg.get(p_name)
-
             # check whether parameter is defined as optional and
-            # check default type
-            if 'defaultvalue' in prop:
-                value = prop.get('defaultvalue')
-                if value == 'needs updating':
-                    self._report_inconsistency(
-                        'No default value specified for %s parameter in'
-                        ' %s' % (p_name, identifier))
-                if value == 'no-default':
-                    continue
-                if a is None or a == value:
-                    continue
-            else:
-                if a is None:
-                    self._report_inconsistency(
-                        'Required property %s is not provided when calling'
-                        ' %s' % (p_name, identifier))
-                    continue
-            # call type verification
-            self._verify_type(prop, a, identifier)
+            # keep the default value
+            optional = 'defaultvalue' in prop
+            checks.append((prop.get('name'), optional,
+                           prop.get('defaultvalue'),
+                           self._compile_type(prop, identifier, memo)))
+
+        def verify(arg):
+            # check if there are any extra prarameters
+            unknown_props = prop_names.unknown(arg)
+            if unknown_props:
+                self._report_inconsistency('Following parameters %s were not'
+                                           ' recognized' % (unknown_props))
+            # iterate over properties
+            for p_name, optional, value, verify_prop in checks:
+                a = arg.get(p_name)
+
+                # check default type
+                if optional:
+                    if value == 'needs updating':
+                        self._report_inconsistency(
+                            'No default value specified for %s parameter in'
+                            ' %s' % (p_name, identifier))
+                    if value == 'no-default':
+                        continue
+                    if a is None or a == value:
+                        continue
+                else:
+                    if a is None:
+                        self._report_inconsistency(
+                            'Required property %s is not provided when'
+                            ' calling %s' % (p_name, identifier))
+                        continue
+                # call type verification
+                verify_prop(a)
+
+        return verify
 
     def verify_retval(self, rep, ret):
         try:
-            ret_args = self.get_ret_param(rep)
-
-            if ret_args:
-                if isinstance(ret, Suppressed):
-                    ret = ret.value
-                self._verify_type(ret_args.get('type'), ret, rep.id)
+            verify = self._retval_validators.get(rep.id)
+            if verify is None:
+                ret_args = self.get_ret_param(rep)
+                if ret_args:
+                    verify = self._compile_type(ret_args.get('type'), rep.id,
+                                                {})
+                else:
+                    verify = _ignore
+                self._retval_validators[rep.id] = verify
+
+            if isinstance(ret, Suppressed):
+                ret = ret.value
+            verify(ret)
         except JsonRpcInvalidParamsError:
             raise
         except Exception:
@@ -342,26 +458,67 @@ class Schema(object):
     def verify_event_params(self, sub_id, args):
         rep = EventRep(sub_id)
         try:
+            verify = self._event_validators.get(rep.id)
+            if verify is None:
+                verify = self._compile_event_params(rep)
+                self._event_validators[rep.id] = verify
+            verify(args)
+        except JsonRpcInvalidParamsError:
+            raise
+        except Exception:
+            self._report_inconsistency('Unexpected issue with event type'
+                                       ' verification for %s' % rep.id)
+
+    def _compile_event_params(self, rep):
+        memo = {}
+        params = [(param.get('name'), 'defaultvalue' in param,
+                   self._compile_type(param, rep.id, memo))
+                  for param in self.get_args(rep)]
+
+        def verify(args):
             # due to issue with vm status changes key names (vm_ids)
             # we are not able to find unknown params
-            for param in self.get_args(rep):
-                name = param.get('name')
+            for name, optional, verify_param in params:
                 if name == 'no_name':
                     for key, value in six.iteritems(args):
                         if key == "notify_time":
                             continue
-                        self._verify_type(param, {key: value}, rep.id)
+                        verify_param({key: value})
                     continue
                 arg = args.get(name)
                 if arg is None:
-                    if 'defaultvalue' not in param:
+                    if not optional:
                         self._report_inconsistency(
                             'Required parameter %s is not '
                             'provided when sending %s' % (name, rep.id))
                     continue
-                self._verify_type(param, arg, rep.id)
-        except JsonRpcInvalidParamsError:
-            raise
-        except Exception:
-            self._report_inconsistency('Unexpected issue with event type'
-                                       ' verification for %s' % rep.id)
+                verify_param(arg)
+
+        return verify
+
+
+class _Names(object):
+    """
+    Names of parameters or properties, for finding unknown keys quickly.
+    """
+
+    def __init__(self, names):
+        self._names = list(names)
+        self._set = frozenset(self._names)
+
+    def unknown(self, arg):
+        try:
+            return [key for key in arg if key not in self._set]
+        except TypeError:
+            # unhashable key, arg is not a dict
+            return [key for key in arg if key not in self._names]
+
+
+def _raise(error):
+    def verify(value):
+        raise error
+    return verify
+
+
+def _ignore(value):
+    pass
@@ -128,19 +128,38 @@ class Barrier(object):
 Result = namedtuple("Result", ["succeeded", "value"])
 
 
-def tmap(func, iterable):
+def tmap(func, iterable, max_threads=None):
+    """
+    Run func with each item of iterable in another thread, and return a list
+    of Result tuples, in the order of the items.
+
+    If max_threads is set, at most max_threads threads are started, each
+    running func with the next item until all items were handled.
+    """
     args = list(iterable)
     results = [None] * len(args)
+    items = iter(enumerate(args))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                try:
+                    i, arg = next(items)
+                except StopIteration:
+                    return
+            try:
+                results[i] = Result(True, func(arg))
+            except Exception as e:
+                results[i] = Result(False, e)
 
-    def worker(i, f, arg):
-        try:
-            results[i] = Result(True, f(arg))
-        except Exception as e:
-            results[i] = Result(False, e)
+    count = len(args)
+    if max_threads is not None:
+        count = min(count, max_threads)
 
     threads = []
-    for i, arg in enumerate(args):
-        t = thread(worker, args=(i, func, arg))
+    for _ in range(count):
+        t = thread(worker)
         t.start()
         threads.append(t)
 
@@ -24,12 +24,14 @@ Blocked tasks may be discarded, and the worker pool is automatically
 replenished."""
 
 import collections
-import functools
+import itertools
 import logging
 import threading
+import weakref
 
 from . import concurrent
 from . import pthread
+from .utils import monotonic_time
 
 
 class NotRunning(Exception):
@@ -63,7 +65,10 @@ class Executor(object):
       any processed task.  If the time is exceeded then the worker continues
       processing the task but another worker is created not to limit
       availability of task processing.  When the original worker finishes
-      executing the long task, it's finished.
+      executing the long task, it's finished.  Workers keep the deadline of
+      their current task, and a single scheduled call checks the deadlines of
+      all the workers, so starting a task with a timeout does not need a
+      scheduler call.
 
     - However there is a limit on the total number of the workers in the
       executor, set with `max_workers`.  If the limit is reached, no new
@@ -71,11 +76,17 @@ class Executor(object):
       the stuck task finishes.  This prevents creating an excessive number
       of threads when many tasks are stuck.
 
+    - Optionally, tasks may be dispatched to named queues (see `queues`
+      constructor parameter).  Workers take tasks from the queue with the
+      highest priority first, and never run more than the queue's
+      `max_running` tasks at the same time, so tasks stuck in one queue
+      cannot starve the other queues.
+
     """
     _log = logging.getLogger('Executor')
 
     def __init__(self, name, workers_count, max_tasks, scheduler,
-                 max_workers=None):
+                 max_workers=None, queues=()):
         """
         :param name: Name of the executor; no special purpose, just for
           logging and debugging.
@@ -97,17 +108,28 @@ class Executor(object):
           it is not None and it gets reached then no further workers are
           created.
         :type max_workers: int or None
+        :param queues: Named queues for the tasks. If not empty, tasks are
+          dispatched to one of these queues, or to the `DEFAULT_QUEUE`,
+          created automatically if not specified. Each queue may hold up to
+          `max_tasks` tasks. Queues statistics are available via `stats()`.
+        :type queues: sequence of `Queue`
 
         """
         self._name = name
         self._workers_count = workers_count
         self._max_workers = max_workers
         self._worker_id = 0
-        self._tasks = TaskQueue(max_tasks)
+        if queues:
+            self._tasks = PriorityTaskQueue(max_tasks, queues)
+        else:
+            self._tasks = TaskQueue(max_tasks)
         self._scheduler = scheduler
         self._workers = set()
         self._lock = threading.Lock()
         self._running = False
+        # Time of the next deadlines check, and the scheduled call doing it.
+        self._next_check = _NEVER
+        self._check_call = None
 
     @property
     def name(self):
@@ -121,19 +143,26 @@ class Executor(object):
             self._running = True
             for _ in range(self._workers_count):
                 self._add_worker()
+        if isinstance(self._tasks, PriorityTaskQueue):
+            _executors.add(self)
 
     def stop(self, wait=True):
         self._log.debug('Stopping executor')
+        _executors.discard(self)
         with self._lock:
             self._running = False
             self._tasks.clear()
             for _ in range(self._workers_count):
                 self._tasks.put(_STOP)
+            if self._check_call is not None:
+                self._check_call.cancel()
+                self._check_call = None
+            self._next_check = _NEVER
             workers = tuple(self._workers) if wait else ()
         for worker in workers:
             worker.join()
 
-    def dispatch(self, callable, timeout=None):
+    def dispatch(self, callable, timeout=None, queue=None):
         """
         Dispatches a new task to the executor.
 
@@ -143,10 +172,28 @@ class Executor(object):
 
         The timeout is measured from the time the callable
         is called.
+
+        If the executor has named queues, the task is added to queue, or to
+        the `DEFAULT_QUEUE` if queue is None. Raises KeyError if there is no
+        such queue.
         """
         if not self._running:
             raise NotRunning()
-        self._tasks.put(Task(callable, timeout))
+        task = Task(callable, timeout, queue or DEFAULT_QUEUE)
+        if isinstance(self._tasks, PriorityTaskQueue):
+            self._tasks.put(task, task.queue)
+        else:
+            self._tasks.put(task)
+
+    def stats(self):
+        """
+        Returns a dict with the statistics of every named queue, see
+        PriorityTaskQueue.stats(). Returns an empty dict if the executor
+        has no named queues.
+        """
+        if isinstance(self._tasks, PriorityTaskQueue):
+            return self._tasks.stats()
+        return {}
 
     # Serving workers
 
@@ -223,17 +270,102 @@ class Executor(object):
             raise NotRunning()
         return task
 
+    def _task_done(self, task):
+        """
+        Called from the worker thread when a task returned, even if the worker
+        was discarded while running it.
+        """
+        if isinstance(self._tasks, PriorityTaskQueue):
+            self._tasks.task_done(task.queue)
+
+    # Tracking tasks deadlines
+
+    def _track_deadline(self, deadline):
+        """
+        Called from the worker thread after it set the deadline of a new task,
+        to make sure the deadlines are checked before deadline.
+
+        Usually a check is already scheduled before deadline, so this does not
+        take any lock.
+        """
+        # Reading _next_check without the lock is safe: _check_deadlines()
+        # resets it before reading the workers deadlines, so either it sees
+        # the new deadline, or we see the reset value.
+        if deadline < self._next_check:
+            with self._lock:
+                if deadline < self._next_check:
+                    self._schedule_check(deadline)
+
+    def _schedule_check(self, deadline):
+        """
+        Must be called with self._lock held.
+        """
+        if self._check_call is not None:
+            self._check_call.cancel()
+        self._next_check = deadline
+        delay = max(0, deadline - monotonic_time())
+        self._check_call = self._scheduler.schedule(delay,
+                                                    self._check_deadlines)
+
+    def _check_deadlines(self):
+        """
+        Called from the scheduler thread to discard the workers whose task has
+        timed out, and schedule the next check.
+        """
+        now = monotonic_time()
+        expired = []
+        with self._lock:
+            self._check_call = None
+            self._next_check = _NEVER
+            if not self._running:
+                return
+            next_check = _NEVER
+            for worker in self._workers:
+                deadline = worker.deadline
+                if deadline is None or worker.discarded:
+                    continue
+                if deadline <= now + _CLOCK_RESOLUTION:
+                    expired.append(worker)
+                else:
+                    next_check = min(next_check, deadline)
+            if next_check < _NEVER:
+                self._schedule_check(next_check)
+
+        # Discarding calls back into the executor, so it must be done outside
+        # the lock.
+        for worker in expired:
+            worker._discard_expired(now)
+
     # Private
 
     def _add_worker(self):
         name = "%s/%d" % (self.name, self._worker_id)
         self._worker_id += 1
-        worker = _Worker(self, self._scheduler, name)
+        worker = _Worker(self, name)
         self._workers.add(worker)
 
 
 _STOP = object()
 
+_NEVER = float("inf")
+
+# monotonic_time() resolution; deadlines closer than this are considered
+# expired.
+_CLOCK_RESOLUTION = 0.01
+
+DEFAULT_QUEUE = "default"
+
+# Running executors with named queues, for reporting their statistics.
+_executors = weakref.WeakSet()
+
+
+def stats():
+    """
+    Returns a dict mapping the name of every running executor with named
+    queues to its queues statistics.
+    """
+    return {executor.name: executor.stats() for executor in tuple(_executors)}
+
 
 class _WorkerDiscarded(Exception):
     """ Raised if worker was discarded during execution of a task """
@@ -243,11 +375,11 @@ class _Worker(object):
 
     _log = logging.getLogger('Executor')
 
-    def __init__(self, executor, scheduler, name):
+    def __init__(self, executor, name):
         self._executor = executor
-        self._scheduler = scheduler
         self._discarded = False
         self._task_counter = 0
+        self._deadline = None
         self._lock = threading.Lock()
         self._thread = concurrent.thread(self._run, name=name,
                                          logger=self._log.name)
@@ -267,6 +399,13 @@ class _Worker(object):
     def discarded(self):
         return self._discarded
 
+    @property
+    def deadline(self):
+        """
+        The time when the current task times out, or None.
+        """
+        return self._deadline
+
     def _run(self):
         pthread.setname(self.name[:15])
         self._log.debug('Worker started')
@@ -282,38 +421,39 @@ class _Worker(object):
 
     def _execute_task(self):
         task = self._executor._next_task()
-        discard = self._discard_after(task.timeout)
         self._task = task
+        if task.timeout is not None:
+            self._deadline = monotonic_time() + task.timeout
+            self._executor._track_deadline(self._deadline)
         try:
             task.callable()
         except Exception:
             self._log.exception("Unhandled exception in %s", task)
         finally:
             self._task = None
-            # We want to discard workers that were too slow to disarm
-            # the timer. It does not matter if the thread was still
+            self._executor._task_done(task)
+            # We want to discard workers that were too slow to clear
+            # the deadline. It does not matter if the thread was still
             # blocked on callable when we discard it or it just finished.
             # However, we expect that most of times only blocked threads
             # will be discarded.
-            if discard is not None:
-                discard.cancel()
             with self._lock:
+                self._deadline = None
                 self._task_counter += 1
             if self._discarded:
                 raise _WorkerDiscarded()
 
-    def _discard_after(self, timeout):
-        if timeout is not None:
-            discard = functools.partial(self._discard, self._task_counter)
-            return self._scheduler.schedule(timeout, discard)
-        return None
-
-    def _discard(self, task_number):
+    def _discard_expired(self, now):
+        """
+        Called from the scheduler thread to discard the worker if its current
+        task has timed out.
+        """
         with self._lock:
-            if task_number != self._task_counter:
+            # The task may have finished since the deadline was checked, and
+            # the worker may be running another task.
+            if (self._discarded or self._deadline is None or
+                    self._deadline > now + _CLOCK_RESOLUTION):
                 return
-            if self._discarded:
-                raise AssertionError("Attempt to discard worker twice")
             self._discarded = True
         # Please make sure the executor call is performed outside the lock --
         # there is another lock involved in the executor and we don't want to
@@ -331,7 +471,12 @@ class _Worker(object):
         )
 
 
-Task = collections.namedtuple("Task", "callable, timeout")
+Task = collections.namedtuple("Task", "callable, timeout, queue")
+
+# A named queue of an Executor. Tasks in queues with higher priority are
+# run first. max_running limits the number of tasks from this queue running
+# at the same time, including stuck tasks; None means no limit.
+Queue = collections.namedtuple("Queue", "name, priority, max_running")
 
 
 class TaskQueue(object):
@@ -379,3 +524,130 @@ class TaskQueue(object):
     def clear(self):
         with self._cond:
             self._tasks.clear()
+
+
+class PriorityTaskQueue(object):
+    """
+    Task queue made of named queues with priorities.
+
+    get() returns the oldest task from the queue with the highest priority
+    which is not running max_running tasks already. The caller must call
+    task_done() when a task returned by get() has finished.
+    """
+
+    def __init__(self, max_tasks, queues):
+        self._max_tasks = max_tasks
+        self._queues = {q.name: _NamedQueue(q) for q in queues}
+        if DEFAULT_QUEUE not in self._queues:
+            self._queues[DEFAULT_QUEUE] = _NamedQueue(
+                Queue(DEFAULT_QUEUE, 0, None))
+        # Queues grouped by priority, highest priority first.
+        groups = collections.defaultdict(list)
+        for q in self._queues.values():
+            groups[q.priority].append(q)
+        self._groups = [groups[p] for p in sorted(groups, reverse=True)]
+        self._stop = collections.deque()
+        # monotonic_time() resolution is too low for ordering tasks.
+        self._seq = itertools.count()
+        self._cond = threading.Condition(threading.Lock())
+
+    def put(self, task, queue=DEFAULT_QUEUE):
+        """
+        Put a new task in queue.
+        Do not block when the queue is full, raises TooManyTasks instead.
+        """
+        with self._cond:
+            if task is _STOP:
+                self._stop.append(task)
+            else:
+                q = self._queues[queue]
+                if len(q.tasks) == self._max_tasks:
+                    raise TooManyTasks()
+                q.tasks.append((next(self._seq), monotonic_time(), task))
+            self._cond.notify()
+
+    def get(self):
+        """
+        Get a new task. Blocks until a task can run.
+        """
+        with self._cond:
+            while True:
+                if self._stop:
+                    return self._stop.popleft()
+                q = self._next_queue()
+                if q is not None:
+                    return q.pop()
+                self._cond.wait()
+
+    def task_done(self, queue):
+        with self._cond:
+            self._queues[queue].running -= 1
+            self._cond.notify()
+
+    def clear(self):
+        with self._cond:
+            for q in self._queues.values():
+                q.tasks.clear()
+
+    def stats(self):
+        """
+        Returns a dict mapping queue name to a dict with:
+          depth: number of waiting tasks
+          running: number of running tasks
+          oldest: wait time of the oldest waiting task
+          started: number of tasks started since the last call
+          wait_avg, wait_max: wait time of the tasks started since the last
+            call
+        """
+        now = monotonic_time()
+        with self._cond:
+            return {name: q.stats(now) for name, q in self._queues.items()}
+
+    def _next_queue(self):
+        for group in self._groups:
+            ready = [q for q in group if q.ready()]
+            if ready:
+                # Keep arrival order between queues with the same priority.
+                return min(ready, key=lambda q: q.tasks[0][0])
+        return None
+
+
+class _NamedQueue(object):
+
+    def __init__(self, queue):
+        self.name = queue.name
+        self.priority = queue.priority
+        self.max_running = queue.max_running
+        self.tasks = collections.deque()
+        self.running = 0
+        self._started = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def ready(self):
+        return self.tasks and (self.max_running is None or
+                               self.running < self.max_running)
+
+    def pop(self):
+        _, queued, task = self.tasks.popleft()
+        wait = monotonic_time() - queued
+        self.running += 1
+        self._started += 1
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+        return task
+
+    def stats(self, now):
+        stats = {
+            "depth": len(self.tasks),
+            "running": self.running,
+            "oldest": now - self.tasks[0][1] if self.tasks else 0.0,
+            "started": self._started,
+            "wait_avg": (self._wait_total / self._started
+                         if self._started else 0.0),
+            "wait_max": self._wait_max,
+        }
+        self._started = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        return stats
@@ -27,6 +27,7 @@ import threading
 from . config import config
 from . import concurrent
 from . import cpuarch
+from . import executor
 from . import metrics
 from . import host
 
@@ -90,6 +91,7 @@ class Monitor(object):
         self.log.debug("Checking health")
         self._check_garbage()
         self._check_resources()
+        self._check_executors()
         self._report_stats()
 
     def _check_garbage(self):
@@ -121,6 +123,21 @@ class Monitor(object):
                        abs(delta_rss),
                        self._stats['threads'])
 
+    def _check_executors(self):
+        self._stats['executors'] = executor.stats()
+        for name, queues in sorted(self._stats['executors'].items()):
+            for queue, stats in sorted(queues.items()):
+                self.log.debug("executor %s queue %s: depth=%d, running=%d, "
+                               "oldest=%.2f, started=%d, wait_avg=%.2f, "
+                               "wait_max=%.2f",
+                               name, queue,
+                               stats['depth'],
+                               stats['running'],
+                               stats['oldest'],
+                               stats['started'],
+                               stats['wait_avg'],
+                               stats['wait_max'])
+
     def _report_stats(self):
         prefix = "hosts." + host.uuid() + ".vdsm"
         report = {}
@@ -130,6 +147,13 @@ class Monitor(object):
         report[prefix + '.cpu.sys_pct'] = self._stats['stime_pct']
         report[prefix + '.memory.rss'] = self._stats['rss']
         report[prefix + '.threads_count'] = self._stats['threads']
+        for name, queues in self._stats['executors'].items():
+            for queue, stats in queues.items():
+                queue_prefix = "%s.executor.%s.%s" % (prefix, name, queue)
+                report[queue_prefix + '.depth'] = stats['depth']
+                report[queue_prefix + '.running'] = stats['running']
+                report[queue_prefix + '.wait_avg'] = stats['wait_avg']
+                report[queue_prefix + '.wait_max'] = stats['wait_max']
         metrics.send(report)
 
 
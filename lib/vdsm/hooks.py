@@ -21,6 +21,7 @@
 from __future__ import print_function
 from __future__ import absolute_import
 
+import errno
 import glob
 import hashlib
 import itertools
@@ -29,11 +30,19 @@ import libvirt
 import logging
 import os
 import os.path
+import select
+import signal
 import sys
 import tempfile
+import time
+
+from six.moves import queue
 
 from . import commands
 from . import exception
+from . import utils
+from .compat import CPopen
+from .config import config
 from .constants import P_VDSM_HOOKS, P_VDSM, P_VDSM_RUN
 
 _LAUNCH_FLAGS_FILE = 'launchflags'
@@ -44,6 +53,16 @@ _LAUNCH_FLAGS_PATH = os.path.join(
 )
 
 
+# Scripts found in hook directories, keyed by the directory path, and
+# validated using the directory mtime. Calling hooks with an empty or
+# missing directory costs one stat() call.
+_scripts_cache = {}
+
+# A directory modified in the last seconds may be modified again without
+# changing its mtime, on file systems with low resolution timestamps.
+_SCRIPTS_CACHE_MIN_AGE = 2.0
+
+
 # dir path is relative to '/' for test purposes
 # otherwise path is relative to P_VDSM_HOOKS
 def _scriptsPerDir(dir):
@@ -51,15 +70,25 @@ def _scriptsPerDir(dir):
         path = dir
     else:
         path = P_VDSM_HOOKS + dir
-    return [s for s in glob.glob(path + '/*')
-            if os.access(s, os.X_OK)]
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return []
+    cached = _scripts_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        scripts = cached[1]
+    else:
+        scripts = glob.glob(path + '/*')
+        if time.time() - mtime > _SCRIPTS_CACHE_MIN_AGE:
+            _scripts_cache[path] = (mtime, scripts)
+    return [s for s in scripts if os.access(s, os.X_OK)]
 
 _DOMXML_HOOK = 1
 _JSON_HOOK = 2
 
 
 def _runHooksDir(data, dir, vmconf={}, raiseError=True, params={},
-                 hookType=_DOMXML_HOOK):
+                 hookType=_DOMXML_HOOK, persistent=False):
 
     scripts = _scriptsPerDir(dir)
     scripts.sort()
@@ -67,6 +96,26 @@ def _runHooksDir(data, dir, vmconf={}, raiseError=True, params={},
     if not scripts:
         return data
 
+    # persistent is used only for JSON hooks without vmconf and params
+    if persistent and config.getboolean('vars', 'hook_runner_enable'):
+        timeout = config.getint('vars', 'hook_runner_timeout')
+        try:
+            results, final_data = _runner.run(scripts, data, timeout)
+        except _RunnerTimeout as e:
+            # Running the hooks directly would block in the same way.
+            logging.error("Timeout running hooks %s: %s", scripts, e)
+            if raiseError:
+                raise exception.HookError(str(e))
+            return data
+        except _RunnerError as e:
+            logging.warning("Cannot run hooks using the hook runner, running "
+                            "them directly: %s", e)
+        else:
+            errorSeen, err = _checkResults(results)
+            if errorSeen and raiseError:
+                raise exception.HookError(err)
+            return json.loads(final_data)
+
     data_fd, data_filename = tempfile.mkstemp()
     try:
         if hookType == _DOMXML_HOOK:
@@ -101,18 +150,8 @@ def _runHooksDir(data, dir, vmconf={}, raiseError=True, params={},
         elif hookType == _JSON_HOOK:
             scriptenv['_hook_json'] = data_filename
 
-        errorSeen = False
-        for s in scripts:
-            rc, out, err = commands.execCmd([s], raw=True,
-                                            env=scriptenv)
-            logging.info(err)
-            if rc != 0:
-                errorSeen = True
-
-            if rc == 2:
-                break
-            elif rc > 2:
-                logging.warn('hook returned unexpected return code %s', rc)
+        results = _runScripts(scripts, scriptenv, _execScript)
+        errorSeen, err = _checkResults(results)
 
         if errorSeen and raiseError:
             raise exception.HookError(err)
@@ -127,6 +166,202 @@ def _runHooksDir(data, dir, vmconf={}, raiseError=True, params={},
         return json.loads(final_data)
 
 
+def _runScripts(scripts, scriptenv, execScript):
+    """
+    Runs scripts until a script returns 2. execScript(script, scriptenv)
+    runs a single script and returns (rc, err).
+
+    Returns list of (rc, err) tuples of the scripts that were run.
+    """
+    results = []
+    for s in scripts:
+        rc, err = execScript(s, scriptenv)
+        results.append((rc, err))
+        if rc == 2:
+            break
+    return results
+
+
+def _checkResults(results):
+    """
+    Returns (errorSeen, err), where err is the stderr of the last script.
+    """
+    errorSeen = False
+    for rc, err in results:
+        logging.info(err)
+        if rc != 0:
+            errorSeen = True
+        if rc > 2:
+            logging.warn('hook returned unexpected return code %s', rc)
+    return errorSeen, err
+
+
+def _execScript(script, scriptenv):
+    rc, out, err = commands.execCmd([script], raw=True, env=scriptenv)
+    return rc, err
+
+
+class _RunnerError(Exception):
+    pass
+
+
+class _RunnerTimeout(_RunnerError):
+    pass
+
+
+# Maximum number of hook runner helpers, running hooks of concurrent calls.
+_RUNNER_HELPERS = 4
+
+_RUNNER_READ_SIZE = 65536
+
+
+class _HookRunner(object):
+    """
+    Runs JSON hooks without data in the environment, such as the hooks of
+    the stats and capabilities verbs, in long lived helper processes.
+
+    Vdsm sends the scripts and the hook data to a helper over a pipe, and
+    the helper runs the scripts, so vdsm does not fork for every call. The
+    helper runs the scripts using the same contract as _runHooksDir.
+    Concurrent calls use up to size helpers. If a helper fails, or does not
+    reply in time, it is killed, and a new helper is started on the next
+    call.
+    """
+
+    def __init__(self, size=_RUNNER_HELPERS):
+        # Idle helpers are reused before starting new helpers for the empty
+        # (None) slots.
+        self._idle = queue.LifoQueue()
+        for i in range(size):
+            self._idle.put(None)
+
+    def run(self, scripts, data, timeout):
+        """
+        Returns (results, final_data), where results are the results of
+        _runScripts, and final_data is the JSON encoded hook data modified
+        by the scripts.
+
+        Raises _RunnerTimeout if the helper did not reply in timeout
+        seconds, and _RunnerError if the helper failed.
+        """
+        request = json.dumps({'scripts': scripts, 'data': data})
+        proc = self._idle.get()
+        try:
+            if proc is None:
+                proc = self._start()
+            proc.stdin.write(request + '\n')
+            proc.stdin.flush()
+            reply = json.loads(self._readline(proc, timeout))
+        except Exception as e:
+            self._kill(proc)
+            proc = None
+            if isinstance(e, _RunnerError):
+                raise
+            raise _RunnerError(str(e))
+        finally:
+            self._idle.put(proc)
+        return reply['results'], reply['data']
+
+    def _readline(self, proc, timeout):
+        deadline = utils.monotonic_time() + timeout
+        fd = proc.stdout.fileno()
+        poller = select.poll()
+        poller.register(fd, select.POLLIN)
+        chunks = []
+        while True:
+            remaining = deadline - utils.monotonic_time()
+            if remaining <= 0:
+                raise _RunnerTimeout("Timeout waiting for hook runner pid=%s"
+                                     % proc.pid)
+            if not utils.NoIntrPoll(poller.poll, remaining * 1000):
+                continue
+            data = os.read(fd, _RUNNER_READ_SIZE)
+            if not data:
+                raise _RunnerError("Hook runner terminated: %s"
+                                   % proc.stderr.read())
+            chunks.append(data)
+            if data.endswith('\n'):
+                return ''.join(chunks)
+
+    def _start(self):
+        logging.info("Starting hook runner")
+        # The helper writes to stderr only when it fails, before exiting.
+        return CPopen([sys.executable, '-m', 'vdsm.hooks', '_serveRunner'],
+                      close_fds=True, deathSignal=signal.SIGKILL)
+
+    def _kill(self, proc):
+        if proc is None:
+            return
+        # The helper runs the hook scripts in its own process group, so a
+        # stuck script and its children are killed with the helper.
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+            # The helper did not create its process group yet.
+            try:
+                proc.kill()
+            except OSError:
+                pass  # already terminated
+        proc.wait()
+
+    def _stop(self):
+        """
+        Stop idle helpers. Must not be called while hooks are running.
+        """
+        procs = []
+        while True:
+            try:
+                procs.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for proc in procs:
+            self._kill(proc)
+            self._idle.put(None)
+
+
+_runner = _HookRunner()
+
+
+def _serveRunner():
+    """
+    Hook runner helper main loop, running requests from _HookRunner until
+    vdsm closes the pipe.
+    """
+    # Run the scripts in our process group, so vdsm can kill them with us.
+    os.setpgrp()
+    scriptenv = os.environ.copy()
+    ppath = scriptenv.get('PYTHONPATH', '')
+    scriptenv['PYTHONPATH'] = ':'.join(ppath.split(':') + [P_VDSM])
+
+    for line in iter(sys.stdin.readline, ''):
+        request = json.loads(line)
+        data_fd, data_filename = tempfile.mkstemp()
+        try:
+            os.write(data_fd, json.dumps(request['data']))
+            os.close(data_fd)
+            scriptenv['_hook_json'] = data_filename
+            results = _runScripts(request['scripts'], scriptenv,
+                                  _spawnScript)
+            with open(data_filename) as f:
+                final_data = f.read()
+        finally:
+            os.unlink(data_filename)
+        reply = {'results': results, 'data': final_data}
+        sys.stdout.write(json.dumps(reply) + '\n')
+        sys.stdout.flush()
+
+
+def _spawnScript(script, scriptenv):
+    # The helper is a small single threaded process, so forking it is much
+    # cheaper than forking vdsm.
+    p = CPopen([script], env=scriptenv, close_fds=True,
+               deathSignal=signal.SIGKILL)
+    out, err = p.communicate()
+    return p.returncode, err
+
+
 def before_device_create(devicexml, vmconf={}, customProperties={}):
     return _runHooksDir(devicexml, 'before_device_create', vmconf=vmconf,
                         params=customProperties)
@@ -365,42 +600,42 @@ def after_network_setup_fail(network_config_dict):
 
 def before_get_vm_stats():
     return _runHooksDir({}, 'before_get_vm_stats', raiseError=True,
-                        hookType=_JSON_HOOK)
+                        hookType=_JSON_HOOK, persistent=True)
 
 
 def after_get_vm_stats(stats):
     return _runHooksDir(stats, 'after_get_vm_stats', raiseError=False,
-                        hookType=_JSON_HOOK)
+                        hookType=_JSON_HOOK, persistent=True)
 
 
 def before_get_all_vm_stats():
     return _runHooksDir({}, 'before_get_all_vm_stats', raiseError=True,
-                        hookType=_JSON_HOOK)
+                        hookType=_JSON_HOOK, persistent=True)
 
 
 def after_get_all_vm_stats(stats):
     return _runHooksDir(stats, 'after_get_all_vm_stats', raiseError=False,
-                        hookType=_JSON_HOOK)
+                        hookType=_JSON_HOOK, persistent=True)
 
 
 def before_get_caps():
     return _runHooksDir({}, 'before_get_caps', raiseError=True,
-                        hookType=_JSON_HOOK)
+                        hookType=_JSON_HOOK, persistent=True)
 
 
 def after_get_caps(caps):
     return _runHooksDir(caps, 'after_get_caps', raiseError=False,
-                        hookType=_JSON_HOOK)
+                        hookType=_JSON_HOOK, persistent=True)
 
 
 def before_get_stats():
     return _runHooksDir({}, 'before_get_stats', raiseError=True,
-                        hookType=_JSON_HOOK)
+                        hookType=_JSON_HOOK, persistent=True)
 
 
 def after_get_stats(caps):
     return _runHooksDir(caps, 'after_get_stats', raiseError=False,
-                        hookType=_JSON_HOOK)
+                        hookType=_JSON_HOOK, persistent=True)
 
 
 def before_ifcfg_write(hook_dict):
@@ -28,6 +28,7 @@ from api import vdsmapi
 from vdsm.config import config
 from vdsm.network.netinfo.addresses import getDeviceByIP
 from vdsm.exception import VdsmException
+from vdsm.logUtils import Suppressed
 
 
 try:
@@ -259,6 +260,16 @@ def Host_getStorageRepoStats_Ret(ret):
     return ret
 
 
+def Host_getAllVmStatsDelta_Ret(ret):
+    """
+    The returned dictionary doesn't separate the delta from the status code
+    so we need to rebuild the result. The delta is suppressed from the logs,
+    like the result of getAllVmStats.
+    """
+    del ret['status']
+    return Suppressed(ret)
+
+
 def Host_getVMList_Call(api, args):
     """
     This call is only interested in returning the VM UUIDs so pass False for
@@ -354,6 +365,7 @@ command_info = {
     'Host_getVMList': {'call': Host_getVMList_Call, 'ret': 'vmList'},
     'Host_getVMFullList': {'call': Host_getVMFullList_Call, 'ret': 'vmList'},
     'Host_getAllVmStats': {'ret': 'statsList'},
+    'Host_getAllVmStatsDelta': {'ret': Host_getAllVmStatsDelta_Ret},
     'Host_setupNetworks': {'ret': 'status'},
     'Host_setKsmTune': {'ret': 'taskStatus'},
     'Image_cloneStructure': {'ret': 'uuid'},
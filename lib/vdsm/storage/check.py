@@ -27,11 +27,15 @@ CheckService     entry point for starting and stopping path checkers.
 DirectioChecker  checker using dd process for file or block based
                  volumes.
 
+ThreadedChecker  checker performing the direct I/O read in a thread pool,
+                 avoiding a dd process per check.
+
 CheckResult      result object provided to user callback on each check.
 """
 
 from __future__ import absolute_import
 
+import errno
 import logging
 import re
 import subprocess
@@ -40,12 +44,23 @@ import threading
 from vdsm import cmdutils
 from vdsm import concurrent
 from vdsm import constants
+from vdsm import executor
+from vdsm import schedule
+from vdsm import utils
 from vdsm.compat import CPopen
 from vdsm.storage import asyncevent
+from vdsm.storage import directio
 from vdsm.storage import exception
 
 EXEC_ERROR = 127
 
+# Checker backends
+DD = "dd"
+THREAD = "thread"
+
+# Size of a check read, same as the dd block size.
+BLOCK_SIZE = 4096
+
 _log = logging.getLogger("storage.check")
 
 
@@ -77,17 +92,39 @@ class CheckService(object):
 
     """
 
-    def __init__(self):
+    def __init__(self, backend=DD, workers=4, max_workers=20):
+        """
+        backend: DD to check paths using a dd process, or THREAD to perform
+                 the read in a pool of `workers' threads. Since a read
+                 blocked on inaccessible storage blocks its thread, up to
+                 `max_workers' threads are used to replace blocked ones.
+        """
+        if backend not in (DD, THREAD):
+            raise ValueError("Unsupported checker backend %r" % backend)
         self._lock = threading.Lock()
         self._loop = asyncevent.EventLoop()
         self._thread = concurrent.thread(self._loop.run_forever)
         self._checkers = {}
+        self._backend = backend
+        self._scheduler = None
+        self._executor = None
+        if backend == THREAD:
+            self._scheduler = schedule.Scheduler(name="check.Scheduler",
+                                                 clock=utils.monotonic_time)
+            self._executor = executor.Executor(name="check",
+                                               workers_count=workers,
+                                               max_tasks=max_workers * 100,
+                                               scheduler=self._scheduler,
+                                               max_workers=max_workers)
 
     def start(self):
         """
         Start the service thread.
         """
-        _log.info("Starting check service")
+        _log.info("Starting check service (backend=%s)", self._backend)
+        if self._executor:
+            self._scheduler.start()
+            self._executor.start()
         self._thread.start()
 
     def stop(self):
@@ -108,6 +145,9 @@ class CheckService(object):
             self._loop.call_soon_threadsafe(self._loop.stop)
             self._thread.join()
             self._loop.close()
+        if self._executor:
+            self._executor.stop(wait=False)
+            self._scheduler.stop()
 
     def start_checking(self, path, complete, interval=10.0):
         """
@@ -121,8 +161,12 @@ class CheckService(object):
         with self._lock:
             if path in self._checkers:
                 raise RuntimeError("Already checking path %r" % path)
-            checker = DirectioChecker(self._loop, path, complete,
-                                      interval=interval)
+            if self._backend == THREAD:
+                checker = ThreadedChecker(self._loop, path, complete,
+                                          self._executor, interval=interval)
+            else:
+                checker = DirectioChecker(self._loop, path, complete,
+                                          interval=interval)
             self._checkers[path] = checker
         self._loop.call_soon_threadsafe(checker.start)
 
@@ -213,6 +257,7 @@ class DirectioChecker(object):
         self._next_check = None
         self._check_time = None
         self._timer = None
+        self._checking = False
         self._proc = None
         self._reader = None
         self._reaper = None
@@ -251,7 +296,7 @@ class DirectioChecker(object):
         if self._timer:
             self._timer.cancel()
             self._timer = None
-        if self._proc is None:
+        if not self._checking:
             self._stop_completed()
 
     def wait(self, timeout=None):
@@ -277,16 +322,17 @@ class DirectioChecker(object):
         """
         assert self._state is RUNNING
         self._timer = None
+        self._checking = True
         self._check_time = self._loop.time()
         _log.debug("START check %r (delay=%.2f)",
                    self._path, self._check_time - self._next_check)
         try:
-            self._start_process()
+            self._start_check()
         except Exception as e:
             self._err = "Error starting process: %s" % e
             self._check_completed(EXEC_ERROR)
 
-    def _start_process(self):
+    def _start_check(self):
         """
         Starts a dd process performing direct I/O to path, reading the process
         stderr. When stderr has closed, _read_completed will be called.
@@ -316,15 +362,16 @@ class DirectioChecker(object):
             return
         self._check_completed(rc)
 
-    def _check_completed(self, rc):
+    def _check_completed(self, rc, read_delay=None):
         """
-        Called when the dd process has exited with exit code rc.
+        Called when the check has completed with exit code rc.
         """
         assert self._state is not IDLE
         now = self._loop.time()
         elapsed = now - self._check_time
         _log.debug("FINISH check %r (rc=%s, elapsed=%.02f)",
                    self._path, rc, elapsed)
+        self._checking = False
         self._reaper = None
         self._proc = None
         if self._state is STOPPING:
@@ -332,7 +379,7 @@ class DirectioChecker(object):
             return
         self._schedule_next_check(now)
         result = CheckResult(self._path, rc, self._err, self._check_time,
-                             elapsed)
+                             elapsed, read_delay=read_delay)
         self._complete(result)
 
     def _schedule_next_check(self, now):
@@ -349,22 +396,91 @@ class DirectioChecker(object):
         return "<%s at 0x%x>" % (" ".join(info), id(self))
 
 
+class ThreadedChecker(DirectioChecker):
+    """
+    Check path availability using direct I/O, like DirectioChecker, but
+    performing the read in an executor thread instead of running a dd
+    process.
+
+    The read delay is measured around the read system call only, so it does
+    not include process creation and scheduling delays.
+
+    When storage is not accessible, the read may block for long time. Like
+    a blocked dd process, a blocked read delays the next check until it
+    completes; the executor replaces the blocked thread, so each blocked
+    checker holds at most one thread.
+
+    Usage is the same as DirectioChecker, with an additional running
+    executor.Executor instance used to perform the reads.
+    """
+
+    def __init__(self, loop, path, complete, executor, interval=10.0):
+        super(ThreadedChecker, self).__init__(loop, path, complete,
+                                              interval=interval)
+        self._executor = executor
+
+    def _start_check(self):
+        """
+        Dispatches a direct I/O read of path to the executor. When the read
+        is done, _read_completed will be called in the event loop thread.
+        """
+        self._err = None
+        self._executor.dispatch(self._read, timeout=self._interval)
+
+    def _read(self):
+        """
+        Called in an executor thread. Must not access the checker state.
+        """
+        rc = 0
+        err = None
+        read_delay = None
+        try:
+            with directio.DirectFile(self._path, "r") as f:
+                start = utils.monotonic_time()
+                f.read(BLOCK_SIZE)
+                read_delay = utils.monotonic_time() - start
+        except EnvironmentError as e:
+            rc = e.errno or errno.EIO
+            err = str(e)
+        except Exception as e:
+            rc = EXEC_ERROR
+            err = "Error reading path: %s" % e
+        try:
+            self._loop.call_soon_threadsafe(self._read_completed, rc, err,
+                                            read_delay)
+        except Exception:
+            # The event loop was closed while we were blocked on storage.
+            _log.debug("Discarding check result for %r", self._path)
+
+    def _read_completed(self, rc, err, read_delay):
+        assert self._state is not IDLE
+        self._err = err
+        self._check_completed(rc, read_delay=read_delay)
+
+
 class CheckResult(object):
 
     _PATTERN = re.compile(br".*, ([\de\-.]+) s,[^,]+")
 
-    def __init__(self, path, rc, err, time, elapsed):
+    def __init__(self, path, rc, err, time, elapsed, read_delay=None):
+        """
+        read_delay: the measured read delay, if known. If None, the delay
+                    is parsed from the dd output in err.
+        """
         self.path = path
         self.rc = rc
         self.err = err
         self.time = time
         self.elapsed = elapsed
+        self.read_delay = read_delay
 
     def delay(self):
         # TODO: Raising MiscFileReadException for all errors to keep the old
         # behavior. Should probably use StorageDomainAccessError.
         if self.rc != 0:
             raise exception.MiscFileReadException(self.path, self.rc, self.err)
+        if self.read_delay is not None:
+            return self.read_delay
         if not self.err:
             raise exception.MiscFileReadException(self.path, "no stats")
         stats = self.err.splitlines()[-1]
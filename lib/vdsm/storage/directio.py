@@ -35,6 +35,82 @@ CharPointer = ctypes.POINTER(ctypes.c_char)
 _PC_REC_XFER_ALIGN = 17
 _PC_REC_MIN_XFER_SIZE = 16
 
+# Alignment suitable for direct I/O on both 512 bytes and 4k sector devices.
+BUFFER_ALIGNMENT = 4096
+
+_pread = libc.pread
+_pread.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t,
+                   ctypes.c_int64]
+_pread.restype = ctypes.c_ssize_t
+
+_pwrite = libc.pwrite
+_pwrite.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t,
+                    ctypes.c_int64]
+_pwrite.restype = ctypes.c_ssize_t
+
+
+class AlignedBuffer(object):
+    """
+    Preallocated buffer aligned for direct I/O, used with DirectFile.pread()
+    and DirectFile.pwrite() to avoid allocating a new aligned buffer for
+    every I/O.
+    """
+
+    def __init__(self, size, alignment=BUFFER_ALIGNMENT):
+        self._pbuff = ctypes.c_void_p()
+        rc = libc.posix_memalign(ctypes.byref(self._pbuff), alignment, size)
+        if rc:
+            raise OSError(rc, "Could not allocate aligned buffer")
+        ctypes.memset(self._pbuff, 0, size)
+        self._size = size
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def address(self):
+        return self._pbuff.value
+
+    def getvalue(self, n):
+        """
+        Return the first n bytes of the buffer.
+        """
+        self._check_closed()
+        if n > self._size:
+            raise ValueError("Cannot get %d bytes from %d bytes buffer" %
+                             (n, self._size))
+        return ctypes.string_at(self._pbuff, n)
+
+    def setvalue(self, data):
+        """
+        Copy data to the start of the buffer.
+        """
+        self._check_closed()
+        if len(data) > self._size:
+            raise ValueError("Cannot set %d bytes in %d bytes buffer" %
+                             (len(data), self._size))
+        ctypes.memmove(self._pbuff, data, len(data))
+
+    @property
+    def closed(self):
+        return not self._pbuff
+
+    # Bind globals as defaults, so buffers can be freed during interpreter
+    # shutdown, when module globals may already be None.
+    def close(self, _free=libc.free, _null=ctypes.c_void_p):
+        if self._pbuff:
+            _free(self._pbuff)
+            self._pbuff = _null()
+
+    def _check_closed(self):
+        if self.closed:
+            raise ValueError("Operation on closed buffer")
+
+    def __del__(self):
+        if hasattr(self, "_pbuff"):
+            self.close()
+
 
 class DirectFile(object):
 
@@ -160,6 +236,36 @@ class DirectFile(object):
                     msg = os.strerror(err)
                     raise OSError(err, msg)
 
+    def pread(self, buf, size, offset):
+        """
+        Read size bytes at offset into AlignedBuffer buf, without changing
+        the file position. Returns the number of bytes read.
+        """
+        if size % 512 or offset % 512:
+            raise ValueError("You can only read in 512 multiplies")
+        if buf.closed or size > buf.size:
+            raise ValueError("Invalid buffer for %d bytes" % size)
+        numRead = _pread(self._fd, buf.address, size, offset)
+        if numRead < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return numRead
+
+    def pwrite(self, buf, size, offset):
+        """
+        Write size bytes from AlignedBuffer buf at offset, without changing
+        the file position. Returns the number of bytes written.
+        """
+        if size % 512 or offset % 512:
+            raise ValueError("You can only write in 512 multiplies")
+        if buf.closed or size > buf.size:
+            raise ValueError("Invalid buffer for %d bytes" % size)
+        numWritten = _pwrite(self._fd, buf.address, size, offset)
+        if numWritten < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return numWritten
+
     def seek(self, offset, whence=os.SEEK_SET):
         return os.lseek(self._fd, offset, whence)
 
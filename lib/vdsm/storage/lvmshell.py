@@ -0,0 +1,367 @@
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+This module runs lvm commands in long running lvm shell processes, avoiding
+the cost of starting lvm for every command.
+
+Shell           lvm shell process, running one command at a time.
+ShellPool       pool of Shell instances, used by multiple threads.
+
+The lvm shell reads one command per line from stdin. It does not report when
+a command has completed, or the command exit code, so every command is
+followed by an unknown command used as a marker. When the shell reports the
+unknown marker command on stderr, the previous command has completed, and its
+output was flushed to stdout before the shell read the marker line. When
+reading from a pipe, the shell may echo each line after the prompt; the
+echoed command and marker lines are used to frame the command output.
+
+The shell splits command lines on whitespace and does not support quoting, so
+arguments containing whitespace, such as --config, cannot be used. The shell
+should be started with LVM_SYSTEM_DIR pointing to a directory with the
+lvm.conf to use.
+"""
+
+from __future__ import absolute_import
+
+import errno
+import logging
+import os
+import re
+import select
+import threading
+
+from six.moves import queue
+
+from vdsm import utils
+from vdsm.common import filecontrol
+from vdsm.common import zombiereaper
+from vdsm.compat import CPopen
+
+# Return code for commands which did not complete in time.
+TIMEOUT = -errno.ETIMEDOUT
+
+# Return code for failed commands when the shell did not report the exit
+# code. This is the exit code of lvm for failed commands (ECMD_FAILED).
+FAILED = 5
+
+# Printed by the lvm shell before reading each command
+PROMPT = b"lvm> "
+
+_MARKER = b"vdsm-command-completed-%d"
+_MARKER_LINE = re.compile(br"vdsm-command-completed-\d+$")
+_MARKER_ERROR = re.compile(br"No such command '(vdsm-command-completed-\d+)'")
+_STATUS_ERROR = re.compile(br"Command failed with status code (\d+)")
+_READ_SIZE = 65536
+
+_log = logging.getLogger("storage.lvmshell")
+
+
+class Error(Exception):
+    """
+    Raised when the shell could not run a command.
+    """
+
+
+class Timeout(Error):
+    """
+    Raised when a command did not complete in time.
+    """
+
+
+class Shell(object):
+    """
+    An lvm shell process.
+
+    Not thread safe; use ShellPool to run commands from multiple threads.
+    """
+
+    def __init__(self, command, env=None):
+        self._command = command
+        self._env = env
+        self._proc = None
+        self._markers = 0
+        self._out = b""
+        self._err = b""
+
+    @property
+    def running(self):
+        return self._proc is not None
+
+    def start(self, timeout):
+        """
+        Start the shell, and check that it accepts commands.
+
+        Raises Error if the shell could not be started.
+        """
+        _log.debug("Starting lvm shell %s", self._command)
+        try:
+            self._proc = CPopen(self._command, close_fds=True, env=self._env)
+        except OSError as e:
+            raise Error("Cannot start lvm shell: %s" % e)
+        for fd in (self._proc.stdout.fileno(), self._proc.stderr.fileno()):
+            filecontrol.set_non_blocking(fd)
+        # Check the protocol, and discard start up warnings
+        self.run((), timeout)
+
+    def run(self, args, timeout):
+        """
+        Run lvm command args, and return rc, out, err like commands.execCmd.
+
+        Raises Error if the shell failed, and Timeout if the command did not
+        complete in timeout seconds; the shell is stopped in both cases.
+        """
+        if not self.running:
+            raise Error("Shell is not running")
+        for arg in args:
+            if not arg or len(arg.split()) != 1:
+                raise ValueError("Unsupported argument %r" % arg)
+
+        self._markers += 1
+        marker = _MARKER % self._markers
+        line = b" ".join(a.encode("utf-8") if not isinstance(a, bytes) else a
+                         for a in args)
+        try:
+            self._write(line + b"\n" + marker + b"\n")
+            out, err = self._wait_for(marker, timeout)
+        except Exception:
+            self.stop()
+            raise
+
+        lines = self._frame(line, out)
+        errors = [l for l in err.splitlines(False)
+                  if l.strip() and not _MARKER_ERROR.search(l)]
+        return self._returncode(errors), lines, errors
+
+    def stop(self):
+        """
+        Stop the shell. The shell process will be reaped in the background
+        if it did not exit yet, for example if it is blocked on storage.
+        """
+        if self._proc is None:
+            return
+        proc = self._proc
+        self._proc = None
+        _log.debug("Stopping lvm shell pid=%s", proc.pid)
+        for f in (proc.stdin, proc.stdout, proc.stderr):
+            try:
+                f.close()
+            except EnvironmentError:
+                pass
+        if proc.poll() is None:
+            try:
+                proc.terminate()
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    _log.warning("Cannot terminate lvm shell pid=%s: %s",
+                                 proc.pid, e)
+            try:
+                zombiereaper.autoReapPID(proc.pid)
+            except RuntimeError:
+                # zombiereaper is not registered, for example in tests.
+                proc.wait()
+
+    def _write(self, data):
+        try:
+            self._proc.stdin.write(data)
+            self._proc.stdin.flush()
+        except EnvironmentError as e:
+            raise Error("Cannot write to lvm shell: %s" % e)
+
+    def _wait_for(self, marker, timeout):
+        """
+        Read stdout and stderr until marker is reported on stderr, and return
+        the data read before the marker.
+        """
+        deadline = utils.monotonic_time() + timeout
+        stdout = self._proc.stdout.fileno()
+        stderr = self._proc.stderr.fileno()
+        poller = select.poll()
+        poller.register(stdout, select.POLLIN)
+        poller.register(stderr, select.POLLIN)
+
+        while True:
+            span = self._find_marker(marker)
+            if span:
+                # The command output was flushed before the shell read the
+                # marker line, so all of it is ready now.
+                self._read(stdout)
+                start, end = span
+                err = self._err[:start]
+                self._err = self._err[end:]
+                # Keep the prompt for the next command, so the shell echo of
+                # the next command line is not split between commands.
+                tail = self._out.rfind(b"\n") + 1
+                if self._out[tail:].replace(PROMPT, b""):
+                    tail = len(self._out)
+                out = self._out[:tail]
+                self._out = self._out[tail:]
+                return out, err
+
+            remaining = deadline - utils.monotonic_time()
+            if remaining <= 0:
+                raise Timeout("Timeout waiting for lvm shell pid=%s" %
+                              self._proc.pid)
+            events = utils.NoIntrPoll(poller.poll, remaining * 1000)
+            for fd, event in events:
+                if event & (select.POLLIN | select.POLLHUP | select.POLLERR):
+                    if not self._read(fd):
+                        raise Error("lvm shell pid=%s terminated" %
+                                    self._proc.pid)
+
+    def _find_marker(self, marker):
+        """
+        Return the start and end of the line reporting marker on stderr, or
+        None if the line was not read yet.
+        """
+        for match in _MARKER_ERROR.finditer(self._err):
+            if match.group(1) == marker:
+                end = self._err.find(b"\n", match.end())
+                if end == -1:
+                    return None
+                start = self._err.rfind(b"\n", 0, match.start()) + 1
+                return start, end + 1
+        return None
+
+    def _read(self, fd):
+        """
+        Read available data from fd. Returns False on EOF.
+        """
+        while True:
+            try:
+                data = os.read(fd, _READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return True
+                raise
+            if not data:
+                return False
+            if fd == self._proc.stdout.fileno():
+                self._out += data
+            else:
+                self._err += data
+
+    def _frame(self, line, out):
+        """
+        Return the report lines in out, the output of command line.
+
+        When reading from a pipe, the shell may echo each command line after
+        the prompt. The echoed command line and marker line frame the command
+        output; lines before the command line, such as output left by a
+        previous command, and lines after the marker are dropped.
+        """
+        lines = []
+        for l in out.splitlines(True):
+            text = l.rstrip(b"\r\n")
+            if text.startswith(PROMPT):
+                echoed = text.replace(PROMPT, b"").strip()
+                if echoed == line:
+                    del lines[:]
+                    continue
+                if _MARKER_LINE.match(echoed):
+                    break
+            lines.append(text.replace(PROMPT, b""))
+        return lines
+
+    def _returncode(self, errors):
+        for line in errors:
+            match = _STATUS_ERROR.search(line)
+            if match:
+                return int(match.group(1))
+        for line in errors:
+            if not line.lstrip().startswith(b"WARNING"):
+                return FAILED
+        return 0
+
+
+class ShellPool(object):
+    """
+    Run commands using up to size lvm shells.
+
+    Shells are started on demand. A shell running a command which times out
+    is stopped, and replaced by a new shell on the next command. Calling
+    reset() marks all shells as stale; a stale shell is stopped and replaced
+    by a new shell when it is taken for the next command, so the next
+    commands use a new shell, for example after the lvm configuration has
+    changed.
+    """
+
+    def __init__(self, command, size=1, timeout=60, env=None):
+        self._command = command
+        self._env = env
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._idle = queue.Queue()
+        for i in range(size):
+            self._idle.put(None)
+
+    def run(self, args):
+        """
+        Run lvm command args, returning rc, out, err like commands.execCmd.
+
+        Raises Error if a shell could not be started.
+        """
+        entry = self._idle.get()
+        shell = None
+        try:
+            shell, generation = entry if entry else (None, None)
+            with self._lock:
+                current = self._generation
+            if shell and generation != current:
+                shell.stop()
+                shell = None
+            if shell is None:
+                shell = Shell(self._command, env=self._env)
+                shell.start(self._timeout)
+                generation = current
+            try:
+                return shell.run(args, self._timeout)
+            except Timeout:
+                _log.warning("lvm command %s timed out after %s seconds, "
+                             "stopping shell", args, self._timeout)
+                return TIMEOUT, [], [b"Timeout running lvm command"]
+        finally:
+            if shell and shell.running:
+                self._idle.put((shell, generation))
+            else:
+                self._idle.put(None)
+
+    def reset(self):
+        """
+        Mark all shells as stale. Shells are not stopped here; idle shells
+        keep running until they are taken for the next command.
+        """
+        with self._lock:
+            self._generation += 1
+
+    def close(self):
+        """
+        Stop idle shells. Must not be called while commands are running.
+        """
+        entries = []
+        while True:
+            try:
+                entries.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for entry in entries:
+            if entry:
+                entry[0].stop()
+            self._idle.put(None)
@@ -44,6 +44,7 @@ import weakref
 
 from array import array
 from collections import defaultdict
+from contextlib import contextmanager
 from functools import wraps, partial
 from itertools import chain, imap
 
@@ -53,6 +54,7 @@ from vdsm import constants
 from vdsm import logUtils
 from vdsm import utils
 
+from vdsm.storage import directio
 from vdsm.storage import exception as se
 from vdsm.storage.constants import SECTOR_SIZE
 
@@ -64,6 +66,9 @@ UUID_HYPHENS = [8, 13, 18, 23]
 MEGA = 1 << 20
 UNLIMITED_THREADS = -1
 
+# Largest read used by readblocks() when merging nearby blocks.
+READ_BATCH_SIZE = MEGA
+
 log = logging.getLogger('Storage.Misc')
 
 
@@ -194,31 +199,70 @@ def readblock(name, offset, size):
     '''
     Read (direct IO) the content of device 'name' at offset, size bytes
     '''
+    return readblocks(name, [offset], size)[0]
+
+
+def readblocks(name, offsets, size):
+    """
+    Read (direct IO) size bytes at each of offsets from device 'name'.
+    Blocks close to each other are read using one large read, so reading
+    many small blocks, like volume metadata slots, costs few I/Os.
 
+    Returns a list with the lines of each block, in the order of offsets.
+    """
     # direct io must be aligned on block size boundaries
-    if (size % 512) or (offset % 512):
-        raise se.MiscBlockReadException(name, offset, size)
+    for offset in offsets:
+        if (size % 512) or (offset % 512):
+            raise se.MiscBlockReadException(name, offset, size)
 
-    left = size
-    ret = ""
-    baseoffset = offset
+    blocks = {}
+    try:
+        with directio.DirectFile(name, "r") as f, _buffers.get() as buf:
+            for start, end in _readRanges(offsets, size, READ_BATCH_SIZE):
+                data = _directRead(name, f, buf, start, end - start)
+                for offset in offsets:
+                    if start <= offset < end:
+                        pos = offset - start
+                        blocks[offset] = data[pos:pos + size].splitlines()
+    except EnvironmentError as e:
+        log.error("Error reading %s: %s", name, e)
+        raise se.MiscBlockReadException(name, offsets[0], size)
 
-    while left > 0:
-        (iounit, count, iooffset) = _alignData(left, offset)
+    return [blocks[offset] for offset in offsets]
 
-        cmd = [constants.EXT_DD, "iflag=%s" % DIRECTFLAG, "skip=%d" % iooffset,
-               "bs=%d" % iounit, "if=%s" % name, "count=%s" % count]
 
-        (rc, out, err) = execCmd(cmd, raw=True)
-        if rc:
-            raise se.MiscBlockReadException(name, offset, size)
-        if not validateDDBytes(err.splitlines(), iounit * count):
-            raise se.MiscBlockReadIncomplete(name, offset, size)
+def _readRanges(offsets, size, limit):
+    """
+    Yield (start, end) ranges covering size bytes at every offset, merging
+    blocks into ranges up to limit bytes.
+    """
+    start = end = None
+    for offset in sorted(set(offsets)):
+        if start is not None and offset + size - start <= limit:
+            end = offset + size
+            continue
+        if start is not None:
+            yield start, end
+        start = offset
+        end = offset + size
+    if start is not None:
+        yield start, end
 
-        ret += out
-        left = left % iounit
-        offset = baseoffset + size - left
-    return ret.splitlines()
+
+def _directRead(name, f, buf, offset, size):
+    """
+    Read size bytes at offset from DirectFile f using AlignedBuffer buf.
+    """
+    chunks = []
+    pos = offset
+    end = offset + size
+    while pos < end:
+        n = min(buf.size, end - pos)
+        if f.pread(buf, n, pos) != n:
+            raise se.MiscBlockReadIncomplete(name, offset, size)
+        chunks.append(buf.getvalue(n))
+        pos += n
+    return "".join(chunks)
 
 
 def validateDDBytes(ddstderr, size):
@@ -321,6 +365,38 @@ def ddWatchCopy(src, dst, stop, size, offset=0):
     return (rc, out, err)
 
 
+class _BufferPool(object):
+    """
+    Keep aligned buffers for direct I/O, so readblock() does not allocate a
+    new buffer for every call.
+    """
+
+    def __init__(self, size, maxfree):
+        self._size = size
+        self._maxfree = maxfree
+        self._free = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def get(self):
+        with self._lock:
+            buf = self._free.pop() if self._free else None
+        if buf is None:
+            buf = directio.AlignedBuffer(self._size)
+        try:
+            yield buf
+        finally:
+            with self._lock:
+                if len(self._free) < self._maxfree:
+                    self._free.append(buf)
+                    buf = None
+            if buf is not None:
+                buf.close()
+
+
+_buffers = _BufferPool(MEGA, 4)
+
+
 def ddCopy(src, dst, size):
     """
     Copy src to dst using dd command
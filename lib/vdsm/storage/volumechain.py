@@ -0,0 +1,120 @@
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+Resolving volume chains from the parent of every volume of an image.
+
+The parent/child graph is built in memory, so callers can read the metadata
+of all the image volumes at once, instead of reading the metadata of each
+volume while walking the chain.
+"""
+
+from __future__ import absolute_import
+
+from vdsm.storage import constants as sc
+
+
+class ChainError(Exception):
+    def __init__(self, volumes_children):
+        self.volumes_children = volumes_children
+
+
+class DuplicateParentError(ChainError):
+    description = ("More than one volume pointing to the same parent volume "
+                   "e.g: (_BLANK_UUID<-a), (a<-b), (a<-c)")
+
+
+class NoBaseVolume(ChainError):
+    description = ("no volume with a parent volume Id _BLANK_UUID found e.g: "
+                   "(a<-b), (b<-c)")
+
+
+class ChainLoopError(ChainError):
+    description = ("A loop found in the volume chain. This happens if a "
+                   "volume points to one of it's parent volume e.g.: "
+                   "(BLANK_UUID<-a), (a<-b), (b<-c), (c<-a)")
+
+
+class OrphanVolumes(ChainError):
+    description = ("There are volumes that are part of an image and are "
+                   "pointing to volumes which are not part of the chain e.g: "
+                   "(BLANK_UUID<-a), (a<-b), (c<-d)")
+
+
+def build(volumes_children):
+    """
+    Build a chain from a list of (parent_uuid, vol_uuid) tuples, requiring
+    every volume to be part of the chain.
+
+    Returns a list of volume UUIDs, sorted from base to leaf. Raises a
+    ChainError subclass if the volumes do not form a single chain.
+    """
+    volumes_by_parents = dict(volumes_children)
+    if len(volumes_by_parents) < len(volumes_children):
+        raise DuplicateParentError(volumes_children)
+
+    child_vol = sc.BLANK_UUID
+    chain = []  # ordered vol_UUIDs
+    seen = set()
+    while True:
+        child_vol = volumes_by_parents.get(child_vol)
+        if child_vol is None:
+            break  # end of chain
+        if child_vol in seen:
+            raise ChainLoopError(volumes_children)
+        chain.append(child_vol)
+        seen.add(child_vol)
+
+    if not chain and volumes_by_parents:
+        raise NoBaseVolume(volumes_children)
+
+    if len(chain) < len(volumes_by_parents):
+        raise OrphanVolumes(volumes_children)
+
+    return chain
+
+
+def walk(parents, leaf_uuid):
+    """
+    Walk from leaf_uuid to the base of the chain using parents, a dict
+    mapping volume UUID to parent volume UUID. Volumes not on the path from
+    the leaf are ignored.
+
+    The walk stops at a volume whose parent is BLANK_UUID or is missing in
+    parents, for example a template volume from another image. Use
+    parents[chain[0]] to find the parent of the base volume.
+
+    Returns a list of volume UUIDs, sorted from base to leaf. Raises
+    ChainLoopError if a volume points to one of its children.
+    """
+    chain = []
+    seen = set()
+    vol_uuid = leaf_uuid
+    while True:
+        chain.append(vol_uuid)
+        seen.add(vol_uuid)
+        parent_uuid = parents[vol_uuid]
+        if parent_uuid == sc.BLANK_UUID or parent_uuid not in parents:
+            break
+        if parent_uuid in seen:
+            raise ChainLoopError([(parents[v], v) for v in chain])
+        vol_uuid = parent_uuid
+
+    chain.reverse()
+    return chain
@@ -25,6 +25,9 @@ import os
 from multiprocessing.managers import BaseManager, RemoteError
 import logging
 import threading
+
+import six
+
 from vdsm import constants, utils
 from vdsm.panic import panic
 
@@ -39,6 +42,32 @@ class _SuperVdsmManager(BaseManager):
     pass
 
 
+class _CallStats(object):
+    """
+    Latency counters per remote function.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def add(self, funcName, elapsed):
+        with self._lock:
+            count, total, slowest = self._stats.get(funcName, (0, 0.0, 0.0))
+            self._stats[funcName] = (count + 1, total + elapsed,
+                                     max(slowest, elapsed))
+
+    def get(self):
+        """
+        Returns a dict mapping function name to a dict with the number of
+        calls, and the total and maximum latency in seconds.
+        """
+        with self._lock:
+            return {name: {"count": count, "total": total, "max": slowest}
+                    for name, (count, total, slowest)
+                    in six.iteritems(self._stats)}
+
+
 class ProxyCaller(object):
 
     def __init__(self, supervdsmProxy, funcName):
@@ -49,6 +78,7 @@ class ProxyCaller(object):
         callMethod = lambda: \
             getattr(self._supervdsmProxy._svdsm, self._funcName)(*args,
                                                                  **kwargs)
+        start = utils.monotonic_time()
         try:
             return callMethod()
         except RemoteError:
@@ -56,19 +86,53 @@ class ProxyCaller(object):
             raise RuntimeError(
                 "Broken communication with supervdsm. Failed call to %s"
                 % self._funcName)
+        finally:
+            self._supervdsmProxy._stats.add(
+                self._funcName, utils.monotonic_time() - start)
 
 
 class SuperVdsmProxy(object):
     """
     A wrapper around all the supervdsm init stuff
+
+    The proxy keeps one connection to supervdsm per calling thread, so
+    concurrent callers do not wait for each other.
     """
     _log = logging.getLogger("SuperVdsmProxy")
 
     def __init__(self):
         self._manager = None
         self._svdsm = None
+        self._stats = _CallStats()
         self._connect()
 
+    def batch(self, calls):
+        """
+        Run many calls in supervdsm in one round trip.
+
+        calls is a sequence of (funcName, args, kwargs) tuples. Returns a
+        list of (succeeded, value) tuples in the same order, where value is
+        the result of the call, or the exception raised by the call.
+
+        The latency of each batched call is recorded under its function
+        name, as the time supervdsm spent running it. The round trip is
+        recorded under "batch".
+        """
+        calls = list(calls)
+        if not calls:
+            return []
+        results = ProxyCaller(self, 'batch')(calls)
+        for (funcName, _, _), (_, _, elapsed) in zip(calls, results):
+            self._stats.add(funcName, elapsed)
+        return [(succeeded, value) for succeeded, value, _ in results]
+
+    def stats(self):
+        """
+        Returns the latency counters of the remote functions, see
+        _CallStats.get.
+        """
+        return self._stats.get()
+
     def open(self, *args, **kwargs):
         return self._manager.open(*args, **kwargs)
 
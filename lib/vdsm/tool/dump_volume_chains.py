@@ -26,10 +26,11 @@ import socket
 from . import expose
 
 from vdsm import vdscli
+from vdsm.storage import constants as sc
+from vdsm.storage import volumechain
+from vdsm.storage.volumechain import ChainError
 
-# BLANK_UUID is re-declared here since it cannot be imported properly. This
-# constant should be introduced under lib publicly available
-_BLANK_UUID = '00000000-0000-0000-0000-000000000000'
+_BLANK_UUID = sc.BLANK_UUID
 _NAME = 'dump-volume-chains'
 
 
@@ -54,33 +55,6 @@ class NoConnectedStoragePoolError(DumpChainsError):
     pass
 
 
-class ChainError(DumpChainsError):
-    def __init__(self, volumes_children):
-        self.volumes_children = volumes_children
-
-
-class DuplicateParentError(ChainError):
-    description = ("More than one volume pointing to the same parent volume "
-                   "e.g: (_BLANK_UUID<-a), (a<-b), (a<-c)")
-
-
-class NoBaseVolume(ChainError):
-    description = ("no volume with a parent volume Id _BLANK_UUID found e.g: "
-                   "(a<-b), (b<-c)")
-
-
-class ChainLoopError(ChainError):
-    description = ("A loop found in the volume chain. This happens if a "
-                   "volume points to one of it's parent volume e.g.: "
-                   "(BLANK_UUID<-a), (a<-b), (b<-c), (c<-a)")
-
-
-class OrphanVolumes(ChainError):
-    description = ("There are volumes that are part of an image and are "
-                   "pointing to volumes which are not part of the chain e.g: "
-                   "(BLANK_UUID<-a), (a<-b), (c<-d)")
-
-
 @expose(_NAME)
 def dump_chains(*args):
     """
@@ -166,27 +140,7 @@ def _get_volumes_for_image(server, img_uuid, sd_uuid, sp_uuid):
 
 
 def _build_volume_chain(volumes_children):
-    volumes_by_parents = dict(volumes_children)
-    if len(volumes_by_parents) < len(volumes_children):
-        raise DuplicateParentError(volumes_children)
-
-    child_vol = _BLANK_UUID
-    chain = []  # ordered vol_UUIDs
-    while True:
-        child_vol = volumes_by_parents.get(child_vol)
-        if child_vol is None:
-            break  # end of chain
-        if child_vol in chain:
-            raise ChainLoopError(volumes_children)
-        chain.append(child_vol)
-
-    if not chain and volumes_by_parents:
-        raise NoBaseVolume(volumes_children)
-
-    if len(chain) < len(volumes_by_parents):
-        raise OrphanVolumes(volumes_children)
-
-    return chain
+    return volumechain.build(volumes_children)
 
 
 def _get_sp_uuid(server):
@@ -23,8 +23,10 @@ from __future__ import absolute_import
 Code to perform periodic maintenance and bookkeeping of the VMs.
 """
 
+import fractions
 import logging
 import threading
+from collections import defaultdict
 
 import libvirt
 
@@ -34,6 +36,7 @@ from vdsm import libvirtconnection
 from vdsm.config import config
 from vdsm.virt import sampling
 from vdsm.virt import virdomain
+from vdsm.virt import vmstats
 from vdsm.virt import vmstatus
 
 
@@ -44,6 +47,18 @@ _TASK_PER_WORKER = config.getint('sampling', 'periodic_task_per_worker')
 _TASKS = _WORKERS * _TASK_PER_WORKER
 _MAX_WORKERS = config.getint('sampling', 'max_workers')
 
+# Late extension of thin provisioned drives pauses VMs, so the watermark
+# monitor must not wait behind other operations, including the other per-vm
+# operations. Operations which access storage may block for long time during
+# storage outages; limiting the number of their running tasks keeps workers
+# available for the others.
+_QUEUES = (
+    executor.Queue("watermark", priority=10, max_running=None),
+    executor.Queue(executor.DEFAULT_QUEUE, priority=5, max_running=None),
+    executor.Queue("vm", priority=1, max_running=None),
+    executor.Queue("volumes", priority=0, max_running=max(1, _WORKERS // 2)),
+)
+
 
 _operations = []
 _executor = None
@@ -64,49 +79,78 @@ def start(cif, scheduler):
                                   workers_count=_WORKERS,
                                   max_tasks=_TASKS,
                                   scheduler=scheduler,
-                                  max_workers=_MAX_WORKERS)
+                                  max_workers=_MAX_WORKERS,
+                                  queues=_QUEUES)
     _executor.start()
 
-    def per_vm_operation(func, period):
+    def per_vm_operation(func, period, queue):
         disp = VmDispatcher(
-            cif.getVMs, _executor, func, _timeout_from(period))
+            cif.getVMs, _executor, func, _timeout_from(period), queue=queue)
         return Operation(disp, period, scheduler)
 
+    # The drive watermark monitor uses the block stats of all the VMs
+    # needing drive monitoring, sampled with a single libvirt call.
+    watermarks_sampler = Operation(
+        sampling.VMBulkSampler(
+            libvirtconnection.get(cif),
+            cif.getVMs,
+            sampling.block_watermarks,
+            stats_flags=libvirt.VIR_DOMAIN_STATS_BLOCK,
+            select=lambda vm: vm.needsDriveMonitoring()),
+        config.getint('vars', 'vm_watermark_interval'),
+        scheduler)
+
+    vm_operations = CoalescingVmDispatcher(
+        cif.getVMs, _executor, [
+            # Needs dispatching because it accesses FS and libvirt data.
+            (NumaInfoMonitor,
+             config.getint('vars', 'vm_sample_numa_interval')),
+
+            # Job monitoring need QEMU monitor access.
+            (BlockjobMonitor,
+             config.getint('vars', 'vm_sample_jobs_interval')),
+        ],
+        queue="vm")
+
+    vol_size_interval = config.getint('irs', 'vol_size_sample_interval')
+    update_volumes = UpdateVolumes(
+        cif.getVMs, cif.irs, _executor, _timeout_from(vol_size_interval),
+        queue="volumes")
+
     _operations = [
-        # Needs dispatching because updating the volume stats needs
-        # access to the storage, thus can block.
-        per_vm_operation(
-            UpdateVolumes,
-            config.getint('irs', 'vol_size_sample_interval')),
+        # Dispatches a task per storage domain, because updating the
+        # volume stats needs access to the storage, thus can block.
+        Operation(update_volumes, vol_size_interval, scheduler),
 
-        # Needs dispatching because it accesses FS and libvirt data.
-        per_vm_operation(
-            NumaInfoMonitor,
-            config.getint('vars', 'vm_sample_numa_interval')),
+        # Started before the watermark monitor, so it finds a fresh sample.
+        watermarks_sampler,
 
-        # Job monitoring need QEMU monitor access.
+        # We do this only until we get high water mark notifications
+        # from QEMU. It accesses storage and/or QEMU monitor, so can block,
+        # thus we need dispatching. Not coalesced with the other per-vm
+        # operations, so slow numa or job updates cannot delay it.
         per_vm_operation(
-            BlockjobMonitor,
-            config.getint('vars', 'vm_sample_jobs_interval')),
+            DriveWatermarkMonitor,
+            config.getint('vars', 'vm_watermark_interval'),
+            "watermark"),
+
+        # The operations due for a vm at the same time run in one task.
+        Operation(vm_operations, vm_operations.period, scheduler),
 
         # libvirt sampling using bulk stats can block, but unresponsive
         # domains are handled inside VMBulkSampler for performance reasons;
         # thus, does not need dispatching.
+        # The sampler also publishes the stats of all the VMs, so readers
+        # don't need to compute them again for each request.
         Operation(
             sampling.VMBulkSampler(
                 libvirtconnection.get(cif),
                 cif.getVMs,
-                sampling.stats_cache),
+                sampling.stats_cache,
+                produce_stats=vmstats.sampled),
             config.getint('vars', 'vm_sample_interval'),
             scheduler),
 
-        # We do this only until we get high water mark notifications
-        # from QEMU. It accesses storage and/or QEMU monitor, so can block,
-        # thus we need dispatching.
-        per_vm_operation(
-            DriveWatermarkMonitor,
-            config.getint('vars', 'vm_watermark_interval')),
-
         Operation(
             sampling.HostMonitor(cif=cif),
             config.getint('vars', 'host_sample_stats_interval'),
@@ -138,7 +182,8 @@ class Operation(object):
 
     _log = logging.getLogger("virt.periodic.Operation")
 
-    def __init__(self, func, period, scheduler, timeout=0, executor=None):
+    def __init__(self, func, period, scheduler, timeout=0, executor=None,
+                 queue=None):
         """
         parameters:
 
@@ -149,12 +194,14 @@ class Operation(object):
         timeout: same meaning of Executor.dispatch
         scheduler: Scheduler instance to use
         executor: Executor instance to use
+        queue: name of the executor queue, or None for the default queue.
         """
         self._func = func
         self._period = period
         self._timeout = _timeout_from(period) if timeout == 0 else timeout
         self._scheduler = scheduler
         self._executor = _executor if executor is None else executor
+        self._queue = queue
         self._lock = threading.Lock()
         self._running = False
         self._call = None
@@ -204,7 +251,7 @@ class Operation(object):
         Send `func' to Executor to be run as soon as possible.
         """
         self._call = None
-        self._executor.dispatch(self, self._timeout)
+        self._executor.dispatch(self, self._timeout, queue=self._queue)
         self._step()
 
     def __repr__(self):
@@ -221,7 +268,7 @@ class VmDispatcher(object):
 
     _log = logging.getLogger("virt.periodic.VmDispatcher")
 
-    def __init__(self, get_vms, executor, create, timeout):
+    def __init__(self, get_vms, executor, create, timeout, queue=None):
         """
         get_vms: callable which will return a dict which maps
                  vm_ids to vm_instances
@@ -230,11 +277,14 @@ class VmDispatcher(object):
                 dispatch, with its timeout
         timeout: per-vm operation timeout, in seconds
                  (fractions allowed).
+        queue: name of the executor queue for the per-vm
+               operations, or None for the default queue.
         """
         self._get_vms = get_vms
         self._executor = executor
         self._create = create
         self._timeout = timeout
+        self._queue = queue
 
     def __call__(self):
         vms = self._get_vms()
@@ -262,7 +312,8 @@ class VmDispatcher(object):
                 self._log.exception("while dispatching %s", op)
             else:
                 try:
-                    self._executor.dispatch(op, self._timeout)
+                    self._executor.dispatch(op, self._timeout,
+                                            queue=self._queue)
                 except executor.TooManyTasks:
                     skipped.append(vm_id)
 
@@ -277,9 +328,143 @@ class VmDispatcher(object):
         )
 
 
-class _RunnableOnVm(object):
+class CoalescingVmDispatcher(object):
+    """
+    Dispatch all the per-vm operations due at the same time as one task
+    per VM, instead of one task per VM per operation.
+
+    The dispatcher must be called every `period` seconds, the greatest
+    common divisor of the operations periods.
+    """
+
+    _log = logging.getLogger("virt.periodic.CoalescingVmDispatcher")
+
+    def __init__(self, get_vms, executor, operations, queue=None):
+        """
+        get_vms: callable which will return a dict which maps
+                 vm_ids to vm_instances
+        executor: executor.Executor instance
+        operations: list of (create, period) tuples, where create is a
+                    _RunnableOnVm subclass, and period is an integer
+                    number of seconds.
+        queue: name of the executor queue for the per-vm
+               tasks, or None for the default queue.
+        """
+        self._get_vms = get_vms
+        self._executor = executor
+        self._queue = queue
+        self.period = reduce(fractions.gcd, [p for _, p in operations])
+        self._operations = [(create, period // self.period, period)
+                            for create, period in operations]
+        self._lock = threading.Lock()
+        self._ticks = 0
+
+    def __call__(self):
+        with self._lock:
+            ticks = self._ticks
+            self._ticks += 1
+
+        due = [(create, period) for create, every, period in self._operations
+               if ticks % every == 0]
+        if not due:
+            return []
+        timeout = max(_timeout_from(period) for _, period in due)
+
+        vms = self._get_vms()
+        skipped = []
+
+        for vm_id, vm_obj in vms.iteritems():
+            # Shared by all the operations, so the domain readiness is
+            # checked once.
+            ready = _Readiness(vm_obj)
+            ops = []
+            for create, _ in due:
+                try:
+                    op = create(vm_obj, ready)
+                    if op.required:
+                        ops.append(op)
+                except Exception:
+                    # we want to make sure to have VM UUID logged
+                    self._log.exception("while dispatching %s on %s",
+                                        create, vm_id)
+            if not ops:
+                continue
+
+            try:
+                self._executor.dispatch(_VmOperations(vm_obj, ops), timeout,
+                                        queue=self._queue)
+            except executor.TooManyTasks:
+                skipped.append(vm_id)
+
+        if skipped:
+            self._log.warning('could not run %s on %s',
+                              [create for create, _ in due], skipped)
+        return skipped  # for testing purposes
+
+    def __repr__(self):
+        return '<CoalescingVmDispatcher operations=%s at 0x%x>' % (
+            [create for create, _, _ in self._operations], id(self)
+        )
+
+
+class _VmOperations(object):
+    """
+    Run operations on one vm, skipping those which are not runnable.
+    """
+
+    _log = logging.getLogger("virt.periodic.VmOperations")
+
+    def __init__(self, vm, ops):
+        self._vm = vm
+        self._ops = ops
+
+    def __call__(self):
+        skipped = []
+        for op in self._ops:
+            try:
+                # When dealing with blocked domains, we also want to avoid
+                # to pile up jobs that libvirt can't handle, see
+                # VmDispatcher.
+                if not op.runnable:
+                    skipped.append(op)
+                    continue
+                op()
+            except Exception:
+                self._log.exception("%s operation failed", op)
+        if skipped:
+            self._log.warning('could not run %s on %s', skipped, self._vm.id)
+
+    def __repr__(self):
+        return '<VmOperations vm=%s operations=%s at 0x%x>' % (
+            self._vm.id, self._ops, id(self)
+        )
+
+
+class _Readiness(object):
+    """
+    Check once if a domain is ready for commands.
+    """
+
     def __init__(self, vm):
         self._vm = vm
+        self._ready = None
+
+    def __call__(self):
+        if self._ready is None:
+            self._ready = self._vm.isDomainReadyForCommands()
+        return self._ready
+
+
+class _RunnableOnVm(object):
+    def __init__(self, vm, ready=None):
+        """
+        vm: the vm to run on
+        ready: _Readiness instance shared by operations on the same vm,
+               or None to check the domain readiness on each call of
+               `runnable'.
+        """
+        self._vm = vm
+        self._ready = ready
 
     @property
     def required(self):
@@ -289,6 +474,8 @@ class _RunnableOnVm(object):
 
     @property
     def runnable(self):
+        if self._ready is not None:
+            return self._ready()
         return self._vm.isDomainReadyForCommands()
 
     def __call__(self):
@@ -320,20 +507,119 @@ class _RunnableOnVm(object):
         )
 
 
-class UpdateVolumes(_RunnableOnVm):
+class UpdateVolumes(object):
+    """
+    Update the volume size of the disk drives of all the VMs, using one
+    storage request per storage domain, instead of one request per
+    volume.
 
-    @property
-    def required(self):
-        return (super(UpdateVolumes, self).required and
-                # Avoid queries from storage during recovery process
-                self._vm.driveMonitorEnabled())
+    Every domain is queried in its own executor task, so a slow domain
+    delays only the drives on this domain. A domain is not queried again
+    while its previous request is still running.
+    """
 
-    def _execute(self):
-        for drive in self._vm.getDiskDevices():
-            # TODO: If this blocks (is it actually possible?)
-            # we must make sure we don't overwrite good data
-            # with stale old data.
-            self._vm.updateDriveVolume(drive)
+    _log = logging.getLogger("virt.periodic.UpdateVolumes")
+
+    def __init__(self, get_vms, irs, executor, timeout, queue=None):
+        """
+        get_vms: callable which will return a dict which maps
+                 vm_ids to vm_instances
+        irs: storage dispatcher providing getVolumesSize()
+        executor: executor.Executor instance
+        timeout: per-domain request timeout, in seconds
+                 (fractions allowed).
+        queue: name of the executor queue for the per-domain
+               requests, or None for the default queue.
+        """
+        self._get_vms = get_vms
+        self._irs = irs
+        self._executor = executor
+        self._timeout = timeout
+        self._queue = queue
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def __call__(self):
+        volumes = defaultdict(set)
+        vms = defaultdict(dict)
+        for vm in self._get_vms().itervalues():
+            # Disable everything until the migration destination VM
+            # is fully started, and avoid queries from storage during
+            # recovery process.
+            if vm.incomingMigrationPending() or not vm.driveMonitorEnabled():
+                continue
+            for volume in vm.getDriveVolumes():
+                sd_id = volume[0]
+                volumes[sd_id].add(volume)
+                vms[sd_id][vm.id] = vm
+
+        skipped = []
+
+        for sd_id, sd_volumes in volumes.iteritems():
+            with self._lock:
+                if sd_id in self._pending:
+                    skipped.append(sd_id)
+                    continue
+                self._pending.add(sd_id)
+
+            update = _UpdateDomainVolumes(
+                self, sd_id, list(sd_volumes), vms[sd_id].values())
+            try:
+                self._executor.dispatch(update, self._timeout,
+                                        queue=self._queue)
+            except executor.TooManyTasks:
+                self._done(sd_id)
+                skipped.append(sd_id)
+
+        if skipped:
+            self._log.warning('could not update volumes on domains %s',
+                              skipped)
+        return skipped  # for testing purposes
+
+    def _update(self, sd_id, volumes, vms):
+        try:
+            res = self._irs.getVolumesSize(volumes)
+            if res['status']['code'] != 0:
+                self._log.error("Unable to get volumes size on domain %s: "
+                                "%s", sd_id, res['status']['message'])
+                return
+
+            for vm in vms:
+                try:
+                    vm.updateDriveVolumes(res['sizes'])
+                except Exception:
+                    # we want to make sure to have VM UUID logged
+                    self._log.exception("while updating volumes of %s",
+                                        vm.id)
+        finally:
+            self._done(sd_id)
+
+    def _done(self, sd_id):
+        with self._lock:
+            self._pending.discard(sd_id)
+
+    def __repr__(self):
+        return '<UpdateVolumes at 0x%x>' % id(self)
+
+
+class _UpdateDomainVolumes(object):
+    """
+    Update the volumes of one storage domain, see UpdateVolumes.
+    """
+
+    def __init__(self, owner, sd_id, volumes, vms):
+        self._owner = owner
+        self._sd_id = sd_id
+        self._volumes = volumes
+        self._vms = vms
+
+    def __call__(self):
+        self._owner._update(self._sd_id, self._volumes, self._vms)
+
+    def __repr__(self):
+        return '<UpdateDomainVolumes domain=%s at 0x%x>' % (
+            self._sd_id, id(self)
+        )
 
 
 class NumaInfoMonitor(_RunnableOnVm):
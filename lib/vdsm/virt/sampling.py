@@ -23,7 +23,7 @@ from __future__ import absolute_import
 Support for VM and host statistics sampling.
 """
 
-from collections import defaultdict, deque, namedtuple
+from collections import Mapping, defaultdict, deque, namedtuple
 import errno
 import logging
 import os
@@ -37,6 +37,7 @@ from vdsm.constants import P_VDSM_RUN, P_VDSM_CLIENT_LOG
 from vdsm.host import api as hostapi
 from vdsm.network import ipwrapper
 from vdsm.network.netinfo import nics, bonding, vlans
+from vdsm.virt import vmstats
 from vdsm.virt.utils import ExpiringCache
 
 
@@ -354,6 +355,61 @@ StatsSample = namedtuple('StatsSample',
 EMPTY_SAMPLE = StatsSample(None, None, None, None)
 
 
+class VmStatsSnapshot(Mapping):
+    """
+    Immutable mapping of vmid to the stats computed from one bulk sample.
+
+    Snapshots are built once per sampling cycle and shared by all the
+    readers, so the returned stats must not be modified.
+    Every snapshot carries a generation number, increasing with each
+    published snapshot, and the monotonic timestamp of the sample it was
+    built from.
+    """
+
+    __slots__ = ('_generation', '_timestamp', '_vms_stats', '_clock')
+
+    def __init__(self, generation, timestamp, vms_stats,
+                 clock=utils.monotonic_time):
+        self._generation = generation
+        self._timestamp = timestamp
+        self._vms_stats = vms_stats
+        self._clock = clock
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+    @property
+    def age(self):
+        """
+        Seconds elapsed since the sample this snapshot was built from was
+        taken, or None if the snapshot is empty.
+        """
+        if self._timestamp is None:
+            return None
+        return self._clock() - self._timestamp
+
+    def __getitem__(self, vmid):
+        return self._vms_stats[vmid]
+
+    def __iter__(self):
+        return iter(self._vms_stats)
+
+    def __len__(self):
+        return len(self._vms_stats)
+
+    def __repr__(self):
+        return '<VmStatsSnapshot generation=%d vms=%d at 0x%x>' % (
+            self._generation, len(self._vms_stats), id(self))
+
+
+EMPTY_SNAPSHOT = VmStatsSnapshot(0, None, {})
+
+
 class StatsCache(object):
     """
     Cache for bulk stats samples.
@@ -389,6 +445,7 @@ class StatsCache(object):
         self._samples = SampleWindow(size=2, timefn=self._clock)
         self._last_sample_time = 0
         self._vm_last_timestamp = defaultdict(int)
+        self._snapshot = EMPTY_SNAPSHOT
 
     def add(self, vmid):
         """
@@ -454,6 +511,32 @@ class StatsCache(object):
                     'dropped stale old sample: sampled %f stored %f',
                     monotonic_ts, last_sample_time)
 
+    def snapshot(self):
+        """
+        Return the last published VmStatsSnapshot.
+        """
+        return self._snapshot
+
+    def publish(self, vms_stats, monotonic_ts):
+        """
+        Publish a new VmStatsSnapshot built from `vms_stats', a dict mapping
+        vmid to the stats computed from the sample taken at `monotonic_ts'.
+        Like put(), silently discard snapshots older than the current one.
+        Return the published snapshot, or None if it was discarded.
+        """
+        with self._lock:
+            current = self._snapshot
+            if (current.timestamp is not None and
+                    monotonic_ts < current.timestamp):
+                self._log.warning(
+                    'dropped stale old snapshot: sampled %f published %f',
+                    monotonic_ts, current.timestamp)
+                return None
+            self._snapshot = VmStatsSnapshot(
+                current.generation + 1, monotonic_ts, vms_stats,
+                clock=self._clock)
+            return self._snapshot
+
     def _update_ts(self, bulk_stats, monotonic_ts):
         # FIXME: this is expected to be costly performance-wise.
         for vmid in bulk_stats:
@@ -463,6 +546,96 @@ class StatsCache(object):
 stats_cache = StatsCache()
 
 
+class BlockWatermarks(object):
+    """
+    Host-wide view of the allocation of the VMs drives, sampled by a
+    VMBulkSampler with one bulk stats call for all the VMs, so drive
+    watermark checks do not need a blockInfo call per drive.
+
+    Provides the clock() and put() methods of StatsCache.
+    """
+
+    _log = logging.getLogger("virt.sampling.BlockWatermarks")
+
+    def __init__(self, clock=utils.monotonic_time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._timestamp = 0
+        # vmid -> {drive name: (path, capacity, alloc, physical)}
+        self._drives = {}
+        # vmid -> time of invalidation
+        self._invalidated = {}
+
+    def clock(self):
+        """
+        Provide timestamp compatible with what put() expects
+        """
+        return self._clock()
+
+    def put(self, bulk_stats, monotonic_ts):
+        """
+        Replace the current sample with a new bulk sample taken at
+        `monotonic_ts'. Like StatsCache.put(), discard silently out of order
+        samples.
+        """
+        drives = dict((vmid, _block_watermarks(stats))
+                      for vmid, stats in bulk_stats.iteritems())
+        with self._lock:
+            if monotonic_ts < self._timestamp:
+                self._log.warning(
+                    'dropped stale old sample: sampled %f stored %f',
+                    monotonic_ts, self._timestamp)
+                return
+            for vmid, invalidated in list(self._invalidated.items()):
+                if invalidated >= monotonic_ts:
+                    drives.pop(vmid, None)
+                else:
+                    del self._invalidated[vmid]
+            self._timestamp = monotonic_ts
+            self._drives = drives
+
+    def get(self, vmid, name, path, max_age):
+        """
+        Return (capacity, alloc, physical) of the drive `name' of the vm, or
+        None if the last sample is older than `max_age' seconds, or has no
+        data for this drive at `path'.
+        """
+        with self._lock:
+            if self._clock() - self._timestamp > max_age:
+                return None
+            info = self._drives.get(vmid, {}).get(name)
+        if info is None or info[0] != path:
+            return None
+        return info[1:]
+
+    def invalidate(self, vmid):
+        """
+        Discard the data of the vm sampled until now, for example after
+        extending one of its drives.
+        """
+        with self._lock:
+            self._invalidated[vmid] = self._clock()
+            self._drives.pop(vmid, None)
+
+
+def _block_watermarks(stats):
+    drives = {}
+    for i in range(stats.get('block.count', 0)):
+        prefix = 'block.%d.' % i
+        try:
+            drives[stats[prefix + 'name']] = (stats[prefix + 'path'],
+                                              stats[prefix + 'capacity'],
+                                              stats[prefix + 'allocation'],
+                                              stats[prefix + 'physical'])
+        except KeyError:
+            # Not reported for all drives, for example an empty cdrom.
+            continue
+    return drives
+
+
+block_watermarks = BlockWatermarks()
+
+
 # this value can be tricky to tune.
 # we should avoid as much as we can to trigger
 # false positive fast flows (getAllDomainStats call).
@@ -475,11 +648,23 @@ _TTL = 40.0
 
 class VMBulkSampler(object):
     def __init__(self, conn, get_vms, stats_cache,
-                 stats_flags=0, ttl=_TTL):
+                 stats_flags=0, ttl=_TTL, produce_stats=None, select=None):
+        """
+        produce_stats: optional callable, accepting a vm object and its
+                       StatsSample and returning the vm stats.
+                       If given, after each successful sampling the stats
+                       of all the VMs are computed once and published
+                       in `stats_cache' as a VmStatsSnapshot.
+        select: optional callable, accepting a vm object and returning
+                True if the vm should be sampled. If given, only the
+                selected VMs are sampled, instead of all the domains.
+        """
         self._conn = conn
         self._get_vms = get_vms
         self._stats_cache = stats_cache
         self._stats_flags = stats_flags
+        self._produce_stats = produce_stats
+        self._select = select
         self._skip_doms = ExpiringCache(ttl)
         self._sampling = threading.Semaphore()  # used as glorified counter
         self._log = logging.getLogger("virt.sampling.VMBulkSampler")
@@ -493,7 +678,14 @@ class VMBulkSampler(object):
         fast_path = acquired and not self._skip_doms
         doms = []  # whitelist, meaningful only in the slow path
         try:
-            if fast_path:
+            if fast_path and self._select is not None:
+                doms = self._get_selected_doms()
+                if doms:
+                    bulk_stats = self._conn.domainListGetStats(
+                        doms, self._stats_flags)
+                else:
+                    bulk_stats = []
+            elif fast_path:
                 # This is expected to be the common case.
                 # If everything's ok, we can skip all the costly checks.
                 bulk_stats = self._conn.getAllDomainStats(self._stats_flags)
@@ -511,6 +703,8 @@ class VMBulkSampler(object):
             log_status = False
         else:
             self._stats_cache.put(_translate(bulk_stats), timestamp)
+            if self._produce_stats is not None:
+                self._publish_stats(timestamp)
         finally:
             if acquired:
                 self._sampling.release()
@@ -518,7 +712,28 @@ class VMBulkSampler(object):
             self._log.debug(
                 'sampled timestamp %r elapsed %.3f acquired %r domains %s',
                 timestamp,  self._stats_cache.clock() - timestamp, acquired,
-                'all' if fast_path else len(doms))
+                'all' if fast_path and self._select is None else len(doms))
+
+    def _publish_stats(self, timestamp):
+        vms_stats = {}
+        for vm_id, vm_obj in self._get_vms().iteritems():
+            try:
+                vms_stats[vm_id] = self._produce_stats(
+                    vm_obj, self._stats_cache.get(vm_id))
+            except Exception:
+                self._log.exception("failed to produce stats for vm %s",
+                                    vm_id)
+        snapshot = self._stats_cache.publish(vms_stats, timestamp)
+        if snapshot is not None:
+            vmstats.report_stats(snapshot)
+
+    def _get_selected_doms(self):
+        doms = []
+        for vm_obj in self._get_vms().itervalues():
+            # VMs not started yet or already shut down have no domain.
+            if vm_obj._dom.connected and self._select(vm_obj):
+                doms.append(vm_obj._dom._dom)
+        return doms
 
     def _get_responsive_doms(self):
         vms = self._get_vms()
@@ -527,6 +742,8 @@ class VMBulkSampler(object):
             to_skip = self._skip_doms.get(vm_id, False)
             if to_skip:
                 continue
+            elif self._select is not None and not self._select(vm_obj):
+                continue
             elif not vm_obj.isDomainReadyForCommands():
                 self._skip_doms[vm_id] = True
             else:
@@ -19,8 +19,11 @@
 #
 from __future__ import absolute_import
 
+from collections import OrderedDict
 import contextlib
 import logging
+import threading
+import time
 
 import six
 
@@ -33,6 +36,9 @@ from vdsm.virt.utils import isVdsmImage
 
 _MBPS_TO_BPS = 10 ** 6 / 8
 
+# How many removed VMs are remembered to report them in deltas.
+_REMOVED_HISTORY = 1000
+
 
 def produce(vm, first_sample, last_sample, interval):
     """
@@ -51,6 +57,16 @@ def produce(vm, first_sample, last_sample, interval):
     return stats
 
 
+def sampled(vm, vm_sample):
+    """
+    Produce and translate the stats of `vm' from its StatsSample.
+    """
+    return translate(produce(vm,
+                             vm_sample.first_value,
+                             vm_sample.last_value,
+                             vm_sample.interval))
+
+
 def translate(vm_stats):
     stats = {}
 
@@ -200,14 +216,15 @@ def report_stats(vms_stats):
             report[prefix + '.cpu.sys'] = stat['cpuSys']
             report[prefix + '.cpu.usage'] = stat['cpuUsage']
 
-            report[prefix + '.balloon.max'] = \
-                stat['balloonInfo']['balloon_max']
-            report[prefix + '.balloon.min'] = \
-                stat['balloonInfo']['balloon_min']
-            report[prefix + '.balloon.target'] = \
-                stat['balloonInfo']['balloon_target']
-            report[prefix + '.balloon.cur'] = \
-                stat['balloonInfo']['balloon_cur']
+            if 'balloonInfo' in stat:
+                report[prefix + '.balloon.max'] = \
+                    stat['balloonInfo']['balloon_max']
+                report[prefix + '.balloon.min'] = \
+                    stat['balloonInfo']['balloon_min']
+                report[prefix + '.balloon.target'] = \
+                    stat['balloonInfo']['balloon_target']
+                report[prefix + '.balloon.cur'] = \
+                    stat['balloonInfo']['balloon_cur']
 
             if 'disks' in stat:
                 for disk in stat['disks']:
@@ -263,6 +280,108 @@ def report_stats(vms_stats):
         logging.exception('Report vm stats failed')
 
 
+class DeltaTracker(object):
+    """
+    Track changes in the stats of all the VMs, to report to each client
+    only the VMs and the keys which changed since the generation it saw
+    last.
+
+    The generation is bumped every time a change is detected, and every
+    key of every VM remembers the generation it last changed at. Keys which
+    disappear from the stats of a VM are reported as changed to None.
+
+    Generations are initialized from the wall clock in microseconds, so
+    a generation obtained from a previous vdsm instance is older than
+    any generation of the current one, and results in a full report.
+    """
+
+    def __init__(self, removed_history=_REMOVED_HISTORY, clock=time.time):
+        self._lock = threading.Lock()
+        self._generation = int(clock() * 1000000)
+        # Oldest generation deltas can be computed from
+        self._horizon = self._generation
+        self._removed_history = removed_history
+        # vmid -> (stats, {key: generation})
+        self._vms = {}
+        # vmid -> generation, oldest first
+        self._removed = OrderedDict()
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def delta(self, stats_list, since=None):
+        """
+        Update the tracker with the current `stats_list', as returned by
+        getAllVmStats, and return a tuple (generation, full, changed,
+        removed), where `changed' is a list of stats dicts containing
+        the vmId and the keys changed since generation `since', and
+        `removed' is the list of the ids of the VMs removed since then.
+
+        If `since' is None or too old to compute a delta, all the stats
+        are returned, and `full' is True.
+        """
+        with self._lock:
+            self._update(stats_list)
+            if (since is None or since < self._horizon or
+                    since > self._generation):
+                return (self._generation, True,
+                        [stats for stats, _ in six.itervalues(self._vms)],
+                        [])
+
+            changed = []
+            for vm_id, (stats, changes) in six.iteritems(self._vms):
+                vm_delta = dict((key, stats.get(key))
+                                for key, gen in six.iteritems(changes)
+                                if gen > since)
+                if vm_delta:
+                    vm_delta['vmId'] = vm_id
+                    changed.append(vm_delta)
+
+            removed = [vm_id for vm_id, gen in six.iteritems(self._removed)
+                       if gen > since]
+
+            return self._generation, False, changed, removed
+
+    def _update(self, stats_list):
+        generation = self._generation + 1
+        modified = False
+
+        current = {}
+        for stats in stats_list:
+            vm_id = stats['vmId']
+            current[vm_id] = stats
+            try:
+                old_stats, changes = self._vms[vm_id]
+            except KeyError:
+                changes = dict.fromkeys(stats, generation)
+                self._removed.pop(vm_id, None)
+                modified = True
+            else:
+                for key, value in six.iteritems(stats):
+                    if key not in old_stats or old_stats[key] != value:
+                        changes[key] = generation
+                        modified = True
+                for key in old_stats:
+                    if key not in stats:
+                        changes[key] = generation
+                        modified = True
+            self._vms[vm_id] = (stats, changes)
+
+        for vm_id in list(self._vms):
+            if vm_id not in current:
+                del self._vms[vm_id]
+                self._removed[vm_id] = generation
+                modified = True
+
+        while len(self._removed) > self._removed_history:
+            _, gen = self._removed.popitem(last=False)
+            self._horizon = max(self._horizon, gen)
+
+        if modified:
+            self._generation = generation
+
+
 def _nic_traffic(vm_obj, name, model, mac,
                  start_sample, start_index,
                  end_sample, end_index, interval):
@@ -249,20 +249,60 @@ class _JsonRpcClientRequestContext(object):
                 "]")
 
 
+class _EncodeStats(object):
+    """
+    Aggregates the number of responses, encoded bytes and encoding time per
+    method, so we can tell which verbs are expensive to send.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._methods = {}
+
+    def add(self, method, size, elapsed):
+        with self._lock:
+            count, total_size, total_elapsed = self._methods.get(
+                method, (0, 0, 0.0))
+            self._methods[method] = (count + 1, total_size + size,
+                                     total_elapsed + elapsed)
+
+    def pop(self):
+        """
+        Returns list of (method, count, bytes, seconds) tuples sorted by
+        encoded bytes, and starts a new aggregation period.
+        """
+        with self._lock:
+            methods, self._methods = self._methods, {}
+        stats = [(method,) + values for method, values in methods.items()]
+        stats.sort(key=lambda s: s[2], reverse=True)
+        return stats
+
+
 class _JsonRpcServeRequestContext(object):
-    def __init__(self, client, server_address):
+    def __init__(self, client, server_address, encode_stats=None):
         self._requests = []
         self._client = client
         self._server_address = server_address
+        self._encode_stats = encode_stats
         self._counter = 0
         self._requests = {}
         self._responses = []
+        # Workers serving requests of a batch complete concurrently. This lock
+        # protects _requests, _responses, _encoding and _sent, so the reply is
+        # sent once, when all the responses were encoded.
+        self._lock = Lock()
+        self._encoding = 0
+        self._sent = False
+        # Time spent waiting in the server queue and decoding the message,
+        # shared by all requests of a batch.
+        self.queue_wait = 0.0
+        self.decode_time = 0.0
 
     def setRequests(self, requests):
-        for request in requests:
-            if not request.isNotification():
-                self._counter += 1
-                self._requests[request.id] = request
+        with self._lock:
+            for request in requests:
+                if not request.isNotification():
+                    self._counter += 1
+                    self._requests[request.id] = request
 
         self.sendReply()
 
@@ -275,38 +315,68 @@ class _JsonRpcServeRequestContext(object):
         return self._server_address
 
     def sendReply(self):
-        if len(self._requests) > 0:
-            return
+        with self._lock:
+            if self._requests or self._encoding or self._sent:
+                return
+            self._sent = True
+            responses = list(self._responses)
 
-        encodedObjects = []
-        for response in self._responses:
-            try:
-                encodedObjects.append(response.encode())
-            except:  # Error encoding data
-                response = JsonRpcResponse(None, JsonRpcInternalError(),
-                                           response.id)
-                encodedObjects.append(response.encode())
+        encodedObjects = [encoded for encoded, _ in responses]
+        response_ids = [response_id for _, response_id in responses]
 
         if len(encodedObjects) == 1:
             data = encodedObjects[0]
         else:
             data = '[' + ','.join(encodedObjects) + ']'
 
-        self._client.send(data.encode('utf-8'))
+        # The ids are passed with the data so the transport can route the
+        # reply without decoding it again.
+        self._client.send(data.encode('utf-8'), response_ids=response_ids)
 
-    def addResponse(self, response):
-        self._responses.append(response)
+    def addResponse(self, response, method=None):
+        """
+        Encodes response in the calling thread, so batch responses are
+        encoded by the workers serving them. Returns the encoding time.
+        """
+        with self._lock:
+            slot = self._reserveSlot()
+        return self._encodeResponse(slot, response, method)
 
     def requestDone(self, response):
-        try:
-            del self._requests[response.id]
-        except KeyError:
-            # ignore when response had no id
-            # we wouldn't be able to match it
-            # with request on the client side
-            pass
-        self.addResponse(response)
+        with self._lock:
+            # Response without id is not removed; we wouldn't be able to match
+            # it with request on the client side.
+            request = self._requests.pop(response.id, None)
+            slot = self._reserveSlot()
+        method = None if request is None else request.method
+        elapsed = self._encodeResponse(slot, response, method)
         self.sendReply()
+        return elapsed
+
+    def _reserveSlot(self):
+        """
+        Must be called with _lock held. The reply is not sent until the
+        response is stored in the returned slot.
+        """
+        self._responses.append(None)
+        self._encoding += 1
+        return len(self._responses) - 1
+
+    def _encodeResponse(self, slot, response, method):
+        start_time = monotonic_time()
+        try:
+            encoded = response.encode()
+        except:  # Error encoding data
+            response = JsonRpcResponse(None, JsonRpcInternalError(),
+                                       response.id)
+            encoded = response.encode()
+        elapsed = monotonic_time() - start_time
+        if self._encode_stats is not None:
+            self._encode_stats.add(method, len(encoded), elapsed)
+        with self._lock:
+            self._responses[slot] = (encoded, response.id)
+            self._encoding -= 1
+        return elapsed
 
 
 class JsonRpcCall(object):
@@ -476,7 +546,8 @@ class JsonRpcServer(object):
     """
     Creates new JsonrRpcServer by providing a bridge, timeout in seconds
     which defining how often we should log connections stats and thread
-    factory.
+    factory. When a thread factory is provided, messages are decoded and
+    requests are served in the threads it provides.
     """
     def __init__(self, bridge, timeout, cif, threadFactory=None):
         self._bridge = bridge
@@ -486,9 +557,10 @@ class JsonRpcServer(object):
         self._timeout = timeout
         self._next_report = monotonic_time() + self._timeout
         self._counter = 0
+        self._encode_stats = _EncodeStats()
 
     def queueRequest(self, req):
-        self._workQueue.put_nowait(req)
+        self._workQueue.put_nowait((monotonic_time(), req))
 
     """
     Aggregates number of requests received by vdsm. Each request from
@@ -500,21 +572,32 @@ class JsonRpcServer(object):
         if monotonic_time() > self._next_report:
             self.log.info('%s requests processed during %s seconds',
                           self._counter, self._timeout)
+            for method, count, size, elapsed in self._encode_stats.pop():
+                self.log.debug('%s: %d responses, %d bytes encoded in '
+                               '%.3f seconds', method, count, size, elapsed)
             self._next_report += self._timeout
             self._counter = 0
 
-    def _serveRequest(self, ctx, req):
+    def _serveRequest(self, ctx, req, dispatch_time=None):
         start_time = monotonic_time()
+        if dispatch_time is None:
+            dispatch_time = start_time
         response = self._handle_request(req, ctx.server_address)
+        execute_time = monotonic_time() - start_time
         error = getattr(response, "error", None)
         if error is None:
             response_log = "succeeded"
         else:
             response_log = "failed (error %s)" % (error.code,)
-        self.log.info("RPC call %s %s in %.2f seconds",
-                      req.method, response_log, monotonic_time() - start_time)
+        encode_time = 0.0
         if response is not None:
-            ctx.requestDone(response)
+            encode_time = ctx.requestDone(response)
+        self.log.info("RPC call %s %s in %.2f seconds (queue: %.3f, "
+                      "decode: %.3f, dispatch: %.3f, execute: %.3f, "
+                      "encode: %.3f)",
+                      req.method, response_log, execute_time, ctx.queue_wait,
+                      ctx.decode_time, start_time - dispatch_time,
+                      execute_time, encode_time)
 
     def _handle_request(self, req, server_address):
         self._attempt_log_stats()
@@ -566,11 +649,33 @@ class JsonRpcServer(object):
             if obj is None:
                 break
 
-            client, server_address, msg = obj
-            self._parseMessage(client, server_address, msg)
+            queued_time, (client, server_address, msg) = obj
+            self._runParser(client, server_address, msg, queued_time)
 
-    def _parseMessage(self, client, server_address, msg):
-        ctx = _JsonRpcServeRequestContext(client, server_address)
+    def _runParser(self, client, server_address, msg, queued_time):
+        """
+        Decodes the message in a worker thread, so large messages do not
+        delay messages from other clients.
+        """
+        if self._threadFactory is None:
+            self._parseMessage(client, server_address, msg, queued_time)
+        else:
+            try:
+                self._threadFactory(partial(self._parseMessage, client,
+                                            server_address, msg, queued_time))
+            except Exception:
+                # The requests cannot be served either, let _runRequest
+                # report the error for each of them.
+                self.log.warning("could not allocate parser thread, "
+                                 "parsing message in server thread")
+                self._parseMessage(client, server_address, msg, queued_time)
+
+    def _parseMessage(self, client, server_address, msg, queued_time=None):
+        start_time = monotonic_time()
+        ctx = _JsonRpcServeRequestContext(client, server_address,
+                                          self._encode_stats)
+        if queued_time is not None:
+            ctx.queue_wait = start_time - queued_time
 
         try:
             rawRequests = json.loads(msg)
@@ -607,6 +712,15 @@ class JsonRpcServer(object):
                                                 JsonRpcInternalError(),
                                                 None))
 
+        ctx.decode_time = monotonic_time() - start_time
+
+        # Transports routing responses by request id learn the ids only
+        # now, since the message is decoded in this worker.
+        register_requests = getattr(client, "register_requests", None)
+        if register_requests is not None:
+            register_requests([request.id for request in requests
+                               if not request.isNotification()])
+
         ctx.setRequests(requests)
 
         # No request was built successfully or is only notifications
@@ -621,7 +735,8 @@ class JsonRpcServer(object):
             self._serveRequest(ctx, request)
         else:
             try:
-                self._threadFactory(partial(self._serveRequest, ctx, request))
+                self._threadFactory(partial(self._serveRequest, ctx, request,
+                                            monotonic_time()))
             except Exception as e:
                 self.log.exception("could not allocate request thread")
                 ctx.requestDone(
@@ -19,9 +19,13 @@
 from __future__ import absolute_import
 import asyncore
 import errno
+import heapq
 import logging
+import select
 import socket
+import threading
 
+from vdsm import utils
 from vdsm.common.eventfd import EventFD
 from vdsm.sslcompat import sslutils
 
@@ -189,18 +193,62 @@ class AsyncoreEvent(asyncore.file_dispatcher):
         asyncore.file_dispatcher.close(self)
 
 
+class _DispatcherMap(dict):
+    """
+    Map of file descriptors to dispatchers, reporting added and removed
+    file descriptors to the reactor.
+
+    Asyncore dispatchers add and remove themselves from the map, possibly
+    from other threads.
+    """
+
+    def __init__(self, changed):
+        dict.__init__(self)
+        self._changed = changed
+
+    def __setitem__(self, fd, dispatcher):
+        dict.__setitem__(self, fd, dispatcher)
+        self._changed(fd)
+
+    def __delitem__(self, fd):
+        dict.__delitem__(self, fd)
+        self._changed(fd)
+
+
 class Reactor(object):
     """
     map dictionary maps sock.fileno() to channels to watch. We add channels to
     it by running add_dispatcher and removing by remove_dispatcher.
-    It is used by asyncore loop to know which channels events to track.
+
+    File descriptors are registered once with epoll. The readable() and
+    writable() state of a dispatcher is checked again only when it had an
+    event, when it was woken up, or when its next check interval expired, and
+    epoll interest is modified only when this state changes. Next check
+    deadlines are kept in a heap. All dispatchers are checked when woken up
+    without a dispatcher, and every DEFAULT_TIMEOUT seconds.
 
     We use eventfd as mechanism to trigger processing when needed.
     """
 
-    def __init__(self):
-        self._map = {}
+    DEFAULT_TIMEOUT = 30.0
+
+    def __init__(self, clock=utils.monotonic_time):
+        self._clock = clock
+        self._lock = threading.Lock()
         self._is_running = False
+        self._wakeupEvent = None
+        # File descriptors to check in the next iteration, and whether all
+        # file descriptors should be checked. Modified by other threads.
+        self._pending = set()
+        self._check_all = True
+        self._next_check_all = 0
+        # Poller state, used only by the reactor thread.
+        self._poller = None
+        self._ready = []  # (fd, events) handled in the last iteration
+        self._registered = {}  # fd -> (dispatcher, epoll events mask)
+        self._deadlines = {}  # fd -> next check deadline
+        self._heap = []  # (deadline, fd)
+        self._map = _DispatcherMap(self._changed)
         self._wakeupEvent = AsyncoreEvent(self._map)
 
     def create_dispatcher(self, sock, impl=None):
@@ -208,29 +256,165 @@ class Reactor(object):
 
     def process_requests(self):
         self._is_running = True
-        while self._is_running:
-            asyncore.loop(
-                timeout=self._get_timeout(self._map),
-                use_poll=True,
-                map=self._map,
-                count=1,
-            )
+        self._poller = select.epoll()
+        self._check_all = True
+        try:
+            while self._is_running:
+                self._update()
+                self._poll(self._get_timeout())
+        finally:
+            self._is_running = False
+            self._poller.close()
+            self._poller = None
+            self._ready = []
+            self._registered.clear()
+            self._deadlines.clear()
+            del self._heap[:]
 
         for dispatcher in self._map.values():
             dispatcher.close()
 
         self._map.clear()
 
-    def _get_timeout(self, map):
-        timeout = 30.0
-        for disp in self._map.values():
-            if hasattr(disp, "next_check_interval"):
-                interval = disp.next_check_interval()
-                if interval is not None and interval >= 0:
-                    timeout = min(interval, timeout)
-        return timeout
+    def _poll(self, timeout):
+        try:
+            events = self._poller.poll(timeout)
+        except IOError as e:
+            if e.errno != errno.EINTR:
+                raise
+            return
+
+        self._ready = events
+        for fd, flags in events:
+            obj = self._map.get(fd)
+            if obj is not None:
+                asyncore.readwrite(obj, flags)
+
+    def _update(self):
+        now = self._clock()
+        with self._lock:
+            # Check all dispatchers periodically, in case some dispatcher state
+            # was modified without waking up the reactor.
+            if self._check_all or now >= self._next_check_all:
+                self._next_check_all = now + self.DEFAULT_TIMEOUT
+                fds = set(self._map.keys())
+                fds.update(self._registered)
+                self._check_all = False
+            else:
+                fds = self._pending
+            self._pending = set()
+
+        # Dispatchers handling events may have changed their state.
+        for fd, flags in self._ready:
+            fds.add(fd)
+        self._ready = []
+
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, fd = heapq.heappop(heap)
+            if self._deadlines.get(fd) == deadline:
+                del self._deadlines[fd]
+                fds.add(fd)
+
+        for fd in fds:
+            self._update_dispatcher(fd, now)
+
+    def _update_dispatcher(self, fd, now):
+        obj = self._map.get(fd)
+        flags = 0
+        if obj is not None:
+            if obj.readable():
+                flags |= select.EPOLLIN | select.EPOLLPRI
+            # accepting sockets should not be writable
+            if obj.writable() and not obj.accepting:
+                flags |= select.EPOLLOUT
+            # readable() and writable() may close the dispatcher
+            if self._map.get(fd) is not obj:
+                obj = None
+                flags = 0
+
+        if flags:
+            flags |= select.EPOLLERR | select.EPOLLHUP
+            self._register(fd, obj, flags)
+        else:
+            self._unregister(fd)
+
+        interval = None
+        if obj is not None and hasattr(obj, "next_check_interval"):
+            interval = obj.next_check_interval()
+        if interval is not None and interval >= 0:
+            deadline = now + min(interval, self.DEFAULT_TIMEOUT)
+            if self._deadlines.get(fd) != deadline:
+                self._deadlines[fd] = deadline
+                heapq.heappush(self._heap, (deadline, fd))
+        else:
+            self._deadlines.pop(fd, None)
 
-    def wakeup(self):
+    def _register(self, fd, obj, flags):
+        current = self._registered.get(fd)
+        if current == (obj, flags):
+            return
+        try:
+            try:
+                if current is None:
+                    self._poller.register(fd, flags)
+                else:
+                    self._poller.modify(fd, flags)
+            except IOError as e:
+                # The file descriptor may have been closed and reused by
+                # another dispatcher since it was registered. Closing a file
+                # descriptor removes it from epoll.
+                if e.errno == errno.EEXIST:
+                    self._poller.modify(fd, flags)
+                elif e.errno == errno.ENOENT:
+                    self._poller.register(fd, flags)
+                else:
+                    raise
+        except IOError as e:
+            if e.errno != errno.EBADF:
+                raise
+            # The socket was closed without removing the dispatcher, handle
+            # it like poll() reporting an invalid file descriptor.
+            self._registered.pop(fd, None)
+            asyncore.readwrite(obj, select.POLLNVAL)
+            return
+        self._registered[fd] = (obj, flags)
+
+    def _unregister(self, fd):
+        if self._registered.pop(fd, None) is None:
+            return
+        try:
+            self._poller.unregister(fd)
+        except IOError as e:
+            # Closing a file descriptor removes it from epoll.
+            if e.errno not in (errno.ENOENT, errno.EBADF):
+                raise
+
+    def _get_timeout(self):
+        heap = self._heap
+        while heap and self._deadlines.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        deadline = self._next_check_all
+        if heap:
+            deadline = min(heap[0][0], deadline)
+        return max(deadline - self._clock(), 0)
+
+    def _changed(self, fd):
+        with self._lock:
+            self._pending.add(fd)
+        if self._is_running:
+            self._wakeupEvent.set()
+
+    def wakeup(self, dispatcher=None):
+        """
+        Wake up the reactor thread, checking the state of all dispatchers, or
+        only of dispatcher if specified.
+        """
+        with self._lock:
+            if dispatcher is None:
+                self._check_all = True
+            elif dispatcher._fileno is not None:
+                self._pending.add(dispatcher._fileno)
         self._wakeupEvent.set()
 
     def stop(self):
@@ -162,10 +162,23 @@ def encodeValue(s):
 
 
 class Parser(object):
+    """
+    Incremental STOMP frame parser.
+
+    Incoming data is appended to a single bytearray and consumed by moving a
+    read offset, so parsing a frame never rebuilds the pending data. When
+    looking for a terminator, only bytes that were not scanned before are
+    searched, and bodies with a content-length header are sliced directly
+    from the buffer. Consumed data is discarded lazily, once it makes up
+    most of the buffer.
+    """
     _STATE_CMD = "Parsing command"
     _STATE_HEADER = "Parsing headers"
     _STATE_BODY = "Receiving body"
 
+    # Do not bother compacting the buffer for less than this many bytes.
+    _COMPACT_THRESHOLD = 4096
+
     def __init__(self):
         self._states = {
             self._STATE_CMD: self._parse_command,
@@ -181,25 +194,60 @@ class Parser(object):
         self._state_cb = self._states[new_state]
 
     def _flush(self):
-        self._buffer = ""
+        self._buffer = bytearray()
+        # Start of unconsumed data
+        self._offset = 0
+        # Position where the next terminator search starts
+        self._scan = 0
 
     def _write_buffer(self, buff):
         self._buffer += buff
 
-    def _get_buffer(self):
-        return self._buffer
+    def _consume(self, end):
+        buf = self._buffer
+        if end == len(buf):
+            del buf[:]
+            end = 0
+        elif end > self._COMPACT_THRESHOLD and end > len(buf) // 2:
+            del buf[:end]
+            end = 0
+
+        self._offset = end
+        self._scan = end
 
     def _handle_terminator(self, term):
-        res, sep, rest = self._buffer.partition(term)
-        if not sep:
+        buf = self._buffer
+        idx = buf.find(term, self._scan)
+        if idx == -1:
+            self._scan = len(buf)
             return None
 
-        self._buffer = rest
+        res = str(buf[self._offset:idx])
+        self._consume(idx + 1)
 
         return res
 
+    def _read_body(self, length):
+        """
+        Return the body of exactly length bytes and consume the frame
+        terminator following it, or None if the frame is not complete yet.
+        """
+        buf = self._buffer
+        start = self._offset
+        end = start + length
+        if len(buf) < end + 1:
+            return None
+
+        if buf[end] != 0:
+            raise RuntimeError("Frame end is missing \\0")
+
+        body = memoryview(buf)[start:end].tobytes()
+        self._consume(end + 1)
+
+        return body
+
     def _parse_command(self):
-        cmd = self._handle_terminator('\n')
+        cmd = self._handle_terminator(b'\n')
         if cmd is None:
             return False
 
@@ -216,7 +264,7 @@ class Parser(object):
         return True
 
     def _parse_header(self):
-        header = self._handle_terminator('\n')
+        header = self._handle_terminator(b'\n')
         if header is None:
             return False
 
@@ -254,7 +302,7 @@ class Parser(object):
             return self._parse_body_terminator()
 
     def _parse_body_terminator(self):
-        body = self._handle_terminator('\0')
+        body = self._handle_terminator(b'\0')
         if body is None:
             return False
 
@@ -263,19 +311,10 @@ class Parser(object):
         return True
 
     def _parse_body_length(self):
-        buf = self._get_buffer()
-        cl = self._contentLength
-        ndata = len(buf)
-        if ndata < (cl + 1):
+        body = self._read_body(self._contentLength)
+        if body is None:
             return False
 
-        if buf[cl] != "\0":
-            raise RuntimeError("Frame end is missing \\0")
-
-        self._flush()
-        self._write_buffer(buf[cl + 1:])
-        body = buf[:cl]
-
         self._tmpFrame.body = body
         self._pushFrame()
 
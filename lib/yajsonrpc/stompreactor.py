@@ -17,12 +17,10 @@ from __future__ import absolute_import
 import logging
 from collections import deque
 from uuid import uuid4
-import functools
 import threading
 
 from vdsm import utils
 from vdsm.config import config
-from vdsm.compat import json
 from vdsm.sslcompat import SSLSocket
 from . import JsonRpcClient, JsonRpcServer
 from . import stomp
@@ -234,26 +232,12 @@ class StompAdapterImpl(object):
         We need to build response dictionary which maps message id
         with destination. For legacy mode we use known 3.5 destination
         or for standard mode we use 'reply-to' header.
-        """
-        try:
-            self._handle_destination(dispatcher, req_dest, json.loads(request))
-        except Exception:
-            # let json server process issue
-            pass
-        dispatcher.connection.handleMessage(request)
 
-    def _handle_destination(self, dispatcher, req_dest, request):
-        """
-        We could receive single message or batch of messages. We need
-        to build response map for each message.
+        The message is decoded by the json server worker, which records
+        the destination of the request ids, so the message is passed with
+        its destination without decoding it in the reactor thread.
         """
-        if isinstance(request, list):
-            map(functools.partial(self._handle_destination, dispatcher,
-                                  req_dest),
-                request)
-            return
-
-        self._req_dest[request.get("id")] = req_dest
+        dispatcher.connection.handleMessage(request, req_dest)
 
     def handle_frame(self, dispatcher, frame):
         try:
@@ -276,7 +260,7 @@ class _StompConnection(object):
 
     def send_raw(self, msg):
         self._async_client.queue_frame(msg)
-        self._reactor.wakeup()
+        self._reactor.wakeup(self._dispatcher)
 
     def setTimeout(self, timeout):
         self._dispatcher.socket.settimeout(timeout)
@@ -296,10 +280,10 @@ class _StompConnection(object):
         self._messageHandler = msgHandler
         self._dispatcher.handle_read_event()
 
-    def handleMessage(self, data):
+    def handleMessage(self, data, req_dest=None):
         if self._messageHandler is not None:
-            self._messageHandler((self._server, self.get_local_address(),
-                                  data))
+            client = _StompRequestSender(self._server, req_dest)
+            self._messageHandler((client, self.get_local_address(), data))
 
     def is_closed(self):
         return not self._dispatcher.connected
@@ -322,17 +306,20 @@ class StompServer(object):
 
     """
     Sends message to all subscribes that subscribed to destination.
+    Responses pass the ids of the requests they answer in response_ids,
+    so the destination recorded when the request was received is used
+    without parsing the message.
     """
-    def send(self, message, destination=stomp.LEGACY_SUBSCRIPTION_ID_RESPONSE):
-        resp = json.loads(message)
-        response_id = resp.get("id")
-
-        try:
-            destination = self._req_dest[response_id]
-            del self._req_dest[response_id]
-        except KeyError:
-            # we could have no reply-to or we could send events (no message id)
-            pass
+    def send(self, message, destination=stomp.LEGACY_SUBSCRIPTION_ID_RESPONSE,
+             response_ids=()):
+        reply_destination = None
+        for response_id in response_ids:
+            # we could have no reply-to (no message id)
+            req_dest = self._req_dest.pop(response_id, None)
+            if reply_destination is None:
+                reply_destination = req_dest
+        if reply_destination is not None:
+            destination = reply_destination
 
         try:
             connections = self._sub_map[destination]
@@ -356,6 +343,25 @@ class StompServer(object):
                 connection.client.send_raw(res)
 
 
+class _StompRequestSender(object):
+    """
+    The server side client of a message received by the StompServer,
+    recording the destination of the message requests when the json server
+    has decoded them.
+    """
+
+    def __init__(self, server, req_dest):
+        self._server = server
+        self._req_dest = req_dest
+
+    def register_requests(self, request_ids):
+        for request_id in request_ids:
+            self._server._req_dest[request_id] = self._req_dest
+
+    def send(self, message, response_ids=()):
+        self._server.send(message, response_ids=response_ids)
+
+
 class StompClient(object):
     log = logging.getLogger("jsonrpc.AsyncoreClient")
 
@@ -400,7 +406,7 @@ class StompClient(object):
 
     def subscribe(self, *args, **kwargs):
         sub = self._aclient.subscribe(*args, **kwargs)
-        self._reactor.wakeup()
+        self._reactor.wakeup(self._stompConn._dispatcher)
         return sub
 
     def send(self, message, destination=stomp.LEGACY_SUBSCRIPTION_ID_RESPONSE,
@@ -411,7 +417,7 @@ class StompClient(object):
             message,
             headers
         )
-        self._reactor.wakeup()
+        self._reactor.wakeup(self._stompConn._dispatcher)
 
     def close(self):
         self._stompConn.close()
@@ -518,7 +524,9 @@ class ServerRpcContextAdapter(object):
     def get_local_address(self, *args, **kwargs):
         return self._address
 
-    def send(self, data):
+    def send(self, data, response_ids=()):
+        # The broker routes the response using the reply-to header of the
+        # request, so the response ids are not needed.
         if self._reply_to:
             self._client.send(
                 self._reply_to,
@@ -18,13 +18,19 @@
 #
 # Refer to the README and COPYING files for full details of the license
 #
+from __future__ import print_function
 import socket
-from contextlib import closing
+import threading
+import time
+from contextlib import closing, contextmanager
 
 from vdsm import concurrent
+from vdsm import utils
 from yajsonrpc.betterAsyncore import AsyncoreEvent, Reactor
 
 from testlib import VdsmTestCase as TestCaseBase
+from testlib import expandPermutations, permutations
+from testValidation import stresstest
 
 
 class TestEvent(TestCaseBase):
@@ -68,3 +74,200 @@ class TestReactor(TestCaseBase):
 
         self.assertTrue(disp.closing)
         self.assertFalse(reactor._wakeupEvent.closing)
+
+
+class EchoImpl(object):
+
+    def __init__(self):
+        self.outbuf = b""
+
+    def readable(self, dispatcher):
+        return True
+
+    def writable(self, dispatcher):
+        return len(self.outbuf) > 0
+
+    def handle_read(self, dispatcher):
+        data = dispatcher.recv(4096)
+        if data:
+            self.outbuf += data
+
+    def handle_write(self, dispatcher):
+        sent = dispatcher.send(self.outbuf)
+        self.outbuf = self.outbuf[sent:]
+
+    def handle_close(self, dispatcher):
+        dispatcher.close()
+
+
+class PingImpl(EchoImpl):
+    """
+    Send a ping when the check interval expires, like stomp heartbeats.
+    """
+
+    def __init__(self, interval):
+        EchoImpl.__init__(self)
+        self.interval = interval
+        self.last_write = utils.monotonic_time()
+
+    def next_check_interval(self):
+        return max(self.last_write + self.interval - utils.monotonic_time(),
+                   0)
+
+    def writable(self, dispatcher):
+        if self.next_check_interval() == 0 and not self.outbuf:
+            self.outbuf = b"ping"
+        return EchoImpl.writable(self, dispatcher)
+
+    def handle_write(self, dispatcher):
+        EchoImpl.handle_write(self, dispatcher)
+        self.last_write = utils.monotonic_time()
+
+
+class ExpiringImpl(EchoImpl):
+    """
+    Close the dispatcher when the check interval expires, like the protocol
+    detector.
+    """
+
+    def __init__(self, timeout):
+        EchoImpl.__init__(self)
+        self.give_up_at = utils.monotonic_time() + timeout
+
+    def next_check_interval(self):
+        return max(self.give_up_at - utils.monotonic_time(), 0)
+
+    def readable(self, dispatcher):
+        if utils.monotonic_time() >= self.give_up_at:
+            dispatcher.close()
+            return False
+        return True
+
+
+@contextmanager
+def running(reactor):
+    thread = concurrent.thread(reactor.process_requests, name='test reactor')
+    thread.start()
+    try:
+        yield reactor
+    finally:
+        reactor.stop()
+        thread.join(timeout=5)
+
+
+def recv_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class TestEpollReactor(TestCaseBase):
+
+    def test_echo(self):
+        with running(Reactor()) as reactor:
+            s1, s2 = socket.socketpair()
+            with closing(s2):
+                reactor.create_dispatcher(s1, impl=EchoImpl())
+                reactor.wakeup()
+                s2.settimeout(2)
+                for i in range(10):
+                    msg = b"message %d" % i
+                    s2.sendall(msg)
+                    self.assertEqual(recv_exactly(s2, len(msg)), msg)
+
+    def test_wakeup_dispatcher(self):
+        with running(Reactor()) as reactor:
+            s1, s2 = socket.socketpair()
+            with closing(s2):
+                impl = EchoImpl()
+                disp = reactor.create_dispatcher(s1, impl=impl)
+                # Let the reactor register the idle dispatcher.
+                time.sleep(0.1)
+                impl.outbuf = b"data"
+                reactor.wakeup(disp)
+                s2.settimeout(2)
+                self.assertEqual(recv_exactly(s2, 4), b"data")
+
+    def test_next_check_interval(self):
+        with running(Reactor()) as reactor:
+            s1, s2 = socket.socketpair()
+            with closing(s2):
+                reactor.create_dispatcher(s1, impl=PingImpl(0.1))
+                reactor.wakeup()
+                s2.settimeout(2)
+                start = utils.monotonic_time()
+                for i in range(3):
+                    self.assertEqual(recv_exactly(s2, 4), b"ping")
+                elapsed = utils.monotonic_time() - start
+                self.assertTrue(0.2 <= elapsed < 1.5, elapsed)
+
+    def test_close_when_expired(self):
+        with running(Reactor()) as reactor:
+            s1, s2 = socket.socketpair()
+            with closing(s2):
+                disp = reactor.create_dispatcher(s1, impl=ExpiringImpl(0.1))
+                reactor.wakeup()
+                s2.settimeout(2)
+                self.assertEqual(s2.recv(1), b"")
+                self.assertFalse(disp.connected)
+
+    def test_replace_closed_dispatcher(self):
+        with running(Reactor()) as reactor:
+            s1, s2 = socket.socketpair()
+            with closing(s2):
+                disp = reactor.create_dispatcher(s1, impl=EchoImpl())
+                disp.close()
+                s3, s4 = socket.socketpair()
+                with closing(s4):
+                    reactor.create_dispatcher(s3, impl=EchoImpl())
+                    s4.settimeout(2)
+                    s4.sendall(b"data")
+                    self.assertEqual(recv_exactly(s4, 4), b"data")
+
+
+@expandPermutations
+class ReactorBenchmark(TestCaseBase):
+
+    @stresstest
+    @permutations([
+        # idle, busy
+        (0, 10),
+        (500, 10),
+        (1000, 10),
+    ])
+    def test_echo(self, idle, busy):
+        messages = 2000
+        msg = b"x" * 100
+        sockets = []
+        try:
+            with running(Reactor()) as reactor:
+                for i in range(idle + busy):
+                    s1, s2 = socket.socketpair()
+                    sockets.append(s2)
+                    reactor.create_dispatcher(s1, impl=PingImpl(10.0))
+                reactor.wakeup()
+
+                def client(sock):
+                    sock.settimeout(10)
+                    for i in range(messages):
+                        sock.sendall(msg)
+                        recv_exactly(sock, len(msg))
+
+                threads = [threading.Thread(target=client, args=(s,))
+                           for s in sockets[:busy]]
+                start = utils.monotonic_time()
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                elapsed = utils.monotonic_time() - start
+        finally:
+            for s in sockets:
+                s.close()
+
+        print("idle=%d busy=%d: %.2f messages/s" %
+              (idle, busy, busy * messages / elapsed))
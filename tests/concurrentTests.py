@@ -185,6 +185,26 @@ class TMapTests(VdsmTestCase):
         expected = [concurrent.Result(False, error)] * 10
         self.assertEqual(results, expected)
 
+    def test_max_threads(self):
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+
+        def func(x):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return x
+
+        values = range(10)
+        results = concurrent.tmap(func, values, max_threads=3)
+        expected = [concurrent.Result(True, x) for x in values]
+        self.assertEqual(results, expected)
+        self.assertEqual(peak[0], 3)
+
 
 class ThreadTests(VdsmTestCase):
 
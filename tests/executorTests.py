@@ -17,6 +17,7 @@
 #
 # Refer to the README and COPYING files for full details of the license
 #
+from __future__ import print_function
 
 import threading
 import time
@@ -27,8 +28,9 @@ from vdsm import pthread
 from vdsm import schedule
 from vdsm import utils
 
-from testValidation import slowtest
+from testValidation import slowtest, stresstest
 from testlib import VdsmTestCase as TestCaseBase
+from testlib import expandPermutations, permutations
 
 
 class ExecutorTests(TestCaseBase):
@@ -223,6 +225,169 @@ class ExecutorTests(TestCaseBase):
             blocked.set()
 
 
+class PriorityTaskQueueTests(TestCaseBase):
+
+    def setUp(self):
+        self.queue = executor.PriorityTaskQueue(2, [
+            executor.Queue("high", priority=10, max_running=None),
+            executor.Queue("low", priority=0, max_running=1),
+            executor.Queue("other", priority=0, max_running=None),
+        ])
+
+    def test_priority(self):
+        self.queue.put("low-task", "low")
+        self.queue.put("default-task")
+        self.queue.put("high-task", "high")
+        self.assertEqual([self.queue.get() for i in range(3)],
+                         ["high-task", "low-task", "default-task"])
+
+    def test_same_priority_fifo(self):
+        self.queue.put("other-1", "other")
+        self.queue.put("low-1", "low")
+        self.queue.put("other-2", "other")
+        self.assertEqual([self.queue.get() for i in range(3)],
+                         ["other-1", "low-1", "other-2"])
+
+    def test_max_running(self):
+        self.queue.put("low-1", "low")
+        self.queue.put("low-2", "low")
+        self.queue.put("other-1", "other")
+        self.assertEqual(self.queue.get(), "low-1")
+        # low-2 must wait until low-1 is done
+        self.assertEqual(self.queue.get(), "other-1")
+        self.queue.task_done("low")
+        self.assertEqual(self.queue.get(), "low-2")
+
+    def test_too_many_tasks_per_queue(self):
+        self.queue.put("low-1", "low")
+        self.queue.put("low-2", "low")
+        self.assertRaises(executor.TooManyTasks,
+                          self.queue.put, "low-3", "low")
+        self.queue.put("high-1", "high")
+
+    def test_unknown_queue(self):
+        self.assertRaises(KeyError, self.queue.put, "task", "no-such-queue")
+
+    def test_stats(self):
+        self.queue.put("low-1", "low")
+        self.queue.put("low-2", "low")
+        self.queue.get()
+        stats = self.queue.stats()
+        self.assertEqual(sorted(stats), ["default", "high", "low", "other"])
+        self.assertEqual(stats["low"]["depth"], 1)
+        self.assertEqual(stats["low"]["running"], 1)
+        self.assertEqual(stats["low"]["started"], 1)
+        self.assertEqual(stats["high"]["depth"], 0)
+        # Wait statistics are reset after reporting
+        self.assertEqual(self.queue.stats()["low"]["started"], 0)
+
+
+class ExecutorQueuesTests(TestCaseBase):
+
+    def setUp(self):
+        self.executor = executor.Executor(
+            'queues', workers_count=2, max_tasks=10, scheduler=None,
+            queues=[executor.Queue("urgent", priority=10, max_running=None),
+                    executor.Queue("slow", priority=0, max_running=1)])
+        self.executor.start()
+
+    def tearDown(self):
+        self.executor.stop()
+
+    def test_stuck_queue_does_not_starve_others(self):
+        release = threading.Event()
+        stuck = [Task(event=release) for i in range(3)]
+        for task in stuck:
+            self.executor.dispatch(task, queue="slow")
+        urgent = Task()
+        self.executor.dispatch(urgent, queue="urgent")
+        self.assertTrue(urgent.executed.wait(1))
+        self.assertEqual([t.started.is_set() for t in stuck],
+                         [True, False, False])
+        release.set()
+        for task in stuck:
+            self.assertTrue(task.executed.wait(1))
+
+    def test_stats(self):
+        self.assertIn('queues', executor.stats())
+        self.assertEqual(sorted(self.executor.stats()),
+                         ["default", "slow", "urgent"])
+        self.executor.stop()
+        self.assertNotIn('queues', executor.stats())
+
+    def test_no_queues_stats(self):
+        plain = executor.Executor('plain', 1, 1, None)
+        self.assertEqual(plain.stats(), {})
+
+
+class ExecutorTimeoutTests(TestCaseBase):
+
+    def setUp(self):
+        self.scheduler = schedule.Scheduler(clock=utils.monotonic_time)
+        self.scheduler.start()
+        self.executor = executor.Executor('single', workers_count=1,
+                                          max_tasks=10,
+                                          scheduler=self.scheduler,
+                                          max_workers=2)
+        self.executor.start()
+
+    def tearDown(self):
+        self.executor.stop()
+        self.scheduler.stop()
+
+    def test_blocked_worker_replaced(self):
+        release = threading.Event()
+        try:
+            blocked = Task(event=release)
+            self.executor.dispatch(blocked, 0.1)
+            task = Task()
+            self.executor.dispatch(task, 1.0)
+            self.assertTrue(task.executed.wait(1))
+            self.assertFalse(blocked.executed.is_set())
+        finally:
+            release.set()
+
+    def test_finished_worker_not_discarded(self):
+        names = []
+        for timeout in (0.05, None):
+            done = threading.Event()
+
+            def task():
+                names.append(pthread.getname())
+                done.set()
+
+            self.executor.dispatch(task, timeout)
+            self.assertTrue(done.wait(1))
+            time.sleep(0.2)
+        self.assertEqual(names, ["single/0", "single/0"])
+
+
+@expandPermutations
+class ExecutorBenchmark(TestCaseBase):
+
+    @stresstest
+    @permutations([
+        # timeout
+        (None,),
+        (10,),
+    ])
+    def test_dispatch(self, timeout):
+        tasks = 100000
+        scheduler = schedule.Scheduler(clock=utils.monotonic_time)
+        exc = executor.Executor('bench', workers_count=4, max_tasks=tasks,
+                                scheduler=scheduler)
+        done = threading.Semaphore(0)
+        with utils.running(scheduler), utils.running(exc):
+            start = utils.monotonic_time()
+            for i in range(tasks):
+                exc.dispatch(done.release, timeout)
+            for i in range(tasks):
+                done.acquire()
+            elapsed = utils.monotonic_time() - start
+        print("%d tasks (timeout=%s) in %.3f seconds (%d tasks/s)" %
+              (tasks, timeout, elapsed, tasks / elapsed))
+
+
 class TestWorkerSystemNames(TestCaseBase):
 
     def test_worker_thread_system_name(self):
@@ -22,16 +22,22 @@
 
 
 import contextlib
+import errno
 import libvirt
 import tempfile
+import threading
+import time
 import os
 import os.path
 from contextlib import contextmanager
 from monkeypatch import MonkeyPatchScope
 from testlib import VdsmTestCase as TestCaseBase
+from testlib import make_config
 from testlib import namedTemporaryDir
 
+from vdsm import exception
 from vdsm import hooks
+from vdsm.utils import retry
 
 
 class TestHooks(TestCaseBase):
@@ -63,6 +69,34 @@ echo -n %s >> "$_hook_domxml"
             hooksNames.sort()
             self.assertEqual(sNames, hooksNames)
 
+    def test_scriptsPerDir_missing(self):
+        self.assertEqual([], hooks._scriptsPerDir('/no/such/dir'))
+
+    def test_scriptsPerDir_cached(self):
+        with self.tempScripts() as (dirName, scripts):
+            # Make the directory old enough to be cached
+            mtime = time.time() - 10
+            os.utime(dirName, (mtime, mtime))
+            sNames = sorted(script.name for script in scripts)
+            self.assertEqual(sNames, sorted(hooks._scriptsPerDir(dirName)))
+            self.assertIn(dirName, hooks._scripts_cache)
+
+            # A script was removed, modifying the directory mtime
+            os.unlink(scripts[0].name)
+            os.utime(dirName, (mtime + 1, mtime + 1))
+            self.assertEqual(sNames[1:],
+                             sorted(hooks._scriptsPerDir(dirName)))
+
+    def test_scriptsPerDir_not_executable(self):
+        with self.tempScripts() as (dirName, scripts):
+            mtime = time.time() - 10
+            os.utime(dirName, (mtime, mtime))
+            hooks._scriptsPerDir(dirName)
+            # Does not modify the directory mtime
+            os.chmod(scripts[0].name, 0o664)
+            sNames = sorted(script.name for script in scripts[1:])
+            self.assertEqual(sNames, sorted(hooks._scriptsPerDir(dirName)))
+
     def test_runHooksDir(self):
         # Add an unicode value to the environment variables
         # to test whether the utf-8 recoding works properly
@@ -158,3 +192,180 @@ domXMLFile.close()
                     self.assertTrue(os.path.exists(flags_file))
                     hooks.remove_vm_launch_flags_file(vm_id)
                     self.assertFalse(os.path.exists(flags_file))
+
+
+@contextmanager
+def hookRunner(enable=True, timeout=30):
+    value = 'true' if enable else 'false'
+    cfg = make_config([('vars', 'hook_runner_enable', value),
+                       ('vars', 'hook_runner_timeout', str(timeout))])
+    try:
+        with MonkeyPatchScope([(hooks, 'config', cfg)]):
+            yield
+    finally:
+        hooks._runner._stop()
+
+
+def runnerProcs():
+    return [proc for proc in hooks._runner._idle.queue if proc is not None]
+
+
+class TestHookRunner(TestCaseBase):
+
+    @contextmanager
+    def jsonScripts(self, *codes):
+        with namedTemporaryDir() as dirName:
+            for n, code in enumerate(codes):
+                path = os.path.join(dirName, '%02d' % n)
+                with open(path, 'w') as f:
+                    f.write(code)
+                os.chmod(path, 0o775)
+            yield dirName
+
+    def test_run(self):
+        code = """#!/bin/sh
+sed -i 's/}$/, "%s": %d}/' "$_hook_json"
+"""
+        with self.jsonScripts(code % ('a', 1), code % ('b', 2)) as dirName:
+            with hookRunner():
+                for i in range(2):
+                    res = hooks._runHooksDir({'x': 0}, dirName,
+                                             hookType=hooks._JSON_HOOK,
+                                             persistent=True)
+                    self.assertEqual({'x': 0, 'a': 1, 'b': 2}, res)
+                self.assertEqual(len(runnerProcs()), 1)
+
+    def test_disabled(self):
+        code = """#!/bin/sh
+echo '{"a": 1}' > "$_hook_json"
+"""
+        with self.jsonScripts(code) as dirName:
+            with hookRunner(enable=False):
+                res = hooks._runHooksDir({}, dirName,
+                                         hookType=hooks._JSON_HOOK,
+                                         persistent=True)
+                self.assertEqual({'a': 1}, res)
+                self.assertEqual(runnerProcs(), [])
+
+    def test_error(self):
+        code = """#!/bin/sh
+echo "failed" >&2
+exit 2
+"""
+        with self.jsonScripts(code, code) as dirName:
+            with hookRunner():
+                with self.assertRaises(exception.HookError) as e:
+                    hooks._runHooksDir({}, dirName,
+                                       hookType=hooks._JSON_HOOK,
+                                       persistent=True)
+                self.assertIn('failed', str(e.exception))
+
+    def test_runner_terminated(self):
+        code = """#!/bin/sh
+echo '{"a": 1}' > "$_hook_json"
+"""
+        with self.jsonScripts(code) as dirName:
+            with hookRunner():
+                hooks._runHooksDir({}, dirName, hookType=hooks._JSON_HOOK,
+                                   persistent=True)
+                proc, = runnerProcs()
+                proc.kill()
+                proc.wait()
+                # Runs the hooks directly, and starts a new runner on the
+                # next call.
+                res = hooks._runHooksDir({}, dirName,
+                                         hookType=hooks._JSON_HOOK,
+                                         persistent=True)
+                self.assertEqual({'a': 1}, res)
+                self.assertEqual(runnerProcs(), [])
+
+    def test_timeout(self):
+        code = """#!/bin/sh
+if [ -e "%s" ]; then
+    sleep 10
+fi
+echo '{"a": 1}' > "$_hook_json"
+"""
+        with namedTemporaryDir() as tmpDir:
+            block = os.path.join(tmpDir, 'block')
+            with self.jsonScripts(code % block) as dirName:
+                with hookRunner(timeout=1):
+                    open(block, 'w').close()
+                    start = time.time()
+                    # Returns the data unchanged, without running the hooks
+                    # directly.
+                    res = hooks._runHooksDir({'x': 0}, dirName,
+                                             hookType=hooks._JSON_HOOK,
+                                             raiseError=False,
+                                             persistent=True)
+                    self.assertEqual({'x': 0}, res)
+                    self.assertLess(time.time() - start, 5)
+                    self.assertEqual(runnerProcs(), [])
+
+                    # Starts a new runner on the next call.
+                    os.unlink(block)
+                    res = hooks._runHooksDir({'x': 0}, dirName,
+                                             hookType=hooks._JSON_HOOK,
+                                             persistent=True)
+                    self.assertEqual({'a': 1}, res)
+                    self.assertEqual(len(runnerProcs()), 1)
+
+    def test_timeout_raise(self):
+        code = """#!/bin/sh
+sleep 10
+"""
+        with self.jsonScripts(code) as dirName:
+            with hookRunner(timeout=1):
+                self.assertRaises(exception.HookError, hooks._runHooksDir,
+                                  {}, dirName, hookType=hooks._JSON_HOOK,
+                                  raiseError=True, persistent=True)
+
+    def test_timeout_kills_scripts(self):
+        code = """#!/bin/sh
+sleep 10 &
+echo $$ $! > "%s"
+wait
+"""
+        with namedTemporaryDir() as tmpDir:
+            pidsFile = os.path.join(tmpDir, 'pids')
+            with self.jsonScripts(code % pidsFile) as dirName:
+                with hookRunner(timeout=1):
+                    hooks._runHooksDir({}, dirName,
+                                       hookType=hooks._JSON_HOOK,
+                                       raiseError=False, persistent=True)
+            with open(pidsFile) as f:
+                pids = [int(pid) for pid in f.read().split()]
+        # The script and its child were killed with the helper.
+        for pid in pids:
+            retry(AssertionError, lambda: self.assertNotRunning(pid),
+                  timeout=2, sleep=0.1)
+
+    def assertNotRunning(self, pid):
+        try:
+            with open('/proc/%d/stat' % pid) as f:
+                state = f.read().rsplit(')', 1)[1].split()[0]
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        self.assertEqual(state, 'Z', "Process %d is running" % pid)
+
+    def test_concurrent(self):
+        code = """#!/bin/sh
+sleep 1
+"""
+        with self.jsonScripts(code) as dirName:
+            with hookRunner():
+                def run():
+                    hooks._runHooksDir({}, dirName,
+                                       hookType=hooks._JSON_HOOK,
+                                       persistent=True)
+                threads = [threading.Thread(target=run) for i in range(2)]
+                start = time.time()
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                # The calls did not wait for each other.
+                self.assertLess(time.time() - start, 1.9)
+                self.assertEqual(len(runnerProcs()), 2)
@@ -0,0 +1,204 @@
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+
+import json
+import threading
+
+from testlib import VdsmTestCase as TestCaseBase
+
+from vdsm import executor
+from yajsonrpc import JsonRpcServer, JsonRpcMethodNotFoundError
+from yajsonrpc import JsonRpcRequest, JsonRpcResponse
+from yajsonrpc import _JsonRpcServeRequestContext
+
+
+class FakeBridge(object):
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def dispatch(self, method):
+        if method == 'echo':
+            return self.echo
+        if method == 'wait':
+            return self.wait
+        raise JsonRpcMethodNotFoundError(method)
+
+    def echo(self, text):
+        return text
+
+    def wait(self):
+        self.started.set()
+        self.release.wait(5)
+        return 'done'
+
+    def register_server_address(self, server_address):
+        pass
+
+    def unregister_server_address(self):
+        pass
+
+
+class FakeCif(object):
+    ready = True
+
+
+class RecordingClient(object):
+
+    def __init__(self):
+        self.replies = []
+        self.replied = threading.Event()
+        self.registered = []
+
+    def register_requests(self, request_ids):
+        self.registered.extend(request_ids)
+
+    def send(self, data, response_ids=()):
+        self.replies.append((json.loads(data), list(response_ids)))
+        self.replied.set()
+
+
+class ThreadFactory(object):
+
+    def __init__(self):
+        self.tasks = 0
+
+    def __call__(self, func):
+        self.tasks += 1
+        t = threading.Thread(target=func)
+        t.daemon = True
+        t.start()
+
+
+class SlowResponse(JsonRpcResponse):
+
+    def __init__(self, result, reqId):
+        super(SlowResponse, self).__init__(result, None, reqId)
+        self.encoding = threading.Event()
+        self.release = threading.Event()
+
+    def encode(self):
+        self.encoding.set()
+        self.release.wait(5)
+        return super(SlowResponse, self).encode()
+
+
+def full_executor(func):
+    raise executor.TooManyTasks
+
+
+def request(method, params, rid):
+    return {"jsonrpc": "2.0", "method": method, "params": params, "id": rid}
+
+
+class JsonRpcServerTests(TestCaseBase):
+
+    def setUp(self):
+        self.bridge = FakeBridge()
+        self.client = RecordingClient()
+
+    def serve(self, msg, thread_factory=None):
+        server = JsonRpcServer(self.bridge, 60, FakeCif(), thread_factory)
+        server.queueRequest((self.client, 'address', msg))
+        server.stop()
+        server.serve_requests()
+
+    def test_single_request(self):
+        self.serve(json.dumps(request('echo', ['hello'], 1)))
+        self.assertEqual(self.client.replies,
+                         [({"jsonrpc": "2.0", "id": 1, "result": "hello"},
+                           [1])])
+
+    def test_register_requests(self):
+        batch = [request('echo', ['a'], 1), request('echo', ['b'], 2),
+                 request('echo', ['c'], None)]
+        self.serve(json.dumps(batch))
+        self.assertEqual(self.client.registered, [1, 2])
+
+    def test_parse_error(self):
+        self.serve("not json")
+        reply, ids = self.client.replies[0]
+        self.assertEqual(reply["error"]["code"], -32700)
+        self.assertEqual(ids, [None])
+
+    def test_parse_in_worker(self):
+        factory = ThreadFactory()
+        self.serve(json.dumps(request('echo', ['hello'], 1)), factory)
+        self.assertTrue(self.client.replied.wait(5))
+        # One task for parsing the message, one for serving the request.
+        self.assertEqual(factory.tasks, 2)
+
+    def test_batch_answered_together(self):
+        batch = [request('wait', [], 1), request('echo', ['hello'], 2)]
+        self.serve(json.dumps(batch), ThreadFactory())
+        self.assertTrue(self.bridge.started.wait(5))
+        # The echo request was served, but it must not be sent before the
+        # other request in the batch.
+        self.assertFalse(self.client.replied.wait(0.2))
+        self.bridge.release.set()
+        self.assertTrue(self.client.replied.wait(5))
+
+        self.assertEqual(len(self.client.replies), 1)
+        replies, ids = self.client.replies[0]
+        self.assertEqual(sorted(r["result"] for r in replies),
+                         ["done", "hello"])
+        self.assertEqual(sorted(ids), [1, 2])
+
+    def test_full_executor(self):
+        batch = [request('echo', ['a'], 1), request('echo', ['b'], 2)]
+        self.serve(json.dumps(batch), full_executor)
+        replies, ids = self.client.replies[0]
+        self.assertEqual([r["error"]["code"] for r in replies],
+                         [-32603, -32603])
+        self.assertEqual(sorted(ids), [1, 2])
+
+
+class ServeRequestContextTests(TestCaseBase):
+
+    def test_batch_reply_waits_for_encoding(self):
+        client = RecordingClient()
+        ctx = _JsonRpcServeRequestContext(client, 'address')
+        ctx.setRequests([JsonRpcRequest('slow', [], 1),
+                         JsonRpcRequest('fast', [], 2)])
+        slow = SlowResponse('slow', 1)
+        t = threading.Thread(target=ctx.requestDone, args=(slow,))
+        t.daemon = True
+        t.start()
+        self.assertTrue(slow.encoding.wait(5))
+        # The other request completes while the first response is encoded.
+        ctx.requestDone(JsonRpcResponse('fast', None, 2))
+        self.assertEqual(client.replies, [])
+        slow.release.set()
+        t.join(5)
+        self.assertEqual(len(client.replies), 1)
+        replies, ids = client.replies[0]
+        self.assertEqual(sorted(r["result"] for r in replies),
+                         ["fast", "slow"])
+        self.assertEqual(sorted(ids), [1, 2])
+
+    def test_reply_sent_once(self):
+        client = RecordingClient()
+        ctx = _JsonRpcServeRequestContext(client, 'address')
+        ctx.addResponse(JsonRpcResponse('result', None, None))
+        ctx.setRequests([])
+        ctx.sendReply()
+        self.assertEqual(len(client.replies), 1)
@@ -19,8 +19,14 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+import threading
+import time
+
+from monkeypatch import MonkeyPatchScope
 from testlib import VdsmTestCase as TestCaseBase
 
+from vdsm.storage import exception as se
+
 import storage.lvm as lvm
 
 
@@ -37,3 +43,384 @@ class LvmTests(TestCaseBase):
                           "\\\\x22\\\\x28|\', \'r|.*|\' ]"
                           )
         self.assertEqual(expectedFilter, filter)
+
+
+class FakeLVMCache(lvm.LVMCache):
+    """
+    LVMCache running lvs on a fake table of LVs, recording the commands.
+    """
+
+    def __init__(self, lvs):
+        super(FakeLVMCache, self).__init__()
+        self.table = {}
+        for vg, lv, tags in lvs:
+            self.add(vg, lv, tags)
+        self.commands = []
+        self.block = None
+        self.broken_vgs = set()
+
+    def add(self, vg, lv, tags=()):
+        self.table[(vg, lv)] = (vg, lv, tags)
+
+    def cmd(self, cmd, devices=tuple()):
+        self.commands.append(tuple(cmd))
+        if self.block:
+            self.block.wait()
+        if cmd[0] == "vgck":
+            if self.broken_vgs.intersection(cmd[1:]):
+                return 5, [], ["Checksum error"]
+            return 0, [], []
+        if cmd[0] != "lvs":
+            return 0, [], []
+        args = cmd[len(lvm.LVS_CMD):]
+        rc = 0
+        out = []
+        for arg in args:
+            if "/" in arg:
+                key = tuple(arg.split("/"))
+                if key in self.table:
+                    out.append(self._format(*self.table[key]))
+                else:
+                    rc = 5
+            else:
+                out.extend(self._format(*self.table[key])
+                           for key in sorted(self.table) if key[0] == arg)
+        if rc != 0:
+            return rc, [], ["Failed to find logical volume"]
+        return rc, out, []
+
+    def lvs_commands(self):
+        return [cmd[len(lvm.LVS_CMD):] for cmd in self.commands
+                if cmd[0] == "lvs"]
+
+    def vgck_commands(self):
+        return [cmd[1:] for cmd in self.commands if cmd[0] == "vgck"]
+
+    def vgs_commands(self):
+        return [cmd[len(lvm.VGS_CMD):] for cmd in self.commands
+                if cmd[0] == "vgs"]
+
+    def _format(self, vg, lv, tags):
+        fields = ("uuid-" + lv, lv, vg, "-wi-a-----", "1073741824", "0",
+                  "/dev/mapper/pv1(0)", ",".join(tags))
+        return lvm.SEPARATOR.join(fields)
+
+
+class LVMCacheTests(TestCaseBase):
+
+    def setUp(self):
+        self.cache = FakeLVMCache([("vg", "lv1", ("tag1",)),
+                                   ("vg", "lv2", ()),
+                                   ("vg", "lv3", ()),
+                                   ("vg2", "lv1", ())])
+
+    def test_get_vg_lvs(self):
+        lvs = self.cache.getLv("vg")
+        self.assertEqual(sorted(lv.name for lv in lvs),
+                         ["lv1", "lv2", "lv3"])
+        self.assertEqual(self.cache.lvs_commands(), [("vg",)])
+
+    def test_get_vg_lvs_cached(self):
+        self.cache.getLv("vg")
+        self.cache.getLv("vg")
+        self.cache.getLv("vg", "lv2")
+        self.assertEqual(self.cache.lvs_commands(), [("vg",)])
+        stats = self.cache.stats()
+        self.assertEqual(stats["lv_misses"], 1)
+        self.assertEqual(stats["lv_hits"], 2)
+        self.assertEqual(stats["lv_reloads"], 1)
+
+    def test_unknown_vg_reloads_vg(self):
+        lv = self.cache.getLv("vg", "lv2")
+        self.assertEqual(lv.name, "lv2")
+        self.assertEqual(self.cache.lvs_commands(), [("vg",)])
+
+    def test_reload_stale_lv_only(self):
+        self.cache.getLv("vg")
+        self.cache._invalidatelvs("vg", "lv1")
+        self.cache.getLv("vg", "lv1")
+        self.assertEqual(self.cache.lvs_commands(), [("vg",), ("vg/lv1",)])
+
+    def test_reload_stale_lvs_in_one_command(self):
+        self.cache.getLv("vg")
+        self.cache._invalidatelvs("vg", ["lv1", "lv3"])
+        lvs = self.cache.getLv("vg")
+        self.assertEqual(len(lvs), 3)
+        self.assertEqual(self.cache.lvs_commands(),
+                         [("vg",), ("vg/lv1", "vg/lv3")])
+
+    def test_stale_lvs_in_other_vg_ignored(self):
+        self.cache.getLv("vg")
+        self.cache.getLv("vg2")
+        self.cache._invalidatelvs("vg2", "lv1")
+        self.cache.getLv("vg")
+        self.assertEqual(self.cache.lvs_commands(), [("vg",), ("vg2",)])
+
+    def test_invalidated_vg_reloads_vg(self):
+        self.cache.getLv("vg")
+        self.cache._invalidatelvs("vg")
+        self.cache.getLv("vg")
+        self.assertEqual(self.cache.lvs_commands(), [("vg",), ("vg",)])
+
+    def test_new_lv(self):
+        self.cache.getLv("vg")
+        self.cache.add("vg", "lv4")
+        lv = self.cache.getLv("vg", "lv4")
+        self.assertEqual(lv.name, "lv4")
+        self.assertEqual(self.cache.lvs_commands(), [("vg",), ("vg/lv4",)])
+
+    def test_removed_lv(self):
+        self.cache.getLv("vg")
+        self.cache._invalidatelvs("vg", "lv2")
+        del self.cache.table[("vg", "lv2")]
+        self.assertIsNone(self.cache.getLv("vg", "lv2"))
+        # Partial reload failed, so the entire VG was reloaded
+        self.assertEqual(self.cache.lvs_commands(),
+                         [("vg",), ("vg/lv2",), ("vg",)])
+        lvs = self.cache.getLv("vg")
+        self.assertEqual(sorted(lv.name for lv in lvs), ["lv1", "lv3"])
+
+    def test_flush(self):
+        self.cache.getLv("vg")
+        self.cache.flush()
+        self.cache.getLv("vg", "lv1")
+        self.assertEqual(self.cache.lvs_commands(), [("vg",), ("vg",)])
+
+    def test_concurrent_reloads(self):
+        self.cache.getLv("vg")
+        self.cache._invalidatelvs("vg", "lv1")
+        self.cache.block = threading.Event()
+        results = {}
+
+        def get(lvName):
+            results[lvName] = self.cache.getLv("vg", lvName)
+
+        first = threading.Thread(target=get, args=("lv1",))
+        first.start()
+        # Wait until the first reload is blocked in lvs, and invalidate more
+        # lvs while it is in progress.
+        while len(self.cache.commands) < 2:
+            time.sleep(0.01)
+        self.cache._invalidatelvs("vg", ["lv2", "lv3"])
+        others = [threading.Thread(target=get, args=(name,))
+                  for name in ("lv2", "lv3")]
+        for t in others:
+            t.start()
+        time.sleep(0.1)
+        self.cache.block.set()
+        for t in [first] + others:
+            t.join()
+        self.assertEqual(sorted(results), ["lv1", "lv2", "lv3"])
+        for name, lv in results.items():
+            self.assertEqual(lv.name, name)
+        # The waiting threads reloaded both lvs using single command.
+        self.assertEqual(self.cache.lvs_commands(),
+                         [("vg",), ("vg/lv1",), ("vg/lv2", "vg/lv3")])
+
+    def test_refresh_vgs(self):
+        self.cache.refreshVgs(["vg2", "vg"])
+        self.assertEqual(self.cache.vgs_commands(), [("vg", "vg2")])
+        self.assertEqual(self.cache.lvs_commands(), [("vg", "vg2")])
+        lvs = self.cache.getLv("vg")
+        self.assertEqual(sorted(lv.name for lv in lvs),
+                         ["lv1", "lv2", "lv3"])
+        self.assertEqual(self.cache.getLv("vg2", "lv1").name, "lv1")
+        self.assertEqual(self.cache.lvs_commands(), [("vg", "vg2")])
+
+    def test_refresh_vgs_fresh_lvs(self):
+        self.cache.refreshVgs(["vg", "vg2"])
+        self.cache.refreshVgs(["vg", "vg2"])
+        self.assertEqual(self.cache.vgs_commands(),
+                         [("vg", "vg2"), ("vg", "vg2")])
+        self.assertEqual(self.cache.lvs_commands(), [("vg", "vg2")])
+
+    def test_refresh_vgs_stale_lvs(self):
+        self.cache.refreshVgs(["vg", "vg2"])
+        self.cache._invalidatelvs("vg2", "lv1")
+        del self.cache.table[("vg", "lv3")]
+        self.cache._invalidatelvs("vg")
+        self.cache.refreshVgs(["vg", "vg2"])
+        self.assertEqual(self.cache.lvs_commands(),
+                         [("vg", "vg2"), ("vg", "vg2")])
+        lvs = self.cache.getLv("vg")
+        self.assertEqual(sorted(lv.name for lv in lvs), ["lv1", "lv2"])
+        self.assertEqual(len(self.cache.lvs_commands()), 2)
+
+    def test_check_vgs(self):
+        self.assertIsNone(self.cache.lastVgCheck("vg"))
+        self.assertEqual(self.cache.checkVgs(["vg2", "vg"]), {})
+        self.assertEqual(self.cache.vgck_commands(), [("vg", "vg2")])
+        self.assertIsNotNone(self.cache.lastVgCheck("vg"))
+        self.assertIsNotNone(self.cache.lastVgCheck("vg2"))
+
+    def test_check_vgs_failed(self):
+        self.cache.refreshVgs(["vg", "vg2"])
+        self.cache.broken_vgs.add("vg2")
+        failed = self.cache.checkVgs(["vg", "vg2"])
+        self.assertEqual(failed, {"vg2": ["Checksum error"]})
+        # The failed VG is found by checking each VG.
+        self.assertEqual(self.cache.vgck_commands(),
+                         [("vg", "vg2"), ("vg",), ("vg2",)])
+        self.assertIsNotNone(self.cache.lastVgCheck("vg2"))
+        # The LVs of the failed VG are reloaded on the next access.
+        self.cache.getLv("vg2")
+        self.cache.getLv("vg")
+        self.assertEqual(self.cache.lvs_commands(), [("vg", "vg2"), ("vg2",)])
+
+    def test_chk_vg_failed(self):
+        self.cache.broken_vgs.add("vg")
+        with MonkeyPatchScope([(lvm, "_lvminfo", self.cache)]):
+            self.assertRaises(se.StorageDomainAccessError, lvm.chkVG, "vg")
+
+
+class LVMChangesTests(TestCaseBase):
+
+    def setUp(self):
+        self.cache = FakeLVMCache([("vg", "lv1", ("tag1", "tag2")),
+                                   ("vg", "lv2", ())])
+        self.cache.getLv("vg")
+
+    def test_change_tags(self):
+        with MonkeyPatchScope([(lvm, "_lvminfo", self.cache)]):
+            lvm.changeLVTags("vg", "lv1", delTags=("tag1",),
+                             addTags=("tag3",))
+            lv = lvm.getLV("vg", "lv1")
+        self.assertEqual(lv.tags, ("tag2", "tag3"))
+        self.assertEqual(self.cache.lvs_commands(), [("vg",)])
+
+    def test_replace_tag(self):
+        with MonkeyPatchScope([(lvm, "_lvminfo", self.cache)]):
+            lvm.replaceLVTag("vg", "lv1", "tag2", "tag4")
+            lv = lvm.getLV("vg", "lv1")
+        self.assertEqual(lv.tags, ("tag1", "tag4"))
+        self.assertEqual(self.cache.lvs_commands(), [("vg",)])
+
+    def test_add_tag(self):
+        with MonkeyPatchScope([(lvm, "_lvminfo", self.cache)]):
+            lvm.addtag("vg", "lv2", "tag1")
+            lv = lvm.getLV("vg", "lv2")
+        self.assertEqual(lv.tags, ("tag1",))
+        self.assertEqual(self.cache.lvs_commands(), [("vg",)])
+
+    def test_change_tags_uncached(self):
+        self.cache._invalidatelvs("vg", "lv1")
+        with MonkeyPatchScope([(lvm, "_lvminfo", self.cache)]):
+            lvm.changeLVTags("vg", "lv1", addTags=("tag3",))
+            lvm.getLV("vg", "lv1")
+        self.assertEqual(self.cache.lvs_commands(), [("vg",), ("vg/lv1",)])
+
+    def test_rename(self):
+        with MonkeyPatchScope([(lvm, "_lvminfo", self.cache)]):
+            lvm.renameLV("vg", "lv2", "lv3")
+            lv = lvm.getLV("vg", "lv3")
+        self.assertEqual(lv.name, "lv3")
+        self.assertNotIn(("vg", "lv2"), self.cache._lvs)
+        self.assertEqual(self.cache.lvs_commands(), [("vg",)])
+
+
+class FakeShellPool(object):
+
+    def __init__(self, result):
+        self.result = result
+        self.commands = []
+        self.resets = 0
+
+    def run(self, cmd):
+        self.commands.append(tuple(cmd))
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+    def reset(self):
+        self.resets += 1
+
+
+class LVMShellTests(TestCaseBase):
+
+    def setUp(self):
+        self.cache = lvm.LVMCache()
+        self.cache._extraCfg = "config"
+        self.cache._filterStale = False
+        self.executed = []
+
+    def execCmd(self, cmd, sudo=False):
+        self.executed.append(cmd)
+        return 0, ["forked"], []
+
+    def lvm_cmd(self, cmd, devices=()):
+        with MonkeyPatchScope([(lvm.misc, "execCmd", self.execCmd),
+                               (lvm, "_updateLvmConf", lambda conf: None)]):
+            return self.cache.cmd(cmd, devices)
+
+    def test_report_uses_shell(self):
+        self.cache._shellPool = FakeShellPool((0, ["shell"], []))
+        res = self.lvm_cmd(["vgs", "vg"])
+        self.assertEqual(res, (0, ["shell"], []))
+        self.assertEqual(self.cache._shellPool.commands, [("vgs", "vg")])
+        self.assertEqual(self.executed, [])
+
+    def test_reset_on_config_change(self):
+        self.cache._shellPool = FakeShellPool((0, ["shell"], []))
+        self.lvm_cmd(["vgs"])
+        self.lvm_cmd(["vgs"])
+        self.assertEqual(self.cache._shellPool.resets, 1)
+        self.cache._filterStale = True
+        with MonkeyPatchScope([(lvm, "_buildConfig", lambda devs: "new"),
+                               (lvm.multipath, "getMPDevNamesIter",
+                                lambda: ())]):
+            self.lvm_cmd(["vgs"])
+        self.assertEqual(self.cache._shellPool.resets, 2)
+
+    def test_change_forks(self):
+        self.cache._shellPool = FakeShellPool((0, ["shell"], []))
+        res = self.lvm_cmd(["lvchange", "--addtag", "tag", "vg/lv"])
+        self.assertEqual(res, (0, ["forked"], []))
+        self.assertEqual(self.cache._shellPool.commands, [])
+
+    def test_devices_fork(self):
+        self.cache._shellPool = FakeShellPool((0, ["shell"], []))
+        res = self.lvm_cmd(["pvs"], devices=("/dev/mapper/a",))
+        self.assertEqual(res, (0, ["forked"], []))
+        self.assertEqual(self.cache._shellPool.commands, [])
+
+    def test_whitespace_forks(self):
+        self.cache._shellPool = FakeShellPool((0, ["shell"], []))
+        res = self.lvm_cmd(["lvs", "-o", "name, tags"])
+        self.assertEqual(res, (0, ["forked"], []))
+
+    def test_shell_failure_does_not_fork(self):
+        self.cache._shellPool = FakeShellPool((5, [], ["error"]))
+        with MonkeyPatchScope([(lvm, "_buildConfig", lambda devs: "config"),
+                               (lvm.multipath, "getMPDevNamesIter",
+                                lambda: ())]):
+            res = self.lvm_cmd(["vgs", "vg"])
+        self.assertEqual(res, (5, [], ["error"]))
+        self.assertEqual(self.cache._shellPool.commands, [("vgs", "vg")])
+        self.assertEqual(self.executed, [])
+        self.assertFalse(self.cache._filterStale)
+
+    def test_shell_failure_filter_changed(self):
+        self.cache._shellPool = FakeShellPool((5, [], ["error"]))
+        with MonkeyPatchScope([(lvm, "_buildConfig", lambda devs: "new"),
+                               (lvm.multipath, "getMPDevNamesIter",
+                                lambda: ())]):
+            res = self.lvm_cmd(["vgs", "vg"])
+        self.assertEqual(res, (5, [], ["error"]))
+        self.assertEqual(self.cache._shellPool.commands,
+                         [("vgs", "vg"), ("vgs", "vg")])
+        self.assertEqual(self.cache._extraCfg, "new")
+        self.assertEqual(self.executed, [])
+
+    def test_shell_timeout_does_not_fork(self):
+        self.cache._shellPool = FakeShellPool(
+            (lvm.lvmshell.TIMEOUT, [], ["timeout"]))
+        res = self.lvm_cmd(["vgs", "vg"])
+        self.assertEqual(res, (lvm.lvmshell.TIMEOUT, [], ["timeout"]))
+        self.assertEqual(self.cache._shellPool.commands, [("vgs", "vg")])
+        self.assertEqual(self.executed, [])
+
+    def test_shell_error_does_not_fork(self):
+        self.cache._shellPool = FakeShellPool(lvm.lvmshell.Error("error"))
+        rc, out, err = self.lvm_cmd(["vgs", "vg"])
+        self.assertEqual(rc, lvm.lvmshell.FAILED)
+        self.assertEqual(self.executed, [])
@@ -467,6 +467,19 @@ class DdWatchCopy(TestCaseBase):
         else:
             self.fail("Copying didn't stop!")
 
+    def testCopyUnalignedOffset(self):
+        data = "".join(chr(i % 256) for i in range(misc.MEGA * 2 + 1000))
+        offset = 100
+        size = len(data) - offset
+
+        with temporaryPath(perms=0o666, data=data) as srcPath:
+            with temporaryPath(perms=0o666, data="x" * offset) as dstPath:
+                misc.ddWatchCopy(srcPath, dstPath, None, size, offset)
+                with open(dstPath) as f:
+                    readData = f.read()
+
+        self.assertEqual(readData, "x" * offset + data[offset:])
+
 
 class ValidateN(TestCaseBase):
 
@@ -788,6 +801,30 @@ class ReadBlock(TestCaseBase):
 
         os.unlink(path)
 
+    def testReadBlocks(self):
+        blocks = ["block %d\n" % i + "\0" * (512 - len("block %d\n" % i))
+                  for i in range(4096)]
+        with temporaryPath(data="".join(blocks)) as path:
+            offsets = [512 * 3000, 0, 512 * 5, 512 * 3000]
+            res = misc.readblocks(path, offsets, 512)
+
+        self.assertEqual([lines[0] for lines in res],
+                         ["block 3000", "block 0", "block 5", "block 3000"])
+
+    def testReadBlocksIncomplete(self):
+        with temporaryPath(data="x" * 1024) as path:
+            self.assertRaises(misc.se.MiscBlockReadIncomplete,
+                              misc.readblocks, path, [0, 1024], 512)
+
+    def testReadBlocksInvalidOffset(self):
+        self.assertRaises(misc.se.MiscBlockReadException, misc.readblocks,
+                          "/dev/urandom", [0, 513], 512)
+
+    def testReadRanges(self):
+        ranges = list(misc._readRanges([4096, 0, 1024, 4096, 8192], 512,
+                                       4608))
+        self.assertEqual(ranges, [(0, 4608), (8192, 8704)])
+
 
 class CleanUpDir(TestCaseBase):
 
@@ -238,6 +238,93 @@ class VmDispatcherTests(TestCaseBase):
                     vm_id, vm_id)
 
 
+class CoalescingVmDispatcherTests(TestCaseBase):
+
+    def setUp(self):
+        self.cif = fake.ClientIF()
+        for i in range(VM_NUM):
+            vm_id = _fake_vm_id(i)
+            with self.cif.vmContainerLock:
+                self.cif.vmContainer[vm_id] = _FakeVM(vm_id, vm_id)
+        self.exc = _RecordingExecutor()
+        _Visitor.VMS.clear()
+        _OtherVisitor.VMS.clear()
+
+    def test_period(self):
+        disp = periodic.CoalescingVmDispatcher(
+            self.cif.getVMs, self.exc, [(_Visitor, 4), (_OtherVisitor, 6)])
+        self.assertEqual(disp.period, 2)
+
+    def test_one_task_per_vm(self):
+        disp = periodic.CoalescingVmDispatcher(
+            self.cif.getVMs, self.exc, [(_Visitor, 2), (_OtherVisitor, 2)],
+            queue="vm")
+        disp()
+        self.assertEqual(len(self.exc.tasks), VM_NUM)
+        self.assertEqual(set(queue for _, _, queue in self.exc.tasks),
+                         set(["vm"]))
+        for vm_id in self.cif.getVMs():
+            self.assertEqual(_Visitor.VMS[vm_id], 1)
+            self.assertEqual(_OtherVisitor.VMS[vm_id], 1)
+
+    def test_due_operations(self):
+        disp = periodic.CoalescingVmDispatcher(
+            self.cif.getVMs, self.exc, [(_Visitor, 2), (_OtherVisitor, 4)])
+        for i in range(4):
+            disp()
+        vm_id = _fake_vm_id(0)
+        self.assertEqual(_Visitor.VMS[vm_id], 4)
+        self.assertEqual(_OtherVisitor.VMS[vm_id], 2)
+        # Every tick dispatches one task per vm.
+        self.assertEqual(len(self.exc.tasks), 4 * VM_NUM)
+
+    def test_timeout_of_slowest_operation(self):
+        disp = periodic.CoalescingVmDispatcher(
+            self.cif.getVMs, self.exc, [(_Visitor, 2), (_OtherVisitor, 4)])
+        disp()
+        disp()
+        timeouts = [timeout for _, timeout, _ in self.exc.tasks]
+        self.assertEqual(timeouts, [2] * VM_NUM + [1] * VM_NUM)
+
+    def test_not_required(self):
+        with self.cif.vmContainerLock:
+            self.cif.vmContainer[_fake_vm_id(0)].fail_required = True
+        disp = periodic.CoalescingVmDispatcher(
+            self.cif.getVMs, self.exc, [(_Visitor, 2)])
+        disp()
+        self.assertEqual(len(self.exc.tasks), VM_NUM - 1)
+        self.assertNotIn(_fake_vm_id(0), _Visitor.VMS)
+
+    def test_readiness_checked_once(self):
+        disp = periodic.CoalescingVmDispatcher(
+            self.cif.getVMs, self.exc, [(_Ready, 2), (_Ready, 2)])
+        disp()
+        for vm in self.cif.getVMs().values():
+            self.assertEqual(vm.ready_checks, 1)
+
+    def test_not_ready(self):
+        vm = self.cif.getVMs()[_fake_vm_id(0)]
+        vm.ready = False
+        disp = periodic.CoalescingVmDispatcher(
+            self.cif.getVMs, self.exc, [(_Ready, 2)])
+        disp()
+        self.assertEqual(vm.executed, 0)
+        self.assertEqual(self.cif.getVMs()[_fake_vm_id(1)].executed, 1)
+
+    def test_failed_operation(self):
+        disp = periodic.CoalescingVmDispatcher(
+            self.cif.getVMs, self.exc, [(_Failing, 2), (_Visitor, 2)])
+        disp()
+        for vm_id in self.cif.getVMs():
+            self.assertEqual(_Visitor.VMS[vm_id], 1)
+
+    def test_dispatch_fails(self):
+        disp = periodic.CoalescingVmDispatcher(
+            self.cif.getVMs, _FakeExecutor(fail=True), [(_Nop, 2)])
+        skipped = disp()
+        self.assertEqual(set(skipped), set(self.cif.getVMs().keys()))
+
+
 @expandPermutations
 class NumaInfoMonitorTests(TestCaseBase):
 
@@ -274,6 +361,95 @@ class NumaInfoMonitorTests(TestCaseBase):
         self.assertRaises(libvirt.libvirtError, self.op)
 
 
+class UpdateVolumesTests(TestCaseBase):
+
+    def setUp(self):
+        self.irs = _FakeIRS()
+        self.exc = _RecordingExecutor()
+        self.cif = fake.ClientIF()
+        for i in range(3):
+            vm = _FakeVM(_fake_vm_id(i), _fake_vm_id(i))
+            vm.volumes = [("sd", "img-%d" % i, "vol-%d" % i)]
+            self.cif.vmContainer[vm.id] = vm
+        self.op = periodic.UpdateVolumes(self.cif.getVMs, self.irs, self.exc,
+                                         10, queue="volumes")
+
+    def test_one_request(self):
+        self.op()
+        self.assertEqual(len(self.irs.requests), 1)
+        self.assertEqual(sorted(self.irs.requests[0]),
+                         [("sd", "img-%d" % i, "vol-%d" % i)
+                          for i in range(3)])
+        self.assertEqual([(timeout, queue)
+                          for _, timeout, queue in self.exc.tasks],
+                         [(10, "volumes")])
+        for vm in self.cif.getVMs().values():
+            self.assertEqual(vm.sizes, self.irs.sizes)
+
+    def test_one_request_per_domain(self):
+        vms = self.cif.getVMs()
+        vms[_fake_vm_id(0)].volumes.append(("sd2", "img", "vol"))
+        vms[_fake_vm_id(1)].volumes = [("sd2", "img-1", "vol-1")]
+        self.op()
+        self.assertEqual(len(self.exc.tasks), 2)
+        requests = dict((volumes[0][0], sorted(volumes))
+                        for volumes in self.irs.requests)
+        self.assertEqual(requests, {
+            "sd": [("sd", "img-0", "vol-0"), ("sd", "img-2", "vol-2")],
+            "sd2": [("sd2", "img", "vol"), ("sd2", "img-1", "vol-1")],
+        })
+
+    def test_shared_volume_requested_once(self):
+        for vm in self.cif.getVMs().values():
+            vm.volumes = [("sd", "img", "vol")]
+        self.op()
+        self.assertEqual(self.irs.requests, [[("sd", "img", "vol")]])
+
+    def test_skip_vms(self):
+        vms = self.cif.getVMs()
+        vms[_fake_vm_id(0)].incoming_migration = True
+        vms[_fake_vm_id(1)].drive_monitor = False
+        self.op()
+        self.assertEqual(self.irs.requests, [[("sd", "img-2", "vol-2")]])
+        self.assertIsNone(vms[_fake_vm_id(0)].sizes)
+        self.assertIsNone(vms[_fake_vm_id(1)].sizes)
+        self.assertEqual(vms[_fake_vm_id(2)].sizes, self.irs.sizes)
+
+    def test_no_volumes(self):
+        for vm in self.cif.getVMs().values():
+            vm.volumes = []
+        self.op()
+        self.assertEqual(self.irs.requests, [])
+        self.assertEqual(self.exc.tasks, [])
+
+    def test_request_fails(self):
+        self.irs.status = {'code': 100, 'message': "ERROR"}
+        self.op()
+        for vm in self.cif.getVMs().values():
+            self.assertIsNone(vm.sizes)
+        # The next update requests the domain again.
+        self.assertEqual(self.op(), [])
+
+    def test_pending_domain_skipped(self):
+        exc = _PendingExecutor()
+        op = periodic.UpdateVolumes(self.cif.getVMs, self.irs, exc, 10)
+        op()
+        self.assertEqual(op(), ["sd"])
+        self.assertEqual(len(exc.tasks), 1)
+        exc.tasks[0]()
+        self.assertEqual(op(), [])
+        self.assertEqual(len(exc.tasks), 2)
+
+    def test_dispatch_fails(self):
+        op = periodic.UpdateVolumes(self.cif.getVMs, self.irs,
+                                    _FakeExecutor(fail=True), 10)
+        self.assertEqual(op(), ["sd"])
+        # The failed dispatch does not leave the domain pending.
+        op._executor = self.exc
+        self.assertEqual(op(), [])
+        self.assertEqual(len(self.irs.requests), 1)
+
+
 def _fake_vm_id(i):
     return 'VM-%03i' % i
 
@@ -298,6 +474,24 @@ class _Visitor(periodic._RunnableOnVm):
         _Visitor.VMS[self._vm.id] += 1
 
 
+class _OtherVisitor(_Visitor):
+
+    VMS = defaultdict(int)
+
+    def _execute(self):
+        _OtherVisitor.VMS[self._vm.id] += 1
+
+
+class _Ready(periodic._RunnableOnVm):
+
+    @property
+    def required(self):
+        return True
+
+    def _execute(self):
+        self._vm.executed += 1
+
+
 class _Nop(periodic._RunnableOnVm):
 
     @property
@@ -312,18 +506,57 @@ class _Nop(periodic._RunnableOnVm):
         pass
 
 
+class _Failing(_Nop):
+
+    def _execute(self):
+        raise RuntimeError("operation failed")
+
+
 class _FakeExecutor(object):
 
     def __init__(self, fail=False):
         self._fail = fail
 
-    def dispatch(self, func, timeout):
+    def dispatch(self, func, timeout, queue=None):
         if self._fail:
             raise executor.TooManyTasks()
         else:
             func()
 
 
+class _RecordingExecutor(object):
+
+    def __init__(self):
+        self.tasks = []
+
+    def dispatch(self, func, timeout, queue=None):
+        self.tasks.append((func, timeout, queue))
+        func()
+
+
+class _PendingExecutor(object):
+
+    def __init__(self):
+        self.tasks = []
+
+    def dispatch(self, func, timeout, queue=None):
+        self.tasks.append(func)
+
+
+class _FakeIRS(object):
+
+    def __init__(self):
+        self.requests = []
+        self.status = {'code': 0, 'message': "OK"}
+        self.sizes = {"sd": {}}
+
+    def getVolumesSize(self, volumes):
+        self.requests.append(volumes)
+        if self.status['code'] != 0:
+            return {'status': self.status}
+        return {'status': self.status, 'sizes': self.sizes}
+
+
 # fake.VM is a quite complex beast. We need only the bare minimum here,
 # literally only `id' and `name', so it seems sensible to create this
 # new tiny fake locally.
@@ -333,9 +566,32 @@ class _FakeVM(object):
         self.name = vmName
         self.migrating = False
         self.lastStatus = vmstatus.UP
+        self.ready = True
+        self.ready_checks = 0
+        self.executed = 0
+        self.incoming_migration = False
+        self.drive_monitor = True
+        self.volumes = []
+        self.sizes = None
 
     def isMigrating(self):
         return self.migrating
 
+    def isDomainReadyForCommands(self):
+        self.ready_checks += 1
+        return self.ready
+
     def updateNumaInfo(self):
         pass
+
+    def incomingMigrationPending(self):
+        return self.incoming_migration
+
+    def driveMonitorEnabled(self):
+        return self.drive_monitor
+
+    def getDriveVolumes(self):
+        return self.volumes
+
+    def updateDriveVolumes(self, sizes):
+        self.sizes = sizes
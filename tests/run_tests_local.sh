@@ -0,0 +1,43 @@
+#!/bin/sh
+if [ -z "$PYTHON_EXE" ]; then
+    PYTHON_EXE="/root/.pyenv/versions/2.7.18/bin/python"
+fi
+
+export \
+    LC_ALL=C \
+    NOSE_LOGFORMAT='%(asctime)s %(levelname)-7s [%(name)s] (%(threadName)s) %(message)s' \
+    NOSE_VERBOSE=${NOSE_VERBOSE:-3} \
+    PYTHONDONTWRITEBYTECODE=1 \
+    PYTHONPATH="/root/package/lib:/root/package/vdsm:/root/package/client:/root/package/vdsm_api:$PYTHONPATH" \
+    $NULL
+
+"$PYTHON_EXE" /root/package/tests/testrunner.py --local-modules -A "type!='functional'" $@ &
+runner_pid=$!
+
+if [ -n "$TIMEOUT" ]; then
+    (
+        sleep $TIMEOUT
+        echo
+        echo "========================================================================"
+        echo "=           Timeout completing tests - extracting stacktrace           ="
+        echo "========================================================================"
+        echo
+        gdb -p $runner_pid --batch -ex "thread apply all py-bt"
+        echo
+        echo "========================================================================"
+        echo "=                        Aborting tests                                ="
+        echo "========================================================================"
+        kill -KILL $runner_pid
+        sleep 5
+    ) &
+    watcher_pid=$!
+fi
+
+wait $runner_pid
+runner_status=$?
+
+if [ -n "$TIMEOUT" ]; then
+    kill -TERM $watcher_pid
+fi
+
+exit $runner_status
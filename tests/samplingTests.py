@@ -328,3 +328,218 @@ class StatsCacheTests(TestCaseBase):
     def _feed_cache(self, samples):
         for sample in samples:
             self.cache.put(*sample)
+
+
+class StatsSnapshotTests(TestCaseBase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = sampling.StatsCache(clock=self.clock)
+
+    def test_empty(self):
+        snapshot = self.cache.snapshot()
+        self.assertEqual(snapshot.generation, 0)
+        self.assertIsNone(snapshot.age)
+        self.assertIsNone(snapshot.get('a'))
+
+    def test_publish(self):
+        self.cache.publish({'a': {'cpuUser': '1.00'}}, 1)
+        snapshot = self.cache.snapshot()
+        self.assertEqual(snapshot.generation, 1)
+        self.assertEqual(snapshot['a'], {'cpuUser': '1.00'})
+        self.assertEqual(len(snapshot), 1)
+
+    def test_generation_increases(self):
+        self.cache.publish({'a': {}}, 1)
+        first = self.cache.snapshot()
+        self.cache.publish({'a': {}}, 2)
+        second = self.cache.snapshot()
+        self.assertEqual(second.generation, first.generation + 1)
+
+    def test_publish_out_of_order(self):
+        self.cache.publish({'a': 'foo'}, 2)
+        self.assertIsNone(self.cache.publish({'a': 'bar'}, 1))
+        snapshot = self.cache.snapshot()
+        self.assertEqual(snapshot.generation, 1)
+        self.assertEqual(snapshot['a'], 'foo')
+
+    def test_age(self):
+        self.cache.publish({'a': {}}, 1)
+        self.clock.freeze(value=10)
+        self.assertEqual(self.cache.snapshot().age, 9)
+
+
+class VMBulkSamplerPublishTests(TestCaseBase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = sampling.StatsCache(clock=self.clock)
+
+    def test_publish_after_sampling(self):
+        vms = {'a': object(), 'b': object()}
+        produced = []
+
+        def produce_stats(vm_obj, vm_sample):
+            produced.append(vm_obj)
+            return {'cpuUser': '0.00', 'cpuSys': '0.00', 'cpuUsage': '0',
+                    'interval': vm_sample.interval}
+
+        sampler = sampling.VMBulkSampler(FakeBulkConnection(vms),
+                                         lambda: vms,
+                                         self.cache,
+                                         produce_stats=produce_stats)
+        sampler()
+        sampler()
+        snapshot = self.cache.snapshot()
+        self.assertEqual(snapshot.generation, 2)
+        self.assertEqual(sorted(snapshot), ['a', 'b'])
+        self.assertEqual(snapshot['a']['interval'],
+                         self.cache.get('a').interval)
+        self.assertEqual(len(produced), 4)
+
+    def test_failed_vm_not_published(self):
+        vms = {'a': object(), 'b': object()}
+
+        def produce_stats(vm_obj, vm_sample):
+            if vm_obj is vms['b']:
+                raise RuntimeError("fake error")
+            return {'cpuUser': '0.00', 'cpuSys': '0.00', 'cpuUsage': '0'}
+
+        sampler = sampling.VMBulkSampler(FakeBulkConnection(vms),
+                                         lambda: vms,
+                                         self.cache,
+                                         produce_stats=produce_stats)
+        sampler()
+        snapshot = self.cache.snapshot()
+        self.assertEqual(list(snapshot), ['a'])
+
+
+class VMBulkSamplerSelectTests(TestCaseBase):
+
+    def test_sample_selected(self):
+        vms = {'a': FakeVM('a', selected=True),
+               'b': FakeVM('b', selected=False),
+               'c': FakeVM('c', selected=True, connected=False)}
+        conn = FakeBulkConnection(vms)
+        cache = sampling.BlockWatermarks(clock=FakeClock())
+        sampler = sampling.VMBulkSampler(conn, lambda: vms, cache,
+                                         select=lambda vm: vm.selected)
+        sampler()
+        self.assertEqual(conn.sampled, [['a']])
+
+    def test_nothing_selected(self):
+        vms = {'a': FakeVM('a', selected=False)}
+        conn = FakeBulkConnection(vms)
+        cache = sampling.BlockWatermarks(clock=FakeClock())
+        sampler = sampling.VMBulkSampler(conn, lambda: vms, cache,
+                                         select=lambda vm: vm.selected)
+        sampler()
+        self.assertEqual(conn.sampled, [])
+
+
+def block_stats(*drives):
+    stats = {'block.count': len(drives)}
+    for i, (name, path, capacity, alloc, physical) in enumerate(drives):
+        stats['block.%d.name' % i] = name
+        stats['block.%d.path' % i] = path
+        stats['block.%d.capacity' % i] = capacity
+        stats['block.%d.allocation' % i] = alloc
+        stats['block.%d.physical' % i] = physical
+    return stats
+
+
+class BlockWatermarksTests(TestCaseBase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.clock.freeze(10)
+        self.watermarks = sampling.BlockWatermarks(clock=self.clock)
+        self.watermarks.put({
+            'a': block_stats(('vda', '/path/a', 1024, 100, 512),
+                             ('vdb', '/path/b', 2048, 200, 1024)),
+        }, 10)
+
+    def test_get(self):
+        self.assertEqual(self.watermarks.get('a', 'vda', '/path/a', 2),
+                         (1024, 100, 512))
+        self.assertEqual(self.watermarks.get('a', 'vdb', '/path/b', 2),
+                         (2048, 200, 1024))
+
+    def test_get_missing(self):
+        self.assertIsNone(self.watermarks.get('a', 'vdc', '/path/c', 2))
+        self.assertIsNone(self.watermarks.get('b', 'vda', '/path/a', 2))
+
+    def test_get_other_path(self):
+        # The drive was switched to another volume since the sample
+        self.assertIsNone(self.watermarks.get('a', 'vda', '/path/new', 2))
+
+    def test_get_stale(self):
+        self.clock.freeze(13)
+        self.assertIsNone(self.watermarks.get('a', 'vda', '/path/a', 2))
+
+    def test_incomplete_stats(self):
+        stats = block_stats(('vda', '/path/a', 1024, 100, 512))
+        del stats['block.0.physical']
+        self.watermarks.put({'a': stats}, 11)
+        self.assertIsNone(self.watermarks.get('a', 'vda', '/path/a', 2))
+
+    def test_put_out_of_order(self):
+        self.watermarks.put({
+            'a': block_stats(('vda', '/path/a', 1024, 50, 512)),
+        }, 9)
+        self.assertEqual(self.watermarks.get('a', 'vda', '/path/a', 2),
+                         (1024, 100, 512))
+
+    def test_invalidate(self):
+        self.clock.freeze(11)
+        self.watermarks.invalidate('a')
+        self.assertIsNone(self.watermarks.get('a', 'vda', '/path/a', 2))
+        # Sampled before the invalidation
+        self.watermarks.put({
+            'a': block_stats(('vda', '/path/a', 1024, 100, 512)),
+        }, 11)
+        self.assertIsNone(self.watermarks.get('a', 'vda', '/path/a', 2))
+        # Sampled after the invalidation
+        self.watermarks.put({
+            'a': block_stats(('vda', '/path/a', 1024, 100, 1024)),
+        }, 12)
+        self.assertEqual(self.watermarks.get('a', 'vda', '/path/a', 2),
+                         (1024, 100, 1024))
+
+
+class FakeVM(object):
+
+    def __init__(self, vmid, selected=True, connected=True):
+        self.id = vmid
+        self.selected = selected
+        self._dom = FakeDomainWrapper(vmid, connected)
+
+
+class FakeDomainWrapper(object):
+
+    def __init__(self, vmid, connected):
+        self.connected = connected
+        self._dom = FakeBulkDomain(vmid)
+
+
+class FakeBulkDomain(object):
+
+    def __init__(self, vmid):
+        self._vmid = vmid
+
+    def UUIDString(self):
+        return self._vmid
+
+
+class FakeBulkConnection(object):
+
+    def __init__(self, vms):
+        self._vms = vms
+        self.sampled = []
+
+    def getAllDomainStats(self, flags=0):
+        return [(FakeBulkDomain(vmid), {}) for vmid in self._vms]
+
+    def domainListGetStats(self, doms, flags=0):
+        self.sampled.append(sorted(dom.UUIDString() for dom in doms))
+        return [(dom, {}) for dom in doms]
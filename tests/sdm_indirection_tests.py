@@ -182,6 +182,10 @@ class FakeBlockDomainManifest(FakeDomainManifest):
     def getVAllocSize(self, imgUUID, volUUID):
         pass
 
+    @recorded
+    def getVSizes(self, volumes):
+        pass
+
     @recorded
     def getLeasesFilePath(self):
         pass
@@ -247,6 +251,10 @@ class FakeFileDomainManifest(FakeDomainManifest):
     def getVAllocSize(self, imgUUID, volUUID):
         pass
 
+    @recorded
+    def getVSizes(self, volumes):
+        pass
+
     @recorded
     def getLeasesFilePath(self):
         pass
@@ -675,6 +683,7 @@ class DomainTestMixin(object):
         ['replaceMetadata', 1],
         ['getVSize', 2],
         ['getVAllocSize', 2],
+        ['getVSizes', 1],
         ['getLeasesFilePath', 0],
         ['getIdsFilePath', 0],
         ['getIsoDomainImagesDir', 0],
@@ -26,8 +26,10 @@ from yajsonrpc.stomp import \
     Command, \
     Frame, \
     Headers, \
-    LEGACY_SUBSCRIPTION_ID_REQUEST
-from yajsonrpc.stompreactor import StompAdapterImpl
+    LEGACY_SUBSCRIPTION_ID_REQUEST, \
+    LEGACY_SUBSCRIPTION_ID_RESPONSE
+from yajsonrpc.stompreactor import StompAdapterImpl, StompServer
+from yajsonrpc.stompreactor import _StompRequestSender
 
 
 class TestConnection(object):
@@ -38,7 +40,7 @@ class TestConnection(object):
     def send_raw(self, msg):
         self._client.queue_frame(msg)
 
-    def handleMessage(self, data):
+    def handleMessage(self, data, req_dest=None):
         self._client.queue_frame(data)
 
 
@@ -77,6 +79,25 @@ class TestSubscription(object):
         return self._client
 
 
+class RecordingClient(object):
+
+    def __init__(self):
+        self.frames = []
+
+    def is_closed(self):
+        return False
+
+    def send_raw(self, frame):
+        self.frames.append(frame)
+
+
+class RecordingSubscription(TestSubscription):
+
+    def __init__(self, destination, id):
+        super(RecordingSubscription, self).__init__(destination, id)
+        self._client = RecordingClient()
+
+
 class ConnectFrameTest(TestCaseBase):
 
     def test_connect(self):
@@ -258,7 +279,8 @@ class SendFrameTest(TestCaseBase):
         self.assertIsNot(data, None)
         request = JsonRpcRequest.decode(data)
         self.assertEquals(request.method, 'Host.getAllVmStats')
-        self.assertTrue(len(ids) == 1)
+        # The request ids are recorded when the message is decoded.
+        self.assertEqual(ids, {})
 
     def test_send_legacy(self):
         dest = LEGACY_SUBSCRIPTION_ID_REQUEST
@@ -281,7 +303,8 @@ class SendFrameTest(TestCaseBase):
         self.assertIsNot(data, None)
         request = JsonRpcRequest.decode(data)
         self.assertEquals(request.method, 'Host.getAllVmStats')
-        self.assertTrue(len(ids) == 1)
+        # The request ids are recorded when the message is decoded.
+        self.assertEqual(ids, {})
 
     def test_send_no_destination(self):
         frame = Frame(Command.SEND,
@@ -314,7 +337,7 @@ class SendFrameTest(TestCaseBase):
 
         data = adapter.pop_message()
         self.assertIsNot(data, None)
-        self.assertTrue(len(ids) == 2)
+        self.assertEqual(ids, {})
 
     def test_send_broker(self):
         frame = Frame(command=Command.SEND,
@@ -338,3 +361,70 @@ class SendFrameTest(TestCaseBase):
 
         resp_frame = adapter.pop_message()
         self.assertEquals(resp_frame.command, Command.MESSAGE)
+
+
+class StompServerSendTest(TestCaseBase):
+
+    def setUp(self):
+        self.subscriptions = defaultdict(list)
+        self.server = StompServer(Reactor(), self.subscriptions)
+
+    def subscribe(self, destination):
+        subscription = RecordingSubscription(destination, destination + "-id")
+        self.subscriptions[destination].append(subscription)
+        return subscription.client
+
+    def test_send_response(self):
+        client = self.subscribe('jms.topic.vdsm_responses')
+        self.server._req_dest['req-1'] = 'jms.topic.vdsm_responses'
+
+        # Not a valid json, the message must be sent as is.
+        self.server.send('response-1', response_ids=['req-1'])
+
+        self.assertEqual(len(client.frames), 1)
+        frame = client.frames[0]
+        self.assertEqual(frame.headers[Headers.DESTINATION],
+                         'jms.topic.vdsm_responses')
+        self.assertEqual(frame.body, 'response-1')
+        self.assertEqual(self.server._req_dest, {})
+
+    def test_send_batch_response(self):
+        client = self.subscribe('jms.topic.vdsm_responses')
+        self.server._req_dest['req-1'] = 'jms.topic.vdsm_responses'
+        self.server._req_dest['req-2'] = 'jms.topic.vdsm_responses'
+
+        self.server.send('[response-1,response-2]',
+                         response_ids=['req-1', 'req-2'])
+
+        self.assertEqual(len(client.frames), 1)
+        self.assertEqual(self.server._req_dest, {})
+
+    def test_send_response_legacy(self):
+        client = self.subscribe(LEGACY_SUBSCRIPTION_ID_RESPONSE)
+
+        self.server.send('response-1', response_ids=['unknown'])
+
+        self.assertEqual(len(client.frames), 1)
+
+    def test_send_event(self):
+        client = self.subscribe('jms.topic.vdsm_events')
+        self.server._req_dest['req-1'] = 'jms.topic.vdsm_responses'
+
+        self.server.send('event', 'jms.topic.vdsm_events')
+
+        self.assertEqual(len(client.frames), 1)
+        self.assertEqual(self.server._req_dest,
+                         {'req-1': 'jms.topic.vdsm_responses'})
+
+    def test_send_registered_requests(self):
+        client = self.subscribe('jms.topic.vdsm_responses')
+        sender = _StompRequestSender(self.server, 'jms.topic.vdsm_responses')
+        sender.register_requests(['req-1', 'req-2'])
+
+        sender.send('[response-1,response-2]',
+                    response_ids=['req-1', 'req-2'])
+
+        self.assertEqual(len(client.frames), 1)
+        self.assertEqual(client.frames[0].headers[Headers.DESTINATION],
+                         'jms.topic.vdsm_responses')
+        self.assertEqual(self.server._req_dest, {})
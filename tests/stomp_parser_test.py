@@ -0,0 +1,192 @@
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import print_function
+
+import cPickle
+import os
+import resource
+import time
+
+from testlib import VdsmTestCase as TestCaseBase
+from testlib import expandPermutations, permutations
+from testValidation import slowtest
+
+from yajsonrpc.stomp import Command, Frame, Parser
+
+
+class StringBufferParser(Parser):
+    """
+    The previous parser implementation, keeping pending data in a str and
+    rebuilding it for every consumed line. Used as a baseline for the
+    benchmarks below.
+    """
+
+    def _flush(self):
+        self._buffer = ""
+
+    def _write_buffer(self, buff):
+        self._buffer += buff
+
+    def _handle_terminator(self, term):
+        res, sep, rest = self._buffer.partition(term)
+        if not sep:
+            return None
+
+        self._buffer = rest
+
+        return res
+
+    def _read_body(self, length):
+        buf = self._buffer
+        if len(buf) < (length + 1):
+            return None
+
+        if buf[length] != "\0":
+            raise RuntimeError("Frame end is missing \\0")
+
+        self._flush()
+        self._write_buffer(buf[length + 1:])
+        return buf[:length]
+
+
+def _frame(body, headers=None):
+    return Frame(Command.SEND, headers or {"destination": "/queue/test"},
+                 body)
+
+
+@expandPermutations
+class ParserTests(TestCaseBase):
+
+    def test_single_frame(self):
+        parser = Parser()
+        parser.parse(_frame("hello").encode())
+        frame = parser.popFrame()
+        self.assertEqual(frame.command, Command.SEND)
+        self.assertEqual(frame.headers["destination"], "/queue/test")
+        self.assertEqual(frame.body, "hello")
+        self.assertEqual(parser.pending, 0)
+
+    def test_body_without_content_length(self):
+        parser = Parser()
+        parser.parse("SEND\ndestination:/queue/test\n\nhello\0")
+        frame = parser.popFrame()
+        self.assertEqual(frame.body, "hello")
+
+    def test_body_with_nul_and_content_length(self):
+        parser = Parser()
+        parser.parse(_frame("a\0b").encode())
+        self.assertEqual(parser.popFrame().body, "a\0b")
+
+    def test_crlf_lines(self):
+        parser = Parser()
+        parser.parse("SEND\r\ndestination:/queue/test\r\n\r\nhello\0")
+        frame = parser.popFrame()
+        self.assertEqual(frame.command, Command.SEND)
+        self.assertEqual(frame.headers["destination"], "/queue/test")
+
+    def test_heartbeats_between_frames(self):
+        parser = Parser()
+        data = "\n\n" + _frame("a").encode() + "\n" + _frame("b").encode()
+        parser.parse(data)
+        self.assertEqual(parser.pending, 2)
+        self.assertEqual(parser.popFrame().body, "a")
+        self.assertEqual(parser.popFrame().body, "b")
+
+    def test_missing_terminator(self):
+        parser = Parser()
+        data = _frame("hello").encode()[:-1] + "x"
+        self.assertRaises(RuntimeError, parser.parse, data)
+
+    @permutations([[1], [7], [4096]])
+    def test_split_frames(self, chunk_size):
+        bodies = ["x" * 10, "y" * 5000, "", "z" * 70000]
+        data = "".join(_frame(body).encode() for body in bodies)
+        parser = Parser()
+        for i in range(0, len(data), chunk_size):
+            parser.parse(data[i:i + chunk_size])
+
+        self.assertEqual(parser.pending, len(bodies))
+        for body in bodies:
+            self.assertEqual(parser.popFrame().body, body)
+
+    def test_buffer_compaction(self):
+        parser = Parser()
+        data = _frame("x" * 8192).encode()
+        for i in range(10):
+            parser.parse(data + data[:100])
+            parser.parse(data[100:])
+        self.assertEqual(parser.pending, 20)
+        # Every frame was consumed, nothing should be left behind
+        self.assertEqual(len(parser._buffer), 0)
+
+
+def _run_benchmark(parser_class, body_size, chunk_size=4096):
+    frame = _frame("x" * body_size).encode()
+    count = max(1, (16 * 1024 ** 2) // len(frame))
+    data = frame * count
+    parser = parser_class()
+    start = time.time()
+    for i in range(0, len(data), chunk_size):
+        parser.parse(data[i:i + chunk_size])
+        while parser.popFrame() is not None:
+            pass
+    elapsed = time.time() - start
+    return count / elapsed
+
+
+def _in_child(func, *args):
+    """
+    Run func in a child process and return its result and the peak resident
+    memory of the child in KiB.
+    """
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(r)
+            result = func(*args)
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(w, cPickle.dumps((result, maxrss)))
+        finally:
+            os._exit(0)
+    os.close(w)
+    try:
+        data = []
+        while True:
+            buf = os.read(r, 4096)
+            if not buf:
+                break
+            data.append(buf)
+    finally:
+        os.close(r)
+        os.waitpid(pid, 0)
+    return cPickle.loads("".join(data))
+
+
+@expandPermutations
+class ParserBenchmarkTests(TestCaseBase):
+
+    @slowtest
+    @permutations([[1024], [64 * 1024], [4 * 1024 ** 2]])
+    def test_benchmark(self, body_size):
+        for parser_class in (StringBufferParser, Parser):
+            rate, maxrss = _in_child(_run_benchmark, parser_class, body_size)
+            print("%s body=%d: %.2f frames/s, peak rss %d KiB" %
+                  (parser_class.__name__, body_size, rate, maxrss))
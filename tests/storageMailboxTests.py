@@ -18,21 +18,34 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+from __future__ import print_function
+
+from contextlib import contextmanager
+from functools import partial
 from uuid import uuid4
+import errno
 import threading
 import os
 import shutil
+import struct
+import time
 
+from monkeypatch import MonkeyPatchScope
 from testlib import VdsmTestCase as TestCaseBase
+from testlib import expandPermutations, permutations
+from testlib import make_config
+from testlib import temporaryPath
+from testValidation import slowtest
 
 import storage.storage_mailbox as sm
 from storage.sd import DOMAIN_META_DATA
+from vdsm.storage import misc
 from vdsm.utils import retry
 import tempfile
 
 
 class StoragePoolStub(object):
-    def __init__(self):
+    def __init__(self, data="DATA"):
         self.spUUID = str(uuid4())
         self.storage_repository = tempfile.mkdtemp(dir='/var/tmp')
         self.__masterDir = os.path.join(self.storage_repository, self.spUUID,
@@ -41,7 +54,12 @@ class StoragePoolStub(object):
         os.makedirs(self.__masterDir)
         for fname in ["id", "inbox", "outbox"]:
             with open(os.path.join(self.__masterDir, fname), "w") as f:
-                f.write("DATA")
+                f.write(data)
+        self.spmMailer = None
+        self.extended = []
+
+    def extendVolume(self, sdUUID, volUUID, size):
+        self.extended.append((sdUUID, volUUID, size))
 
     def __del__(self):
         # rmtree removes the folder as well
@@ -56,3 +74,338 @@ class SPM_MailMonitorTests(TestCaseBase):
         mailer.run()
         t = lambda: self.assertEquals(threadCount, len(threading.enumerate()))
         retry(AssertionError, t, timeout=4, sleep=0.1)
+
+
+@expandPermutations
+class MailboxIOTests(TestCaseBase):
+
+    @permutations([[sm.DD], [sm.DIRECT]])
+    def test_write_read(self, backend):
+        data = "\0" * sm.MAILBOX_SIZE * 4
+        mail = "x" * sm.MAILBOX_SIZE
+        with temporaryPath(data=data) as path, \
+                mailbox_config(backend=backend):
+            io = sm.mailboxIO(path, "r+")
+            try:
+                io.write(2 * sm.MAILBOX_SIZE, mail)
+                self.assertEqual(io.read(2 * sm.MAILBOX_SIZE,
+                                         sm.MAILBOX_SIZE), mail)
+                self.assertEqual(io.read(0, len(data)),
+                                 data[:2 * sm.MAILBOX_SIZE] + mail +
+                                 data[3 * sm.MAILBOX_SIZE:])
+            finally:
+                io.close()
+
+    @permutations([[sm.DD], [sm.DIRECT]])
+    def test_missing(self, backend):
+        with mailbox_config(backend=backend):
+            io = sm.mailboxIO("/no/such/mailbox", "r")
+            try:
+                self.assertRaises(EnvironmentError, io.read, 0,
+                                  sm.MAILBOX_SIZE)
+            finally:
+                io.close()
+
+    def test_direct_closed(self):
+        with temporaryPath(data="\0" * sm.MAILBOX_SIZE) as path:
+            io = sm.DirectMailboxIO(path, "r+")
+            io.close()
+            self.assertRaises(EnvironmentError, io.read, 0, sm.MAILBOX_SIZE)
+            self.assertRaises(EnvironmentError, io.write, 0,
+                              "x" * sm.MAILBOX_SIZE)
+
+    def test_unsupported_backend(self):
+        with mailbox_config(backend="bad"):
+            self.assertRaises(ValueError, sm.mailboxIO, "/path", "r")
+
+
+@expandPermutations
+class MailboxRoundTripTests(TestCaseBase):
+
+    def test_extend(self):
+        with mailbox_pool(sm.DIRECT, 0.05, 4) as (pool, hsm):
+            self.assertTrue(extend(pool, hsm, timeout=5))
+            self.assertEqual(len(pool.extended), 1)
+
+    @slowtest
+    @permutations([
+        # backend, interval, hosts
+        (sm.DD, 0.5, 250),
+        (sm.DIRECT, 0.5, 250),
+        (sm.DIRECT, 0.1, 250),
+        (sm.DIRECT, 0.1, 2000),
+    ])
+    def test_extend_latency(self, backend, interval, hosts):
+        """
+        Measure the round trip of an extend request, from sending the request
+        from the HSM until the HSM handles the SPM reply. A file on /var/tmp
+        stands in for the inbox and outbox logical volumes.
+        """
+        requests = 5
+        with mailbox_pool(backend, interval, hosts) as (pool, hsm):
+            latencies = []
+            for i in range(requests):
+                start = time.time()
+                self.assertTrue(extend(pool, hsm, timeout=interval * 20))
+                latencies.append(time.time() - start)
+        latencies.sort()
+        print("backend=%s interval=%.1f hosts=%d: min=%.3f median=%.3f "
+              "max=%.3f seconds" % (backend, interval, hosts, latencies[0],
+                                    latencies[len(latencies) // 2],
+                                    latencies[-1]))
+
+
+class FakeThreadPool(object):
+
+    def __init__(self):
+        self.tasks = []
+
+    def queueTask(self, id, target, args):
+        self.tasks.append(args)
+        return True
+
+    def joinAll(self, waitForTasks=True):
+        pass
+
+
+class FakeMailboxIO(object):
+
+    def __init__(self, data, failures=0):
+        self.data = data
+        self.failures = failures
+        self.writes = 0
+
+    def read(self, offset, size):
+        return self.data[offset:offset + size]
+
+    def write(self, offset, data):
+        if self.failures:
+            self.failures -= 1
+            raise IOError(errno.EIO, "Fake write error")
+        self.data = (self.data[:offset] + data +
+                     self.data[offset + len(data):])
+        self.writes += 1
+
+
+@expandPermutations
+class SPMHandleRequestsTests(TestCaseBase):
+
+    HOSTS = 10
+
+    def setUp(self):
+        self.pool = StoragePoolStub(data="\0" * sm.MAILBOX_SIZE * self.HOSTS)
+        with mailbox_config(backend=sm.DIRECT):
+            self.spm = sm.SPM_MailMonitor(self.pool, self.HOSTS,
+                                          monitorInterval=0.05)
+        self.spm.stop()
+        retry(AssertionError, lambda: assert_stopped(self.spm), timeout=2,
+              sleep=0.05)
+        self.spm.tp = FakeThreadPool()
+        self.spm.registerMessageType(sm.EXTEND_CODE, "extend")
+
+    def test_new_request(self):
+        msg = extend_message(self.pool)
+        mail = make_inbox(self.HOSTS, {3: {1: msg.payload}})
+        self.spm._handleRequests(mail)
+        self.assertFalse(self.spm._outboxDirty)
+        msgId = 3 * sm.SLOTS_PER_MAILBOX + 1
+        self.assertEqual(self.spm.tp.tasks, [("extend", msgId, msg.payload)])
+        # Same request, already handled
+        self.spm._handleRequests(mail)
+        self.assertEqual(len(self.spm.tp.tasks), 1)
+
+    def test_multiple_requests(self):
+        msgs = [extend_message(self.pool) for i in range(3)]
+        mail = make_inbox(self.HOSTS, {0: {1: msgs[0].payload},
+                                       5: {2: msgs[1].payload},
+                                       9: {1: msgs[2].payload}})
+        self.spm._handleRequests(mail)
+        payloads = [args[2] for args in self.spm.tp.tasks]
+        self.assertEqual(payloads, [m.payload for m in msgs])
+
+    def test_changed_request(self):
+        msg1 = extend_message(self.pool)
+        msg2 = extend_message(self.pool)
+        for msg in (msg1, msg2):
+            mail = make_inbox(self.HOSTS, {2: {1: msg.payload}})
+            self.spm._handleRequests(mail)
+        payloads = [args[2] for args in self.spm.tp.tasks]
+        self.assertEqual(payloads, [msg1.payload, msg2.payload])
+
+    def test_invalid_checksum(self):
+        msg = extend_message(self.pool)
+        mail = bytearray(make_inbox(self.HOSTS, {4: {1: msg.payload}}))
+        mail[5 * sm.MAILBOX_SIZE - 1] ^= 0xff
+        mail = bytes(mail)
+        self.spm._handleRequests(mail)
+        self.assertEqual(self.spm.tp.tasks, [])
+        # Invalid mailbox is cleared, so it will be checked again
+        start = 4 * sm.MAILBOX_SIZE
+        self.assertEqual(
+            self.spm._incomingMail[start:start + sm.MAILBOX_SIZE],
+            sm.EMPTYMAILBOX)
+
+    def test_clean_message(self):
+        msgId = 6 * sm.SLOTS_PER_MAILBOX + 3
+        msgStart = msgId * sm.MESSAGE_SIZE
+        self.spm._outgoingMail[msgStart:msgStart + sm.MESSAGE_SIZE] = \
+            extend_message(self.pool).payload
+        mail = make_inbox(self.HOSTS, {6: {3: sm.CLEAN_MESSAGE}})
+        self.spm._handleRequests(mail)
+        self.assertTrue(self.spm._outboxDirty)
+        self.assertEqual(
+            self.spm._outgoingMail[msgStart:msgStart + sm.MESSAGE_SIZE],
+            sm.CLEAN_MESSAGE)
+        self.assertEqual(self.spm.tp.tasks, [])
+
+    def test_clean_message_write_failed(self):
+        msgId = 6 * sm.SLOTS_PER_MAILBOX + 3
+        msgStart = msgId * sm.MESSAGE_SIZE
+        mail = make_inbox(self.HOSTS, {6: {3: sm.CLEAN_MESSAGE}})
+        self.spm._inboxIO = FakeMailboxIO(mail)
+        self.spm._outboxIO = FakeMailboxIO("\0" * len(mail), failures=1)
+
+        # The write fails, and the outbox stays dirty.
+        self.spm._checkForMail()
+        self.assertTrue(self.spm._outboxDirty)
+
+        # The inbox did not change, but the write is retried.
+        self.spm._checkForMail()
+        self.assertFalse(self.spm._outboxDirty)
+        self.assertEqual(
+            self.spm._outboxIO.data[msgStart:msgStart + sm.MESSAGE_SIZE],
+            sm.CLEAN_MESSAGE)
+
+        # Nothing to write when nothing changed.
+        self.spm._checkForMail()
+        self.assertEqual(self.spm._outboxIO.writes, 1)
+
+    def test_send_reply(self):
+        msg = extend_message(self.pool)
+        msgId = 7 * sm.SLOTS_PER_MAILBOX + 2
+        self.spm._outboxIO = sm.DirectMailboxIO(self.outbox(), "r+")
+        self.spm.sendReply(msgId, msg)
+        msgStart = msgId * sm.MESSAGE_SIZE
+        with open(self.outbox()) as f:
+            outbox = f.read()
+        self.assertEqual(outbox[msgStart:msgStart + sm.MESSAGE_SIZE],
+                         msg.payload)
+        self.assertEqual(len(self.spm._outgoingMail),
+                         self.HOSTS * sm.MAILBOX_SIZE)
+
+    @permutations([[5], [20]])
+    def test_set_max_host_id(self, hosts):
+        self.spm.setMaxHostID(hosts)
+        self.assertEqual(self.spm.getMaxHostID(), hosts)
+        self.assertEqual(len(self.spm._outgoingMail),
+                         hosts * sm.MAILBOX_SIZE)
+        self.assertEqual(len(self.spm._incomingMail),
+                         hosts * sm.MAILBOX_SIZE)
+
+    def outbox(self):
+        return os.path.join(self.pool.storage_repository, self.pool.spUUID,
+                            "mastersd", DOMAIN_META_DATA, "outbox")
+
+
+@expandPermutations
+class SPMHandleRequestsBenchmark(TestCaseBase):
+
+    @slowtest
+    @permutations([[250], [2000]])
+    def test_scan(self, hosts):
+        """
+        Measure the time to scan the SPM inbox when a single mailbox has
+        changed since the last read.
+        """
+        pool = StoragePoolStub(data="\0" * sm.MAILBOX_SIZE * hosts)
+        with mailbox_config(backend=sm.DIRECT):
+            spm = sm.SPM_MailMonitor(pool, hosts, monitorInterval=0.05)
+        spm.stop()
+        retry(AssertionError, lambda: assert_stopped(spm), timeout=2,
+              sleep=0.05)
+        spm.tp = FakeThreadPool()
+        spm.registerMessageType(sm.EXTEND_CODE, "extend")
+        mails = [make_inbox(hosts, {i % hosts: {1: extend_message(pool)
+                                                .payload}})
+                 for i in range(100)]
+        start = time.time()
+        for mail in mails:
+            spm._handleRequests(mail)
+        elapsed = time.time() - start
+        self.assertEqual(len(spm.tp.tasks), len(mails))
+        print("hosts=%d: %.6f seconds per scan" % (hosts,
+                                                   elapsed / len(mails)))
+
+
+def extend_message(pool):
+    volumeData = {'poolID': pool.spUUID,
+                  'domainID': str(uuid4()),
+                  'volumeID': str(uuid4())}
+    return sm.SPM_Extend_Message(volumeData, 1024)
+
+
+def make_inbox(hosts, messages):
+    """
+    Return SPM inbox contents for hosts, with messages; a dict mapping host
+    to a dict mapping message slot to message payload.
+    """
+    mail = bytearray(sm.MAILBOX_SIZE * hosts)
+    chkStart = sm.MAILBOX_SIZE - sm.CHECKSUM_BYTES
+    for host, slots in messages.items():
+        mailboxStart = host * sm.MAILBOX_SIZE
+        mailbox = bytearray(sm.EMPTYMAILBOX)
+        for slot, payload in slots.items():
+            msgStart = slot * sm.MESSAGE_SIZE
+            mailbox[msgStart:msgStart + sm.MESSAGE_SIZE] = payload
+        chk = misc.checksum(bytes(mailbox[:chkStart]), sm.CHECKSUM_BYTES)
+        mailbox[chkStart:] = struct.pack('<l', chk)
+        mail[mailboxStart:mailboxStart + sm.MAILBOX_SIZE] = mailbox
+    return bytes(mail)
+
+
+@contextmanager
+def mailbox_config(backend=sm.DD, repository=None):
+    tunables = [('irs', 'mailbox_backend', backend)]
+    if repository:
+        tunables.append(('irs', 'repository', repository))
+    with MonkeyPatchScope([(sm, 'config', make_config(tunables))]):
+        yield
+
+
+@contextmanager
+def mailbox_pool(backend, interval, hosts, hostID=1):
+    pool = StoragePoolStub(data="\0" * sm.MAILBOX_SIZE * hosts)
+    with mailbox_config(backend=backend,
+                        repository=pool.storage_repository):
+        spm = sm.SPM_MailMonitor(pool, hosts, monitorInterval=interval)
+        pool.spmMailer = spm
+        spm.registerMessageType(
+            sm.EXTEND_CODE, partial(sm.SPM_Extend_Message.processRequest,
+                                    pool))
+        try:
+            hsm = sm.HSM_Mailbox(hostID, pool.spUUID,
+                                 monitorInterval=interval)
+            try:
+                yield pool, hsm
+            finally:
+                hsm.stop()
+        finally:
+            spm.stop()
+            retry(AssertionError,
+                  lambda: assert_stopped(spm), timeout=interval * 10,
+                  sleep=0.05)
+
+
+def assert_stopped(spm):
+    assert spm.isStopped()
+
+
+def extend(pool, hsm, timeout):
+    done = threading.Event()
+    volumeData = {'poolID': pool.spUUID,
+                  'domainID': str(uuid4()),
+                  'volumeID': str(uuid4())}
+    hsm.sendExtendMsg(volumeData, 1024,
+                      callbackFunction=lambda volumeData: done.set())
+    done.wait(timeout)
+    return done.is_set()
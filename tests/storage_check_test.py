@@ -35,8 +35,12 @@ from testlib import temporaryPath
 
 from vdsm import concurrent
 from vdsm import constants
+from vdsm import executor
+from vdsm import schedule
+from vdsm import utils
 from vdsm.storage import check
 from vdsm.storage import asyncevent
+from vdsm.storage import directio
 from vdsm.storage import exception
 
 
@@ -268,6 +272,167 @@ class TestDirectioCheckerTimings(VdsmTestCase):
             self.assertRaises(exception.MiscFileReadException, res.delay)
 
 
+class ExecutorMixin(object):
+
+    def start_executor(self):
+        self.scheduler = schedule.Scheduler(clock=utils.monotonic_time)
+        self.scheduler.start()
+        self.executor = executor.Executor("test.check", workers_count=4,
+                                          max_tasks=1000,
+                                          scheduler=self.scheduler,
+                                          max_workers=20)
+        self.executor.start()
+
+    def stop_executor(self):
+        self.executor.stop(wait=False)
+        self.scheduler.stop()
+
+
+@expandPermutations
+class TestThreadedChecker(ExecutorMixin, VdsmTestCase):
+
+    def setUp(self):
+        self.loop = asyncevent.EventLoop()
+        self.start_executor()
+        self.results = []
+        self.checks = 1
+
+    def tearDown(self):
+        self.stop_executor()
+        self.loop.close()
+
+    def complete(self, result):
+        self.results.append(result)
+        if len(self.results) == self.checks:
+            self.loop.stop()
+
+    def test_path_missing(self):
+        checker = check.ThreadedChecker(self.loop, "/no/such/path",
+                                        self.complete, self.executor)
+        checker.start()
+        self.loop.run_forever()
+        pprint.pprint(self.results)
+        result = self.results[0]
+        self.assertRaises(exception.MiscFileReadException, result.delay)
+
+    def test_path_ok(self):
+        with temporaryPath(data=b"blah") as path:
+            checker = check.ThreadedChecker(self.loop, path, self.complete,
+                                            self.executor)
+            checker.start()
+            self.loop.run_forever()
+            pprint.pprint(self.results)
+            result = self.results[0]
+            delay = result.delay()
+            print("delay:", delay)
+            self.assertEqual(type(delay), float)
+            self.assertLessEqual(delay, result.elapsed)
+
+    @slowtest
+    def test_interval(self):
+        self.checks = 5
+        interval = 0.1
+        clock_res = 0.01
+        with temporaryPath(data=b"blah") as path:
+            checker = check.ThreadedChecker(self.loop, path, self.complete,
+                                            self.executor, interval=interval)
+            checker.start()
+            self.loop.run_forever()
+            pprint.pprint(self.results)
+            for i in range(self.checks - 1):
+                r1 = self.results[i]
+                r2 = self.results[i + 1]
+                actual = r2.time - r1.time
+                self.assertGreater(actual, interval - clock_res)
+                self.assertLess(actual, interval + clock_res)
+
+    def test_executor_not_running(self):
+        self.stop_executor()
+        checker = check.ThreadedChecker(self.loop, "/path", self.complete,
+                                        self.executor)
+        checker.start()
+        self.loop.run_forever()
+        result = self.results[0]
+        self.assertRaises(exception.MiscFileReadException, result.delay)
+
+
+@expandPermutations
+class TestThreadedCheckerWaiting(ExecutorMixin, VdsmTestCase):
+
+    def setUp(self):
+        self.loop = asyncevent.EventLoop()
+        self.thread = concurrent.thread(self.loop.run_forever)
+        self.thread.start()
+        self.start_executor()
+        self.completed = threading.Event()
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.stop_executor()
+
+    def complete(self, result):
+        self.completed.set()
+
+    @slowtest
+    def test_running_stop_during_check(self):
+        with blocking_read(0.2):
+            checker = check.ThreadedChecker(self.loop, "/path",
+                                            self.complete, self.executor)
+            self.loop.call_soon_threadsafe(checker.start)
+            self.loop.call_soon_threadsafe(checker.stop)
+            self.assertTrue(checker.wait(1.0))
+            self.assertFalse(self.completed.is_set())
+            self.assertFalse(checker.is_running())
+
+    @slowtest
+    def test_stopping_timeout(self):
+        with blocking_read(0.2):
+            checker = check.ThreadedChecker(self.loop, "/path",
+                                            self.complete, self.executor)
+            self.loop.call_soon_threadsafe(checker.start)
+            self.loop.call_soon_threadsafe(checker.stop)
+            self.assertFalse(checker.wait(0.1))
+            self.assertTrue(checker.is_running())
+
+
+@expandPermutations
+class TestThreadedCheckerTimings(ExecutorMixin, VdsmTestCase):
+
+    def setUp(self):
+        self.loop = asyncevent.EventLoop()
+        self.start_executor()
+        self.results = []
+
+    def tearDown(self):
+        self.stop_executor()
+        self.loop.close()
+
+    def complete(self, result):
+        self.results.append(result)
+        if len(self.results) == self.checkers:
+            self.loop.stop()
+
+    @slowtest
+    @permutations([[1], [50], [100], [200]])
+    def test_path_ok(self, checkers):
+        self.checkers = checkers
+        with temporaryPath(data=b"blah") as path:
+            start = time.time()
+            for i in range(checkers):
+                checker = check.ThreadedChecker(self.loop, path,
+                                                self.complete, self.executor)
+                checker.start()
+            self.loop.run_forever()
+            elapsed = time.time() - start
+            self.assertEqual(len(self.results), self.checkers)
+            print("%d checkers: %f seconds" % (checkers, elapsed))
+            # Make sure all succeeded
+            for res in self.results:
+                res.delay()
+
+
 @expandPermutations
 class TestCheckResult(VdsmTestCase):
 
@@ -299,6 +464,14 @@ class TestCheckResult(VdsmTestCase):
         result = check.CheckResult("/path", 0, err, 0, 0)
         self.assertEqual(result.delay(), seconds)
 
+    def test_read_delay(self):
+        result = check.CheckResult("/path", 0, None, 0, 0, read_delay=0.5)
+        self.assertEqual(result.delay(), 0.5)
+
+    def test_read_delay_non_zero_exit_code(self):
+        result = check.CheckResult("/path", 2, "REASON", 0, 0, read_delay=0.5)
+        self.assertRaises(exception.MiscFileReadException, result.delay)
+
     def test_non_zero_exit_code(self):
         path = "/path"
         reason = "REASON"
@@ -373,6 +546,58 @@ class TestCheckService(VdsmTestCase):
             self.assertFalse(self.service.is_checking("/path"))
 
 
+class TestThreadedCheckService(VdsmTestCase):
+
+    def setUp(self):
+        self.service = check.CheckService(backend=check.THREAD)
+        self.service.start()
+        self.result = None
+        self.completed = threading.Event()
+
+    def tearDown(self):
+        self.service.stop()
+
+    def complete(self, result):
+        self.result = result
+        self.completed.set()
+
+    def test_start_checking(self):
+        with temporaryPath(data=b"blah") as path:
+            self.service.start_checking(path, self.complete)
+            self.assertTrue(self.service.is_checking(path))
+            self.assertTrue(self.completed.wait(1.0))
+            self.assertEqual(self.result.rc, 0)
+            self.assertTrue(self.service.stop_checking(path, timeout=1.0))
+
+    def test_unsupported_backend(self):
+        self.assertRaises(ValueError, check.CheckService, backend="bad")
+
+
+class BlockingFile(object):
+
+    def __init__(self, delay):
+        self._delay = delay
+
+    def __call__(self, path, mode):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def read(self, n):
+        time.sleep(self._delay)
+        return b"\0" * n
+
+
+@contextmanager
+def blocking_read(delay):
+    with MonkeyPatchScope([(directio, "DirectFile", BlockingFile(delay))]):
+        yield
+
+
 @contextmanager
 def fake_dd(delay):
     script = "#!/bin/sh\nsleep %.1f\n" % delay
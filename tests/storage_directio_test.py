@@ -94,3 +94,76 @@ class TestDirectFile(TestCaseBase):
                 directio.DirectFile(srcPath, "r") as direct_file, \
                 io.open(srcPath, "rb") as buffered_file:
             self.assertEquals(direct_file.read(), buffered_file.read())
+
+    @permutations([[0], [BLOCK_SIZE]])
+    def test_pread(self, offset):
+        buf = directio.AlignedBuffer(len(self.DATA))
+        with temporaryPath(data=self.DATA) as srcPath, \
+                directio.DirectFile(srcPath, "r") as f:
+            n = f.pread(buf, BLOCK_SIZE, offset)
+            self.assertEqual(n, BLOCK_SIZE)
+            self.assertEqual(buf.getvalue(n),
+                             self.DATA[offset:offset + BLOCK_SIZE])
+            # pread does not change the file position
+            self.assertEqual(f.tell(), 0)
+
+    def test_pread_short(self):
+        buf = directio.AlignedBuffer(4 * len(self.DATA))
+        with temporaryPath(data=self.DATA) as srcPath, \
+                directio.DirectFile(srcPath, "r") as f:
+            n = f.pread(buf, buf.size, 0)
+            self.assertEqual(buf.getvalue(n), self.DATA)
+
+    def test_pread_unaligned(self):
+        buf = directio.AlignedBuffer(len(self.DATA))
+        with temporaryPath(data=self.DATA) as srcPath, \
+                directio.DirectFile(srcPath, "r") as f:
+            self.assertRaises(ValueError, f.pread, buf, 511, 0)
+            self.assertRaises(ValueError, f.pread, buf, BLOCK_SIZE, 1)
+
+    def test_pread_buffer_too_small(self):
+        buf = directio.AlignedBuffer(BLOCK_SIZE)
+        with temporaryPath(data=self.DATA) as srcPath, \
+                directio.DirectFile(srcPath, "r") as f:
+            self.assertRaises(ValueError, f.pread, buf, 2 * BLOCK_SIZE, 0)
+
+    def test_pwrite(self):
+        buf = directio.AlignedBuffer(BLOCK_SIZE)
+        buf.setvalue(b"x" * BLOCK_SIZE)
+        with temporaryPath(data=self.DATA) as srcPath:
+            with directio.DirectFile(srcPath, "r+") as f:
+                n = f.pwrite(buf, BLOCK_SIZE, BLOCK_SIZE)
+                self.assertEqual(n, BLOCK_SIZE)
+            with io.open(srcPath, "rb") as f:
+                expected = (self.DATA[:BLOCK_SIZE] + b"x" * BLOCK_SIZE +
+                            self.DATA[2 * BLOCK_SIZE:])
+                self.assertEqual(f.read(), expected)
+
+
+class TestAlignedBuffer(TestCaseBase):
+
+    def test_aligned(self):
+        buf = directio.AlignedBuffer(BLOCK_SIZE)
+        self.assertEqual(buf.address % directio.BUFFER_ALIGNMENT, 0)
+
+    def test_zeroed(self):
+        buf = directio.AlignedBuffer(BLOCK_SIZE)
+        self.assertEqual(buf.getvalue(BLOCK_SIZE), b"\0" * BLOCK_SIZE)
+
+    def test_set_get(self):
+        buf = directio.AlignedBuffer(BLOCK_SIZE)
+        buf.setvalue(b"data")
+        self.assertEqual(buf.getvalue(5), b"data\0")
+
+    def test_too_large(self):
+        buf = directio.AlignedBuffer(BLOCK_SIZE)
+        self.assertRaises(ValueError, buf.setvalue, b"x" * (BLOCK_SIZE + 1))
+        self.assertRaises(ValueError, buf.getvalue, BLOCK_SIZE + 1)
+
+    def test_close(self):
+        buf = directio.AlignedBuffer(BLOCK_SIZE)
+        buf.close()
+        self.assertTrue(buf.closed)
+        buf.close()  # Ignored
+        self.assertRaises(ValueError, buf.getvalue, 1)
+        self.assertRaises(ValueError, buf.setvalue, b"x")
@@ -18,6 +18,8 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+import threading
+import time
 import uuid
 from contextlib import contextmanager
 
@@ -25,14 +27,19 @@ from monkeypatch import MonkeyPatchScope
 from testlib import make_config
 from testlib import VdsmTestCase
 from testlib import permutations, expandPermutations
+from storagetestlib import fake_block_env
 from storagetestlib import fake_file_env
+from storagetestlib import make_block_volume
 from storagetestlib import make_file_volume
 
+from vdsm import concurrent
 from vdsm import qemuimg
 from vdsm.storage import constants as sc
 from vdsm.storage import exception as se
+from vdsm.storage.threadlocal import vars
 
 from storage import hsm
+from storage import sd
 
 
 class FakeHSM(hsm.HSM):
@@ -40,6 +47,63 @@ class FakeHSM(hsm.HSM):
         pass
 
 
+class FakeConnectionHSM(FakeHSM):
+
+    def __init__(self):
+        self.prefetched = []
+
+    def _HSM__prefetchDomains(self, domType, conObj):
+        self.prefetched.append(conObj)
+        return {}
+
+
+class FakeTask(object):
+
+    def setDefaultException(self, e):
+        pass
+
+
+class FakeSDCache(object):
+
+    def __init__(self):
+        self.knownSDs = {}
+        self.refreshed = 0
+        self.invalidated = 0
+
+    def refreshStorage(self):
+        self.refreshed += 1
+
+    def invalidateStorage(self):
+        self.invalidated += 1
+
+    def manuallyRemoveDomain(self, sdUUID):
+        pass
+
+
+class FakeManifestCache(object):
+
+    def __init__(self, *manifests):
+        self.manifests = dict((m.sdUUID, m) for m in manifests)
+
+    def produce(self, sdUUID):
+        return self.manifests[sdUUID]
+
+
+class FakeConnection(object):
+
+    def __init__(self, conInfo, barrier=None):
+        self.id = conInfo
+        self.barrier = barrier
+        self.connected = False
+
+    def connect(self):
+        if self.barrier:
+            self.barrier.wait(timeout=5)
+        if self.id == "bad":
+            raise se.StorageServerConnectionError(self.id)
+        self.connected = True
+
+
 @expandPermutations
 class VerifyUntrustedVolumeTest(VdsmTestCase):
     SIZE = 1024 * 1024
@@ -117,3 +181,160 @@ class VerifyUntrustedVolumeTest(VdsmTestCase):
             make_file_volume(env.sd_manifest, self.SIZE, img_id, vol_id,
                              vol_format=vol_fmt)
             yield env.sd_manifest.produceVolume(img_id, vol_id)
+
+
+@expandPermutations
+class ConnectStorageServerTests(VdsmTestCase):
+
+    def setUp(self):
+        self.sdcache = FakeSDCache()
+        self.connections = []
+        self.barrier = None
+        vars.task = FakeTask()
+
+    def tearDown(self):
+        del vars.task
+
+    @permutations(((sd.ISCSI_DOMAIN,), (sd.FCP_DOMAIN,)))
+    def test_block_refresh_once(self, domType):
+        h, res = self.connect(domType, ["a", "b", "c"])
+        self.assertEqual(res, {"statuslist": [{"id": "a", "status": 0},
+                                              {"id": "b", "status": 0},
+                                              {"id": "c", "status": 0}]})
+        self.assertEqual(self.sdcache.refreshed, 1)
+        self.assertEqual(self.sdcache.invalidated, 1)
+        self.assertEqual(len(h.prefetched), 1)
+
+    def test_block_all_failed(self):
+        h, res = self.connect(sd.ISCSI_DOMAIN, ["bad", "bad"])
+        code = se.StorageServerConnectionError.code
+        self.assertEqual(res, {"statuslist": [{"id": "bad", "status": code},
+                                              {"id": "bad", "status": code}]})
+        self.assertEqual(self.sdcache.refreshed, 0)
+        self.assertEqual(h.prefetched, [])
+
+    def test_file_prefetch_per_connection(self):
+        h, res = self.connect(sd.NFS_DOMAIN, ["a", "bad", "c"])
+        code = se.StorageServerConnectionError.code
+        self.assertEqual(res, {"statuslist": [{"id": "a", "status": 0},
+                                              {"id": "bad", "status": code},
+                                              {"id": "c", "status": 0}]})
+        self.assertEqual(self.sdcache.refreshed, 0)
+        self.assertEqual([c.id for c in h.prefetched], ["a", "c"])
+
+    def test_concurrent_connect(self):
+        # Every connection waits until all the connections are connecting.
+        self.barrier = concurrent.Barrier(3)
+        h, res = self.connect(sd.ISCSI_DOMAIN, ["a", "b", "c"])
+        self.assertTrue(all(c.connected for c in self.connections))
+        self.assertEqual(self.sdcache.refreshed, 1)
+
+    def test_bounded_connect(self):
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+
+        class CountingConnection(FakeConnection):
+            def connect(self):
+                with lock:
+                    running[0] += 1
+                    peak[0] = max(peak[0], running[0])
+                time.sleep(0.05)
+                with lock:
+                    running[0] -= 1
+
+        conf = make_config([("irs", "connect_storage_server_workers", "2")])
+        with MonkeyPatchScope([(hsm, "config", conf)]):
+            self.connect(sd.NFS_DOMAIN, ["a", "b", "c", "d"],
+                         connection=CountingConnection)
+        self.assertEqual(peak[0], 2)
+
+    def connect(self, domType, ids, connection=FakeConnection):
+        def createConnection(cls, conInfo):
+            con = connection(conInfo, self.barrier)
+            self.connections.append(con)
+            return con
+
+        conList = [{"id": i} for i in ids]
+        with MonkeyPatchScope([
+            (hsm, "sdCache", self.sdcache),
+            (hsm, "_connectionDict2ConnectionInfo",
+             lambda domType, conDef: conDef["id"]),
+            (hsm.storageServer.ConnectionFactory, "createConnection",
+             createConnection),
+        ]):
+            h = FakeConnectionHSM()
+            res = h.connectStorageServer(domType, "pool", conList)
+        return h, res
+
+
+class GetVolumesSizeTest(VdsmTestCase):
+    SIZE = 1024 * 1024
+
+    def test_file(self):
+        with fake_file_env() as env:
+            sd_manifest = env.sd_manifest
+            img_id = str(uuid.uuid4())
+            vol_ids = [str(uuid.uuid4()) for i in range(2)]
+            for vol_id in vol_ids:
+                make_file_volume(sd_manifest, self.SIZE, img_id, vol_id)
+            missing = str(uuid.uuid4())
+
+            res = self.get_sizes(sd_manifest, [
+                (sd_manifest.sdUUID, img_id, vol_ids[0]),
+                (sd_manifest.sdUUID, img_id, vol_ids[1]),
+                (sd_manifest.sdUUID, img_id, missing),
+            ])
+            expected = dict(
+                (vol_id, self.expected_size(sd_manifest, img_id, vol_id))
+                for vol_id in vol_ids)
+            self.assertEqual(res, {"sizes": {sd_manifest.sdUUID: expected}})
+
+    def test_block(self):
+        with fake_block_env() as env:
+            sd_manifest = env.sd_manifest
+            sd_id = sd_manifest.sdUUID
+            img_id = str(uuid.uuid4())
+            active = str(uuid.uuid4())
+            make_block_volume(env.lvm, sd_manifest, self.SIZE, img_id,
+                              active)
+            inactive = str(uuid.uuid4())
+            env.lvm.createLV(sd_id, inactive, 2, activate=False)
+
+            res = self.get_sizes(sd_manifest, [
+                (sd_id, img_id, active),
+                (sd_id, img_id, inactive),
+            ])
+            size = str(int(env.lvm.getLV(sd_id, inactive).size))
+            expected = {
+                active: self.expected_size(sd_manifest, img_id, active),
+                inactive: {"apparentsize": size, "truesize": size},
+            }
+            self.assertEqual(res, {"sizes": {sd_id: expected}})
+
+    def test_missing_domain(self):
+        with fake_file_env() as env:
+            sd_manifest = env.sd_manifest
+            img_id = str(uuid.uuid4())
+            vol_id = str(uuid.uuid4())
+            make_file_volume(sd_manifest, self.SIZE, img_id, vol_id)
+
+            res = self.get_sizes(sd_manifest, [
+                (sd_manifest.sdUUID, img_id, vol_id),
+                (str(uuid.uuid4()), img_id, vol_id),
+            ])
+            expected = {
+                vol_id: self.expected_size(sd_manifest, img_id, vol_id),
+            }
+            self.assertEqual(res, {"sizes": {sd_manifest.sdUUID: expected}})
+
+    def get_sizes(self, sd_manifest, volumes):
+        sdcache = FakeManifestCache(sd_manifest)
+        with MonkeyPatchScope([(hsm, "sdCache", sdcache)]):
+            return FakeHSM().getVolumesSize(volumes)
+
+    def expected_size(self, sd_manifest, img_id, vol_id):
+        return {
+            "apparentsize": str(sd_manifest.getVSize(img_id, vol_id)),
+            "truesize": str(sd_manifest.getVAllocSize(img_id, vol_id)),
+        }
@@ -0,0 +1,197 @@
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+import os
+import uuid
+from contextlib import contextmanager
+
+from monkeypatch import MonkeyPatchScope
+from testlib import VdsmTestCase
+from testlib import permutations, expandPermutations
+from storagetestlib import fake_env
+
+from vdsm.storage import constants as sc
+from vdsm.storage import exception as se
+
+from storage import image
+
+MB = 1024 ** 2
+
+
+class FakeManifestCache(object):
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+
+    def produce(self, sdUUID):
+        return self.manifest
+
+
+@expandPermutations
+class GetChainTests(VdsmTestCase):
+
+    @contextmanager
+    def image_env(self, storage_type):
+        with fake_env(storage_type) as env:
+            cache = FakeManifestCache(env.sd_manifest)
+            with MonkeyPatchScope([(image, 'sdCache', cache)]):
+                self.env = env
+                self.storage_type = storage_type
+                self.sdUUID = env.sd_manifest.sdUUID
+                self.img = image.Image(env.sd_manifest.getRepoPath())
+                yield
+
+    def make_chain(self, imgUUID, length, parentUUID=sc.BLANK_UUID):
+        volUUIDs = []
+        for i in range(length):
+            volUUID = str(uuid.uuid4())
+            self.env.make_volume(MB, imgUUID, volUUID,
+                                 parent_vol_id=parentUUID)
+            if i < length - 1:
+                self.set_type(imgUUID, volUUID, sc.INTERNAL_VOL)
+            volUUIDs.append(volUUID)
+            parentUUID = volUUID
+        return volUUIDs
+
+    def make_template(self):
+        templateImage = str(uuid.uuid4())
+        templateUUID, = self.make_chain(templateImage, 1)
+        self.set_type(templateImage, templateUUID, sc.SHARED_VOL)
+        return templateImage, templateUUID
+
+    def link_template(self, templateImage, templateUUID, imgUUID):
+        # File volumes of a template are linked into the images based on it.
+        # Block volumes are found by their LV, and need no link.
+        if self.storage_type == 'block':
+            return
+        images = os.path.join(self.env.sd_manifest.domaindir, "images")
+        src = os.path.join(images, templateImage, templateUUID)
+        dst = os.path.join(images, imgUUID, templateUUID)
+        for ext in ("", ".meta", ".lease"):
+            os.link(src + ext, dst + ext)
+
+    def set_type(self, imgUUID, volUUID, voltype):
+        vol = self.env.sd_manifest.produceVolume(imgUUID, volUUID)
+        vol.setMetaParam(sc.VOLTYPE, sc.type2name(voltype))
+
+    def chain(self, imgUUID, volUUID=None):
+        return [vol.volUUID
+                for vol in self.img.getChain(self.sdUUID, imgUUID, volUUID)]
+
+    @permutations((('file',), ('block',)))
+    def test_chain(self, storage_type):
+        with self.image_env(storage_type):
+            imgUUID = str(uuid.uuid4())
+            volUUIDs = self.make_chain(imgUUID, 3)
+            self.assertEqual(self.chain(imgUUID), volUUIDs)
+
+    @permutations((('file',), ('block',)))
+    def test_chain_from_volume(self, storage_type):
+        with self.image_env(storage_type):
+            imgUUID = str(uuid.uuid4())
+            volUUIDs = self.make_chain(imgUUID, 3)
+            self.assertEqual(self.chain(imgUUID, volUUIDs[1]), volUUIDs[:2])
+
+    @permutations((('file',), ('block',)))
+    def test_volumes_metadata(self, storage_type):
+        with self.image_env(storage_type):
+            imgUUID = str(uuid.uuid4())
+            base, leaf = self.make_chain(imgUUID, 2)
+            vols = self.img.getVolumesMetadata(self.sdUUID, imgUUID)
+            self.assertEqual(sorted(vols), sorted([base, leaf]))
+            self.assertEqual(vols[base][sc.PUUID], sc.BLANK_UUID)
+            self.assertEqual(vols[base][sc.VOLTYPE],
+                             sc.type2name(sc.INTERNAL_VOL))
+            self.assertEqual(vols[leaf][sc.PUUID], base)
+            self.assertEqual(vols[leaf][sc.VOLTYPE],
+                             sc.type2name(sc.LEAF_VOL))
+
+    @permutations((('file',), ('block',)))
+    def test_template(self, storage_type):
+        with self.image_env(storage_type):
+            templateImage, templateUUID = self.make_template()
+            imgUUID = str(uuid.uuid4())
+            volUUIDs = self.make_chain(imgUUID, 2, parentUUID=templateUUID)
+            self.link_template(templateImage, templateUUID, imgUUID)
+
+            # The template is not part of the image chain or volumes
+            # metadata, but it is one of the image volumes.
+            self.assertEqual(self.chain(imgUUID), volUUIDs)
+            vols = self.img.getVolumesMetadata(self.sdUUID, imgUUID)
+            self.assertEqual(sorted(vols), sorted(volUUIDs))
+            self.assertEqual(
+                sorted(self.img.getVolumes(self.sdUUID, imgUUID)),
+                sorted(volUUIDs + [templateUUID]))
+
+    @permutations((('file',), ('block',)))
+    def test_template_image(self, storage_type):
+        with self.image_env(storage_type):
+            templateImage, templateUUID = self.make_template()
+            self.assertEqual(self.chain(templateImage), [templateUUID])
+            self.assertEqual(self.chain(templateImage, templateUUID),
+                             [templateUUID])
+
+    @permutations((('file',), ('block',)))
+    def test_template_linked_volume(self, storage_type):
+        with self.image_env(storage_type):
+            templateImage, templateUUID = self.make_template()
+            imgUUID = str(uuid.uuid4())
+            self.make_chain(imgUUID, 1, parentUUID=templateUUID)
+            self.link_template(templateImage, templateUUID, imgUUID)
+            self.assertEqual(self.chain(imgUUID, templateUUID),
+                             [templateUUID])
+
+    @permutations((('file',), ('block',)))
+    def test_broken_parent(self, storage_type):
+        with self.image_env(storage_type):
+            imgUUID = str(uuid.uuid4())
+            self.make_chain(imgUUID, 2, parentUUID=str(uuid.uuid4()))
+            self.assertRaises(se.ImageIsNotLegalChain, self.chain, imgUUID)
+
+    @permutations((('file',), ('block',)))
+    def test_loop(self, storage_type):
+        with self.image_env(storage_type):
+            imgUUID = str(uuid.uuid4())
+            base, leaf = self.make_chain(imgUUID, 2)
+            vol = self.env.sd_manifest.produceVolume(imgUUID, base)
+            vol.setMetaParam(sc.PUUID, leaf)
+            self.assertRaises(se.ImageIsNotLegalChain, self.chain, imgUUID)
+
+    @permutations((('file',), ('block',)))
+    def test_no_leaf(self, storage_type):
+        with self.image_env(storage_type):
+            imgUUID = str(uuid.uuid4())
+            base, leaf = self.make_chain(imgUUID, 2)
+            self.set_type(imgUUID, leaf, sc.INTERNAL_VOL)
+            self.assertRaises(se.ImageIsNotLegalChain, self.chain, imgUUID)
+
+    @permutations((('file',), ('block',)))
+    def test_missing_volume(self, storage_type):
+        with self.image_env(storage_type):
+            imgUUID = str(uuid.uuid4())
+            self.make_chain(imgUUID, 2)
+            self.assertRaises(se.VolumeDoesNotExist, self.chain, imgUUID,
+                              str(uuid.uuid4()))
+
+    @permutations((('file',), ('block',)))
+    def test_missing_image(self, storage_type):
+        with self.image_env(storage_type):
+            self.assertRaises(se.ImageDoesNotExistInSD, self.chain,
+                              str(uuid.uuid4()))
@@ -0,0 +1,288 @@
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+import os
+import sys
+import threading
+
+from testlib import VdsmTestCase
+from testlib import temporaryPath
+
+from vdsm.storage import lvmshell
+
+# Emulates the lvm shell: prints a prompt, reads one command per line, and
+# reports errors on stderr like lvm.
+FAKE_SHELL = """
+import os
+import sys
+import time
+
+while True:
+    sys.stdout.write("lvm> ")
+    sys.stdout.flush()
+    line = sys.stdin.readline()
+    if not line:
+        break
+    args = line.split()
+    if not args:
+        continue
+    cmd = args[0]
+    if cmd == "echo":
+        sys.stdout.write("\\n".join(args[1:]) + "\\n")
+    elif cmd == "pid":
+        sys.stdout.write("%d\\n" % os.getpid())
+    elif cmd == "env":
+        sys.stdout.write(os.environ.get(args[1], "") + "\\n")
+    elif cmd == "warn":
+        sys.stderr.write("  WARNING: %s\\n" % args[1])
+        sys.stdout.write("output\\n")
+    elif cmd == "error":
+        sys.stderr.write("  %s\\n" % args[1])
+    elif cmd == "status":
+        sys.stderr.write("  Command failed with status code %s.\\n" % args[1])
+    elif cmd == "sleep":
+        time.sleep(float(args[1]))
+    elif cmd == "exit":
+        break
+    else:
+        sys.stderr.write("  No such command '%s'.  Try 'help'.\\n" % cmd)
+    sys.stdout.flush()
+    sys.stderr.flush()
+"""
+
+# Replays lvm shell output recorded for vdsm report commands. Like lvm
+# reading commands from a pipe with readline, echoes every command line after
+# the prompt before the command output.
+RECORDED_SHELL = """
+import sys
+
+VGS = ("vgs --noheadings --units b --nosuffix --separator | "
+       "-o uuid,name,attr,size,free")
+OUTPUT = {
+    VGS: (
+        "  Jw5kU9-0fKv-oXy3-I3kc-Gmf6-1aH3-jbzhcX|"
+        "b0a1ba9e-7be4-4d34-a3fd-e2a7a7b7fb3b|wz--n-|53284438016|"
+        "46842740736\\n"
+        "  xB1lVq-NtB2-kbTt-WT0P-3z6V-Ka5o-u6ePzT|"
+        "vg0|wz--n-|21470642176|0\\n",
+        "  WARNING: lvmetad is running but disabled. "
+        "Restart lvmetad before enabling it!\\n"),
+}
+
+while True:
+    sys.stdout.write("lvm> ")
+    sys.stdout.flush()
+    line = sys.stdin.readline()
+    if not line:
+        sys.stdout.write("\\n")
+        break
+    sys.stdout.write(line)
+    cmd = line.strip()
+    if not cmd:
+        continue
+    if cmd in OUTPUT:
+        out, err = OUTPUT[cmd]
+        sys.stdout.write(out)
+        sys.stderr.write(err)
+    else:
+        sys.stderr.write("  No such command '%s'.  Try 'help'.\\n" %
+                         cmd.split()[0])
+    sys.stdout.flush()
+    sys.stderr.flush()
+"""
+
+
+class ShellTests(VdsmTestCase):
+
+    def setUp(self):
+        self.path_cm = temporaryPath(data=FAKE_SHELL)
+        path = self.path_cm.__enter__()
+        self.command = [sys.executable, path]
+        self.shell = lvmshell.Shell(self.command)
+        self.shell.start(5)
+
+    def tearDown(self):
+        self.shell.stop()
+        self.path_cm.__exit__(None, None, None)
+
+    def test_run(self):
+        res = self.shell.run(["echo", "a", "b"], 5)
+        self.assertEqual(res, (0, ["a", "b"], []))
+
+    def test_run_many(self):
+        for i in range(100):
+            rc, out, err = self.shell.run(["echo", str(i)], 5)
+            self.assertEqual(out, [str(i)])
+
+    def test_no_output(self):
+        res = self.shell.run(["echo"], 5)
+        self.assertEqual(res, (0, [""], []))
+
+    def test_warning(self):
+        rc, out, err = self.shell.run(["warn", "careful"], 5)
+        self.assertEqual(rc, 0)
+        self.assertEqual(out, ["output"])
+        self.assertEqual(err, ["  WARNING: careful"])
+
+    def test_error(self):
+        rc, out, err = self.shell.run(["error", "failed"], 5)
+        self.assertEqual(rc, lvmshell.FAILED)
+        self.assertEqual(err, ["  failed"])
+
+    def test_error_status(self):
+        rc, out, err = self.shell.run(["status", "3"], 5)
+        self.assertEqual(rc, 3)
+
+    def test_unknown_command(self):
+        rc, out, err = self.shell.run(["unknown"], 5)
+        self.assertEqual(rc, lvmshell.FAILED)
+        self.assertEqual(len(err), 1)
+
+    def test_whitespace_argument(self):
+        self.assertRaises(ValueError, self.shell.run, ["echo", "a b"], 5)
+        self.assertTrue(self.shell.running)
+
+    def test_timeout(self):
+        self.assertRaises(lvmshell.Timeout, self.shell.run, ["sleep", "2"],
+                          0.2)
+        self.assertFalse(self.shell.running)
+
+    def test_terminated(self):
+        self.assertRaises(lvmshell.Error, self.shell.run, ["exit"], 5)
+        self.assertFalse(self.shell.running)
+
+    def test_start_error(self):
+        shell = lvmshell.Shell(["/no/such/executable"])
+        self.assertRaises(lvmshell.Error, shell.start, 5)
+
+    def test_env(self):
+        env = os.environ.copy()
+        env["LVM_SYSTEM_DIR"] = "/run/vdsm/lvm"
+        shell = lvmshell.Shell(self.command, env=env)
+        shell.start(5)
+        try:
+            res = shell.run(["env", "LVM_SYSTEM_DIR"], 5)
+        finally:
+            shell.stop()
+        self.assertEqual(res, (0, ["/run/vdsm/lvm"], []))
+
+
+class RecordedShellTests(VdsmTestCase):
+
+    def setUp(self):
+        self.path_cm = temporaryPath(data=RECORDED_SHELL)
+        path = self.path_cm.__enter__()
+        self.shell = lvmshell.Shell([sys.executable, path])
+        self.shell.start(5)
+
+    def tearDown(self):
+        self.shell.stop()
+        self.path_cm.__exit__(None, None, None)
+
+    def test_report(self):
+        cmd = ["vgs", "--noheadings", "--units", "b", "--nosuffix",
+               "--separator", "|", "-o", "uuid,name,attr,size,free"]
+        for i in range(3):
+            rc, out, err = self.shell.run(cmd, 5)
+            self.assertEqual(rc, 0)
+            self.assertEqual(out, [
+                "  Jw5kU9-0fKv-oXy3-I3kc-Gmf6-1aH3-jbzhcX|"
+                "b0a1ba9e-7be4-4d34-a3fd-e2a7a7b7fb3b|wz--n-|53284438016|"
+                "46842740736",
+                "  xB1lVq-NtB2-kbTt-WT0P-3z6V-Ka5o-u6ePzT|"
+                "vg0|wz--n-|21470642176|0",
+            ])
+            self.assertEqual(len(err), 1)
+
+    def test_error(self):
+        rc, out, err = self.shell.run(["vgz"], 5)
+        self.assertEqual(rc, lvmshell.FAILED)
+        self.assertEqual(out, [])
+        self.assertEqual(err, ["  No such command 'vgz'.  Try 'help'."])
+
+
+class FrameTests(VdsmTestCase):
+
+    def setUp(self):
+        self.shell = lvmshell.Shell(["lvm"])
+
+    def test_echoed_lines(self):
+        out = ("lvm> vgs -o name\n  vg0\n  vg1\n"
+               "lvm> vdsm-command-completed-2\n  stale\n")
+        self.assertEqual(self.shell._frame("vgs -o name", out),
+                         ["  vg0", "  vg1"])
+
+    def test_previous_output(self):
+        out = "  stale\nlvm> lvm> vgs -o name\n  vg0\n"
+        self.assertEqual(self.shell._frame("vgs -o name", out), ["  vg0"])
+
+    def test_no_echo(self):
+        out = "lvm>   vg0\n  vg1\n"
+        self.assertEqual(self.shell._frame("vgs -o name", out),
+                         ["  vg0", "  vg1"])
+
+
+class ShellPoolTests(VdsmTestCase):
+
+    def setUp(self):
+        self.path_cm = temporaryPath(data=FAKE_SHELL)
+        path = self.path_cm.__enter__()
+        self.command = [sys.executable, path]
+        self.pool = lvmshell.ShellPool(self.command, size=1, timeout=5)
+
+    def tearDown(self):
+        self.pool.close()
+        self.path_cm.__exit__(None, None, None)
+
+    def test_reuse_shell(self):
+        rc, first, err = self.pool.run(["pid"])
+        rc, second, err = self.pool.run(["pid"])
+        self.assertEqual(first, second)
+
+    def test_reset(self):
+        rc, first, err = self.pool.run(["pid"])
+        self.pool.reset()
+        rc, second, err = self.pool.run(["pid"])
+        self.assertNotEqual(first, second)
+
+    def test_timeout(self):
+        self.pool._timeout = 0.2
+        rc, first, err = self.pool.run(["pid"])
+        rc, out, err = self.pool.run(["sleep", "2"])
+        self.assertEqual(rc, lvmshell.TIMEOUT)
+        rc, second, err = self.pool.run(["pid"])
+        self.assertNotEqual(first, second)
+
+    def test_concurrent(self):
+        self.pool.close()
+        self.pool = lvmshell.ShellPool(self.command, size=3, timeout=5)
+        results = []
+
+        def run(i):
+            results.append(self.pool.run(["echo", str(i)]))
+
+        threads = [threading.Thread(target=run, args=(i,))
+                   for i in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(out[0] for rc, out, err in results),
+                         sorted(str(i) for i in range(10)))
@@ -25,6 +25,9 @@ import time
 
 from contextlib import contextmanager
 
+from vdsm import executor
+from vdsm import schedule
+from vdsm import utils
 from vdsm.storage import exception as se
 
 from monkeypatch import MonkeyPatch
@@ -36,6 +39,7 @@ from testlib import make_config
 from testlib import maybefail
 
 from storage import monitor
+from storage import sd
 
 MONITOR_INTERVAL = 0.2
 CYCLE_TIMEOUT = 5.0
@@ -90,10 +94,12 @@ class FakeDomain(object):
     monitoring.
     """
 
-    def __init__(self, sdUUID, version=1, iso_dir=None):
+    def __init__(self, sdUUID, version=1, iso_dir=None,
+                 storage_type=sd.NFS_DOMAIN):
         self.sdUUID = sdUUID
         self.version = version
         self.iso_dir = iso_dir
+        self.storage_type = storage_type
         self.acquired = False
         self.stats = {
             'disktotal': '100',
@@ -159,6 +165,9 @@ class FakeDomain(object):
     def getIsoDomainImagesDir(self):
         return self.iso_dir
 
+    def getStorageType(self):
+        return self.storage_type
+
 
 class UnexpectedError(Exception):
     pass
@@ -194,6 +203,24 @@ class MonitorEnv(object):
         self.queue.put(None)
 
 
+@contextmanager
+def monitor_executor(workers=4):
+    scheduler = schedule.Scheduler(name="test.Scheduler",
+                                   clock=utils.monotonic_time)
+    scheduler.start()
+    try:
+        tasks = executor.Executor(name="test", workers_count=workers,
+                                  max_tasks=100, scheduler=scheduler,
+                                  max_workers=workers * 2)
+        tasks.start()
+        try:
+            yield scheduler, tasks
+        finally:
+            tasks.stop(wait=False)
+    finally:
+        scheduler.stop()
+
+
 @contextmanager
 def monitor_env(shutdown=False, refresh=300):
     config = make_config([
@@ -202,29 +229,33 @@ def monitor_env(shutdown=False, refresh=300):
     with MonkeyPatchScope([
         (monitor, "sdCache", FakeStorageDomainCache()),
         (monitor, 'config', config),
-    ]):
+    ]), monitor_executor() as (scheduler, tasks):
         event = FakeEvent()
         checker = FakeCheckService()
         thread = monitor.MonitorThread('uuid', 'host_id', MONITOR_INTERVAL,
-                                       event, checker)
+                                       event, checker, scheduler, tasks)
         try:
             yield MonitorEnv(thread, event, checker)
         finally:
             thread.stop(shutdown=shutdown)
-            try:
-                thread.join()
-            except RuntimeError as e:
-                log.error("Error joining thread: %s", e)
+            thread.join()
 
 
 class TestMonitorThreadIdle(VdsmTestCase):
 
     def test_initial_status(self):
-        thread = monitor.MonitorThread('uuid', 'host_id', 0.2, None, None)
+        thread = monitor.MonitorThread('uuid', 'host_id', 0.2, None, None,
+                                       None, None)
         status = thread.getStatus()
         self.assertFalse(status.actual)
         self.assertTrue(status.valid)
 
+    def test_stop_not_started(self):
+        thread = monitor.MonitorThread('uuid', 'host_id', 0.2, None, None,
+                                       None, None)
+        thread.stop()
+        thread.join()
+
 
 @expandPermutations
 class TestMonitorThreadSetup(VdsmTestCase):
@@ -701,6 +732,138 @@ class TestMonitorThreadStopping(VdsmTestCase):
         self.assertNotIn(domain.getMonitoringPath(), env.checker.checkers)
 
 
+class TestMonitorThreadScheduling(VdsmTestCase):
+
+    def test_check_latency(self):
+        with monitor_env() as env:
+            domain = FakeDomain("uuid")
+            monitor.sdCache.domains["uuid"] = domain
+            env.thread.start()
+            env.wait_for_cycle()
+            env.wait_for_cycle()
+            latency = env.thread.getStatus().checkLatency
+            self.assertEqual(latency["0.1"], 2)
+            self.assertEqual(sum(latency.values()), 2)
+
+    def test_jitter(self):
+        with MonkeyPatchScope([(monitor.random, "uniform", max)]):
+            with monitor_env() as env:
+                env.thread.start()
+                start = utils.monotonic_time()
+                env.wait_for_cycle()
+                env.wait_for_cycle()
+                elapsed = utils.monotonic_time() - start
+        # The second cycle is delayed by 1.1 interval.
+        self.assertTrue(elapsed >= MONITOR_INTERVAL * 1.1, elapsed)
+
+    def test_blocked_domain_uses_one_worker(self):
+        blocked = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def block():
+            calls.append(None)
+            blocked.set()
+            release.wait(CYCLE_TIMEOUT)
+
+        with monitor_env() as env:
+            domain = FakeDomain("uuid")
+            domain.selftest = block
+            monitor.sdCache.domains["uuid"] = domain
+            env.thread.start()
+            if not blocked.wait(CYCLE_TIMEOUT):
+                raise RuntimeError("Timeout waiting for selftest")
+            # No other cycle is scheduled while the domain is blocked.
+            time.sleep(MONITOR_INTERVAL * 3)
+            self.assertEqual(len(calls), 1)
+            release.set()
+            env.wait_for_cycle()
+            env.wait_for_cycle()
+            self.assertEqual(len(calls), 2)
+
+    def test_shared_executor(self):
+        with monitor_executor(workers=1) as (scheduler, tasks):
+            with MonkeyPatchScope([
+                (monitor, "sdCache", FakeStorageDomainCache()),
+            ]):
+                envs = []
+                for sdUUID in ("uuid1", "uuid2"):
+                    monitor.sdCache.domains[sdUUID] = FakeDomain(sdUUID)
+                    thread = monitor.MonitorThread(
+                        sdUUID, 'host_id', MONITOR_INTERVAL, FakeEvent(),
+                        FakeCheckService(), scheduler, tasks)
+                    envs.append(MonitorEnv(thread, None, None))
+                for env in envs:
+                    env.thread.start()
+                try:
+                    for env in envs:
+                        env.wait_for_cycle()
+                        env.wait_for_cycle()
+                finally:
+                    for env in envs:
+                        env.thread.stop(shutdown=True)
+                    for env in envs:
+                        env.thread.join()
+
+
+class TestDomainMonitorLvmRefresh(VdsmTestCase):
+
+    def test_refresh_block_domains(self):
+        refreshed = Queue.Queue()
+        checked = Queue.Queue()
+        config = make_config([
+            ("irs", "repo_stats_cache_refresh_timeout", "300")
+        ])
+        with MonkeyPatchScope([
+            (monitor, "sdCache", FakeStorageDomainCache()),
+            (monitor, "config", config),
+            (monitor.lvm, "refreshVGs", refreshed.put),
+            (monitor.lvm, "checkVGs", lambda vgNames: checked.put(vgNames)
+             or {}),
+            (monitor.lvm, "lastVGCheck", lambda vgName: None),
+        ]):
+            for sdUUID, storage_type in [("uuid1", sd.ISCSI_DOMAIN),
+                                         ("uuid2", sd.FCP_DOMAIN),
+                                         ("uuid3", sd.NFS_DOMAIN)]:
+                monitor.sdCache.domains[sdUUID] = FakeDomain(
+                    sdUUID, storage_type=storage_type)
+            domain_monitor = monitor.DomainMonitor(MONITOR_INTERVAL)
+            try:
+                for sdUUID in ("uuid1", "uuid2", "uuid3"):
+                    domain_monitor.startMonitoring(sdUUID, 1, False)
+                # The first refresh may run before the monitors are set up.
+                deadline = utils.monotonic_time() + CYCLE_TIMEOUT
+                while True:
+                    vgNames = refreshed.get(True, CYCLE_TIMEOUT)
+                    if len(vgNames) == 2:
+                        break
+                    if utils.monotonic_time() > deadline:
+                        raise RuntimeError("Timeout waiting for refresh")
+                self.assertEqual(sorted(vgNames), ["uuid1", "uuid2"])
+                # The VGs are checked after refreshing them.
+                while True:
+                    vgNames = checked.get(True, CYCLE_TIMEOUT)
+                    if len(vgNames) == 2:
+                        break
+                self.assertEqual(sorted(vgNames), ["uuid1", "uuid2"])
+            finally:
+                domain_monitor.shutdown()
+
+
+class TestLatencyHistogram(VdsmTestCase):
+
+    def test_empty(self):
+        histogram = monitor.LatencyHistogram(buckets=(1, float("inf")))
+        self.assertEqual(histogram.snapshot(), {"1": 0, "inf": 0})
+
+    def test_add(self):
+        histogram = monitor.LatencyHistogram(buckets=(0.5, 1, float("inf")))
+        for seconds in (0.1, 0.5, 0.7, 1, 120):
+            histogram.add(seconds)
+        self.assertEqual(histogram.snapshot(),
+                         {"0.5": 2, "1": 2, "inf": 1})
+
+
 @expandPermutations
 class TestStatus(VdsmTestCase):
 
@@ -789,6 +952,7 @@ class TestStatus(VdsmTestCase):
         ("vgMdFreeBelowThreashold", True),
         ("isoPrefix", None),
         ("version", -1),
+        ("checkLatency", {}),
     ])
     @MonkeyPatch(time, 'time', lambda: 1234567)
     def test_readonly_attributes(self, attr, value):
@@ -0,0 +1,177 @@
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+import os
+import shutil
+
+from monkeypatch import MonkeyPatchScope
+from testlib import VdsmTestCase
+from testlib import namedTemporaryDir
+
+from vdsm.storage import devicemapper
+
+from storage import iscsi
+from storage import multipath
+
+
+class FakeProxy(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def batch(self, calls):
+        calls = list(calls)
+        self.calls.append([name for name, args, kwargs in calls])
+        return [(True, "serial-" + args[0]) for name, args, kwargs in calls]
+
+
+class FakeSysfs(object):
+
+    def __init__(self, root):
+        self.root = root
+
+    def add_slave(self, name, vendor="vendor", hbtl="1:0:0:7"):
+        self.write(name, "device/vendor", vendor)
+        self.write(name, "device/model", "model")
+        self.write(name, "device/rev", "rev")
+        if hbtl:
+            os.makedirs(self.path(name, "device/scsi_disk", hbtl))
+        self.add_queue(name)
+
+    def add_mpath(self, dm, guid, uuid="mpath-"):
+        self.write(dm, "dm/uuid", uuid + guid)
+        self.write(dm, "dm/name", guid)
+        self.add_queue(dm)
+
+    def add_queue(self, name):
+        self.write(name, "size", "2048")
+        self.write(name, "queue/logical_block_size", "512")
+        self.write(name, "queue/physical_block_size", "4096")
+        self.write(name, "queue/discard_max_bytes", "0")
+        self.write(name, "queue/discard_zeroes_data", "0")
+
+    def remove(self, name):
+        shutil.rmtree(self.path(name))
+
+    def write(self, name, attr, value):
+        path = self.path(name, attr)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(value + "\n")
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+
+class MultipathCacheTests(VdsmTestCase):
+
+    def setUp(self):
+        self.tmpdir = namedTemporaryDir()
+        self.sysfs = FakeSysfs(self.tmpdir.__enter__())
+        self.proxy = FakeProxy()
+        self.patch = MonkeyPatchScope([
+            (multipath, "SYS_BLOCK", self.sysfs.root),
+            (multipath, "_serials", {}),
+            (multipath, "_slaveAttrs", {}),
+            (multipath.supervdsm, "getProxy", lambda: self.proxy),
+            (devicemapper, "getPathsStatus", lambda: {}),
+            (devicemapper, "getSlaves", lambda dm: ["sda"]),
+            (devicemapper, "isBlockDevice", lambda dev: True),
+            (devicemapper, "getDmId", self.getDmId),
+            (iscsi, "devIsiSCSI", lambda dev: False),
+        ])
+        self.patch.__enter__()
+
+    def tearDown(self):
+        self.patch.__exit__(None, None, None)
+        self.tmpdir.__exit__(None, None, None)
+
+    def getDmId(self, guid):
+        for dm in os.listdir(self.sysfs.root):
+            name = self.sysfs.path(dm, "dm", "name")
+            if os.path.exists(name) and open(name).read().strip() == guid:
+                return dm
+        raise OSError("No such device %s" % guid)
+
+    def test_slave_attrs_cached(self):
+        self.sysfs.add_slave("sda", vendor="old")
+        self.assertEqual(multipath._getSlaveAttrs("sda")["vendor"], "old")
+        with open(self.sysfs.path("sda", "device/vendor"), "w") as f:
+            f.write("new\n")
+        self.assertEqual(multipath._getSlaveAttrs("sda")["vendor"], "old")
+
+    def test_slave_replaced(self):
+        self.sysfs.add_slave("sda", vendor="old")
+        self.assertEqual(multipath._getSlaveAttrs("sda")["vendor"], "old")
+        self.sysfs.remove("sda")
+        self.sysfs.add_slave("sda", vendor="new")
+        self.assertEqual(multipath._getSlaveAttrs("sda")["vendor"], "new")
+
+    def test_missing_attr_not_cached(self):
+        self.sysfs.add_slave("sda")
+        os.unlink(self.sysfs.path("sda", "device/model"))
+        self.assertNotIn("product", multipath._getSlaveAttrs("sda"))
+        self.sysfs.write("sda", "device/model", "model")
+        self.assertEqual(multipath._getSlaveAttrs("sda")["product"], "model")
+
+    def test_slave_attrs(self):
+        self.sysfs.add_slave("sda", hbtl=None)
+        attrs = multipath._getSlaveAttrs("sda")
+        self.assertEqual(attrs, {
+            "vendor": "vendor",
+            "product": "model",
+            "fwrev": "rev",
+            "blocksizes": (512, 4096),
+            "hbtl": None,
+            "session": None,
+        })
+
+    def test_serial_cached(self):
+        self.sysfs.add_mpath("dm-0", "guid")
+        self.sysfs.add_slave("sda")
+        for i in range(2):
+            devices = list(multipath.pathListIter())
+            self.assertEqual(len(devices), 1)
+            self.assertEqual(devices[0]["serial"], "serial-dm-0")
+            self.assertEqual(devices[0]["paths"][0]["lun"], "7")
+            self.assertEqual(devices[0]["paths"][0]["capacity"],
+                             str(2048 * 512))
+        # The second scan does not run scsi_id again.
+        self.assertEqual(self.proxy.calls, [["getScsiSerial"], []])
+
+    def test_cache_pruned(self):
+        self.sysfs.add_mpath("dm-0", "guid")
+        self.sysfs.add_slave("sda")
+        list(multipath.pathListIter())
+        self.sysfs.remove("dm-0")
+        list(multipath.pathListIter())
+        self.assertEqual(multipath._serials, {})
+        self.assertEqual(multipath._slaveAttrs, {})
+
+    def test_filter_guids(self):
+        self.sysfs.add_mpath("dm-0", "guid0")
+        self.sysfs.add_mpath("dm-1", "guid1")
+        self.sysfs.add_mpath("dm-2", "guid2", uuid="LVM-")
+        self.sysfs.add_slave("sda")
+        devices = list(multipath.pathListIter(
+            ["guid1", "guid2", "missing", "guid1"]))
+        self.assertEqual([(d["dm"], d["guid"]) for d in devices],
+                         [("dm-1", "guid1")])
@@ -0,0 +1,63 @@
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+
+from testlib import VdsmTestCase
+
+from vdsm.storage import constants as sc
+from vdsm.storage import volumechain
+
+
+class WalkTests(VdsmTestCase):
+
+    def test_only_base_volume(self):
+        parents = {'a': sc.BLANK_UUID}
+        self.assertEqual(volumechain.walk(parents, 'a'), ['a'])
+
+    def test_chain(self):
+        parents = {'a': sc.BLANK_UUID, 'b': 'a', 'c': 'b'}
+        self.assertEqual(volumechain.walk(parents, 'c'), ['a', 'b', 'c'])
+
+    def test_from_internal_volume(self):
+        parents = {'a': sc.BLANK_UUID, 'b': 'a', 'c': 'b'}
+        self.assertEqual(volumechain.walk(parents, 'b'), ['a', 'b'])
+
+    def test_ignore_other_volumes(self):
+        parents = {'a': sc.BLANK_UUID, 'b': 'a', 'c': 'a', 'd': 'x'}
+        self.assertEqual(volumechain.walk(parents, 'b'), ['a', 'b'])
+
+    def test_stop_at_template(self):
+        parents = {'a': 'template', 'b': 'a'}
+        chain = volumechain.walk(parents, 'b')
+        self.assertEqual(chain, ['a', 'b'])
+        self.assertEqual(parents[chain[0]], 'template')
+
+    def test_loop(self):
+        parents = {'a': 'c', 'b': 'a', 'c': 'b'}
+        with self.assertRaises(volumechain.ChainLoopError) as cm:
+            volumechain.walk(parents, 'c')
+        self.assertEqual(sorted(cm.exception.volumes_children),
+                         [('a', 'b'), ('b', 'c'), ('c', 'a')])
+
+    def test_self_parent(self):
+        parents = {'a': 'a'}
+        with self.assertRaises(volumechain.ChainLoopError):
+            volumechain.walk(parents, 'a')
@@ -0,0 +1,174 @@
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+
+import imp
+import logging.config
+import os
+from multiprocessing.managers import RemoteError
+
+from monkeypatch import MonkeyPatchScope
+from testlib import VdsmTestCase as TestCaseBase
+
+from vdsm import supervdsm
+
+SERVER_PATH = os.path.join(os.path.dirname(__file__), "..", "vdsm",
+                           "supervdsmServer")
+
+_server = None
+
+
+def load_server():
+    """
+    Import the supervdsmServer script, without configuring logging.
+    """
+    global _server
+    if _server is None:
+        with MonkeyPatchScope([
+            (logging.config, "fileConfig", lambda *a, **kw: None),
+        ]):
+            _server = imp.load_source("supervdsmServer", SERVER_PATH)
+    return _server
+
+
+class FakeSuperVdsm(object):
+
+    def __init__(self):
+        self.batches = []
+
+    def echo(self, value):
+        return value
+
+    def broken(self):
+        raise RemoteError("connection lost")
+
+    def batch(self, calls):
+        self.batches.append(calls)
+        return [(True, getattr(self, name)(*args, **kwargs), 0.5)
+                for name, args, kwargs in calls]
+
+
+class FakeProxy(supervdsm.SuperVdsmProxy):
+
+    def __init__(self):
+        self._stats = supervdsm._CallStats()
+        self.connects = 0
+        self._connect()
+
+    def _connect(self):
+        self.connects += 1
+        self._svdsm = FakeSuperVdsm()
+
+
+class SuperVdsmProxyTests(TestCaseBase):
+
+    def setUp(self):
+        self.proxy = FakeProxy()
+
+    def test_call(self):
+        self.assertEqual(self.proxy.echo("value"), "value")
+
+    def test_batch(self):
+        calls = [("echo", (1,), {}), ("echo", (), {"value": 2})]
+        self.assertEqual(self.proxy.batch(iter(calls)),
+                         [(True, 1), (True, 2)])
+        self.assertEqual(self.proxy._svdsm.batches, [calls])
+
+    def test_empty_batch(self):
+        self.assertEqual(self.proxy.batch([]), [])
+        self.assertEqual(self.proxy._svdsm.batches, [])
+
+    def test_broken_connection(self):
+        self.assertRaises(RuntimeError, self.proxy.broken)
+        self.assertEqual(self.proxy.connects, 2)
+
+    def test_stats(self):
+        self.proxy.echo(1)
+        self.proxy.echo(2)
+        self.proxy.batch([("echo", (3,), {})])
+        self.assertRaises(RuntimeError, self.proxy.broken)
+        stats = self.proxy.stats()
+        self.assertEqual(sorted(stats), ["batch", "broken", "echo"])
+        self.assertEqual(stats["echo"]["count"], 3)
+        self.assertEqual(stats["echo"]["max"], 0.5)
+        self.assertEqual(stats["batch"]["count"], 1)
+        self.assertEqual(stats["broken"]["count"], 1)
+        for name in stats:
+            self.assertTrue(
+                0 <= stats[name]["max"] <= stats[name]["total"])
+
+
+class SuperVdsmServerTests(TestCaseBase):
+
+    def setUp(self):
+        server = load_server()
+
+        class FakeSuperVdsm(server._SuperVdsm):
+
+            def __init__(self):
+                self.calls = []
+
+            def echo(self, value):
+                self.calls.append("echo")
+                return value
+
+            def fail(self):
+                self.calls.append("fail")
+                raise ValueError("failed")
+
+            def _private(self):
+                self.calls.append("_private")
+
+        self.svdsm = FakeSuperVdsm()
+
+    def test_batch(self):
+        results = self.svdsm.batch([("echo", (1,), {}),
+                                    ("echo", (), {"value": 2})])
+        self.assertEqual([(succeeded, value)
+                          for succeeded, value, _ in results],
+                         [(True, 1), (True, 2)])
+        for _, _, elapsed in results:
+            self.assertTrue(elapsed >= 0)
+
+    def test_exception_captured(self):
+        results = self.svdsm.batch([("fail", (), {}), ("echo", (1,), {})])
+        succeeded, value, _ = results[0]
+        self.assertFalse(succeeded)
+        self.assertIsInstance(value, ValueError)
+        self.assertEqual(results[1][:2], (True, 1))
+        self.assertEqual(self.svdsm.calls, ["fail", "echo"])
+
+    def test_missing_function(self):
+        succeeded, value, _ = self.svdsm.batch([("missing", (), {})])[0]
+        self.assertFalse(succeeded)
+        self.assertIsInstance(value, AttributeError)
+
+    def test_private_rejected(self):
+        succeeded, value, _ = self.svdsm.batch([("_private", (), {})])[0]
+        self.assertFalse(succeeded)
+        self.assertIsInstance(value, AttributeError)
+        self.assertEqual(self.svdsm.calls, [])
+
+    def test_nested_batch_rejected(self):
+        calls = [("echo", (1,), {})]
+        succeeded, value, _ = self.svdsm.batch([("batch", (calls,), {})])[0]
+        self.assertFalse(succeeded)
+        self.assertIsInstance(value, AttributeError)
+        self.assertEqual(self.svdsm.calls, [])
@@ -18,9 +18,9 @@
 #
 
 from testlib import VdsmTestCase as TestCaseBase
-from vdsm.tool.dump_volume_chains import (_build_volume_chain, _BLANK_UUID,
-                                          OrphanVolumes, ChainLoopError,
-                                          NoBaseVolume, DuplicateParentError)
+from vdsm.storage.volumechain import (OrphanVolumes, ChainLoopError,
+                                      NoBaseVolume, DuplicateParentError)
+from vdsm.tool.dump_volume_chains import _build_volume_chain, _BLANK_UUID
 
 
 class GetVolumeChainTests(TestCaseBase):
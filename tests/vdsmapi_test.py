@@ -18,11 +18,22 @@
 # Refer to the README and COPYING files for full details of the license
 #
 from __future__ import absolute_import
+from __future__ import print_function
 
+import os
+import shutil
+import sys
+import time
+
+from api import schemacache
 from api import vdsmapi
 from yajsonrpc import JsonRpcError
 
+from monkeypatch import MonkeyPatchScope
 from testlib import VdsmTestCase as TestCaseBase
+from testlib import namedTemporaryDir
+from testValidation import ValidateNotRunningAsRoot
+from testValidation import stresstest
 
 try:
     import gluster.apiwrapper as gapi
@@ -445,6 +456,38 @@ class DataVerificationTests(TestCaseBase):
         _schema.schema().verify_retval(
             vdsmapi.MethodRep('Host', 'getAllVmStats'), ret)
 
+    def test_allvmstats_delta(self):
+        ret = {'generation': 1476648212000,
+               'full': False,
+               'statsList': [
+                   # Changed keys of a running vm; removed keys are null
+                   {'vmId': u'f1eb5cc5-d793-46c6-b1e3-719345bfec0c',
+                    'cpuSys': '0.12',
+                    'elapsedTime': '2551',
+                    'memoryStats': None},
+                   # Changed keys of a vm that exited
+                   {'vmId': u'5e8bbcbd-a3c5-4b2b-9b36-7bd3e5e4b3e4',
+                    'status': 'Down',
+                    'exitMessage': 'Lost connection with qemu process'},
+                   # Unchanged vm reported after changes were reverted
+                   {'vmId': u'8c4c0e5c-1f3a-4de7-9d0c-0a36d4f7e1c2'}],
+               'removed': [u'0d9e4e06-3b0f-4ab4-8b21-1e0b2bd8fb5c']}
+
+        _schema.schema().verify_retval(
+            vdsmapi.MethodRep('Host', 'getAllVmStatsDelta'), ret)
+
+    def test_allvmstats_delta_bad_type(self):
+        ret = {'generation': 1476648212000,
+               'full': False,
+               'statsList': [
+                   {'vmId': u'f1eb5cc5-d793-46c6-b1e3-719345bfec0c',
+                    'status': 'Unknown status'}],
+               'removed': []}
+
+        with self.assertRaises(JsonRpcError):
+            _schema.schema().verify_retval(
+                vdsmapi.MethodRep('Host', 'getAllVmStatsDelta'), ret)
+
     def test_missing_method(self):
         with self.assertRaises(vdsmapi.MethodNotFound):
             _schema.schema().get_method(
@@ -479,3 +522,128 @@ class DataVerificationTests(TestCaseBase):
         sub_id = '|virt|VM_status|426aef82-ea1d-4442-91d3-fd876540e0f0'
 
         _events_schema.events_schema().verify_event_params(sub_id, params)
+
+    def test_compiled_once(self):
+        schema = _schema.schema()
+        rep = vdsmapi.MethodRep('Host', 'fenceNode')
+        params = {u"addr": u"rack05-pdu01-lab4.tlv.redhat.com", u"port": 54321,
+                  u"agent": u"apc_snmp", u"username": u"emesika",
+                  u"password": u"pass", u"action": u"off",
+                  u"options": u"port=15"}
+        schema.verify_args(rep, params)
+        verify = schema._args_validators[rep.id]
+        schema.verify_args(rep, params)
+        self.assertIs(schema._args_validators[rep.id], verify)
+
+
+def _fail_yaml_load(data):
+    raise AssertionError("yaml.load called")
+
+
+class SchemaCacheTests(TestCaseBase):
+
+    def test_create(self):
+        with namedTemporaryDir() as tmpdir:
+            path = _copy_schema('vdsm-events', tmpdir)
+            expected = schemacache.load(path)
+            self.assertTrue(os.path.exists(schemacache.cache_path(path)))
+            with MonkeyPatchScope([(schemacache.yaml, 'load',
+                                    _fail_yaml_load)]):
+                self.assertEqual(schemacache.load(path), expected)
+
+    def test_stale(self):
+        with namedTemporaryDir() as tmpdir:
+            path = _copy_schema('vdsm-events', tmpdir)
+            schemacache.load(path)
+            with open(path, 'a') as f:
+                f.write('\nAdded.event: {}\n')
+            self.assertIn('Added.event', schemacache.load(path))
+
+    def test_invalid(self):
+        with namedTemporaryDir() as tmpdir:
+            path = _copy_schema('vdsm-events', tmpdir)
+            with open(schemacache.cache_path(path), 'w') as f:
+                f.write('invalid')
+            self.assertIn('types', schemacache.load(path))
+
+    @ValidateNotRunningAsRoot
+    def test_read_only(self):
+        with namedTemporaryDir() as tmpdir:
+            path = _copy_schema('vdsm-events', tmpdir)
+            os.chmod(tmpdir, 0o555)
+            try:
+                self.assertIn('types', schemacache.load(path))
+            finally:
+                os.chmod(tmpdir, 0o755)
+            self.assertFalse(os.path.exists(schemacache.cache_path(path)))
+
+    def test_cache_path(self):
+        # python 2 and python 3 must not share the cache file.
+        path = '/schema/vdsm-api.yml'
+        self.assertEqual(schemacache.cache_path(path),
+                         '/schema/vdsm-api.py%d.pickle' % sys.version_info[0])
+
+    def test_compile(self):
+        with namedTemporaryDir() as tmpdir:
+            path = _copy_schema('vdsm-events', tmpdir)
+            schemacache.compile(path, schemacache.cache_path(path))
+            with MonkeyPatchScope([(schemacache.yaml, 'load',
+                                    _fail_yaml_load)]):
+                self.assertIn('types', schemacache.load(path))
+
+
+def _copy_schema(name, dirname):
+    path = os.path.join(dirname, name + '.yml')
+    shutil.copyfile(vdsmapi.find_schema(name), path)
+    return path
+
+
+class SchemaBenchmark(TestCaseBase):
+
+    @stresstest
+    def test_load(self):
+        with namedTemporaryDir() as tmpdir:
+            paths = [_copy_schema('vdsm-api', tmpdir),
+                     _copy_schema('vdsm-api-gluster', tmpdir)]
+            start = time.time()
+            vdsmapi.Schema(paths, True)
+            parse = time.time() - start
+            start = time.time()
+            vdsmapi.Schema(paths, True)
+            cached = time.time() - start
+        print("load schema: yaml %.3f seconds, cache %.3f seconds" %
+              (parse, cached))
+
+    @stresstest
+    def test_verify(self):
+        schema = _events_schema.events_schema()
+        sub_id = '|virt|VM_status|426aef82-ea1d-4442-91d3-fd876540e0f0'
+        params = {u"notify_time": 4303947020}
+        for i in range(100):
+            params[u"426aef82-ea1d-4442-91d3-%012d" % i] = {
+                u"status": u"Up",
+                u"displayInfo": [{u"tlsPort": u"5901",
+                                  u"ipAddress": u"0",
+                                  u"type": u"spice",
+                                  u"port": u"5900"}],
+                u"hash": u"880508647164395013",
+                u"cpuUser": u"0.00",
+                u"displayIp": u"0",
+                u"monitorResponse": u"0",
+                u"elapsedTime": u"110",
+                u"displayType": u"qxl",
+                u"cpuSys": u"0.00",
+                u"pauseCode": u"NOERR",
+                u"displayPort": u"5900",
+                u"displaySecurePort": u"5901",
+                u"timeOffset": u"0",
+                u"clientIp": u"",
+                u"vcpuQuota": u"-1",
+                u"vcpuPeriod": 100000}
+        calls = 100
+        start = time.time()
+        for i in range(calls):
+            schema.verify_event_params(sub_id, params)
+        elapsed = time.time() - start
+        print("verify VM_status event (100 vms): %.3f msec per call" %
+              (elapsed / calls * 1000))
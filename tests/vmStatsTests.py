@@ -538,8 +538,95 @@ class CpuStatsTests(VmStatsTestCase):
         self.assertNotEquals(res, None)
 
 
+@expandPermutations
+class DeltaTrackerTests(TestCaseBase):
+
+    def setUp(self):
+        self.tracker = vmstats.DeltaTracker(removed_history=2,
+                                            clock=lambda: 1.0)
+        self.stats = [
+            {'vmId': 'a', 'status': 'Up', 'elapsedTime': '10'},
+            {'vmId': 'b', 'status': 'Up', 'elapsedTime': '20'},
+        ]
+
+    def test_initial_full(self):
+        generation, full, changed, removed = self.tracker.delta(self.stats)
+        self.assertTrue(full)
+        self.assertEqual(_sorted_by_id(changed), self.stats)
+        self.assertEqual(removed, [])
+
+    def test_no_changes(self):
+        generation, _, _, _ = self.tracker.delta(self.stats)
+        new_generation, full, changed, removed = self.tracker.delta(
+            copy.deepcopy(self.stats), generation)
+        self.assertEqual(new_generation, generation)
+        self.assertFalse(full)
+        self.assertEqual(changed, [])
+        self.assertEqual(removed, [])
+
+    def test_changed_keys_only(self):
+        generation, _, _, _ = self.tracker.delta(self.stats)
+        stats = copy.deepcopy(self.stats)
+        stats[1]['elapsedTime'] = '35'
+        new_generation, full, changed, removed = self.tracker.delta(
+            stats, generation)
+        self.assertGreater(new_generation, generation)
+        self.assertFalse(full)
+        self.assertEqual(changed, [{'vmId': 'b', 'elapsedTime': '35'}])
+
+    def test_accumulated_changes(self):
+        gen0, _, _, _ = self.tracker.delta(self.stats)
+        stats = copy.deepcopy(self.stats)
+        stats[0]['status'] = 'Paused'
+        self.tracker.delta(stats, gen0)
+        stats = copy.deepcopy(stats)
+        stats[1]['status'] = 'Paused'
+        gen2, _, changed, _ = self.tracker.delta(stats, gen0)
+        self.assertEqual(_sorted_by_id(changed), [
+            {'vmId': 'a', 'status': 'Paused'},
+            {'vmId': 'b', 'status': 'Paused'},
+        ])
+        _, _, changed, _ = self.tracker.delta(stats, gen2)
+        self.assertEqual(changed, [])
+
+    def test_removed_key(self):
+        generation, _, _, _ = self.tracker.delta(self.stats)
+        stats = copy.deepcopy(self.stats)
+        del stats[0]['elapsedTime']
+        _, _, changed, _ = self.tracker.delta(stats, generation)
+        self.assertEqual(changed, [{'vmId': 'a', 'elapsedTime': None}])
+
+    def test_added_and_removed_vms(self):
+        generation, _, _, _ = self.tracker.delta(self.stats)
+        stats = [self.stats[0], {'vmId': 'c', 'status': 'Up'}]
+        _, full, changed, removed = self.tracker.delta(stats, generation)
+        self.assertFalse(full)
+        self.assertEqual(changed, [{'vmId': 'c', 'status': 'Up'}])
+        self.assertEqual(removed, ['b'])
+
+    def test_too_old_generation(self):
+        generation, _, _, _ = self.tracker.delta(self.stats)
+        # Remove more VMs than the tracker remembers
+        for vm_id in ('c', 'd', 'e'):
+            self.tracker.delta(self.stats + [{'vmId': vm_id}])
+            self.tracker.delta(self.stats)
+        _, full, changed, removed = self.tracker.delta(self.stats,
+                                                       generation)
+        self.assertTrue(full)
+        self.assertEqual(_sorted_by_id(changed), self.stats)
+
+    @permutations([[0], [10 ** 20]])
+    def test_unknown_generation(self, since):
+        _, full, _, _ = self.tracker.delta(self.stats, since)
+        self.assertTrue(full)
+
+
 # helpers
 
+def _sorted_by_id(stats_list):
+    return sorted(stats_list, key=lambda stats: stats['vmId'])
+
+
 def _ensure_delta(stats_before, stats_after, key, delta):
     """
     Set stats_before[key] and stats_after[key] so that
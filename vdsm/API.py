@@ -1395,6 +1395,22 @@ class Global(APIBase):
                           AllVmStatsValue(statsList))
         return {'status': doneCode, 'statsList': Suppressed(statsList)}
 
+    def getAllVmStatsDelta(self, sinceGeneration=None):
+        """
+        Get the statistics of all running VMs which changed since
+        the given generation.
+        """
+        hooks.before_get_all_vm_stats()
+        statsList = self._cif.getAllVmStats()
+        statsList = hooks.after_get_all_vm_stats(statsList)
+        generation, full, changed, removed = \
+            self._cif.vmStatsTracker.delta(statsList, sinceGeneration)
+        return {'status': doneCode,
+                'generation': generation,
+                'full': full,
+                'statsList': changed,
+                'removed': removed}
+
     def hostdevListByCaps(self, caps=None):
         devices = hostdev.list_by_caps(caps)
         return {'status': doneCode, 'deviceList': devices}
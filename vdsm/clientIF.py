@@ -38,6 +38,7 @@ from vdsm.protocoldetector import MultiProtocolAcceptor
 from vdsm.momIF import MomClient
 from vdsm.sslcompat import sslutils
 from vdsm.virt import secret
+from vdsm.virt import vmstats
 from vdsm.virt import vmstatus
 from vdsm.virt.vmchannels import Listener
 from vdsm.virt.utils import isVdsmImage
@@ -99,6 +100,7 @@ class clientIF(object):
             self.gluster = None
         try:
             self.vmContainer = {}
+            self.vmStatsTracker = vmstats.DeltaTracker()
             self.lastRemoteAccess = 0
             self._enabled = True
             self._netConfigDirty = False
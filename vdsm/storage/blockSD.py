@@ -25,7 +25,6 @@ import signal
 import errno
 import re
 from StringIO import StringIO
-import time
 import functools
 from collections import namedtuple
 from contextlib import contextmanager
@@ -430,6 +429,37 @@ class BlockStorageDomainManifest(sd.StorageDomainManifest):
 
     getVAllocSize = getVSize
 
+    def getVSizes(self, volumes):
+        """
+        Return a dict mapping volUUID to a tuple (apparentsize, truesize) in
+        bytes, for each (imgUUID, volUUID) tuple in volumes. Volumes whose
+        size cannot be read are missing.
+
+        The LVs of the domain are listed once, only if some volumes are not
+        active.
+        """
+        sizes = {}
+        lvs = None
+        for imgUUID, volUUID in volumes:
+            try:
+                size = _tellEnd(lvm.lvPath(self.sdUUID, volUUID))
+            except IOError as e:
+                if e.errno != os.errno.ENOENT:
+                    self.log.warn("Could not get size for vol %s/%s",
+                                  self.sdUUID, volUUID, exc_info=True)
+                    continue
+                # Inactive volume has no /dev entry. Fallback to lvm way.
+                if lvs is None:
+                    lvs = dict((lv.name, lv)
+                               for lv in lvm.getLV(self.sdUUID))
+                if volUUID not in lvs:
+                    self.log.warn("Could not find vol %s/%s",
+                                  self.sdUUID, volUUID)
+                    continue
+                size = lvs[volUUID].size
+            sizes[volUUID] = (int(size), int(size))
+        return sizes
+
     def getLeasesFilePath(self):
         # TODO: Determine the path without activating the LV
         lvm.activateLVs(self.sdUUID, [sd.LEASES])
@@ -815,7 +845,6 @@ class BlockStorageDomain(sd.StorageDomain):
 
         self.imageGarbageCollector()
         self._registerResourceNamespaces()
-        self._lastUncachedSelftest = 0
 
     @property
     def logBlkSize(self):
@@ -1001,13 +1030,16 @@ class BlockStorageDomain(sd.StorageDomain):
     def selftest(self):
         """
         Run the underlying VG validation routine
+
+        The domain monitor checks the VGs of all block domains using one vgck
+        command, so the VG is checked here only if it was not checked
+        recently.
         """
 
         timeout = config.getint("irs", "repo_stats_cache_refresh_timeout")
-        now = time.time()
+        lastCheck = lvm.lastVGCheck(self.sdUUID)
 
-        if now - self._lastUncachedSelftest > timeout:
-            self._lastUncachedSelftest = now
+        if lastCheck is None or utils.monotonic_time() - lastCheck > timeout:
             lvm.chkVG(self.sdUUID)
         elif lvm.getVG(self.sdUUID).partial != lvm.VG_OK:
             raise se.StorageDomainAccessError(self.sdUUID)
@@ -328,6 +328,32 @@ class BlockVolumeManifest(volume.VolumeManifest):
         lvs = lvm.lvsByTag(sdUUID, "%s%s" % (sc.TAG_PREFIX_IMAGE, imgUUID))
         return [lv.name for lv in lvs]
 
+    @classmethod
+    def getImageVolumesMetadata(cls, repoPath, sdUUID, imgUUID):
+        """
+        Return a dict mapping the UUIDs of the image volumes, not including
+        the shared base (template), to their metadata. The metadata of all
+        the volumes is read at once from the domain metadata LV.
+        """
+        slots = {}
+        for volUUID in cls.getImageVolumes(repoPath, sdUUID, imgUUID):
+            try:
+                md = getVolumeTag(sdUUID, volUUID, sc.TAG_PREFIX_MD)
+            except se.MissingTagOnLogicalVolume:
+                log.error("missing offset tag on volume %s/%s",
+                          sdUUID, volUUID, exc_info=True)
+                raise se.VolumeMetadataReadError(
+                    "missing offset tag on volume %s/%s" %
+                    (sdUUID, volUUID))
+            slots[volUUID] = int(md)
+
+        if not slots:
+            return {}
+
+        metadata = getMetadataSlots(sdUUID, slots.values())
+        return dict((volUUID, metadata[slot])
+                    for volUUID, slot in slots.iteritems())
+
     @classmethod
     def calculate_volume_alloc_size(cls, preallocate, capacity, initial_size):
         """ Calculate the allocation size in mb of the volume
@@ -744,3 +770,23 @@ def getVolumeTag(sdUUID, volUUID, tagPrefix):
         log.error("Missing tag %s in volume: %s/%s. tags: %s",
                   tagPrefix, sdUUID, volUUID, tags)
         raise se.MissingTagOnLogicalVolume(volUUID, tagPrefix)
+
+
+def getMetadataSlots(sdUUID, slots):
+    """
+    Read the metadata of the volumes using slots in domain sdUUID metadata
+    LV, using few large reads instead of one read per volume.
+
+    Returns a dict mapping slot to the volume metadata, as returned by
+    BlockVolumeManifest.getMetadata().
+    """
+    offsets = [slot * sc.METADATA_SIZE for slot in slots]
+    try:
+        blocks = misc.readblocks(lvm.lvPath(sdUUID, sd.METADATA), offsets,
+                                 sc.METADATA_SIZE)
+    except Exception as e:
+        log.error(e, exc_info=True)
+        raise se.VolumeMetadataReadError("%s: %s" % (sdUUID, e))
+
+    return {slot: VolumeMetadata.from_lines(lines).legacy_info()
+            for slot, lines in zip(slots, blocks)}
@@ -36,6 +36,7 @@ import sd
 import sdm.volume_artifacts
 import fileVolume
 import outOfProcess as oop
+from vdsm import concurrent
 from vdsm import constants
 from vdsm.utils import stripNewLines
 from vdsm.storage.constants import LEASE_FILEEXT
@@ -187,6 +188,33 @@ class FileStorageDomainManifest(sd.StorageDomainManifest):
 
         return stat.st_blocks * ST_BYTES_PER_BLOCK
 
+    def getVSizes(self, volumes):
+        """
+        Return a dict mapping volUUID to a tuple (apparentsize, truesize) in
+        bytes, for each (imgUUID, volUUID) tuple in volumes. Volumes whose
+        size cannot be read are missing.
+
+        Each volume is stat()ed once, and the volumes are stat()ed
+        concurrently, up to the number of ioprocess slots of the domain.
+        """
+        def stat(volume):
+            imgUUID, volUUID = volume
+            volPath = os.path.join(self.mountpoint, self.sdUUID, 'images',
+                                   imgUUID, volUUID)
+            return self.oop.os.stat(volPath)
+
+        results = concurrent.tmap(stat, volumes,
+                                  max_threads=oop.HELPERS_PER_DOMAIN)
+        sizes = {}
+        for (imgUUID, volUUID), result in zip(volumes, results):
+            if not result.succeeded:
+                self.log.warning("Could not get size for vol %s/%s: %s",
+                                 self.sdUUID, volUUID, result.value)
+                continue
+            st = result.value
+            sizes[volUUID] = (st.st_size, st.st_blocks * ST_BYTES_PER_BLOCK)
+        return sizes
+
     def getLeasesFilePath(self):
         return os.path.join(self.getMDPath(), sd.LEASES)
 
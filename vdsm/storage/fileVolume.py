@@ -22,6 +22,7 @@ import errno
 import os
 import sanlock
 
+from vdsm import concurrent
 from vdsm import exception
 from vdsm import qemuimg
 from vdsm.commands import grepCmd
@@ -314,18 +315,37 @@ class FileVolumeManifest(volume.VolumeManifest):
         Fetch the list of the Volumes UUIDs,
         not including the shared base (template)
         """
-        # Get Volumes of an image
+        return cls.getImageVolumesMetadata(repoPath, sdUUID, imgUUID).keys()
+
+    @classmethod
+    def getImageVolumesMetadata(cls, repoPath, sdUUID, imgUUID):
+        """
+        Return a dict mapping the UUIDs of the image volumes, not including
+        the shared base (template), to their metadata. The metadata files
+        are read in parallel, using at most one thread per ioprocess helper
+        of the domain.
+        """
         pattern = os.path.join(repoPath, sdUUID, sd.DOMAIN_IMAGES,
-                               imgUUID, "*.meta")
-        files = oop.getProcessPool(sdUUID).glob.glob(pattern)
-        volList = []
-        for i in files:
-            volid = os.path.splitext(os.path.basename(i))[0]
-            if (sdCache.produce(sdUUID).
-                    produceVolume(imgUUID, volid).
-                    getImage() == imgUUID):
-                volList.append(volid)
-        return volList
+                               imgUUID, "*" + META_FILEEXT)
+        procPool = oop.getProcessPool(sdUUID)
+        metaPaths = procPool.glob.glob(pattern)
+        results = concurrent.tmap(procPool.directReadLines, metaPaths,
+                                  max_threads=oop.HELPERS_PER_DOMAIN)
+
+        metadata = {}
+        for metaPath, res in zip(metaPaths, results):
+            if not res.succeeded:
+                cls.log.error("Cannot read metadata %s: %s", metaPath,
+                              res.value)
+                raise se.VolumeMetadataReadError("%s: %s" %
+                                                 (metaPath, res.value))
+            md = VolumeMetadata.from_lines(res.value).legacy_info()
+            # A template volume is linked into the images based on it, but
+            # its metadata belongs to the template image.
+            if md[sc.IMAGE] == imgUUID:
+                volUUID = os.path.splitext(os.path.basename(metaPath))[0]
+                metadata[volUUID] = md
+        return metadata
 
     def llPrepare(self, rw=False, setrw=False):
         """
@@ -2390,43 +2390,75 @@ class HSM(object):
                 "domType=%s, spUUID=%s, conList=%s" %
                 (domType, spUUID, conList)))
 
-        res = []
+        connections = []
         for conDef in conList:
             conInfo = _connectionDict2ConnectionInfo(domType, conDef)
             conObj = storageServer.ConnectionFactory.createConnection(conInfo)
+            connections.append((conDef, conObj))
+
+        def connect(connection):
+            conDef, conObj = connection
             try:
                 self._connectStorageOverIser(conDef, conObj, domType)
                 conObj.connect()
-            except Exception as err:
+            except Exception:
                 self.log.error(
                     "Could not connect to storageServer", exc_info=True)
-                status, _ = self._translateConnectionError(err)
-            else:
-                status = 0
-                # In case there were changes in devices size
-                # while the VDSM was not connected, we need to
-                # call refreshStorage.
-                if domType in (sd.FCP_DOMAIN, sd.ISCSI_DOMAIN):
-                    sdCache.refreshStorage()
-                try:
-                    doms = self.__prefetchDomains(domType, conObj)
-                except:
-                    self.log.debug("prefetch failed: %s",
-                                   sdCache.knownSDs, exc_info=True)
-                else:
-                    # Any pre-existing domains in sdCache stand the chance of
-                    # being invalid, since there is no way to know what happens
-                    # to them while the storage is disconnected.
-                    for sdUUID in doms.iterkeys():
-                        sdCache.manuallyRemoveDomain(sdUUID)
-                    sdCache.knownSDs.update(doms)
+                raise
 
-            self.log.debug("knownSDs: {%s}", ", ".join("%s: %s.%s" %
-                           (k, v.__module__, v.__name__)
-                           for k, v in sdCache.knownSDs.iteritems()))
+        start = utils.monotonic_time()
+        results = concurrent.tmap(
+            connect, connections,
+            max_threads=config.getint('irs', 'connect_storage_server_workers'))
+        connected = utils.monotonic_time()
 
+        res = []
+        succeeded = []
+        for (conDef, conObj), result in zip(connections, results):
+            if result.succeeded:
+                status = 0
+                succeeded.append(conObj)
+            else:
+                status, _ = self._translateConnectionError(result.value)
             res.append({'id': conDef["id"], 'status': status})
 
+        # In case there were changes in devices size while the VDSM was not
+        # connected, we need to call refreshStorage. One refresh finds the
+        # devices of all the connections.
+        if succeeded and domType in (sd.FCP_DOMAIN, sd.ISCSI_DOMAIN):
+            sdCache.refreshStorage()
+        refreshed = utils.monotonic_time()
+
+        # Block domains are found on all the devices, not per connection.
+        prefetch = succeeded
+        if domType in (sd.FCP_DOMAIN, sd.ISCSI_DOMAIN):
+            prefetch = succeeded[:1]
+        for conObj in prefetch:
+            try:
+                doms = self.__prefetchDomains(domType, conObj)
+            except:
+                self.log.debug("prefetch failed: %s",
+                               sdCache.knownSDs, exc_info=True)
+            else:
+                # Any pre-existing domains in sdCache stand the chance of
+                # being invalid, since there is no way to know what happens
+                # to them while the storage is disconnected.
+                for sdUUID in doms.iterkeys():
+                    sdCache.manuallyRemoveDomain(sdUUID)
+                sdCache.knownSDs.update(doms)
+        prefetched = utils.monotonic_time()
+
+        self.log.debug("knownSDs: {%s}", ", ".join("%s: %s.%s" %
+                       (k, v.__module__, v.__name__)
+                       for k, v in sdCache.knownSDs.iteritems()))
+
+        self.log.info("Connected %d of %d connections in %.2f seconds, "
+                      "refreshed storage in %.2f seconds, prefetched "
+                      "domains in %.2f seconds",
+                      len(succeeded), len(connections),
+                      connected - start, refreshed - connected,
+                      prefetched - refreshed)
+
         # Connecting new device may change the visible storage domain list
         # so invalidate caches
         sdCache.invalidateStorage()
@@ -3021,6 +3053,47 @@ class HSM(object):
         truesize = str(dom.getVAllocSize(imgUUID, volUUID))
         return dict(apparentsize=apparentsize, truesize=truesize)
 
+    @public
+    def getVolumesSize(self, volumes, options=None):
+        """
+        Gets the size of many volumes, reading the sizes of all the volumes
+        of a storage domain at once. The storage domains are accessed
+        concurrently.
+
+        :param volumes: The volumes you want to know the size of.
+        :type volumes: list of (sdUUID, imgUUID, volUUID) tuples
+        :param options: ?
+
+        :returns: a dict with "sizes", a dict mapping sdUUID to a dict
+                  mapping volUUID to a dict with the size of the volume,
+                  as returned by getVolumeSize. Volumes whose size cannot
+                  be read are missing.
+        :rtype: dict
+        """
+        domains = defaultdict(list)
+        for sdUUID, imgUUID, volUUID in volumes:
+            domains[sdUUID].append((imgUUID, volUUID))
+
+        def getDomainSizes(sdUUID):
+            dom = sdCache.produce(sdUUID=sdUUID)
+            return dom.getVSizes(domains[sdUUID])
+
+        uuids = domains.keys()
+        sizes = {}
+        for sdUUID, result in zip(uuids,
+                                  concurrent.tmap(getDomainSizes, uuids)):
+            if not result.succeeded:
+                self.log.warning("Could not get volumes size in domain %s: "
+                                 "%s", sdUUID, result.value)
+                continue
+            # Return string because xmlrpc's "int" is very limited
+            sizes[sdUUID] = dict(
+                (volUUID, dict(apparentsize=str(apparentsize),
+                               truesize=str(truesize)))
+                for volUUID, (apparentsize, truesize)
+                in result.value.iteritems())
+        return dict(sizes=sizes)
+
     @public
     def setVolumeSize(self, sdUUID, spUUID, imgUUID, volUUID, capacity):
         capacity = int(capacity)
@@ -3429,7 +3502,8 @@ class HSM(object):
                     'version': domStatus.version,
                     # domStatus.hasHostId can also be None
                     'acquired': domStatus.hasHostId is True,
-                    'actual': domStatus.actual
+                    'actual': domStatus.actual,
+                    'checkLatency': domStatus.checkLatency,
                 },
 
                 'disktotal': disktotal,
@@ -32,6 +32,7 @@ from vdsm.storage import constants as sc
 from vdsm.storage import exception as se
 from vdsm.storage import fileUtils
 from vdsm.storage import misc
+from vdsm.storage import volumechain
 from vdsm.storage.threadlocal import vars
 
 from sdc import sdCache
@@ -184,70 +185,110 @@ class Image:
         newsize = int(newsize * 1.1)    # allocate %10 more for cow metadata
         return newsize
 
+    def getVolumesMetadata(self, sdUUID, imgUUID):
+        """
+        Return a dict mapping the UUIDs of the image volumes, not including
+        a shared base (template), to their metadata. The metadata of all the
+        volumes is read in one pass.
+        """
+        volclass = sdCache.produce(sdUUID).getVolumeClass()
+        return volclass.getImageVolumesMetadata(self.repoPath, sdUUID,
+                                                imgUUID)
+
+    def getVolumes(self, sdUUID, imgUUID):
+        """
+        Return the UUIDs of all the volumes of image, including a shared
+        base (template) if any.
+        """
+        vols = self.getVolumesMetadata(sdUUID, imgUUID)
+        return self._addTemplate(sdUUID, imgUUID, vols)
+
+    def _addTemplate(self, sdUUID, imgUUID, vols):
+        volUUIDs = vols.keys()
+        externalParents = set(md[sc.PUUID] for md in vols.itervalues())
+        externalParents.difference_update(vols)
+        externalParents.discard(sc.BLANK_UUID)
+        for parentUUID in externalParents:
+            if self._isTemplate(sdUUID, imgUUID, parentUUID):
+                volUUIDs.append(parentUUID)
+        return volUUIDs
+
+    def _isTemplate(self, sdUUID, imgUUID, volUUID):
+        volclass = sdCache.produce(sdUUID).getVolumeClass()
+        try:
+            vol = volclass(self.repoPath, sdUUID, imgUUID, volUUID)
+        except se.VolumeDoesNotExist:
+            return False
+        return vol.isShared()
+
     def getChain(self, sdUUID, imgUUID, volUUID=None):
         """
         Return the chain of volumes of image as a sorted list
         (not including a shared base (template) if any)
         """
-        chain = []
         volclass = sdCache.produce(sdUUID).getVolumeClass()
+        vols = self.getVolumesMetadata(sdUUID, imgUUID)
 
         # Use volUUID when provided
         if volUUID:
-            srcVol = volclass(self.repoPath, sdUUID, imgUUID, volUUID)
+            if volUUID not in vols:
+                # A template volume linked into this image
+                srcVol = volclass(self.repoPath, sdUUID, imgUUID, volUUID)
+                if srcVol.isShared():
+                    return [srcVol]
+                self.log.error("Volume %s is not part of image %s",
+                               volUUID, imgUUID)
+                raise se.ImageIsNotLegalChain(imgUUID)
 
             # For template images include only one volume (the template itself)
             # NOTE: this relies on the fact that in a template there is only
             #       one volume
-            if srcVol.isShared():
-                return [srcVol]
+            if vols[volUUID][sc.VOLTYPE] == sc.type2name(sc.SHARED_VOL):
+                return [volclass(self.repoPath, sdUUID, imgUUID, volUUID)]
+
+            leafUUID = volUUID
 
         # Find all the volumes when volUUID is not provided
         else:
-            # Find all volumes of image
-            uuidlist = volclass.getImageVolumes(self.repoPath, sdUUID, imgUUID)
-
-            if not uuidlist:
+            if not vols:
                 raise se.ImageDoesNotExistInSD(imgUUID, sdUUID)
 
-            srcVol = volclass(self.repoPath, sdUUID, imgUUID, uuidlist[0])
-
             # For template images include only one volume (the template itself)
-            if len(uuidlist) == 1 and srcVol.isShared():
-                return [srcVol]
+            if len(vols) == 1:
+                volUUID, md = vols.items()[0]
+                if md[sc.VOLTYPE] == sc.type2name(sc.SHARED_VOL):
+                    return [volclass(self.repoPath, sdUUID, imgUUID, volUUID)]
 
             # Searching for the leaf
-            for vol in uuidlist:
-                srcVol = volclass(self.repoPath, sdUUID, imgUUID, vol)
-
-                if srcVol.isLeaf():
+            for leafUUID, md in vols.iteritems():
+                if md[sc.VOLTYPE] == sc.type2name(sc.LEAF_VOL):
                     break
-
-                srcVol = None
-
-            if not srcVol:
+            else:
                 self.log.error("There is no leaf in the image %s", imgUUID)
                 raise se.ImageIsNotLegalChain(imgUUID)
 
-        # We have seen corrupted chains that cause endless loops here.
-        # https://bugzilla.redhat.com/1125197
-        seen = set()
-
-        # Build up the sorted parent -> child chain
-        while not srcVol.isShared():
-            chain.insert(0, srcVol)
-            seen.add(srcVol.volUUID)
-
-            parentUUID = srcVol.getParent()
-            if parentUUID == sc.BLANK_UUID:
-                break
+        # Build up the sorted parent -> child chain, stopping at a shared base
+        # (template), which is not part of the image volumes.
+        parents = dict((uuid, md[sc.PUUID]) for uuid, md in vols.iteritems()
+                       if md[sc.VOLTYPE] != sc.type2name(sc.SHARED_VOL))
+        try:
+            uuids = volumechain.walk(parents, leafUUID)
+        except volumechain.ChainLoopError:
+            # We have seen corrupted chains that cause endless loops here.
+            # https://bugzilla.redhat.com/1125197
+            self.log.error("Image %s has a loop in its volume chain: %s",
+                           imgUUID, parents)
+            raise se.ImageIsNotLegalChain(imgUUID)
 
-            if parentUUID in seen:
-                self.log.error("Image %s volume %s has invalid parent UUID %s",
-                               imgUUID, srcVol.volUUID, parentUUID)
-                raise se.ImageIsNotLegalChain(imgUUID)
+        parentUUID = parents[uuids[0]]
+        if (parentUUID != sc.BLANK_UUID and parentUUID not in vols and
+                not self._isTemplate(sdUUID, imgUUID, parentUUID)):
+            self.log.error("Image %s volume %s has invalid parent UUID %s",
+                           imgUUID, uuids[0], parentUUID)
+            raise se.ImageIsNotLegalChain(imgUUID)
 
-            srcVol = srcVol.getParentVolume()
+        chain = [volclass(self.repoPath, sdUUID, imgUUID, uuid)
+                 for uuid in uuids]
 
         self.log.info("sdUUID=%s imgUUID=%s chain=%s ", sdUUID, imgUUID, chain)
         return chain
@@ -1222,8 +1263,8 @@ class Image:
         """
         # Prepare volumes
         dom = sdCache.produce(sdUUID)
-        allVols = dom.getAllVolumes()
-        imgVolumes = sd.getVolsOfImage(allVols, imgUUID).keys()
+        vols = self.getVolumesMetadata(sdUUID, imgUUID)
+        imgVolumes = self._addTemplate(sdUUID, imgUUID, vols)
         dom.activateVolumes(imgUUID, imgVolumes)
 
         # Walk the volume chain using qemu-img.  Not safe for running VMs
@@ -1232,7 +1273,11 @@ class Image:
         while volUUID is not None:
             actualVolumes.insert(0, volUUID)
             vol = dom.produceVolume(imgUUID, volUUID)
-            qemuImgFormat = sc.fmt2str(vol.getFormat())
+            if volUUID in vols:
+                volFormat = sc.name2type(vols[volUUID][sc.FORMAT])
+            else:
+                volFormat = vol.getFormat()
+            qemuImgFormat = sc.fmt2str(volFormat)
             imgInfo = qemuimg.info(vol.volumePath, qemuImgFormat)
             backingFile = imgInfo.get('backingfile')
             if backingFile is not None:
@@ -1247,8 +1292,7 @@ class Image:
         # old leaf to the new leaf and mirroring to the old leaf ceases. During
         # mirroring and before pivoting, we mark the old leaf ILLEGAL so we
         # know it's safe to delete in case the operation is interrupted.
-        vol = dom.produceVolume(imgUUID, leafVolUUID)
-        if vol.getLegality() == sc.ILLEGAL_VOL:
+        if vols[leafVolUUID][sc.LEGALITY] == sc.ILLEGAL_VOL:
             actualVolumes.remove(leafVolUUID)
 
         # Now that we know the correct volume chain, sync the storge metadata
@@ -37,9 +37,12 @@ import threading
 from itertools import chain
 from subprocess import list2cmdline
 
+from vdsm import cmdutils
 from vdsm import constants
+from vdsm import utils
 from vdsm.storage import devicemapper
 from vdsm.storage import exception as se
+from vdsm.storage import lvmshell
 from vdsm.storage import misc
 from vdsm.storage.constants import VG_EXTENT_SIZE_MB
 
@@ -98,6 +101,9 @@ PVS_CMD = ("pvs",) + LVM_FLAGS + ("-o", PV_FIELDS)
 VGS_CMD = ("vgs",) + LVM_FLAGS + ("-o", VG_FIELDS)
 LVS_CMD = ("lvs",) + LVM_FLAGS + ("-o", LV_FIELDS)
 
+# Commands that may run in the lvm shell
+SHELL_COMMANDS = frozenset(["pvs", "vgs", "lvs"])
+
 # FIXME we must use different METADATA_USER ownership for qemu-unreadable
 # metadata volumes
 USER_GROUP = constants.DISKIMAGE_USER + ":" + constants.DISKIMAGE_GROUP
@@ -231,6 +237,55 @@ def makeLV(*args):
     return LV(*args)
 
 
+class CacheStats(object):
+    """
+    Count LVMCache hits, misses, reloads and reload time for each object
+    type ("pv", "vg" and "lv").
+    """
+
+    TYPES = ("pv", "vg", "lv")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        for kind in self.TYPES:
+            self._counters[kind + "_hits"] = 0
+            self._counters[kind + "_misses"] = 0
+            self._counters[kind + "_reloads"] = 0
+            self._counters[kind + "_reload_time"] = 0.0
+
+    def hit(self, kind):
+        self._add(kind + "_hits", 1)
+
+    def miss(self, kind):
+        self._add(kind + "_misses", 1)
+
+    def reloaded(self, kind, elapsed):
+        with self._lock:
+            self._counters[kind + "_reloads"] += 1
+            self._counters[kind + "_reload_time"] += elapsed
+
+    def info(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def _add(self, name, value):
+        with self._lock:
+            self._counters[name] += value
+
+
+class _LVsReload(object):
+    """
+    Serialize LV reloads of a single VG. A thread waiting for a reload in
+    progress can use the generation to detect that the LVs it needs were
+    reloaded while it was waiting.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = 0
+
+
 class LVMCache(object):
     """
     Keep all the LVM information.
@@ -264,6 +319,54 @@ class LVMCache(object):
 
         return newcmd
 
+    def _useShell(self, cmd, devices):
+        """
+        Return True if cmd can run in the lvm shell. The shell cannot quote
+        arguments, so it uses the configuration in VDSM_LVM_SYSTEM_DIR, and
+        commands using a different configuration must run in a new process.
+        """
+        if self._shellPool is None or devices:
+            return False
+        if cmd[0] not in SHELL_COMMANDS:
+            return False
+        return all(arg and len(arg.split()) == 1 for arg in cmd)
+
+    def _runInShell(self, cmd):
+        """
+        Run cmd in the lvm shell. Commands that fail or time out are not run
+        again in a new lvm process, since lvm commands run in a new process
+        have no timeout, and would block on inaccessible storage.
+        """
+        rc, out, err = self._shellCmd(cmd)
+        if rc in (0, lvmshell.TIMEOUT):
+            return rc, out, err
+
+        # The command may have failed because devices were added since the
+        # filter was built. Other failures, such as a missing VG, are normal
+        # and must not rebuild the filter.
+        if not self._filterChanged():
+            return rc, out, err
+
+        log.debug("lvm filter changed, running %s again", cmd[0])
+        self.invalidateFilter()
+        return self._shellCmd(cmd)
+
+    def _filterChanged(self):
+        conf = _buildConfig(multipath.getMPDevNamesIter())
+        return conf != self._extraCfg
+
+    def _shellCmd(self, cmd):
+        conf = self._getCachedExtraCfg()
+        if conf != self._shellCfg:
+            # lvm reads the configuration only when starting.
+            self._shellPool.reset()
+            self._shellCfg = conf
+        try:
+            return self._shellPool.run(cmd)
+        except lvmshell.Error as e:
+            log.warning("Cannot run %s in lvm shell: %s", cmd[0], e)
+            return lvmshell.FAILED, [], [str(e)]
+
     def invalidateFilter(self):
         self._filterStale = True
 
@@ -282,8 +385,28 @@ class LVMCache(object):
         self._pvs = {}
         self._vgs = {}
         self._lvs = {}
+        # VGs whose LV list is complete. Some of the LVs may be stale, but
+        # there are no unknown LVs in these VGs.
+        self._lvsloaded = set()
+        self._lvsreloads = {}
+        # Monotonic time of the last vgck of each VG.
+        self._vgchecks = {}
+        self._stats = CacheStats()
+        self._shellCfg = None
+        self._shellPool = None
+        if config.getboolean("irs", "lvm_shell"):
+            env = os.environ.copy()
+            env["LVM_SYSTEM_DIR"] = VDSM_LVM_SYSTEM_DIR
+            self._shellPool = lvmshell.ShellPool(
+                cmdutils.sudo([constants.EXT_LVM]),
+                size=config.getint("irs", "lvm_shell_processes"),
+                timeout=config.getint("irs", "lvm_shell_timeout"),
+                env=env)
 
     def cmd(self, cmd, devices=tuple()):
+        if self._useShell(cmd, devices):
+            return self._runInShell(cmd)
+
         finalCmd = self._addExtraCfg(cmd, devices)
         rc, out, err = misc.execCmd(finalCmd, sudo=True)
         if rc != 0:
@@ -315,7 +438,9 @@ class LVMCache(object):
         pvNames = _normalizeargs(pvName)
         cmd.extend(pvNames)
 
+        start = utils.monotonic_time()
         rc, out, err = self.cmd(cmd)
+        self._stats.reloaded("pv", utils.monotonic_time() - start)
 
         with self._lock:
             if rc != 0:
@@ -368,7 +493,9 @@ class LVMCache(object):
         vgNames = _normalizeargs(vgName)
         cmd.extend(vgNames)
 
+        start = utils.monotonic_time()
         rc, out, err = self.cmd(cmd, self._getVGDevs(vgNames))
+        self._stats.reloaded("vg", utils.monotonic_time() - start)
 
         with self._lock:
             if rc != 0:
@@ -425,7 +552,9 @@ class LVMCache(object):
         else:
             cmd.append(vgName)
 
+        start = utils.monotonic_time()
         rc, out, err = self.cmd(cmd, self._getVGDevs((vgName,)))
+        self._stats.reloaded("lv", utils.monotonic_time() - start)
 
         with self._lock:
             if rc != 0:
@@ -460,16 +589,56 @@ class LVMCache(object):
                 log.warning("Removing stale lv: %s/%s", vgName, lvName)
                 self._lvs.pop((vgName, lvName), None)
 
+            if not lvNames:
+                self._lvsloaded.add(vgName)
+
             log.debug("lvs reloaded")
 
         return updatedLVs
 
+    def _reloadVgsLvs(self, vgNames):
+        """
+        Reload all the LVs in vgNames using a single lvs command.
+        """
+        cmd = list(LVS_CMD)
+        cmd.extend(vgNames)
+
+        start = utils.monotonic_time()
+        rc, out, err = self.cmd(cmd, self._getVGDevs(vgNames))
+        self._stats.reloaded("lv", utils.monotonic_time() - start)
+
+        if rc != 0:
+            # One of the VGs may be missing. Keep the cache as is; the LVs
+            # are reloaded separately for each VG on the next access.
+            log.warning("lvm lvs failed: %s %s %s", str(rc), str(out),
+                        str(err))
+            return
+
+        with self._lock:
+            updatedLVs = set()
+            for line in out:
+                fields = [field.strip() for field in line.split(SEPARATOR)]
+                lv = makeLV(*fields)
+                # For LV we are only interested in its first extent
+                if lv.seg_start_pe == "0":
+                    self._lvs[(lv.vg_name, lv.name)] = lv
+                    updatedLVs.add((lv.vg_name, lv.name))
+
+            for vgName, lvName in self._lvs.keys():
+                if vgName in vgNames and (vgName, lvName) not in updatedLVs:
+                    log.warning("Removing stale lv: %s/%s", vgName, lvName)
+                    self._lvs.pop((vgName, lvName), None)
+
+            self._lvsloaded.update(vgNames)
+
     def _reloadAllLvs(self):
         """
         Used only during bootstrap.
         """
         cmd = list(LVS_CMD)
+        start = utils.monotonic_time()
         rc, out, err = self.cmd(cmd)
+        self._stats.reloaded("lv", utils.monotonic_time() - start)
         if rc == 0:
             updatedLVs = set()
             for line in out:
@@ -485,6 +654,7 @@ class LVMCache(object):
                 if (vgName, lvName) not in updatedLVs:
                     self._lvs.pop((vgName, lvName), None)
                     log.error("Removing stale lv: %s/%s", vgName, lvName)
+            self._lvsloaded = set(vgName for vgName, lvName in updatedLVs)
             self._stalelv = False
         return dict(self._lvs)
 
@@ -520,6 +690,7 @@ class LVMCache(object):
                     self._lvs[(vgName, lvName)] = Stub(lvName, True)
             else:
                 # Invalidate all the LVs in a given VG
+                self._lvsloaded.discard(vgName)
                 for lv in self._lvs.values():
                     if not isinstance(lv, Stub):
                         if lv.vg_name == vgName:
@@ -528,8 +699,42 @@ class LVMCache(object):
     def _invalidateAllLvs(self):
         with self._lock:
             self._stalelv = True
+            self._lvsloaded.clear()
             self._lvs.clear()
 
+    def _changelvtags(self, vgName, lvName, delTags=(), addTags=()):
+        """
+        Apply a tags change made by this host to a cached LV, avoiding a
+        reload. If the LV is not in the cache, invalidate it.
+        """
+        with self._lock:
+            lv = self._lvs.get((vgName, lvName))
+            if lv is None or isinstance(lv, Stub):
+                self._lvs[(vgName, lvName)] = Stub(lvName, True)
+                return
+            delTags = set(delTags)
+            tags = [tag for tag in lv.tags if tag not in delTags]
+            tags.extend(sorted(tag for tag in set(addTags)
+                               if tag not in tags))
+            self._lvs[(vgName, lvName)] = lv._replace(tags=tuple(tags))
+
+    def _renamelv(self, vgName, oldName, newName):
+        """
+        Rename a cached LV after renaming it on storage, avoiding a reload.
+        """
+        with self._lock:
+            lv = self._lvs.pop((vgName, oldName), None)
+            if lv is None or isinstance(lv, Stub):
+                self._lvs[(vgName, newName)] = Stub(newName, True)
+            else:
+                self._lvs[(vgName, newName)] = lv._replace(name=newName)
+
+    def stats(self):
+        """
+        Return a dict of cache counters.
+        """
+        return self._stats.info()
+
     def flush(self):
         self._invalidateAllPvs()
         self._invalidateAllVgs()
@@ -539,8 +744,11 @@ class LVMCache(object):
         # Get specific PV
         pv = self._pvs.get(pvName)
         if not pv or isinstance(pv, Stub):
+            self._stats.miss("pv")
             pvs = self._reloadpvs(pvName)
             pv = pvs.get(pvName)
+        else:
+            self._stats.hit("pv")
         return pv
 
     def getAllPvs(self):
@@ -560,8 +768,11 @@ class LVMCache(object):
         # Get specific VG
         vg = self._vgs.get(vgName)
         if not vg or isinstance(vg, Stub):
+            self._stats.miss("vg")
             vgs = self._reloadvgs(vgName)
             vg = vgs.get(vgName)
+        else:
+            self._stats.hit("vg")
         return vg
 
     def getVgs(self, vgNames):
@@ -588,10 +799,6 @@ class LVMCache(object):
         return vgs.values()
 
     def getLv(self, vgName, lvName=None):
-        # Checking self._stalelv here is suboptimal, because
-        # unnecessary reloads
-        # are done.
-
         # Return vgName/lvName info
         # If both 'vgName' and 'lvName' are None then return everything
         # If only 'lvName' is None then return all the LVs in the given VG
@@ -601,31 +808,166 @@ class LVMCache(object):
             # vgName, lvName
             lv = self._lvs.get((vgName, lvName))
             if not lv or isinstance(lv, Stub):
-                # while we here reload all the LVs in the VG
-                lvs = self._reloadlvs(vgName)
-                lv = lvs.get((vgName, lvName))
+                self._stats.miss("lv")
+                self._reloadStaleLvs(vgName, (lvName,))
+                lv = self._lvs.get((vgName, lvName))
                 if not lv:
                     log.warning("lv: %s not found in lvs vg: %s response",
                                 lvName, vgName)
+            else:
+                self._stats.hit("lv")
             res = lv
         else:
             # vgName, None
-            # If there any stale LVs reload the whole VG, since it would
-            # cost us around same efforts anyhow and these stale LVs can
-            # be in the vg.
-            # Will be better when the pvs dict will be part of the vg.
-            # Fix me: should not be more stubs
-            if self._stalelv or any(isinstance(lv, Stub)
-                                    for lv in self._lvs.values()):
-                lvs = self._reloadlvs(vgName)
+            if self._lvsFresh(vgName):
+                self._stats.hit("lv")
             else:
-                lvs = dict(self._lvs)
-            # lvs = self._reloadlvs()
-            lvs = [lv for lv in lvs.values()
+                self._stats.miss("lv")
+                self._reloadStaleLvs(vgName)
+            with self._lock:
+                lvs = self._lvs.values()
+            res = [lv for lv in lvs
                    if not isinstance(lv, Stub) and (lv.vg_name == vgName)]
-            res = lvs
         return res
 
+    def _lvsFresh(self, vgName, lvNames=()):
+        """
+        Return True if lvNames in vgName, or if lvNames is empty, all the LVs
+        in vgName, are cached and not stale.
+        """
+        with self._lock:
+            if lvNames:
+                for lvName in lvNames:
+                    lv = self._lvs.get((vgName, lvName))
+                    if lv is None or isinstance(lv, Stub):
+                        return False
+                return True
+            if vgName not in self._lvsloaded:
+                return False
+            for (v, lvName), lv in self._lvs.iteritems():
+                if v == vgName and isinstance(lv, Stub):
+                    return False
+            return True
+
+    def _reloadStaleLvs(self, vgName, lvNames=()):
+        """
+        Reload lvNames and any other stale LVs in vgName using a single lvs
+        command. If the VG LV list is not complete, reload all the LVs in the
+        VG.
+
+        Concurrent callers are serialized; a caller waiting while another
+        thread was reloading the VG returns without running lvs if the LVs
+        it needs were reloaded.
+        """
+        with self._lock:
+            lvsReload = self._lvsreloads.setdefault(vgName, _LVsReload())
+            generation = lvsReload.generation
+
+        with lvsReload.lock:
+            if (lvsReload.generation != generation and
+                    self._lvsFresh(vgName, lvNames)):
+                log.debug("lvs of vg %s were reloaded by another thread",
+                          vgName)
+                return
+            try:
+                with self._lock:
+                    if vgName in self._lvsloaded:
+                        stale = set(lvNames)
+                        stale.update(lvName for (v, lvName), lv
+                                     in self._lvs.iteritems()
+                                     if v == vgName and isinstance(lv, Stub))
+                    else:
+                        stale = None
+
+                if stale:
+                    self._reloadlvs(vgName, sorted(stale))
+                    # A partial reload cannot detect LVs removed by another
+                    # host, and fails if one of the LVs does not exist.
+                    if not self._lvsFresh(vgName, stale):
+                        self._reloadlvs(vgName)
+                elif stale is None:
+                    self._reloadlvs(vgName)
+            finally:
+                lvsReload.generation += 1
+
+    def refreshVgs(self, vgNames):
+        """
+        Reload vgNames, and the LVs of vgNames whose LV list is not fresh,
+        using one vgs command and at most one lvs command, regardless of the
+        number of VGs.
+
+        Readers of these VGs and their LVs get the reloaded objects from the
+        cache, without running lvm commands.
+        """
+        vgNames = sorted(vgNames)
+        if not vgNames:
+            return
+
+        self._reloadvgs(vgNames)
+
+        with self._lock:
+            lvsReloads = [self._lvsreloads.setdefault(vgName, _LVsReload())
+                          for vgName in vgNames]
+
+        # Serialize with reloads of a single VG in _reloadStaleLvs(). Locks
+        # are always taken in the same order, so this cannot deadlock.
+        for lvsReload in lvsReloads:
+            lvsReload.lock.acquire()
+        try:
+            stale = [vgName for vgName in vgNames
+                     if not self._lvsFresh(vgName)]
+            if stale:
+                self._reloadVgsLvs(stale)
+        finally:
+            for lvsReload in lvsReloads:
+                lvsReload.generation += 1
+                lvsReload.lock.release()
+
+    def checkVgs(self, vgNames):
+        """
+        Check vgNames using one vgck command, and return a dict mapping the
+        names of the VGs that failed the check to the error. If the command
+        fails, each VG is checked separately to find the failed VGs.
+        """
+        vgNames = sorted(vgNames)
+        if not vgNames:
+            return {}
+
+        rc, err = self._vgck(vgNames)
+        if rc == 0:
+            return {}
+
+        if len(vgNames) == 1:
+            failed = {vgNames[0]: err}
+        else:
+            failed = {}
+            for vgName in vgNames:
+                rc, err = self._vgck((vgName,))
+                if rc != 0:
+                    failed[vgName] = err
+
+        for vgName in failed:
+            self._invalidatevgs(vgName)
+            self._invalidatelvs(vgName)
+        return failed
+
+    def lastVgCheck(self, vgName):
+        """
+        Return the monotonic time of the last check of vgName, or None if
+        vgName was never checked.
+        """
+        with self._lock:
+            return self._vgchecks.get(vgName)
+
+    def _vgck(self, vgNames):
+        cmd = ["vgck"] + list(vgNames)
+        rc, out, err = self.cmd(cmd, self._getVGDevs(vgNames))
+        now = utils.monotonic_time()
+        with self._lock:
+            for vgName in vgNames:
+                self._vgchecks[vgName] = now
+        return rc, err
+
     def getAllLvs(self):
         # None, None
         if self._stalelv or any(isinstance(lv, Stub)
@@ -686,6 +1028,13 @@ def invalidateCache():
     _lvminfo.invalidateCache()
 
 
+def getCacheStats():
+    """
+    Return the LVM cache hits, misses, reloads and reload time counters.
+    """
+    return _lvminfo.stats()
+
+
 def _fqpvname(pv):
     if pv and not pv.startswith(PV_PREFIX):
         pv = os.path.join(PV_PREFIX, pv)
@@ -900,6 +1249,14 @@ def getAllVGs():
     return _lvminfo.getAllVgs()  # returns list
 
 
+def refreshVGs(vgNames):
+    """
+    Reload vgNames and their stale LVs in the cache, running the same number
+    of lvm commands for any number of VGs.
+    """
+    _lvminfo.refreshVgs(vgNames)
+
+
 # TODO: lvm VG UUID should not be exposed.
 # Remove this function when hsm.public_createVG is removed.
 def getVGbyUUID(vgUUID):
@@ -1004,15 +1361,27 @@ def extendVG(vgName, devices, force):
 
 
 def chkVG(vgName):
-    cmd = ["vgck", vgName]
-    rc, out, err = _lvminfo.cmd(cmd, _lvminfo._getVGDevs((vgName, )))
-    if rc != 0:
-        _lvminfo._invalidatevgs(vgName)
-        _lvminfo._invalidatelvs(vgName)
-        raise se.StorageDomainAccessError("%s: %s" % (vgName, err))
+    failed = _lvminfo.checkVgs((vgName,))
+    if failed:
+        raise se.StorageDomainAccessError("%s: %s" % (vgName, failed[vgName]))
     return True
 
 
+def checkVGs(vgNames):
+    """
+    Check vgNames using one vgck command, and return a dict mapping the names
+    of the VGs that failed the check to the error.
+    """
+    return _lvminfo.checkVgs(vgNames)
+
+
+def lastVGCheck(vgName):
+    """
+    Return the monotonic time of the last check of vgName, or None.
+    """
+    return _lvminfo.lastVgCheck(vgName)
+
+
 def deactivateVG(vgName):
     getVG(vgName)  # Check existence
     _setVgAvailability(vgName, available="n")
@@ -1203,8 +1572,7 @@ def renameLV(vg, oldlv, newlv):
     if rc != 0:
         raise se.LogicalVolumeRenameError("%s %s %s" % (vg, oldlv, newlv))
 
-    _lvminfo._lvs.pop((vg, oldlv), None)
-    _lvminfo._reloadlvs(vg, newlv)
+    _lvminfo._renamelv(vg, oldlv, newlv)
 
 
 def refreshLVs(vgName, lvNames):
@@ -1223,10 +1591,11 @@ def addtag(vg, lv, tag):
     lvname = "%s/%s" % (vg, lv)
     cmd = ("lvchange",) + LVM_NOBACKUP + ("--addtag", tag) + (lvname,)
     rc, out, err = _lvminfo.cmd(cmd, _lvminfo._getVGDevs((vg, )))
-    _lvminfo._invalidatelvs(vg, lv)
     if rc != 0:
+        _lvminfo._invalidatelvs(vg, lv)
         # Fix me: should be se.ChangeLogicalVolumeError but this not exists.
         raise se.MissingTagOnLogicalVolume("%s/%s" % (vg, lv), tag)
+    _lvminfo._changelvtags(vg, lv, addTags=(tag,))
 
 
 def changeLVTags(vg, lv, delTags=(), addTags=()):
@@ -1250,11 +1619,12 @@ def changeLVTags(vg, lv, delTags=(), addTags=()):
     cmd.append(lvname)
 
     rc, out, err = _lvminfo.cmd(cmd, _lvminfo._getVGDevs((vg, )))
-    _lvminfo._invalidatelvs(vg, lv)
     if rc != 0:
+        _lvminfo._invalidatelvs(vg, lv)
         raise se.LogicalVolumeReplaceTagError(
             'lv: `%s` add: `%s` del: `%s` (%s)' %
             (lvname, ", ".join(addTags), ", ".join(delTags), err[-1]))
+    _lvminfo._changelvtags(vg, lv, delTags=delTags, addTags=addTags)
 
 
 def addLVTags(vg, lv, addTags):
@@ -1359,7 +1729,8 @@ def replaceLVTag(vg, lv, deltag, addtag):
     cmd = (("lvchange",) + LVM_NOBACKUP + ("--deltag", deltag) +
            ("--addtag", addtag) + (lvname,))
     rc, out, err = _lvminfo.cmd(cmd, _lvminfo._getVGDevs((vg, )))
-    _lvminfo._invalidatelvs(vg, lv)
     if rc != 0:
+        _lvminfo._invalidatelvs(vg, lv)
         raise se.LogicalVolumeReplaceTagError("%s/%s" % (vg, lv),
                                               "%s,%s" % (deltag, addtag))
+    _lvminfo._changelvtags(vg, lv, delTags=(deltag,), addTags=(addtag,))
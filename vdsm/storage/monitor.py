@@ -18,21 +18,34 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+import bisect
 import logging
+import random
 import threading
 import time
 
 from vdsm import concurrent
+from vdsm import executor
+from vdsm import schedule
 from vdsm import utils
 from vdsm.config import config
 from vdsm.storage import check
 from vdsm.storage import clusterlock
 from vdsm.storage import misc
 
+from . import lvm
+from . import sd
 from .sdc import sdCache
 
 log = logging.getLogger('Storage.Monitor')
 
+# Monitor cycles are delayed by up to this fraction of the interval, so
+# monitors started together do not check their domains at the same time.
+_JITTER = 0.1
+
+# Upper bounds in seconds of the check latency histogram buckets.
+_LATENCY_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, float("inf"))
+
 
 class Status(object):
 
@@ -111,6 +124,10 @@ class Status(object):
     def version(self):
         return self._domain_status.version
 
+    @property
+    def checkLatency(self):
+        return self._domain_status.checkLatency
+
 
 class PathStatus(object):
 
@@ -134,6 +151,34 @@ class DomainStatus(object):
         self.vgMdFreeBelowThreashold = True
         self.isoPrefix = None
         self.version = -1
+        self.checkLatency = {}
+
+
+class LatencyHistogram(object):
+    """
+    Count domain checks by their latency. A check is counted in the first
+    bucket whose upper bound is not smaller than the check latency.
+    """
+
+    def __init__(self, buckets=_LATENCY_BUCKETS):
+        self._buckets = buckets
+        self._counts = [0] * len(buckets)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        index = bisect.bisect_left(self._buckets, seconds)
+        with self._lock:
+            self._counts[index] += 1
+
+    def snapshot(self):
+        """
+        Return a dict mapping bucket upper bound (e.g. "0.5", "inf") to the
+        number of checks counted in this bucket.
+        """
+        with self._lock:
+            counts = list(self._counts)
+        return dict(("%g" % bound, count)
+                    for bound, count in zip(self._buckets, counts))
 
 
 class DomainMonitor(object):
@@ -145,8 +190,29 @@ class DomainMonitor(object):
         # the checker event loop thread.
         self.onDomainStateChange = misc.Event(
             "Storage.DomainMonitor.onDomainStateChange", sync=False)
-        self._checker = check.CheckService()
+        self._checker = check.CheckService(
+            backend=config.get("irs", "sd_health_check_backend"),
+            workers=config.getint("irs", "sd_health_check_workers"),
+            max_workers=config.getint("irs", "sd_health_check_max_workers"))
         self._checker.start()
+        # Monitor cycles are scheduled on a single timer thread, and run on a
+        # bounded pool of workers, instead of a thread per domain.
+        max_workers = config.getint("irs", "sd_monitor_max_workers")
+        self._scheduler = schedule.Scheduler(name="monitor.Scheduler",
+                                             clock=utils.monotonic_time)
+        self._executor = executor.Executor(
+            name="monitor",
+            workers_count=config.getint("irs", "sd_monitor_workers"),
+            max_tasks=max_workers * 100,
+            scheduler=self._scheduler,
+            max_workers=max_workers)
+        self._scheduler.start()
+        self._executor.start()
+        # Protects _lvmRefreshCall and _lvmRefreshStopped.
+        self._lvmRefreshLock = threading.Lock()
+        self._lvmRefreshCall = None
+        self._lvmRefreshStopped = False
+        self._scheduleLvmRefresh()
 
     @property
     def domains(self):
@@ -181,7 +247,8 @@ class DomainMonitor(object):
 
         log.info("Start monitoring %s", sdUUID)
         monitor = MonitorThread(sdUUID, hostId, self._interval,
-                                self.onDomainStateChange, self._checker)
+                                self.onDomainStateChange, self._checker,
+                                self._scheduler, self._executor)
         monitor.poolDomain = poolDomain
         monitor.start()
         # The domain should be added only after it succesfully started
@@ -220,8 +287,13 @@ class DomainMonitor(object):
         id. To stop monitors and release the host id, use stopMonitoring().
         """
         log.info("Shutting down domain monitors")
+        self._stopLvmRefresh()
         self._stopMonitors(self._monitors.values(), shutdown=True)
         self._checker.stop()
+        # Workers blocked on inaccessible storage will exit when their check
+        # completes.
+        self._executor.stop(wait=False)
+        self._scheduler.stop()
 
     def _stopMonitors(self, monitors, shutdown=False):
         # The domain monitor issues events that might become raceful if
@@ -230,14 +302,14 @@ class DomainMonitor(object):
         # the host id is released. If the monitor didn't actually exit it
         # might respawn a new acquire host id.
 
-        # First stop monitor threads - this take no time, and make the process
-        # about 7 times faster when stopping 30 monitors.
+        # First stop monitors - this take no time, and make the process about
+        # 7 times faster when stopping 30 monitors.
         for monitor in monitors:
             log.info("Stop monitoring %s (shutdown=%s)",
                      monitor.sdUUID, shutdown)
             monitor.stop(shutdown=shutdown)
 
-        # Now wait for threads to finish - this takes about 10 seconds with 30
+        # Now wait for monitors to finish - this takes about 10 seconds with 30
         # monitors, most of the time spent waiting for sanlock.
         for monitor in monitors:
             log.debug("Waiting for monitor %s", monitor.sdUUID)
@@ -248,11 +320,82 @@ class DomainMonitor(object):
                 log.warning("Montior for %s removed while stopping",
                             monitor.sdUUID)
 
+    # Refreshing LVM
+    #
+    # The VGs of all the monitored block domains are reloaded together once
+    # per monitor interval, so the number of lvm commands does not grow with
+    # the number of block domains. The monitors and other readers use the
+    # reloaded VGs and LVs from the lvm cache.
+    #
+    # The VGs are also checked together with vgck, before the domain
+    # selftest would check each VG separately.
+
+    def _scheduleLvmRefresh(self):
+        with self._lvmRefreshLock:
+            if self._lvmRefreshStopped:
+                return
+            self._lvmRefreshCall = self._scheduler.schedule(
+                self._interval, self._dispatchLvmRefresh)
+
+    def _stopLvmRefresh(self):
+        with self._lvmRefreshLock:
+            self._lvmRefreshStopped = True
+            if self._lvmRefreshCall is not None:
+                self._lvmRefreshCall.cancel()
+                self._lvmRefreshCall = None
+
+    def _dispatchLvmRefresh(self):
+        """
+        Called from the scheduler thread. Must not block!
+        """
+        try:
+            self._executor.dispatch(self._refreshLvm, timeout=self._interval)
+        except executor.TooManyTasks:
+            log.warning("Too many monitor tasks, delaying lvm refresh")
+            self._scheduleLvmRefresh()
+        except executor.NotRunning:
+            log.debug("Monitor executor stopped, not refreshing lvm")
+
+    def _refreshLvm(self):
+        vgNames = [monitor.sdUUID for monitor in self._monitors.values()
+                   if monitor.isBlockDomain]
+        try:
+            if vgNames:
+                lvm.refreshVGs(vgNames)
+                self._checkVGs(vgNames)
+        except Exception:
+            log.exception("Error refreshing lvm for domains %s", vgNames)
+        finally:
+            self._scheduleLvmRefresh()
+
+    def _checkVGs(self, vgNames):
+        # Check early enough so selftest finds a recent check.
+        maxAge = config.getint("irs", "repo_stats_cache_refresh_timeout") / 2
+        now = utils.monotonic_time()
+        stale = []
+        for vgName in vgNames:
+            lastCheck = lvm.lastVGCheck(vgName)
+            if lastCheck is None or now - lastCheck > maxAge:
+                stale.append(vgName)
+        if not stale:
+            return
+        failed = lvm.checkVGs(stale)
+        for vgName, err in failed.items():
+            log.warning("Checking VG %s failed: %s", vgName, err)
+
 
 class MonitorThread(object):
+    """
+    Monitor a storage domain periodically.
+
+    Each monitor cycle is scheduled on the shared scheduler, and run on the
+    shared executor. The next cycle is scheduled only when the current cycle
+    has finished, so a domain blocked on inaccessible storage holds at most
+    one worker, and the executor replaces the worker after interval seconds.
+    """
 
-    def __init__(self, sdUUID, hostId, interval, changeEvent, checker):
-        self.thread = concurrent.thread(self._run, logger=log.name)
+    def __init__(self, sdUUID, hostId, interval, changeEvent, checker,
+                 scheduler, executor):
         self.stopEvent = threading.Event()
         self.domain = None
         self.sdUUID = sdUUID
@@ -269,23 +412,47 @@ class MonitorThread(object):
                              DomainStatus(actual=False))
         self.isIsoDomain = None
         self.isoPrefix = None
+        self.isBlockDomain = None
         self.lastRefresh = time.time()
         # Use float to allow short refresh internal during tests.
         self.refreshTime = \
             config.getfloat("irs", "repo_stats_cache_refresh_timeout")
         self.wasShutdown = False
+        self.checkLatency = LatencyHistogram()
         # Used for synchronizing during the tests
         self.cycleCallback = None
+        self._scheduler = scheduler
+        self._executor = executor
+        self._ready = False
+        # Protects _started and _call, the next scheduled cycle.
+        self._callLock = threading.Lock()
+        self._started = False
+        self._call = None
+        self._stopped = threading.Event()
 
     def start(self):
-        self.thread.start()
+        log.debug("Domain monitor for %s started", self.sdUUID)
+        with self._callLock:
+            self._started = True
+        # Spread the first checks of monitors started together.
+        if not self._scheduleCycle(random.uniform(0, self.interval * _JITTER)):
+            self._stopped.set()
 
     def stop(self, shutdown=False):
         self.wasShutdown = shutdown
         self.stopEvent.set()
+        with self._callLock:
+            started = self._started
+            call, self._call = self._call, None
+        if not started:
+            self._stopped.set()
+        elif call is not None:
+            # No cycle is running, so we have to finish the monitor.
+            call.cancel()
+            self._dispatchFinish()
 
     def join(self):
-        self.thread.join()
+        self._stopped.wait()
 
     def getStatus(self):
         return self.status
@@ -299,40 +466,84 @@ class MonitorThread(object):
         """ Accessed by methods decorated with @util.cancelpoint """
         return self.stopEvent.is_set()
 
-    def _run(self):
-        log.debug("Domain monitor for %s started", self.sdUUID)
+    # Scheduling cycles
+
+    def _scheduleCycle(self, delay):
+        """
+        Schedule the next cycle, unless the monitor was stopped. Returns True
+        if a cycle was scheduled.
+        """
+        with self._callLock:
+            if self.stopEvent.is_set():
+                return False
+            self._call = self._scheduler.schedule(delay, self._dispatchCycle)
+            return True
+
+    def _dispatchCycle(self):
+        """
+        Called from the scheduler thread. Must not block!
+        """
+        with self._callLock:
+            if self._call is None:
+                return  # Stopped
+            self._call = None
         try:
-            self._setupLoop()
-            self._monitorLoop()
+            self._executor.dispatch(self._cycle, timeout=self.interval)
+        except executor.TooManyTasks:
+            log.warning("Too many monitor tasks, delaying monitor for %s",
+                        self.sdUUID)
+            if not self._scheduleCycle(self.interval):
+                self._dispatchFinish()
+
+    def _cycle(self):
+        try:
+            if not self._ready:
+                self._setupCycle()
+            if self._ready:
+                self._monitorCycle()
         except utils.Canceled:
             log.debug("Domain monitor for %s canceled", self.sdUUID)
-        finally:
-            log.debug("Domain monitor for %s stopped (shutdown=%s)",
-                      self.sdUUID, self.wasShutdown)
+            self._finish()
+            return
+
+        delay = self.interval * random.uniform(1 - _JITTER, 1 + _JITTER)
+        if not self._scheduleCycle(delay):
+            self._finish()
+
+    def _dispatchFinish(self):
+        try:
+            self._executor.dispatch(self._finish)
+        except (executor.TooManyTasks, executor.NotRunning):
+            t = concurrent.thread(self._finish, logger=log.name)
+            t.start()
+
+    def _finish(self):
+        log.debug("Domain monitor for %s stopped (shutdown=%s)",
+                  self.sdUUID, self.wasShutdown)
+        try:
             self._stopCheckingPath()
             if self._shouldReleaseHostId():
                 self._releaseHostId()
+        finally:
+            self._stopped.set()
 
     # Setting up
 
-    def _setupLoop(self):
+    def _setupCycle(self):
         """
-        Set up the monitor, retrying on failures. Returns when the monitor is
-        ready.
+        Try to set up the monitor. On failure, we will try again in the next
+        cycle.
         """
-        while True:
-            try:
-                self._setupMonitor()
-                return
-            except Exception as e:
-                log.exception("Setting up monitor for %s failed", self.sdUUID)
-                domain_status = DomainStatus(error=e)
-                status = Status(self.status._path_status, domain_status)
-                self._updateStatus(status)
-                if self.cycleCallback:
-                    self.cycleCallback()
-                if self.stopEvent.wait(self.interval):
-                    raise utils.Canceled
+        try:
+            self._setupMonitor()
+            self._ready = True
+        except Exception as e:
+            log.exception("Setting up monitor for %s failed", self.sdUUID)
+            domain_status = DomainStatus(error=e)
+            status = Status(self.status._path_status, domain_status)
+            self._updateStatus(status)
+            if self.cycleCallback:
+                self.cycleCallback()
 
     def _setupMonitor(self):
         # Pick up changes in the domain, for example, domain upgrade.
@@ -360,6 +571,10 @@ class MonitorThread(object):
         if self.isIsoDomain is None:
             self._setIsoDomainInfo()
 
+        # Block domains VGs are refreshed by the domain monitor.
+        if self.isBlockDomain is None:
+            self._setBlockDomainInfo()
+
     @utils.cancelpoint
     def _produceDomain(self):
         log.debug("Producing domain %s", self.sdUUID)
@@ -373,22 +588,21 @@ class MonitorThread(object):
             self.isoPrefix = self.domain.getIsoDomainImagesDir()
         self.isIsoDomain = isIsoDomain
 
+    @utils.cancelpoint
+    def _setBlockDomainInfo(self):
+        storageType = self.domain.getStorageType()
+        self.isBlockDomain = storageType in sd.BLOCK_DOMAIN_TYPES
+
     # Monitoring
 
-    def _monitorLoop(self):
-        """
-        Monitor the domain peroidically until the monitor is stopped.
-        """
-        while True:
-            try:
-                self._monitorDomain()
-            except Exception:
-                log.exception("Domain monitor for %s failed", self.sdUUID)
-            finally:
-                if self.cycleCallback:
-                    self.cycleCallback()
-            if self.stopEvent.wait(self.interval):
-                raise utils.Canceled
+    def _monitorCycle(self):
+        try:
+            self._monitorDomain()
+        except Exception:
+            log.exception("Domain monitor for %s failed", self.sdUUID)
+        finally:
+            if self.cycleCallback:
+                self.cycleCallback()
 
     def _monitorDomain(self):
         # Pick up changes in the domain, for example, domain upgrade.
@@ -400,6 +614,7 @@ class MonitorThread(object):
     @utils.cancelpoint
     def _checkDomainStatus(self):
         domain_status = DomainStatus()
+        start = utils.monotonic_time()
         try:
             # This may trigger a refresh of lvm cache. We have seen this taking
             # up to 90 seconds on overloaded machines.
@@ -425,6 +640,9 @@ class MonitorThread(object):
             log.exception("Error checking domain %s", self.sdUUID)
             domain_status.error = e
 
+        self.checkLatency.add(utils.monotonic_time() - start)
+        domain_status.checkLatency = self.checkLatency.snapshot()
+
         with self.lock:
             status = Status(self.status._path_status, domain_status)
             self._updateStatus(status)
@@ -27,6 +27,7 @@ import errno
 from glob import glob
 import logging
 import re
+import threading
 from collections import namedtuple
 
 from vdsm import commands
@@ -162,8 +163,12 @@ def getDeviceBlockSizes(dev):
 def getDeviceSize(dev):
     devName = os.path.basename(dev)
     bs, phyBs = getDeviceBlockSizes(devName)
-    size = bs * read_int(os.path.join(SYS_BLOCK, devName, "size"))
-    return size
+    return _deviceSize(devName, bs)
+
+
+def _deviceSize(devName, logicalBlockSize):
+    size = read_int(os.path.join(SYS_BLOCK, devName, "size"))
+    return logicalBlockSize * size
 
 
 def getDeviceDiscardMaxBytes(physDev):
@@ -223,29 +228,139 @@ def getHBTL(physdev):
     return HBTL(*hbtl[0].split(":"))
 
 
-def pathListIter(filterGuids=()):
-    filterLen = len(filterGuids) if filterGuids else -1
-    devsFound = 0
+# The serials of the multipath devices, by guid. The guid is the wwid of the
+# device, so the serial of a guid does not change.
+_serials = {}
+
+# Sysfs attributes of the multipath slaves that do not change while the
+# device exists, by device name. See _getSlaveAttrs().
+_slaveAttrs = {}
+
+_cacheLock = threading.Lock()
+
+# Attributes read by _getSlaveAttrs, and the name used when reading fails.
+_SLAVE_ATTRS = (
+    ("vendor", getVendor, "vendor"),
+    ("product", getModel, "model name"),
+    ("fwrev", getFwRev, "fwrev"),
+    ("blocksizes", getDeviceBlockSizes, "blocksize"),
+)
+
+
+def _getSlaveAttrs(slave):
+    """
+    Returns a dict with the sysfs attributes of slave that do not change
+    while the device exists: vendor, product, fwrev, blocksizes, hbtl and
+    the iSCSI session (None if the device is not iSCSI). Attributes that
+    could not be read are missing.
+
+    The attributes are cached by the inode and change time of the sysfs
+    directory of the device, so a device added using the name of a removed
+    device is read again.
+    """
+    st = os.stat(os.path.join(SYS_BLOCK, slave))
+    key = (st.st_ino, st.st_mtime)
+    with _cacheLock:
+        cached = _slaveAttrs.get(slave)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    attrs = {}
+    for name, read, description in _SLAVE_ATTRS:
+        try:
+            attrs[name] = read(slave)
+        except Exception:
+            log.warn("Problem getting %s from device `%s`",
+                     description, slave, exc_info=True)
+
+    try:
+        attrs["hbtl"] = getHBTL(slave)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            log.error("Error: %s while trying to get hbtl of device: "
+                      "%s", str(e.message), slave)
+            raise
+        attrs["hbtl"] = None
+
+    if iscsi.devIsiSCSI(slave):
+        attrs["session"] = iscsi.getiScsiSession(slave)
+    else:
+        attrs["session"] = None
+
+    # Retry reading missing attributes next time.
+    if len(attrs) == len(_SLAVE_ATTRS) + 2:
+        with _cacheLock:
+            _slaveAttrs[slave] = (key, attrs)
 
+    return attrs
+
+
+def _pruneCache(guids, slaves):
+    """
+    Drop the cached info of devices not found in a full scan.
+    """
+    with _cacheLock:
+        for guid in set(_serials) - guids:
+            del _serials[guid]
+        for slave in set(_slaveAttrs) - slaves:
+            del _slaveAttrs[slave]
+
+
+def pathListIter(filterGuids=()):
     knownSessions = {}
 
     svdsm = supervdsm.getProxy()
     pathStatuses = devicemapper.getPathsStatus()
 
-    for dmId, guid in getMPDevsIter():
-        if devsFound == filterLen:
-            break
-
-        if filterGuids and guid not in filterGuids:
-            continue
-
-        devsFound += 1
+    if filterGuids:
+        mpDevs = _getMPDevsByGuids(filterGuids)
+    else:
+        mpDevs = getMPDevsIter()
 
+    devices = []
+    for dmId, guid in mpDevs:
+        slaves = []
+        for slave in devicemapper.getSlaves(dmId):
+            if not devicemapper.isBlockDevice(slave):
+                log.warning("No such physdev '%s' is ignored" % slave)
+                continue
+            slaves.append((slave, _getSlaveAttrs(slave)))
+        devices.append((dmId, guid, slaves))
+
+    if not filterGuids:
+        _pruneCache(set(guid for dmId, guid, slaves in devices),
+                    set(slave for dmId, guid, slaves in devices
+                        for slave, attrs in slaves))
+
+    # Fetch the serials of new devices and the info of all iSCSI sessions
+    # from supervdsm in one round trip, instead of one call per device and
+    # per session.
+    with _cacheLock:
+        serials = dict((guid, _serials[guid])
+                       for dmId, guid, slaves in devices if guid in _serials)
+    sessionIDs = set(attrs["session"] for dmId, guid, slaves in devices
+                     for slave, attrs in slaves
+                     if attrs["session"] is not None)
+
+    calls = [("getScsiSerial", (dmId,))
+             for dmId, guid, slaves in devices if guid not in serials]
+    calls.extend(("readSessionInfo", (sessionID,)) for sessionID in sessionIDs)
+    prefetched = _batchCall(svdsm, calls)
+
+    for dmId, guid, slaves in devices:
+        if guid not in serials:
+            serials[guid] = _result(prefetched, "getScsiSerial", dmId)
+            # scsi_id returns an empty serial on errors.
+            if serials[guid]:
+                with _cacheLock:
+                    _serials[guid] = serials[guid]
+
+    for dmId, guid, slaves in devices:
         devInfo = {
             "guid": guid,
             "dm": dmId,
             "capacity": str(getDeviceSize(dmId)),
-            "serial": svdsm.getScsiSerial(dmId),
+            "serial": serials[guid],
             "paths": [],
             "connections": [],
             "devtypes": [],
@@ -259,68 +374,46 @@ def pathListIter(filterGuids=()):
             "discard_zeroes_data": getDeviceDiscardZeroesData(dmId),
         }
 
-        for slave in devicemapper.getSlaves(dmId):
-            if not devicemapper.isBlockDevice(slave):
-                log.warning("No such physdev '%s' is ignored" % slave)
-                continue
-
-            if not devInfo["vendor"]:
-                try:
-                    devInfo["vendor"] = getVendor(slave)
-                except Exception:
-                    log.warn("Problem getting vendor from device `%s`",
-                             slave, exc_info=True)
-
-            if not devInfo["product"]:
-                try:
-                    devInfo["product"] = getModel(slave)
-                except Exception:
-                    log.warn("Problem getting model name from device `%s`",
-                             slave, exc_info=True)
-
-            if not devInfo["fwrev"]:
-                try:
-                    devInfo["fwrev"] = getFwRev(slave)
-                except Exception:
-                    log.warn("Problem getting fwrev from device `%s`",
-                             slave, exc_info=True)
+        for slave, attrs in slaves:
+            for name in ("vendor", "product", "fwrev"):
+                if not devInfo[name]:
+                    devInfo[name] = attrs.get(name, "")
 
             if (not devInfo["logicalblocksize"] or
                     not devInfo["physicalblocksize"]):
-                try:
-                    logBlkSize, phyBlkSize = getDeviceBlockSizes(slave)
+                if "blocksizes" in attrs:
+                    logBlkSize, phyBlkSize = attrs["blocksizes"]
                     devInfo["logicalblocksize"] = str(logBlkSize)
                     devInfo["physicalblocksize"] = str(phyBlkSize)
-                except Exception:
-                    log.warn("Problem getting blocksize from device `%s`",
-                             slave, exc_info=True)
 
             pathInfo = {}
             pathInfo["physdev"] = slave
             pathInfo["state"] = pathStatuses.get(slave, "failed")
-            pathInfo["capacity"] = str(getDeviceSize(slave))
-            try:
-                hbtl = getHBTL(slave)
-            except OSError as e:
-                if e.errno == errno.ENOENT:
-                    log.warn("Device has no hbtl: %s", slave)
-                    pathInfo["lun"] = 0
-                else:
-                    log.error("Error: %s while trying to get hbtl of device: "
-                              "%s", str(e.message), slave)
-                    raise
+            if "blocksizes" in attrs:
+                capacity = _deviceSize(slave, attrs["blocksizes"][0])
+            else:
+                capacity = getDeviceSize(slave)
+            pathInfo["capacity"] = str(capacity)
+            if attrs["hbtl"] is None:
+                log.warn("Device has no hbtl: %s", slave)
+                pathInfo["lun"] = 0
             else:
-                pathInfo["lun"] = hbtl.lun
+                pathInfo["lun"] = attrs["hbtl"].lun
 
-            if iscsi.devIsiSCSI(slave):
+            sessionID = attrs["session"]
+            if sessionID is not None:
                 devInfo["devtypes"].append(DEV_ISCSI)
                 pathInfo["type"] = DEV_ISCSI
-                sessionID = iscsi.getiScsiSession(slave)
                 if sessionID not in knownSessions:
                     # FIXME: This entire part is for BC. It should be moved to
                     # hsm and not preserved for new APIs. New APIs should keep
                     # numeric types and sane field names.
-                    sess = iscsi.getSessionInfo(sessionID)
+                    try:
+                        sess = _result(prefetched, "readSessionInfo",
+                                       sessionID)
+                    except KeyError:
+                        # A new session added since we fetched the sessions
+                        sess = iscsi.getSessionInfo(sessionID)
                     sessionInfo = {
                         "connection": sess.target.portal.hostname,
                         "port": str(sess.target.portal.port),
@@ -353,6 +446,26 @@ def pathListIter(filterGuids=()):
         yield devInfo
 
 
+def _batchCall(svdsm, calls):
+    """
+    Run calls, a list of (funcName, args) tuples, in supervdsm in one round
+    trip. Returns a dict mapping (funcName, args) to (succeeded, value).
+    """
+    results = svdsm.batch((name, args, {}) for name, args in calls)
+    return dict(zip(calls, results))
+
+
+def _result(results, funcName, *args):
+    """
+    Returns the result of a call prefetched by _batchCall, raising the error
+    raised by the call. Raises KeyError if the call was not prefetched.
+    """
+    succeeded, value = results[(funcName, args)]
+    if not succeeded:
+        raise value
+    return value
+
+
 TOXIC_REGEX = re.compile(r"[%s]" % re.sub(r"[\-\\\]]",
                          lambda m: "\\" + m.group(),
                          TOXIC_CHARS))
@@ -369,28 +482,56 @@ def getMPDevsIter():
     Return the list of device identifiers w/o "/dev/mapper" prefix
     """
     for dmInfoDir in glob(SYS_BLOCK + "/dm-*/dm/"):
-        uuidFile = os.path.join(dmInfoDir, "uuid")
-        try:
-            with open(uuidFile, "r") as uf:
-                uuid = uf.read().strip()
-        except (OSError, IOError):
-            continue
+        guid = _getMPDevGuid(dmInfoDir)
+        if guid is not None:
+            yield dmInfoDir.split("/")[-3], guid
 
-        if not uuid.startswith("mpath-"):
-            continue
 
-        nameFile = os.path.join(dmInfoDir, "name")
+def _getMPDevsByGuids(guids):
+    """
+    Like getMPDevsIter(), but looks up only the multipath devices with the
+    given guids, instead of scanning all the device mapper devices.
+    """
+    seen = set()
+    for guid in guids:
+        if guid in seen:
+            continue
+        seen.add(guid)
         try:
-            with open(nameFile, "r") as nf:
-                guid = nf.read().rstrip("\n")
-        except (OSError, IOError):
+            dmId = devicemapper.getDmId(guid)
+        except OSError:
             continue
+        if _getMPDevGuid(os.path.join(SYS_BLOCK, dmId, "dm")) == guid:
+            yield dmId, guid
 
-        if TOXIC_REGEX.match(guid):
-            log.info("Device with unsupported GUID %s discarded", guid)
-            continue
 
-        yield dmInfoDir.split("/")[3], guid
+def _getMPDevGuid(dmInfoDir):
+    """
+    Returns the guid of the device mapper device info directory dmInfoDir,
+    or None if the device is not a supported multipath device.
+    """
+    uuidFile = os.path.join(dmInfoDir, "uuid")
+    try:
+        with open(uuidFile, "r") as uf:
+            uuid = uf.read().strip()
+    except (OSError, IOError):
+        return None
+
+    if not uuid.startswith("mpath-"):
+        return None
+
+    nameFile = os.path.join(dmInfoDir, "name")
+    try:
+        with open(nameFile, "r") as nf:
+            guid = nf.read().rstrip("\n")
+    except (OSError, IOError):
+        return None
+
+    if TOXIC_REGEX.match(guid):
+        log.info("Device with unsupported GUID %s discarded", guid)
+        return None
+
+    return guid
 
 
 def devIsiSCSI(type):
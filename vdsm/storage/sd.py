@@ -538,6 +538,9 @@ class StorageDomain(object):
     def getVAllocSize(self, imgUUID, volUUID):
         return self._manifest.getVAllocSize(imgUUID, volUUID)
 
+    def getVSizes(self, volumes):
+        return self._manifest.getVSizes(volumes)
+
     def deleteImage(self, sdUUID, imgUUID, volsImgs):
         self._manifest.deleteImage(sdUUID, imgUUID, volsImgs)
 
@@ -323,8 +323,10 @@ class StoragePool(object):
                 if (self.lvExtendPolicy == "ON"
                         and self.masterDomain.supportsMailbox):
                     self.masterDomain.prepareMailbox()
-                    self.spmMailer = storage_mailbox.SPM_MailMonitor(self,
-                                                                     maxHostID)
+                    self.spmMailer = storage_mailbox.SPM_MailMonitor(
+                        self, maxHostID,
+                        monitorInterval=config.getfloat(
+                            'irs', 'mailbox_poll_interval'))
                     self.spmMailer.registerMessageType('xtnd', partial(
                         storage_mailbox.SPM_Extend_Message.processRequest,
                         self))
@@ -459,7 +461,10 @@ class StoragePool(object):
 
         if (self.lvExtendPolicy == "ON" and
                 self.masterDomain.supportsMailbox):
-            self.hsmMailer = storage_mailbox.HSM_Mailbox(self.id, self.spUUID)
+            self.hsmMailer = storage_mailbox.HSM_Mailbox(
+                self.id, self.spUUID,
+                monitorInterval=config.getfloat(
+                    'irs', 'mailbox_poll_interval'))
             self.log.debug("HSM mailbox ready for pool %s on master "
                            "domain %s", self.spUUID, self.masterDomain.sdUUID)
 
@@ -29,6 +29,7 @@ import logging
 import uuid
 
 from vdsm.config import config
+from vdsm.storage import directio
 from vdsm.storage import misc
 from vdsm.storage.exception import InvalidParameterException
 
@@ -50,6 +51,7 @@ SIZE_CHARS = 16
 MESSAGE_VERSION = "1"
 MESSAGE_SIZE = 64
 CLEAN_MESSAGE = "\1" * MESSAGE_SIZE
+EMPTY_MESSAGE = "\0" * MESSAGE_SIZE
 EXTEND_CODE = "xtnd"
 BLOCK_SIZE = 512
 REPLY_OK = 1
@@ -60,6 +62,10 @@ SLOTS_PER_MAILBOX = int(MAILBOX_SIZE / MESSAGE_SIZE)
 # etc)
 MESSAGES_PER_MAILBOX = SLOTS_PER_MAILBOX - 1
 
+# Mailbox I/O backends
+DD = "dd"
+DIRECT = "direct"
+
 _zeroCheck = misc.checksum(EMPTYMAILBOX, CHECKSUM_BYTES)
 # Assumes CHECKSUM_BYTES equals 4!!!
 pZeroChecksum = struct.pack('<l', _zeroCheck)
@@ -84,6 +90,122 @@ def _mboxExecCmd(*args, **kwargs):
     return misc.execCmd(*args, **kwargs)
 
 
+class DDMailboxIO(object):
+    """
+    Read and write a mailbox file using a dd process for each I/O.
+
+    Offsets must be a multiple of the I/O size.
+    """
+
+    def __init__(self, path):
+        self._path = path
+
+    def read(self, offset, size):
+        cmd = [constants.EXT_DD,
+               'if=' + str(self._path),
+               'iflag=direct,fullblock',
+               'bs=' + str(size),
+               'count=1',
+               'skip=' + str(offset // size)]
+        rc, out, err = _mboxExecCmd(cmd, raw=True)
+        if rc:
+            raise IOError(errno.EIO, "Could not read mailbox %s: %s" %
+                          (self._path, err))
+        return out
+
+    def write(self, offset, data):
+        size = len(data)
+        cmd = [constants.EXT_DD,
+               'of=' + str(self._path),
+               'iflag=fullblock',
+               'oflag=direct',
+               'conv=notrunc',
+               'bs=' + str(size),
+               'count=1',
+               'seek=' + str(offset // size)]
+        rc, out, err = _mboxExecCmd(cmd, data=data)
+        if rc:
+            raise IOError(errno.EIO, "Could not write mailbox %s: %s" %
+                          (self._path, err))
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return "<DDMailboxIO path=%s>" % self._path
+
+
+class DirectMailboxIO(object):
+    """
+    Read and write a mailbox file using direct I/O from vdsm, keeping the
+    file open and reusing the same aligned buffer for each I/O.
+
+    The file is opened on the first I/O, so a mailbox which is not
+    accessible yet fails only the I/O, like DDMailboxIO.
+
+    Not thread safe; callers must serialize I/O.
+    """
+
+    def __init__(self, path, mode, size=MAILBOX_SIZE):
+        self._path = path
+        self._mode = mode
+        self._file = None
+        self._buf = directio.AlignedBuffer(size)
+        self._closed = False
+
+    def read(self, offset, size):
+        self._reserve(size)
+        n = self._open().pread(self._buf, size, offset)
+        return self._buf.getvalue(n)
+
+    def write(self, offset, data):
+        size = len(data)
+        self._reserve(size)
+        self._buf.setvalue(data)
+        n = self._open().pwrite(self._buf, size, offset)
+        if n != size:
+            raise IOError(errno.EIO, "Short write to mailbox %s: %d/%d "
+                          "bytes" % (self._path, n, size))
+
+    def close(self):
+        self._closed = True
+        if self._file:
+            self._file.close()
+            self._file = None
+        self._buf.close()
+
+    def _open(self):
+        if self._closed:
+            raise IOError(errno.EBADF, "Mailbox %s is closed" % self._path)
+        if self._file is None:
+            self._file = directio.DirectFile(self._path, self._mode)
+        return self._file
+
+    def _reserve(self, size):
+        if self._closed:
+            raise IOError(errno.EBADF, "Mailbox %s is closed" % self._path)
+        if size > self._buf.size:
+            self._buf.close()
+            self._buf = directio.AlignedBuffer(size)
+
+    def __repr__(self):
+        return "<DirectMailboxIO path=%s>" % self._path
+
+
+def mailboxIO(path, mode, size=MAILBOX_SIZE):
+    """
+    Create mailbox I/O object for path, using the backend configured in
+    irs:mailbox_backend.
+    """
+    backend = config.get('irs', 'mailbox_backend')
+    if backend == DIRECT:
+        return DirectMailboxIO(path, mode, size)
+    elif backend == DD:
+        return DDMailboxIO(path)
+    else:
+        raise ValueError("Unsupported mailbox backend %r" % backend)
+
+
 class SPM_Extend_Message:
 
     log = logging.getLogger('Storage.SPM.Messages.Extend')
@@ -244,25 +366,13 @@ class HSM_MailMonitor(object):
         self._monitorInterval = monitorInterval
         self._hostID = int(hostID)
         self._used_slots_array = [0] * MESSAGES_PER_MAILBOX
-        self._outgoingMail = EMPTYMAILBOX
+        self._outgoingMail = bytearray(EMPTYMAILBOX)
         self._incomingMail = EMPTYMAILBOX
         # TODO: add support for multiple paths (multiple mailboxes)
         self._spmStorageDir = config.get('irs', 'repository')
-        self._inCmd = [constants.EXT_DD,
-                       'if=' + str(inbox),
-                       'iflag=direct,fullblock',
-                       'bs=' + str(BLOCK_SIZE),
-                       'count=' + str(BLOCKS_PER_MAILBOX),
-                       'skip=' + str(self._hostID * BLOCKS_PER_MAILBOX)
-                       ]
-        self._outCmd = [constants.EXT_DD,
-                        'of=' + str(outbox),
-                        'iflag=fullblock',
-                        'oflag=direct',
-                        'conv=notrunc',
-                        'bs=' + str(BLOCK_SIZE),
-                        'seek=' + str(self._hostID * BLOCKS_PER_MAILBOX)
-                        ]
+        self._mailboxOffset = self._hostID * MAILBOX_SIZE
+        self._inboxIO = mailboxIO(inbox, "r")
+        self._outboxIO = mailboxIO(outbox, "r+")
         self._init = False
         self._initMailbox()  # Read initial mailbox state
         self._msgCounter = 0
@@ -273,14 +383,14 @@ class HSM_MailMonitor(object):
 
     def _initMailbox(self):
         # Sync initial incoming mail state with storage view
-        (rc, out, err) = _mboxExecCmd(self._inCmd, raw=True)
-        if rc == 0:
-            self._incomingMail = out
+        try:
+            self._incomingMail = self._inboxIO.read(self._mailboxOffset,
+                                                    MAILBOX_SIZE)
             self._init = True
-        else:
+        except EnvironmentError as e:
             self.log.warning("HSM_MailboxMonitor - Could not initialize "
-                             "mailbox, will not accept requests until init "
-                             "succeeds")
+                             "mailbox (%s), will not accept requests until "
+                             "init succeeds", e)
 
     def immStop(self):
         self._stop = True
@@ -291,6 +401,10 @@ class HSM_MailMonitor(object):
     def _handleResponses(self, newMsgs):
         rc = False
 
+        # Most of the time nothing has changed since the last read.
+        if newMsgs == self._incomingMail:
+            return rc
+
         for i in range(0, MESSAGES_PER_MAILBOX):
             # Skip checking non used slots
             if self._used_slots_array[i] == 0:
@@ -304,13 +418,9 @@ class HSM_MailMonitor(object):
             if newMsgs[start] in ['\0', '0']:
                 continue
 
-            for j in range(start, start + MESSAGE_SIZE):
-                if newMsgs[j] != self._incomingMail[j]:
-                    break
-
-            # If search exhausted then message hasn't changed since last read
-            # and can be skipped
-            if j == (start + MESSAGE_SIZE - 1):
+            # Skip messages that did not change since last read
+            end = start + MESSAGE_SIZE
+            if newMsgs[start:end] == self._incomingMail[start:end]:
                 continue
 
             #
@@ -326,15 +436,12 @@ class HSM_MailMonitor(object):
                 del self._activeMessages[i]
                 self._used_slots_array[i] = 0
                 self._msgCounter -= 1
-                self._outgoingMail = self._outgoingMail[0:start] + \
-                    MESSAGE_SIZE * "\0" + self._outgoingMail[start +
-                                                             MESSAGE_SIZE:]
+                self._outgoingMail[start:end] = EMPTY_MESSAGE
                 continue
 
             msg = self._activeMessages[i]
             self._activeMessages[i] = CLEAN_MESSAGE
-            self._outgoingMail = self._outgoingMail[0:start] + \
-                CLEAN_MESSAGE + self._outgoingMail[start + MESSAGE_SIZE:]
+            self._outgoingMail[start:end] = CLEAN_MESSAGE
 
             try:
                 self.log.debug("HSM_MailboxMonitor(%s/%s) - Checking reply: "
@@ -369,11 +476,11 @@ class HSM_MailMonitor(object):
 
     def _checkForMail(self):
         # self.log.debug("HSM_MailMonitor - checking for mail")
-        # self.log.debug("Running command: " + str(self._inCmd))
-        (rc, in_mail, err) = misc.execCmd(self._inCmd, raw=True)
-        if rc:
-            raise RuntimeError("_handleResponses.Could not read mailbox - rc "
-                               "%s" % rc)
+        try:
+            in_mail = self._inboxIO.read(self._mailboxOffset, MAILBOX_SIZE)
+        except EnvironmentError as e:
+            raise RuntimeError("_handleResponses.Could not read mailbox - %s"
+                               % e)
         if (len(in_mail) != MAILBOX_SIZE):
             raise RuntimeError("_handleResponses.Could not read mailbox - len "
                                "%s != %s" % (len(in_mail), MAILBOX_SIZE))
@@ -381,15 +488,18 @@ class HSM_MailMonitor(object):
         return self._handleResponses(in_mail)
 
     def _sendMail(self):
-        self.log.info("HSM_MailMonitor sending mail to SPM - " +
-                      str(self._outCmd))
-        chk = misc.checksum(
-            self._outgoingMail[0:MAILBOX_SIZE - CHECKSUM_BYTES],
-            CHECKSUM_BYTES)
+        self.log.info("HSM_MailMonitor sending mail to SPM - %s",
+                      self._outboxIO)
+        chkStart = MAILBOX_SIZE - CHECKSUM_BYTES
+        chk = misc.checksum(bytes(self._outgoingMail[0:chkStart]),
+                            CHECKSUM_BYTES)
         pChk = struct.pack('<l', chk)  # Assumes CHECKSUM_BYTES equals 4!!!
-        self._outgoingMail = \
-            self._outgoingMail[0:MAILBOX_SIZE - CHECKSUM_BYTES] + pChk
-        _mboxExecCmd(self._outCmd, data=self._outgoingMail)
+        self._outgoingMail[chkStart:MAILBOX_SIZE] = pChk
+        try:
+            self._outboxIO.write(self._mailboxOffset,
+                                 bytes(self._outgoingMail))
+        except EnvironmentError as e:
+            self.log.warning("HSM_MailMonitor couldn't send mail: %s", e)
 
     def _handleMessage(self, message):
         # TODO: add support for multiple mailboxes
@@ -399,12 +509,8 @@ class HSM_MailMonitor(object):
                 if not freeSlot:
                     freeSlot = i
                 continue
-            duplicate = True
-            for j in range(0, MESSAGE_SIZE):
-                if message[j] != self._activeMessages[i][j]:
-                    duplicate = False
-                    break
-            if duplicate:
+            if message[0:MESSAGE_SIZE] == \
+                    self._activeMessages[i][0:MESSAGE_SIZE]:
                 self.log.debug("HSM_MailMonitor - ignoring duplicate message "
                                "%s" % (repr(message)))
                 return
@@ -417,8 +523,7 @@ class HSM_MailMonitor(object):
         self._activeMessages[freeSlot] = message
         start = freeSlot * MESSAGE_SIZE
         end = start + MESSAGE_SIZE
-        self._outgoingMail = self._outgoingMail[0:start] + message.payload + \
-            self._outgoingMail[end:]
+        self._outgoingMail[start:end] = message.payload
         self.log.debug("HSM_MailMonitor - start: %s, end: %s, len: %s, "
                        "message(%s/%s): %s" %
                        (start, end, len(self._outgoingMail), self._msgCounter,
@@ -508,8 +613,10 @@ class HSM_MailMonitor(object):
         finally:
             self.log.info("HSM_MailboxMonitor - Incoming mail monitoring "
                           "thread stopped, clearing outgoing mail")
-            self._outgoingMail = EMPTYMAILBOX
+            self._outgoingMail = bytearray(EMPTYMAILBOX)
             self._sendMail()  # Clear outgoing mailbox
+            self._inboxIO.close()
+            self._outboxIO.close()
 
 
 class SPM_MailMonitor:
@@ -553,30 +660,25 @@ class SPM_MailMonitor:
         self._outMailLen = MAILBOX_SIZE * self._numHosts
         self._monitorInterval = monitorInterval
         # TODO: add support for multiple paths (multiple mailboxes)
-        self._outgoingMail = self._outMailLen * "\0"
-        self._incomingMail = self._outgoingMail
-        self._inCmd = ['dd',
-                       'if=' + str(self._inbox),
-                       'iflag=direct,fullblock',
-                       'count=1'
-                       ]
-        self._outCmd = ['dd',
-                        'of=' + str(self._outbox),
-                        'oflag=direct',
-                        'iflag=fullblock',
-                        'conv=notrunc',
-                        'count=1'
-                        ]
+        self._outgoingMail = bytearray(self._outMailLen)
+        self._incomingMail = self._outMailLen * "\0"
+        self._inboxIO = mailboxIO(self._inbox, "r", self._outMailLen)
+        self._outboxIO = mailboxIO(self._outbox, "r+", self._outMailLen)
         self._outLock = threading.Lock()
         self._inLock = threading.Lock()
+        # True if outgoingMail was modified but not written yet. Cleared
+        # only after a successful write, so a failed write is retried on the
+        # next check for mail.
+        self._outboxDirty = True
         # Clear outgoing mail
-        self.log.debug("SPM_MailMonitor - clearing outgoing mail, command is: "
-                       "%s", self._outCmd)
-        cmd = self._outCmd + ['bs=' + str(self._outMailLen)]
-        (rc, out, err) = _mboxExecCmd(cmd, data=self._outgoingMail)
-        if rc:
-            self.log.warning("SPM_MailMonitor couldn't clear outgoing mail, "
-                             "dd failed")
+        self.log.debug("SPM_MailMonitor - clearing outgoing mail %s",
+                       self._outboxIO)
+        try:
+            self._outboxIO.write(0, bytes(self._outgoingMail))
+            self._outboxDirty = False
+        except EnvironmentError as e:
+            self.log.warning("SPM_MailMonitor couldn't clear outgoing mail: "
+                             "%s", e)
 
         t = concurrent.thread(self.run, name="mailbox.SPMMonitor",
                               logger=self.log.name)
@@ -596,16 +698,16 @@ class SPM_MailMonitor:
         with self._inLock:
             with self._outLock:
                 diff = newMaxId - self._numHosts
+                newMailLen = MAILBOX_SIZE * newMaxId
                 if diff > 0:
                     delta = MAILBOX_SIZE * diff * "\0"
                     self._outgoingMail += delta
                     self._incomingMail += delta
                 elif diff < 0:
-                    delta = MAILBOX_SIZE * diff
-                    self._outgoingMail = self._outgoingMail[:-delta]
-                    self._incomingMail = self._incomingMail[:-delta]
+                    del self._outgoingMail[newMailLen:]
+                    self._incomingMail = self._incomingMail[:newMailLen]
                 self._numHosts = newMaxId
-                self._outMailLen = MAILBOX_SIZE * self._numHosts
+                self._outMailLen = newMailLen
 
     def _validateMailbox(self, mailbox, mailboxIndex):
         chkStart = MAILBOX_SIZE - CHECKSUM_BYTES
@@ -622,13 +724,23 @@ class SPM_MailMonitor:
 
     def _handleRequests(self, newMail):
 
-        send = False
+        # Most of the time nothing has changed since the last read.
+        if newMail == self._incomingMail:
+            return
 
-        # run through all messages and check if new messages have arrived
-        # (since last read)
+        invalidMailboxes = []
+
+        # run through all mailboxes changed since last read and check if new
+        # messages have arrived
         for host in range(0, self._numHosts):
-            # Check mailbox checksum
             mailboxStart = host * MAILBOX_SIZE
+            mailboxEnd = mailboxStart + MAILBOX_SIZE
+
+            # Comparing the entire mailbox is much cheaper than checking each
+            # message, and most mailboxes do not change between reads.
+            if newMail[mailboxStart:mailboxEnd] == \
+                    self._incomingMail[mailboxStart:mailboxEnd]:
+                continue
 
             isMailboxValidated = False
 
@@ -636,6 +748,7 @@ class SPM_MailMonitor:
 
                 msgId = host * SLOTS_PER_MAILBOX + i
                 msgStart = msgId * MESSAGE_SIZE
+                msgEnd = msgStart + MESSAGE_SIZE
 
                 # First byte of message is message version.  Check message
                 # version, if 0 then message is empty and can be skipped
@@ -648,42 +761,25 @@ class SPM_MailMonitor:
                 # mailbox
                 if not isMailboxValidated:
                     if not self._validateMailbox(
-                            newMail[mailboxStart:mailboxStart + MAILBOX_SIZE],
-                            host):
+                            newMail[mailboxStart:mailboxEnd], host):
                         # Cleaning invalid mbx in newMail
-                        newMail = newMail[:mailboxStart] + EMPTYMAILBOX + \
-                            newMail[mailboxStart + MAILBOX_SIZE:]
+                        invalidMailboxes.append(host)
                         break
                     self.log.debug("SPM_MailMonitor: Mailbox %s validated, "
                                    "checking mail", host)
                     isMailboxValidated = True
 
-                newMsg = newMail[msgStart:msgStart + MESSAGE_SIZE]
-                msgOffset = msgId * MESSAGE_SIZE
+                newMsg = newMail[msgStart:msgEnd]
                 if newMsg == CLEAN_MESSAGE:
                     # Should probably put a setter on outgoingMail which would
                     # take the lock
-                    self._outLock.acquire()
-                    try:
-                        self._outgoingMail = \
-                            self._outgoingMail[0:msgOffset] + CLEAN_MESSAGE + \
-                            self._outgoingMail[msgOffset + MESSAGE_SIZE:
-                                               self._outMailLen]
-                    finally:
-                        self._outLock.release()
-                    send = True
+                    with self._outLock:
+                        self._outgoingMail[msgStart:msgEnd] = CLEAN_MESSAGE
+                        self._outboxDirty = True
                     continue
 
                 # Message isn't empty, check if its new
-                isMessageNew = False
-                for j in range(msgStart, msgStart + MESSAGE_SIZE):
-                    if newMail[j] != self._incomingMail[j]:
-                        isMessageNew = True
-                        break
-
-                # If search exhausted, i.e. message hasn't changed since last
-                # read, it can be skipped
-                if not isMessageNew:
+                if newMsg == self._incomingMail[msgStart:msgEnd]:
                     continue
 
                 # We only get here if there is a novel request
@@ -694,12 +790,10 @@ class SPM_MailMonitor:
                         # message specific logic
                         id = str(uuid.uuid4())
                         self.log.debug("SPM_MailMonitor: processing request: "
-                                       "%s" % repr(newMail[
-                                           msgStart:msgStart + MESSAGE_SIZE]))
+                                       "%s" % repr(newMsg))
                         res = self.tp.queueTask(
                             id, runTask, (self._messageTypes[msgType], msgId,
-                                          newMail[msgStart:
-                                                  msgStart + MESSAGE_SIZE])
+                                          newMsg)
                         )
                         if not res:
                             raise Exception()
@@ -709,15 +803,19 @@ class SPM_MailMonitor:
                 except RuntimeError as e:
                     self.log.error("SPM_MailMonitor: exception: %s caught "
                                    "while handling message: %s", str(e),
-                                   newMail[msgStart:msgStart + MESSAGE_SIZE])
+                                   newMsg)
                 except:
                     self.log.error("SPM_MailMonitor: exception caught while "
-                                   "handling message: %s",
-                                   newMail[msgStart:msgStart + MESSAGE_SIZE],
+                                   "handling message: %s", newMsg,
                                    exc_info=True)
 
+        if invalidMailboxes:
+            mail = bytearray(newMail)
+            for host in invalidMailboxes:
+                mailboxStart = host * MAILBOX_SIZE
+                mail[mailboxStart:mailboxStart + MAILBOX_SIZE] = EMPTYMAILBOX
+            newMail = bytes(mail)
         self._incomingMail = newMail
-        return send
 
     def _checkForMail(self):
         # Lock is acquired in order to make sure that neither _numHosts nor
@@ -725,33 +823,33 @@ class SPM_MailMonitor:
         self._inLock.acquire()
         try:
             # self.log.debug("SPM_MailMonitor -_checking for mail")
-            cmd = self._inCmd + ['bs=' + str(self._outMailLen)]
-            # self.log.debug("SPM_MailMonitor - reading incoming mail, "
-            #               "command: " + str(cmd))
-            (rc, in_mail, err) = misc.execCmd(cmd, raw=True)
-            if rc:
+            try:
+                in_mail = self._inboxIO.read(0, self._outMailLen)
+            except EnvironmentError as e:
                 raise IOError(errno.EIO, "_handleRequests._checkForMail - "
-                              "Could not read mailbox: %s" % self._inbox)
+                              "Could not read mailbox: %s: %s" %
+                              (self._inbox, e))
 
             if (len(in_mail) != (self._outMailLen)):
-                self.log.error('SPM_MailMonitor: _checkForMail - dd succeeded '
-                               'but read %d bytes instead of %d, cannot check '
-                               'mail.  Read mail contains: %s', len(in_mail),
-                               self._outMailLen, repr(in_mail[:80]))
+                self.log.error('SPM_MailMonitor: _checkForMail - read '
+                               'succeeded but read %d bytes instead of %d, '
+                               'cannot check mail.  Read mail contains: %s',
+                               len(in_mail), self._outMailLen,
+                               repr(in_mail[:80]))
                 raise RuntimeError("_handleRequests._checkForMail - Could not "
                                    "read mailbox")
             # self.log.debug("Parsing inbox content: %s", in_mail)
-            if self._handleRequests(in_mail):
-                self._outLock.acquire()
-                try:
-                    cmd = self._outCmd + ['bs=' + str(self._outMailLen)]
-                    (rc, out, err) = _mboxExecCmd(cmd,
-                                                  data=self._outgoingMail)
-                    if rc:
-                        self.log.warning("SPM_MailMonitor couldn't write "
-                                         "outgoing mail, dd failed")
-                finally:
-                    self._outLock.release()
+            self._handleRequests(in_mail)
+            self._outLock.acquire()
+            try:
+                if self._outboxDirty:
+                    self._outboxIO.write(0, bytes(self._outgoingMail))
+                    self._outboxDirty = False
+            except EnvironmentError as e:
+                self.log.warning("SPM_MailMonitor couldn't write outgoing "
+                                 "mail: %s", e)
+            finally:
+                self._outLock.release()
         finally:
             self._inLock.release()
 
@@ -761,20 +859,18 @@ class SPM_MailMonitor:
         self._outLock.acquire()
         try:
             msgOffset = msgID * MESSAGE_SIZE
-            self._outgoingMail = \
-                self._outgoingMail[0:msgOffset] + msg.payload + \
-                self._outgoingMail[msgOffset + MESSAGE_SIZE:self._outMailLen]
+            self._outgoingMail[msgOffset:msgOffset + MESSAGE_SIZE] = \
+                msg.payload
             mailboxOffset = (msgID / SLOTS_PER_MAILBOX) * MAILBOX_SIZE
-            mailbox = self._outgoingMail[mailboxOffset:
-                                         mailboxOffset + MAILBOX_SIZE]
-            cmd = self._outCmd + ['bs=' + str(MAILBOX_SIZE),
-                                  'seek=' + str(mailboxOffset / MAILBOX_SIZE)]
-            # self.log.debug("Running command: %s, for message id: %s",
-            #               str(cmd), str(msgID))
-            (rc, out, err) = _mboxExecCmd(cmd, data=mailbox)
-            if rc:
+            mailbox = bytes(self._outgoingMail[mailboxOffset:
+                                               mailboxOffset + MAILBOX_SIZE])
+            try:
+                self._outboxIO.write(mailboxOffset, mailbox)
+            except EnvironmentError as e:
                 self.log.error("SPM_MailMonitor: sendReply - couldn't send "
-                               "reply, dd failed")
+                               "reply: %s", e)
+                # Retry on the next check for mail
+                self._outboxDirty = True
         finally:
             self._outLock.release()
 
@@ -789,5 +885,9 @@ class SPM_MailMonitor:
         finally:
             self._stopped = True
             self.tp.joinAll(waitForTasks=False)
+            with self._inLock:
+                self._inboxIO.close()
+            with self._outLock:
+                self._outboxIO.close()
             self.log.info("SPM_MailMonitor - Incoming mail monitoring thread "
                           "stopped")
@@ -1173,3 +1173,8 @@ class Volume(object):
     @classmethod
     def getImageVolumes(cls, repoPath, sdUUID, imgUUID):
         return cls.manifestClass.getImageVolumes(repoPath, sdUUID, imgUUID)
+
+    @classmethod
+    def getImageVolumesMetadata(cls, repoPath, sdUUID, imgUUID):
+        return cls.manifestClass.getImageVolumesMetadata(repoPath, sdUUID,
+                                                         imgUUID)
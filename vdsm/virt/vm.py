@@ -96,6 +96,11 @@ def _filterSnappableDiskDevices(diskDeviceXmlElements):
             if x.getAttribute('device') in ('disk', 'lun', '')]
 
 
+# The block stats are sampled every vm_watermark_interval seconds; older
+# samples are considered stale.
+_WATERMARKS_MAX_AGE = 2 * config.getint('vars', 'vm_watermark_interval')
+
+
 class VolumeError(RuntimeError):
     def __str__(self):
         return "Bad volume specification " + RuntimeError.__str__(self)
@@ -736,7 +741,8 @@ class Vm(object):
 
         for drive in self._chunkedDrives():
             try:
-                capacity, alloc, physical = self._getExtendInfo(drive)
+                capacity, alloc, physical = self._getExtendInfo(
+                    drive, sampled=True)
             except libvirt.libvirtError as e:
                 self.log.error("Unable to get watermarks for drive %s: %s",
                                drive.name, e)
@@ -754,12 +760,21 @@ class Vm(object):
         return [drive for drive in self._devices[hwclass.DISK]
                 if drive.chunked or drive.replicaChunked]
 
-    def _getExtendInfo(self, drive):
+    def _getExtendInfo(self, drive, sampled=False):
         """
         Return extension info for a chunked drive or drive replicating to
         chunked replica volume.
+
+        If sampled is True, use the block stats sampled for all the VMs if
+        they are fresh enough, instead of querying libvirt.
         """
-        capacity, alloc, physical = self._dom.blockInfo(drive.path, 0)
+        watermarks = None
+        if sampled:
+            watermarks = sampling.block_watermarks.get(
+                self.id, drive.name, drive.path, _WATERMARKS_MAX_AGE)
+        if watermarks is None:
+            watermarks = self._dom.blockInfo(drive.path, 0)
+        capacity, alloc, physical = watermarks
 
         # Libvirt reports watermarks only for the source drive, but for
         # file-based drives it reports the same alloc and physical, which
@@ -927,6 +942,9 @@ class Vm(object):
         # TODO: Report failure to the engine.
         volSize = self.__verifyVolumeExtension(volInfo)
 
+        # The sampled block stats may not include the new size yet.
+        sampling.block_watermarks.invalidate(self.id)
+
         # Only update apparentsize and truesize if we've resized the leaf
         if not volInfo['internal']:
             vmDrive = self._findDriveByName(volInfo['name'])
@@ -1252,15 +1270,16 @@ class Vm(object):
 
         try:
             vm_sample = sampling.stats_cache.get(self.id)
-            decStats = vmstats.produce(self,
-                                       vm_sample.first_value,
-                                       vm_sample.last_value,
-                                       vm_sample.interval)
+            # The sampler publishes the stats of every VM after each cycle;
+            # compute them here only if this VM missed the last snapshot.
+            sampled = sampling.stats_cache.snapshot().get(self.id)
+            if sampled is None:
+                sampled = vmstats.sampled(self, vm_sample)
             self._setUnresponsiveIfTimeout(stats, vm_sample.stats_age)
         except Exception:
             self.log.exception("Error fetching vm stats")
         else:
-            stats.update(vmstats.translate(decStats))
+            stats.update(sampled)
 
         stats.update(self._getGraphicsStats())
         stats['hash'] = str(hash((self._domain.devices_hash,
@@ -3071,6 +3090,35 @@ class Vm(object):
         vmDrive.truesize = volSize.truesize
         vmDrive.apparentsize = volSize.apparentsize
 
+    def getDriveVolumes(self):
+        """
+        Return a list of (domainID, imageID, volumeID) tuples, for the
+        volumes of the disk drives updated by updateDriveVolumes.
+        """
+        return [(vmDrive.domainID, vmDrive.imageID, vmDrive.volumeID)
+                for vmDrive in self.getDiskDevices()
+                if vmDrive.device == 'disk' and isVdsmImage(vmDrive)]
+
+    def updateDriveVolumes(self, sizes):
+        """
+        Update the volume size of the disk drives from sizes, as returned
+        by irs.getVolumesSize(). Drives on storage domains missing in sizes
+        are not updated.
+        """
+        for vmDrive in self.getDiskDevices():
+            if not vmDrive.device == 'disk' or not isVdsmImage(vmDrive):
+                continue
+            if vmDrive.domainID not in sizes:
+                continue
+            try:
+                volSize = sizes[vmDrive.domainID][vmDrive.volumeID]
+            except KeyError:
+                self.log.error("Unable to update drive %s volume size",
+                               vmDrive.name)
+                continue
+            vmDrive.truesize = int(volSize['truesize'])
+            vmDrive.apparentsize = int(volSize['apparentsize'])
+
     def updateDriveParameters(self, driveParams):
         """Update the drive with the new volume information"""
 